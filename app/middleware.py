@@ -0,0 +1,76 @@
+"""
+Instrumentação de consultas ao banco por requisição.
+
+Com MEDIR_CONSULTAS (padrão: o mesmo que DEBUG), cada resposta leva o
+cabeçalho `X-Consultas` e, com DEBUG, uma linha no log `app.consultas` com:
+
+- total de consultas da requisição;
+- repetidas: consultas cujo SQL (sem os parâmetros) já tinha sido executado
+  na mesma requisição. Um número que cresce com o tamanho da página é o
+  padrão N+1 (uma consulta por linha);
+- tempo total gasto no banco.
+
+Respostas em streaming (feeds, exportações) consultam o banco enquanto são
+enviadas: o cabeçalho mostra só o que rodou antes do envio.
+
+Os orçamentos de consultas por tela ficam em produtos/tests_consultas.py.
+"""
+import logging
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+
+logger = logging.getLogger('app.consultas')
+
+
+class Medicao:
+    """Consultas executadas enquanto o wrapper está instalado."""
+
+    def __init__(self):
+        self.sqls = Counter()
+        self.tempo = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.tempo += time.perf_counter() - inicio
+            self.sqls[sql] += 1
+
+    @property
+    def total(self):
+        return sum(self.sqls.values())
+
+    @property
+    def repetidas(self):
+        return self.total - len(self.sqls)
+
+    def resumo(self):
+        return f'{self.total} consultas; {self.repetidas} repetidas; {self.tempo * 1000:.1f} ms'
+
+
+class ConsultasMiddleware:
+    """Mede as consultas de cada requisição (cabeçalho X-Consultas e log)."""
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'MEDIR_CONSULTAS', settings.DEBUG):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        medicao = Medicao()
+        with ExitStack() as pilha:
+            for conexao in connections.all():
+                pilha.enter_context(conexao.execute_wrapper(medicao))
+            response = self.get_response(request)
+
+        response['X-Consultas'] = medicao.resumo()
+        if settings.DEBUG:
+            logger.info('%s %s: %s', request.method, request.get_full_path(), medicao.resumo())
+        return response
@@ -5,6 +5,7 @@ Generated by 'django-admin startproject' using Django 6.0.1.
 """
 
 import os
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -38,6 +39,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'app.middleware.ConsultasMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -100,6 +102,64 @@ DATABASES = {
 }
 
 
+# Cache
+# Compartilhado entre os processos (workers do gunicorn): versões e tabelas
+# compiladas (produtos.cache_versionado), dashboard, matriz de preços.
+# Redis quando REDIS_URL estiver definido; senão, em arquivo. Os testes
+# (manage.py test) usam um cache em memória, limpo a cada teste por
+# app.testes.TestCase, e nunca o do servidor de desenvolvimento.
+
+TESTANDO = sys.argv[1:2] == ['test']
+
+if TESTANDO:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+elif os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('DJANGO_CACHE_DIR', BASE_DIR / '.cache'),
+            'OPTIONS': {'MAX_ENTRIES': 5000},
+        }
+    }
+
+
+# Consultas por requisição (cabeçalho X-Consultas e log app.consultas, ver app/middleware.py)
+
+MEDIR_CONSULTAS = os.environ.get('DJANGO_MEDIR_CONSULTAS', str(DEBUG)) == 'True'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'app.consultas': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
+
+# Métricas do motor de preços em /metrics (formato do Prometheus, ver produtos/metricas.py)
+# Com vários workers, METRICAS_DIR é o diretório compartilhado onde cada processo
+# grava o seu estado (limpe-o a cada deploy). Com METRICAS_TOKEN, o /metrics exige
+# "Authorization: Bearer <token>".
+
+METRICAS_DIR = os.environ.get('DJANGO_METRICAS_DIR')
+
+METRICAS_TOKEN = os.environ.get('DJANGO_METRICAS_TOKEN', '')
+
+
 # Password validation
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -148,6 +208,14 @@ STATICFILES_DIRS = [
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
 
+# Arquivos gerados (feeds de preços por canal em MEDIA_ROOT/feeds)
+# Em produção, servir MEDIA_URL direto pelo servidor web (nginx etc.)
+
+MEDIA_URL = 'media/'
+
+MEDIA_ROOT = Path(os.environ.get('DJANGO_MEDIA_ROOT', BASE_DIR / 'media'))
+
+
 # Default primary key field type
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
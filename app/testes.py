@@ -0,0 +1,17 @@
+"""
+Base dos testes do projeto.
+"""
+from django.core.cache import cache
+from django.test import TestCase as DjangoTestCase
+
+
+class TestCase(DjangoTestCase):
+    """
+    TestCase com o cache limpo antes de cada teste: o banco volta ao estado
+    inicial, mas o cache em memória dos testes (ver settings.CACHES) é do
+    processo e guardaria versões e tabelas compiladas de ids já desfeitos.
+    """
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
@@ -1,3 +1,5 @@
+from django.conf import settings
+from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 from django.contrib.auth import views as auth_views
@@ -16,3 +18,6 @@ urlpatterns = [
     path('tabelas-frete/', include('tabela_frete.urls')),
     path('pcp/', include('controle_producao.urls')),
 ]
+
+# Feeds e demais arquivos gerados (em produção, servidos pelo servidor web)
+urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -7,6 +7,7 @@ class CanalVendaAdmin(admin.ModelAdmin):
         'nome', 'grupo', 'herdar_grupo', 'tipo_frete', 'nota_vendedor',
         'ativo', 'atualizado_em'
     ]
+    list_select_related = ['grupo']
     list_filter = ['grupo', 'herdar_grupo', 'tipo_frete', 'nota_vendedor', 'ativo']
     search_fields = ['nome', 'descricao']
     readonly_fields = ['criado_em', 'atualizado_em', 'markup_frete', 'markup_venda', 'markup_promocao', 'markup_minimo']
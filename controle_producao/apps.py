@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ControleProducaoConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'controle_producao'
+
+    def ready(self):
+        # Importa signals para registrá-los
+        import controle_producao.signals  # noqa: F401
@@ -0,0 +1,136 @@
+"""
+Índice em memória para o autocomplete de componentes da ficha técnica.
+
+Cada processo mantém a lista de componentes ativos já normalizada (minúsculo,
+sem acentos) e uma lista ordenada de palavras para busca por prefixo com
+bisect. Uma digitação não consulta o banco: só lê a versão do índice no cache
+versionado (produtos.cache_versionado), que os signals de Componente trocam a
+cada alteração.
+"""
+import bisect
+import re
+import threading
+import time
+import unicodedata
+
+from produtos.cache_versionado import trocar_versao, versao_atual
+
+from .models import Componente
+
+
+NOME_VERSAO = 'componentes:autocomplete'
+
+# Reconstrói mesmo sem invalidação depois desse tempo (cache local por processo)
+TEMPO_MAXIMO = 300
+
+LIMITE_PADRAO = 20
+
+_RE_TOKEN = re.compile(r'[a-z0-9]+')
+
+_lock = threading.Lock()
+_estado = {'indice': None, 'versao': None, 'construido_em': 0.0}
+
+
+def normalizar(texto):
+    texto = unicodedata.normalize('NFKD', str(texto or ''))
+    return ''.join(c for c in texto if not unicodedata.combining(c)).lower()
+
+
+def tokenizar(texto):
+    return _RE_TOKEN.findall(normalizar(texto))
+
+
+class IndiceComponentes:
+    """Componentes ativos com busca por prefixo de palavra e ranking."""
+
+    def __init__(self, componentes):
+        # componentes: iterável de (pk, nome, preco)
+        self.ids = []
+        self.nomes = []
+        self.precos = []
+        self.normalizados = []
+        self.tokens = []
+        palavras = []
+        for i, (pk, nome, preco) in enumerate(sorted(componentes, key=lambda c: normalizar(c[1]))):
+            tokens = tokenizar(nome)
+            self.ids.append(pk)
+            self.nomes.append(nome)
+            self.precos.append(float(preco))
+            self.normalizados.append(' '.join(tokens))
+            self.tokens.append(tokens)
+            for posicao, token in enumerate(tokens):
+                palavras.append((token, i, posicao))
+        palavras.sort()
+        self._palavras = palavras
+        self._chaves = [p[0] for p in palavras]
+
+    def _com_prefixo(self, prefixo):
+        """{indice do componente: menor posição da palavra que começa com o prefixo}."""
+        inicio = bisect.bisect_left(self._chaves, prefixo)
+        fim = bisect.bisect_left(self._chaves, prefixo + '\uffff', lo=inicio)
+        encontrados = {}
+        for _, i, posicao in self._palavras[inicio:fim]:
+            if posicao < encontrados.get(i, len(self.tokens[i])):
+                encontrados[i] = posicao
+        return encontrados
+
+    def buscar(self, termo, limite=LIMITE_PADRAO):
+        """
+        Todas as palavras do termo precisam ser prefixo de alguma palavra do nome.
+        Ranking: nome começa com o termo, depois primeira palavra casando mais cedo, nome mais curto.
+        """
+        tokens = tokenizar(termo)
+        if not tokens:
+            return []
+
+        # Começa pela palavra mais longa (menos candidatos)
+        tokens_ordenados = sorted(tokens, key=len, reverse=True)
+        candidatos = self._com_prefixo(tokens_ordenados[0])
+        for token in tokens_ordenados[1:]:
+            if not candidatos:
+                break
+            outros = self._com_prefixo(token)
+            candidatos = {i: min(p, outros[i]) for i, p in candidatos.items() if i in outros}
+
+        frase = ' '.join(tokens)
+        ordenados = sorted(
+            candidatos.items(),
+            key=lambda item: (
+                not self.normalizados[item[0]].startswith(frase),
+                item[1],
+                len(self.normalizados[item[0]]),
+                item[0],
+            ),
+        )
+        return [
+            {'id': self.ids[i], 'label': self.nomes[i], 'price': self.precos[i]}
+            for i, _ in ordenados[:limite]
+        ]
+
+
+def obter_indice():
+    """Índice do processo, reconstruído se a versão mudou ou passou do TEMPO_MAXIMO."""
+    versao = versao_atual(NOME_VERSAO)
+    agora = time.monotonic()
+    indice = _estado['indice']
+    if indice is not None and _estado['versao'] == versao and agora - _estado['construido_em'] < TEMPO_MAXIMO:
+        return indice
+
+    with _lock:
+        if _estado['indice'] is None or _estado['versao'] != versao or agora - _estado['construido_em'] >= TEMPO_MAXIMO:
+            _estado['indice'] = IndiceComponentes(
+                Componente.objects.filter(ativo=True).values_list('pk', 'nome', 'preco')
+            )
+            _estado['versao'] = versao
+            _estado['construido_em'] = time.monotonic()
+        return _estado['indice']
+
+
+def invalidar_indice():
+    """Troca a versão (todos os processos reconstroem na próxima busca)."""
+    trocar_versao(NOME_VERSAO)
+    _estado['indice'] = None
+
+
+def buscar_componentes(termo, limite=LIMITE_PADRAO):
+    return obter_indice().buscar(termo, limite)
@@ -0,0 +1,14 @@
+"""
+Signals do PCP: mantêm o índice de autocomplete de componentes.
+"""
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+
+@receiver(post_save, sender='controle_producao.Componente')
+@receiver(post_delete, sender='controle_producao.Componente')
+def on_componente_alterado(sender, instance, **kwargs):
+    """Invalida o índice de autocomplete depois do commit."""
+    from .autocomplete import invalidar_indice
+    transaction.on_commit(invalidar_indice)
@@ -1,3 +1,105 @@
-from django.test import TestCase
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+
+from app.testes import TestCase
+
+from . import autocomplete
+from .autocomplete import IndiceComponentes, buscar_componentes
+from .models import Componente
+
+
+def _labels(resultados):
+    return [r['label'] for r in resultados]
+
+
+class IndiceComponentesTest(TestCase):
+    """Busca por prefixo de palavra, ranking e acentos no índice em memória."""
+
+    def _indice(self, *nomes):
+        return IndiceComponentes((pk, nome, Decimal('1.5000')) for pk, nome in enumerate(nomes, start=1))
+
+    def test_todas_as_palavras_precisam_ser_prefixo(self):
+        indice = self._indice('Chapa MDF 15mm', 'Chapa Compensado 15mm', 'Parafuso 4x40')
+
+        self.assertEqual(_labels(indice.buscar('mdf 15')), ['Chapa MDF 15mm'])
+        self.assertEqual(_labels(indice.buscar('15 cha')), ['Chapa MDF 15mm', 'Chapa Compensado 15mm'])
+        self.assertEqual(_labels(indice.buscar('par 4x')), ['Parafuso 4x40'])
+        # Só prefixo: o meio de uma palavra não casa
+        self.assertEqual(indice.buscar('mm'), [])
+        self.assertEqual(indice.buscar('mdf parafuso'), [])
+        self.assertEqual(indice.buscar('  -- '), [])
+
+    def test_ranking(self):
+        indice = self._indice('Chapa MDF', 'MDF Branco 15mm', 'Fita de borda MDF', 'MDF 15mm', 'Mdfx')
+
+        # Começa com o termo, depois a palavra que casa mais cedo, depois o nome mais curto
+        self.assertEqual(
+            _labels(indice.buscar('mdf')),
+            ['Mdfx', 'MDF 15mm', 'MDF Branco 15mm', 'Chapa MDF', 'Fita de borda MDF'],
+        )
+        self.assertEqual(_labels(indice.buscar('mdf 15')), ['MDF 15mm', 'MDF Branco 15mm'])
+        self.assertEqual(_labels(indice.buscar('mdf', limite=2)), ['Mdfx', 'MDF 15mm'])
+
+    def test_sem_acentos_e_maiusculas(self):
+        indice = self._indice('Dobradiça Caneco 35mm', 'Puxador Alumínio')
+
+        for termo in ('dobradica', 'DOBRADIÇA', 'dobrádiça can'):
+            with self.subTest(termo=termo):
+                self.assertEqual(_labels(indice.buscar(termo)), ['Dobradiça Caneco 35mm'])
+        resultado, = indice.buscar('aluminio')
+        self.assertEqual(resultado, {'id': 2, 'label': 'Puxador Alumínio', 'price': 1.5})
+
+
+class AutocompleteComponentesTest(TestCase):
+    """Índice do processo: reconstruído quando um componente muda, sem banco nas buscas seguintes."""
+
+    def setUp(self):
+        super().setUp()
+        self.enterContext(mock.patch.dict(autocomplete._estado, {'indice': None, 'versao': None, 'construido_em': 0.0}))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.mdf = Componente.objects.create(nome='Chapa MDF 15mm', preco=Decimal('12.5000'))
+            Componente.objects.create(nome='Chapa MDF Inativa', preco=Decimal('1.0000'), ativo=False)
+
+    def test_busca_sem_consultar_o_banco_depois_de_construido(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                buscar_componentes('mdf'), [{'id': self.mdf.pk, 'label': 'Chapa MDF 15mm', 'price': 12.5}]
+            )
+        with self.assertNumQueries(0):
+            buscar_componentes('chapa')
+
+    def test_reconstroi_depois_de_salvar_e_apagar(self):
+        self.assertEqual(_labels(buscar_componentes('mdf')), ['Chapa MDF 15mm'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            novo = Componente.objects.create(nome='MDF Branco', preco=Decimal('20.0000'))
+        self.assertEqual(_labels(buscar_componentes('mdf')), ['MDF Branco', 'Chapa MDF 15mm'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.mdf.nome = 'Chapa Compensado 15mm'
+            self.mdf.save()
+        self.assertEqual(_labels(buscar_componentes('mdf')), ['MDF Branco'])
+        self.assertEqual(_labels(buscar_componentes('compensado')), ['Chapa Compensado 15mm'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            novo.delete()
+        self.assertEqual(buscar_componentes('mdf'), [])
+
+    def test_reconstroi_depois_do_tempo_maximo(self):
+        buscar_componentes('mdf')
+        # Alteração que não passou pelos signals (update direto)
+        Componente.objects.filter(pk=self.mdf.pk).update(preco=Decimal('13.0000'))
+        self.assertEqual(buscar_componentes('mdf')[0]['price'], 12.5)
+
+        construido_em = autocomplete._estado['construido_em']
+        with mock.patch.object(autocomplete.time, 'monotonic', return_value=construido_em + autocomplete.TEMPO_MAXIMO):
+            self.assertEqual(buscar_componentes('mdf')[0]['price'], 13.0)
+
+    def test_api(self):
+        self.client.force_login(User.objects.create_user('pcp', password='x'))
+
+        self.assertEqual(self.client.get('/pcp/api/buscar-componente/', {'term': 'm'}).json(), [])
+        resposta = self.client.get('/pcp/api/buscar-componente/', {'term': 'chapa 15'})
+        self.assertEqual(resposta.json(), [{'id': self.mdf.pk, 'label': 'Chapa MDF 15mm', 'price': 12.5}])
@@ -4,33 +4,23 @@ from django.views.generic import ListView, CreateView, UpdateView, DeleteView
 from django.urls import reverse_lazy
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.db.models import Q
+from django.db.models import Count, Q
 
 from .models import Componente
+from .autocomplete import buscar_componentes
 
 @login_required
 def buscar_componente_api(request):
     """
-    API para buscar componentes por nome.
-    Retorna JSON: [{'label': 'Nome', 'value': 'Preço'}, ...]
+    API para buscar componentes por nome (índice em memória, ver autocomplete.py).
+    Retorna JSON: [{'id': 1, 'label': 'Nome', 'price': 1.2345}, ...]
     """
     term = request.GET.get('term', '')
     if len(term) < 2:
         return JsonResponse([], safe=False)
 
-    componentes = Componente.objects.filter(
-        nome__icontains=term, 
-        ativo=True
-    ).order_by('nome')[:20]
-
-    results = []
-    for comp in componentes:
-        results.append({
-            'label': comp.nome,
-            'price': float(comp.preco)  # Retorna float para facilitar JS, formatar depois
-        })
-    
-    return JsonResponse(results, safe=False)
+    # price em float para facilitar no JS, formatar depois
+    return JsonResponse(buscar_componentes(term), safe=False)
 
 # --- CRUD Views ---
 
@@ -41,7 +31,9 @@ class ComponenteListView(LoginRequiredMixin, ListView):
     paginate_by = 20
 
     def get_queryset(self):
-        queryset = super().get_queryset()
+        queryset = super().get_queryset().annotate(
+            produtos_usando=Count('itens_ficha__produto', distinct=True)
+        )
         search = self.request.GET.get('search')
         if search:
             queryset = queryset.filter(nome__icontains=search)
@@ -63,7 +55,15 @@ class ComponenteUpdateView(LoginRequiredMixin, UpdateView):
     fields = ['nome', 'preco', 'ativo']
     success_url = reverse_lazy('componente_list')
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Onde é usado: itens de ficha vinculados (recebem as mudanças de preço)
+        context['itens_ficha'] = self.object.itens_ficha.select_related('produto').order_by('produto__sku')
+        return context
+
     def form_valid(self, form):
+        if 'preco' in form.changed_data and self.object.itens_ficha.exists():
+            messages.info(self.request, 'O novo preço será aplicado às fichas técnicas que usam este componente.')
         messages.success(self.request, 'Componente atualizado com sucesso!')
         return super().form_valid(form)
 
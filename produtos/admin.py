@@ -1,7 +1,22 @@
 from django.contrib import admin
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from canais_vendas.models import CanalVenda
 from .models import Produto, TituloProduto, ItemFichaTecnica, PrecoProdutoCanal, HistoricoPreco
 
 
+# As colunas das listagens vêm de anotações e campos gravados (custo_ficha,
+# *_calculado) com list_select_related: o número de consultas não cresce com as linhas.
+
+
+class CanalListFilter(admin.RelatedFieldListFilter):
+    """Filtro por canal que carrega os grupos junto (o __str__ do canal mostra o grupo)."""
+
+    def field_choices(self, field, request, model_admin):
+        return [(canal.pk, str(canal)) for canal in CanalVenda.objects.select_related('grupo').order_by('nome')]
+
+
 class TituloProdutoInline(admin.TabularInline):
     model = TituloProduto
     extra = 1
@@ -20,8 +35,10 @@ class PrecoProdutoCanalInline(admin.TabularInline):
     fields = ['canal', 'ativo', 'usar_calculo_automatico', 'preco_venda_manual', 'frete_especifico', 'preco_venda_display']
 
     def preco_venda_display(self, obj):
-        if obj.pk:
+        if obj.pk and not obj.calculo_pendente:
             return f"R$ {obj.preco_venda:,.2f}"
+        if obj.pk:
+            return "Cálculo pendente"
         return "-"
 
 
@@ -32,14 +49,28 @@ class ProdutoAdmin(admin.ModelAdmin):
     list_filter = ['ativo']
     inlines = [TituloProdutoInline, ItemFichaTecnicaInline, PrecoProdutoCanalInline]
 
+    def get_queryset(self, request):
+        # Subquery (e não Count com JOIN) para a busca em titulos__titulo não duplicar a contagem
+        titulos_ativos = TituloProduto.objects.filter(produto=OuterRef('pk'), ativo=True).order_by().values(
+            'produto'
+        ).annotate(total=Count('pk')).values('total')
+        return super().get_queryset(request).annotate(
+            qtd_titulos_ativos=Coalesce(Subquery(titulos_ativos, output_field=IntegerField()), 0)
+        )
+
+    @admin.display(description='Custo', ordering='custo_ficha')
+    def custo(self, obj):
+        return f"R$ {obj.custo_ficha:,.2f}"
+
+    @admin.display(description='Títulos', ordering='qtd_titulos_ativos')
     def qtd_titulos(self, obj):
-        return obj.titulos.filter(ativo=True).count()
-    qtd_titulos.short_description = 'Títulos'
+        return obj.qtd_titulos_ativos
 
 
 @admin.register(TituloProduto)
 class TituloProdutoAdmin(admin.ModelAdmin):
     list_display = ['titulo', 'produto_pai_sku', 'custo', 'ativo']
+    list_select_related = ['produto']
     list_filter = ['ativo', 'produto']
     search_fields = ['titulo', 'produto__sku', 'produto__titulo']
     raw_id_fields = ['produto']
@@ -64,7 +95,7 @@ class TituloProdutoAdmin(admin.ModelAdmin):
     titulo_pai.short_description = 'Título do Pai'
 
     def custo(self, obj):
-        return f"R$ {obj.custo:,.2f}"
+        return f"R$ {obj.produto.custo_ficha:,.2f}"
     custo.short_description = 'Custo'
 
     def peso_produto(self, obj):
@@ -77,11 +108,19 @@ class TituloProdutoAdmin(admin.ModelAdmin):
 
 @admin.register(PrecoProdutoCanal)
 class PrecoProdutoCanalAdmin(admin.ModelAdmin):
-    list_display = ['produto', 'canal', 'preco_venda', 'ativo']
-    list_filter = ['canal', 'ativo']
+    list_display = ['produto', 'canal', 'preco_venda', 'calculado_em', 'ativo']
+    list_select_related = ['produto', 'canal__grupo']
+    list_filter = [('canal', CanalListFilter), 'ativo']
     search_fields = ['produto__sku', 'canal__nome']
 
+    @admin.display(description='Preço Venda', ordering='preco_venda_calculado')
+    def preco_venda(self, obj):
+        if obj.calculo_pendente:
+            return 'Cálculo pendente'
+        return f"R$ {obj.preco_venda:,.2f}"
+
 @admin.register(HistoricoPreco)
 class HistoricoPrecoAdmin(admin.ModelAdmin):
     list_display = ['data_registro', 'produto', 'canal', 'preco_venda']
+    list_select_related = ['produto', 'canal__grupo']
     readonly_fields = ['data_registro', 'produto', 'canal', 'custo', 'preco_venda', 'frete_aplicado', 'taxa_extra', 'usuario', 'motivo']
\ No newline at end of file
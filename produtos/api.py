@@ -0,0 +1,146 @@
+"""
+API de leitura de preços em lote (por lista de SKUs).
+
+Uma consulta em PrecoProdutoCanal por página: produto filtrado pelo índice
+único de SKU, preços efetivos (manual/calculado) resolvidos no SQL e
+paginação por cursor na chave primária. Os valores decimais saem como string
+para não perder precisão; a serialização usa orjson quando instalado.
+"""
+import json
+from decimal import Decimal
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F
+from django.db.models.functions import Coalesce
+from django.http import HttpResponse
+
+from .matriz import preco_efetivo
+from .models import PrecoProdutoCanal
+from .paginacao import codificar_cursor, decodificar_cursor
+
+try:
+    import orjson
+except ImportError:  # opcional: cai para o json da biblioteca padrão
+    orjson = None
+
+
+MAX_SKUS = 5000
+LIMITE_PADRAO = 1000
+LIMITE_MAXIMO = 5000
+
+CENTAVOS = Decimal('0.01')
+
+CAMPOS = ['venda', 'promocao', 'minimo', 'frete', 'taxa', 'custo']
+
+
+class ErroConsulta(ValueError):
+    """Parâmetros inválidos na consulta (vira HTTP 400)."""
+
+
+def _decimal(valor):
+    # SQLite devolve expressões sem a escala do campo
+    return None if valor is None else str(valor.quantize(CENTAVOS))
+
+
+def _inteiro(valor, nome):
+    if valor in (None, ''):
+        return None
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        raise ErroConsulta(f'"{nome}" deve ser um número inteiro')
+
+
+def _cursor(valor):
+    """O cursor da página anterior: [pk] codificado (ver consultar_precos)."""
+    if valor in (None, ''):
+        return None
+    posicao = decodificar_cursor(valor) if isinstance(valor, str) else None
+    if not (posicao and len(posicao) == 1 and type(posicao[0]) is int):
+        raise ErroConsulta('"cursor" inválido')
+    return valor
+
+
+def ler_parametros(request):
+    """Lê os parâmetros do corpo JSON (POST) ou da query string (GET, SKUs separados por vírgula)."""
+    if request.method == 'POST':
+        try:
+            dados = json.loads(request.body or b'{}')
+        except ValueError:
+            raise ErroConsulta('Corpo da requisição não é um JSON válido')
+        if not isinstance(dados, dict):
+            raise ErroConsulta('O corpo deve ser um objeto JSON')
+        skus = dados.get('skus') or []
+    else:
+        dados = request.GET
+        skus = [s for s in dados.get('skus', '').split(',') if s]
+
+    if not isinstance(skus, list) or not all(isinstance(s, str) for s in skus):
+        raise ErroConsulta('"skus" deve ser uma lista de strings')
+    skus = list(dict.fromkeys(s.strip() for s in skus if s.strip()))
+    if not skus:
+        raise ErroConsulta('Informe ao menos um SKU em "skus"')
+    if len(skus) > MAX_SKUS:
+        raise ErroConsulta(f'Máximo de {MAX_SKUS} SKUs por requisição')
+
+    limite = _inteiro(dados.get('limite'), 'limite') or LIMITE_PADRAO
+    return {
+        'skus': skus,
+        'canal': _inteiro(dados.get('canal'), 'canal'),
+        'grupo': _inteiro(dados.get('grupo'), 'grupo'),
+        'cursor': _cursor(dados.get('cursor')),
+        'limite': max(1, min(limite, LIMITE_MAXIMO)),
+    }
+
+
+def consultar_precos(skus, canal=None, grupo=None, cursor=None, limite=LIMITE_PADRAO):
+    """Retorna {'itens': [...], 'proximo': cursor ou None}."""
+    queryset = PrecoProdutoCanal.objects.filter(ativo=True, produto__sku__in=skus)
+    if canal:
+        queryset = queryset.filter(canal_id=canal)
+    if grupo:
+        queryset = queryset.filter(canal__grupo_id=grupo)
+
+    posicao = decodificar_cursor(cursor)
+    if posicao:
+        queryset = queryset.filter(pk__gt=posicao[0])
+
+    linhas = list(
+        queryset.annotate(
+            venda=preco_efetivo('venda'),
+            promocao=preco_efetivo('promocao'),
+            minimo=preco_efetivo('minimo'),
+            frete=Coalesce(F('frete_especifico'), F('frete_calculado')),
+        ).order_by('pk').values_list(
+            'pk', 'produto__sku', 'canal_id', 'canal__nome', 'canal__grupo__nome',
+            'venda', 'promocao', 'minimo', 'frete', 'taxa_calculada', 'custo_calculado', 'calculado_em',
+        )[:limite + 1]
+    )
+
+    proximo = None
+    if len(linhas) > limite:
+        linhas = linhas[:limite]
+        proximo = codificar_cursor([linhas[-1][0]])
+
+    itens = []
+    for pk, sku, canal_id, canal_nome, grupo_nome, *valores, calculado_em in linhas:
+        item = {
+            'sku': sku,
+            'canal_id': canal_id,
+            'canal': canal_nome,
+            'grupo': grupo_nome,
+            'calculado_em': calculado_em.isoformat() if calculado_em else None,
+        }
+        item.update(zip(CAMPOS, map(_decimal, valores)))
+        itens.append(item)
+
+    return {'itens': itens, 'proximo': proximo}
+
+
+def resposta_json(dados, status=200):
+    """HttpResponse JSON com orjson (se disponível) ou json padrão."""
+    if orjson is not None:
+        conteudo = orjson.dumps(dados)
+    else:
+        conteudo = json.dumps(dados, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(',', ':'))
+    return HttpResponse(conteudo, status=status, content_type='application/json')
@@ -0,0 +1,147 @@
+"""
+Índice de busca de produtos (SKU, título principal e títulos alternativos).
+
+Cada produto tem um documento normalizado (minúsculo, sem acentos) em
+IndiceBuscaProduto, mantido pelos signals de Produto e TituloProduto.
+
+- SQLite: tabela virtual FTS5 (produtos_busca_fts) com conteúdo externo,
+  sincronizada por triggers a partir de IndiceBuscaProduto.
+- PostgreSQL: índice GIN trigram (pg_trgm) sobre o documento.
+
+A busca é por prefixo de palavra e todas as palavras digitadas precisam
+aparecer (E lógico): "prat aco" encontra "Prateleira de Aço".
+"""
+import re
+import unicodedata
+
+from django.db import connections, router
+from django.db.models.expressions import RawSQL
+
+from .models import Produto, TituloProduto, IndiceBuscaProduto
+
+
+TABELA_FTS = 'produtos_busca_fts'
+
+_RE_TOKEN = re.compile(r'[a-z0-9]+')
+_fts_disponivel = {}
+
+
+def normalizar(texto):
+    """Minúsculo e sem acentos: 'Ação' -> 'acao'."""
+    if not texto:
+        return ''
+    texto = unicodedata.normalize('NFKD', str(texto))
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return texto.lower()
+
+
+def tokenizar(texto):
+    return _RE_TOKEN.findall(normalizar(texto))
+
+
+def montar_documento(sku, titulo, titulos=()):
+    """
+    Monta o texto indexado de um produto.
+    O SKU entra quebrado ("abc 123") e compacto ("abc123") para casar as duas formas de digitar.
+    Começa e termina com espaço para permitir busca por prefixo com LIKE '% termo%'.
+    """
+    tokens = tokenizar(sku)
+    compacto = ''.join(tokens)
+    if compacto and compacto not in tokens:
+        tokens.append(compacto)
+    tokens += tokenizar(titulo)
+    for t in titulos:
+        tokens += tokenizar(t)
+    return ' ' + ' '.join(tokens) + ' '
+
+
+def atualizar_indice_busca(produto):
+    """Recria o documento de busca de um produto."""
+    titulos = produto.titulos.filter(ativo=True).values_list('titulo', flat=True)
+    IndiceBuscaProduto.objects.update_or_create(
+        produto=produto,
+        defaults={'documento': montar_documento(produto.sku, produto.titulo, titulos)},
+    )
+
+
+def atualizar_indices_busca(produto_ids):
+    """Recria os documentos de busca de vários produtos (consultas por conjunto)."""
+    produto_ids = list(produto_ids)
+    titulos_por_produto = {}
+    for produto_id, titulo in TituloProduto.objects.filter(
+        produto_id__in=produto_ids, ativo=True
+    ).values_list('produto_id', 'titulo'):
+        titulos_por_produto.setdefault(produto_id, []).append(titulo)
+
+    IndiceBuscaProduto.objects.filter(produto_id__in=produto_ids).delete()
+    IndiceBuscaProduto.objects.bulk_create([
+        IndiceBuscaProduto(
+            produto_id=pk,
+            documento=montar_documento(sku, titulo, titulos_por_produto.get(pk, ())),
+        )
+        for pk, sku, titulo in Produto.objects.filter(pk__in=produto_ids).values_list('pk', 'sku', 'titulo')
+    ], batch_size=1000)
+
+
+def reconstruir_indice_busca(tamanho_lote=1000):
+    """Reconstrói o índice inteiro (usado pelo comando reconstruir_indices)."""
+    IndiceBuscaProduto.objects.all().delete()
+
+    titulos_por_produto = {}
+    for produto_id, titulo in TituloProduto.objects.filter(ativo=True).values_list('produto_id', 'titulo').iterator():
+        titulos_por_produto.setdefault(produto_id, []).append(titulo)
+
+    lote = []
+    total = 0
+    for pk, sku, titulo in Produto.objects.values_list('pk', 'sku', 'titulo').iterator():
+        lote.append(IndiceBuscaProduto(
+            produto_id=pk,
+            documento=montar_documento(sku, titulo, titulos_por_produto.get(pk, ())),
+        ))
+        if len(lote) >= tamanho_lote:
+            IndiceBuscaProduto.objects.bulk_create(lote)
+            total += len(lote)
+            lote = []
+    if lote:
+        IndiceBuscaProduto.objects.bulk_create(lote)
+        total += len(lote)
+    return total
+
+
+def _usa_fts(alias):
+    if alias not in _fts_disponivel:
+        connection = connections[alias]
+        _fts_disponivel[alias] = (
+            connection.vendor == 'sqlite'
+            and TABELA_FTS in connection.introspection.table_names()
+        )
+    return _fts_disponivel[alias]
+
+
+def produtos_encontrados(termo):
+    """
+    Retorna uma expressão com os ids dos produtos que casam com o termo,
+    para usar em filtros `__in`. Retorna None se o termo não tiver palavras.
+    """
+    tokens = tokenizar(termo)
+    if not tokens:
+        return None
+
+    alias = router.db_for_read(IndiceBuscaProduto)
+    if _usa_fts(alias):
+        consulta = ' '.join(f'"{t}"*' for t in tokens)
+        return RawSQL(f'SELECT rowid FROM {TABELA_FTS} WHERE {TABELA_FTS} MATCH %s', [consulta])
+
+    # PostgreSQL (índice trigram) e demais bancos
+    indice = IndiceBuscaProduto.objects.all()
+    for t in tokens:
+        indice = indice.filter(documento__contains=' ' + t)
+    return indice.values('produto_id')
+
+
+def filtrar_busca(queryset, termo, campo_produto='pk'):
+    """Filtra um queryset pelo termo de busca, sem JOIN nem DISTINCT."""
+    ids = produtos_encontrados(termo)
+    if ids is None:
+        return queryset
+    return queryset.filter(**{f'{campo_produto}__in': ids})
@@ -0,0 +1,111 @@
+"""
+Cache versionado de artefatos compartilhados entre processos.
+
+Estruturas caras de montar (as tabelas de frete e de taxa compiladas) ficam
+no cache do Django sob a chave `<nome>:<versão>`; a versão de cada nome fica
+em `versao:<nome>` e é trocada a cada alteração dos dados. Um artefato só é
+lido pela versão atual, então nada obsoleto é servido: a chave antiga deixa
+de ser consultada por qualquer processo e expira sozinha.
+
+Com um cache compartilhado (Redis ou arquivo, ver CACHES nas settings), um
+worker aproveita o que outro já montou em vez de consultar as regras. Cada
+processo ainda guarda em memória o último artefato de cada nome e, por
+consulta, só lê a versão; dentro de `versoes_fixas()` (recálculo em lote) nem
+isso: cada versão é lida uma vez no bloco.
+"""
+import threading
+import uuid
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from django.db import transaction
+
+from . import metricas
+
+
+# Rede de segurança: artefatos de versões antigas saem do cache depois desse tempo
+TEMPO_ARTEFATO = 60 * 60 * 24
+
+_lock = threading.Lock()
+_locais = {}                      # nome -> (versão, artefato)
+_fixas = threading.local()
+
+
+def _chave_versao(nome):
+    return f'versao:{nome}'
+
+
+def versao_atual(nome):
+    fixas = getattr(_fixas, 'versoes', None)
+    if fixas is not None and nome in fixas:
+        return fixas[nome]
+
+    versao = cache.get(_chave_versao(nome))
+    if versao is None:
+        versao = uuid.uuid4().hex
+        cache.add(_chave_versao(nome), versao, None)
+        versao = cache.get(_chave_versao(nome), versao)
+    if fixas is not None:
+        fixas[nome] = versao
+    return versao
+
+
+def trocar_versao(*nomes):
+    """Nova versão para os nomes (todos os processos remontam na próxima consulta)."""
+    cache.set_many({_chave_versao(nome): uuid.uuid4().hex for nome in nomes}, None)
+    fixas = getattr(_fixas, 'versoes', None)
+    if fixas is not None:
+        for nome in nomes:
+            fixas.pop(nome, None)
+
+
+def invalidar(*nomes):
+    """
+    Troca a versão agora (quem consulta na mesma transação já vê os dados novos)
+    e de novo no commit: outro processo pode ter montado o artefato no meio da
+    transação, ainda com os dados antigos, e guardado na versão intermediária.
+    """
+    trocar_versao(*nomes)
+    transaction.on_commit(lambda: trocar_versao(*nomes))
+
+
+def obter(nome, construir, tempo=TEMPO_ARTEFATO):
+    """Artefato da versão atual: da memória do processo, do cache ou montado por construir()."""
+    versao = versao_atual(nome)
+    artefato_metrica = nome.split(':', 1)[0]
+    local = _locais.get(nome)
+    if local is not None and local[0] == versao:
+        metricas.CACHE_ARTEFATOS.inc(artefato=artefato_metrica, origem='memoria')
+        return local[1]
+
+    with _lock:
+        local = _locais.get(nome)
+        if local is not None and local[0] == versao:
+            metricas.CACHE_ARTEFATOS.inc(artefato=artefato_metrica, origem='memoria')
+            return local[1]
+        chave = f'{nome}:{versao}'
+        artefato = cache.get(chave)
+        origem = 'cache'
+        if artefato is None:
+            artefato = construir()
+            cache.set(chave, artefato, tempo)
+            origem = 'montado'
+        metricas.CACHE_ARTEFATOS.inc(artefato=artefato_metrica, origem=origem)
+        _locais[nome] = (versao, artefato)
+        return artefato
+
+
+@contextmanager
+def versoes_fixas():
+    """
+    Cada versão é lida do cache uma vez no bloco (trocas feitas pelo próprio
+    bloco continuam valendo). Para laços que consultam as tabelas milhares de vezes.
+    """
+    if getattr(_fixas, 'versoes', None) is not None:
+        yield
+        return
+    _fixas.versoes = {}
+    try:
+        yield
+    finally:
+        _fixas.versoes = None
@@ -0,0 +1,129 @@
+"""
+GET condicional (ETag / Last-Modified) para as páginas que leem preços.
+
+Cada página tem um escopo (catálogo inteiro, um canal, um grupo ou um produto)
+com um contador em ContadorAlteracao, incrementado pelos signals sempre que algo
+visível naquele escopo muda. O validador é uma leitura por chave primária:
+se o cliente já tem a versão atual, a resposta é 304 sem executar a consulta
+principal nem renderizar o template.
+"""
+import hashlib
+
+from django.contrib.messages import get_messages
+from django.db.models import F
+from django.utils import timezone
+from django.views.decorators.http import condition
+
+from .models import ContadorAlteracao, PrecoProdutoCanal
+from .pendencias import PendenciasDoCommit
+
+
+CATALOGO = 'catalogo'
+# Nomes de canais e grupos aparecem em todas as páginas de preço
+ESTRUTURA = 'estrutura'
+
+
+def escopo_canal(canal_id):
+    return f'canal:{canal_id}'
+
+
+def escopo_grupo(grupo_id):
+    return f'grupo:{grupo_id}'
+
+
+def escopo_produto(produto_id):
+    return f'produto:{produto_id}'
+
+
+def escopos_do_produto(produto_id):
+    """Escopos afetados por uma mudança no produto (inclui os canais/grupos onde ele tem preço)."""
+    return escopos_dos_produtos([produto_id])
+
+
+def escopos_dos_produtos(produto_ids):
+    """Escopos afetados por mudanças em vários produtos (uma consulta)."""
+    escopos = {CATALOGO}
+    escopos.update(escopo_produto(pk) for pk in produto_ids)
+    for canal_id, grupo_id in PrecoProdutoCanal.objects.filter(produto_id__in=produto_ids).values_list(
+        'canal_id', 'canal__grupo_id'
+    ).distinct():
+        escopos.add(escopo_canal(canal_id))
+        escopos.add(escopo_grupo(grupo_id))
+    return escopos
+
+
+def _gravar_escopos(escopos):
+    agora = timezone.now()
+    for escopo in sorted(escopos):
+        atualizados = ContadorAlteracao.objects.filter(escopo=escopo).update(
+            valor=F('valor') + 1, atualizado_em=agora
+        )
+        if not atualizados:
+            ContadorAlteracao.objects.get_or_create(
+                escopo=escopo, defaults={'valor': 1, 'atualizado_em': agora}
+            )
+
+
+_pendentes = PendenciasDoCommit(_gravar_escopos)
+
+
+def marcar_alteracao(*escopos):
+    """
+    Marca escopos como alterados. Os incrementos são agrupados e gravados no
+    commit da transação (um UPDATE por escopo, mesmo em recálculos de milhares
+    de preços); numa transação desfeita, nada é gravado.
+    """
+    _pendentes.marcar(escopos)
+
+
+def _validador(request, escopo):
+    """(etag, last_modified) do escopo, calculado uma vez por request."""
+    if not hasattr(request, '_validador_precos'):
+        # Mensagens pendentes (ex.: "Preço salvo") precisam ser renderizadas
+        if len(get_messages(request)):
+            request._validador_precos = (None, None)
+            return request._validador_precos
+
+        contadores = dict(
+            (e, (valor, atualizado_em))
+            for e, valor, atualizado_em in ContadorAlteracao.objects.filter(
+                escopo__in=[escopo, ESTRUTURA]
+            ).values_list('escopo', 'valor', 'atualizado_em')
+        )
+        valor, modificado = contadores.get(escopo, (0, None))
+        valor_estrutura, modificado_estrutura = contadores.get(ESTRUTURA, (0, None))
+        datas = [d for d in (modificado, modificado_estrutura) if d]
+
+        usuario = request.user.pk if request.user.is_authenticated else 0
+        base = f'{escopo}:{valor}:{valor_estrutura}:{usuario}:{request.get_full_path()}'
+        request._validador_precos = (
+            hashlib.md5(base.encode()).hexdigest(),
+            max(datas) if datas else None,
+        )
+    return request._validador_precos
+
+
+def condicional_por_escopo(funcao_escopo):
+    """
+    Decorator de view: `funcao_escopo(request, *args, **kwargs)` devolve o escopo da página.
+    Para class-based views use com method_decorator no dispatch.
+    """
+    return condition(
+        etag_func=lambda request, *args, **kwargs: _validador(request, funcao_escopo(request, *args, **kwargs))[0],
+        last_modified_func=lambda request, *args, **kwargs: _validador(request, funcao_escopo(request, *args, **kwargs))[1],
+    )
+
+
+def escopo_listagem(request, *args, **kwargs):
+    """Escopo das listagens filtráveis por canal ou grupo (demais filtros entram na ETag pela URL)."""
+    canal = request.GET.get('canal')
+    grupo = request.GET.get('grupo')
+    if canal and canal.isdigit():
+        return escopo_canal(canal)
+    if grupo and grupo.isdigit():
+        return escopo_grupo(grupo)
+    return CATALOGO
+
+
+def escopo_produto_detalhe(request, pk, *args, **kwargs):
+    return escopo_produto(pk)
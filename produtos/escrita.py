@@ -0,0 +1,137 @@
+"""
+Escrita em massa com o caminho nativo de cada banco.
+
+Usado pelo recálculo em lote (histórico e campos calculados dos preços) e
+pelas importações de regras de frete e taxa:
+
+- inserir_em_massa: no PostgreSQL, `COPY ... FROM STDIN` em formato texto (uma
+  ida ao banco por lote, sem montar INSERTs); nos demais bancos (SQLite no
+  desenvolvimento e nos testes), INSERT com executemany por lote. Como o COPY
+  não devolve as chaves, os objetos não recebem pk: serve para linhas que
+  ninguém referencia logo depois (histórico, regras);
+- gravar_ou_atualizar: `INSERT ... ON CONFLICT (chave) DO UPDATE` pelo
+  bulk_create do Django (PostgreSQL e SQLite têm upsert nativo). Para os
+  preços substitui o bulk_update, que gera um CASE por linha e coluna.
+
+Assim como bulk_create, nada aqui chama save() nem envia signals; os valores
+de auto_now/auto_now_add são preenchidos por pre_save dos campos.
+"""
+import io
+import json
+from itertools import islice
+
+from django.db import connections, router
+
+
+TAMANHO_LOTE = 2000
+
+
+def _lotes(objetos, tamanho_lote):
+    objetos = iter(objetos)
+    while True:
+        lote = list(islice(objetos, tamanho_lote))
+        if not lote:
+            return
+        yield lote
+
+
+def _campos(modelo, lote):
+    """Campos gravados: todos os concretos, menos a pk automática quando os objetos não têm pk."""
+    pk = modelo._meta.pk
+    sem_pk = [obj.pk is None for obj in lote]
+    if any(sem_pk) and not all(sem_pk):
+        raise ValueError('Lote mistura objetos com e sem pk')
+    automatica = pk.get_internal_type() in ('AutoField', 'BigAutoField', 'SmallAutoField')
+    return [
+        campo for campo in modelo._meta.concrete_fields
+        if not (campo.primary_key and automatica and sem_pk[0])
+    ]
+
+
+def _valor(campo, obj, conexao):
+    valor = campo.pre_save(obj, True)
+    if conexao.vendor == 'postgresql' and campo.get_internal_type() == 'JSONField':
+        # O adaptador do psycopg não serve para o COPY: vai o JSON em texto
+        return None if valor is None else json.dumps(valor, cls=campo.encoder)
+    return campo.get_db_prep_save(valor, connection=conexao)
+
+
+def _linhas(campos, lote, conexao):
+    for obj in lote:
+        yield [_valor(campo, obj, conexao) for campo in campos]
+
+
+# ------------------------------------------------------------
+# COPY (PostgreSQL)
+# ------------------------------------------------------------
+
+def _texto_copy(valor):
+    """Valor no formato texto do COPY: \\N para NULL e escapes de barra, tab e quebras de linha."""
+    if valor is None:
+        return '\\N'
+    if valor is True:
+        return 't'
+    if valor is False:
+        return 'f'
+    return (
+        str(valor).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+    )
+
+
+def _copiar(conexao, tabela, colunas, linhas):
+    buffer = io.StringIO()
+    for linha in linhas:
+        buffer.write('\t'.join(_texto_copy(valor) for valor in linha))
+        buffer.write('\n')
+    buffer.seek(0)
+
+    sql = f'COPY {tabela} ({", ".join(colunas)}) FROM STDIN'
+    with conexao.cursor() as cursor:
+        bruto = cursor.cursor
+        if hasattr(bruto, 'copy_expert'):
+            # psycopg2
+            bruto.copy_expert(sql, buffer)
+        else:
+            # psycopg 3
+            with bruto.copy(sql) as copia:
+                copia.write(buffer.getvalue())
+
+
+def _executemany(conexao, tabela, colunas, linhas):
+    sql = f'INSERT INTO {tabela} ({", ".join(colunas)}) VALUES ({", ".join(["%s"] * len(colunas))})'
+    with conexao.cursor() as cursor:
+        cursor.executemany(sql, list(linhas))
+
+
+def inserir_em_massa(modelo, objetos, tamanho_lote=TAMANHO_LOTE, using=None):
+    """
+    Insere os objetos (iterável, pode ser um gerador) em lotes: COPY no
+    PostgreSQL, executemany nos demais. Retorna o total inserido.
+    """
+    conexao = connections[using or router.db_for_write(modelo)]
+    quote = conexao.ops.quote_name
+    tabela = quote(modelo._meta.db_table)
+    gravar = _copiar if conexao.vendor == 'postgresql' else _executemany
+
+    total = 0
+    for lote in _lotes(objetos, tamanho_lote):
+        campos = _campos(modelo, lote)
+        gravar(conexao, tabela, [quote(campo.column) for campo in campos], _linhas(campos, lote, conexao))
+        total += len(lote)
+    return total
+
+
+# ------------------------------------------------------------
+# Upsert
+# ------------------------------------------------------------
+
+def gravar_ou_atualizar(modelo, objetos, chave, campos, tamanho_lote=TAMANHO_LOTE):
+    """
+    INSERT ... ON CONFLICT (chave) DO UPDATE SET campos = EXCLUDED.campos,
+    em lotes. Para linhas que já existem, só `campos` são regravados. Retorna o total.
+    """
+    total = 0
+    for lote in _lotes(objetos, tamanho_lote):
+        modelo.objects.bulk_create(lote, update_conflicts=True, unique_fields=chave, update_fields=campos)
+        total += len(lote)
+    return total
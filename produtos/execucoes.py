@@ -0,0 +1,97 @@
+"""
+Registro das execuções de recálculo de preços (ExecucaoRecalculo).
+
+Todo recálculo roda dentro de `registrar_execucao(origem, motivo, usuario)`:
+cascatas dos signals (produto, canal, grupo, tabelas de frete e taxa),
+recalcular_em_lote (importação, componentes, substituição de regras), o
+comando recalcular_precos, a edição em massa de regras e a edição manual de
+um preço. A execução:
+
+- é criada no início, então uma execução travada aparece sem duração;
+- conta os preços lidos, alterados e inalterados (PrecoProdutoCanal.aplicar_calculo
+  compara os campos calculados antes e depois);
+- mede duração e consultas ao banco (o mesmo wrapper do app.middleware);
+- marca com o seu id os históricos gravados durante ela;
+- guarda o erro que interrompeu o recálculo, quando há;
+- é apagada ao terminar se não leu nenhum preço nem teve erro (cascata de um
+  canal sem preços, por exemplo), para não encher a lista de linhas vazias.
+
+Execuções aninhadas (recalcular_em_lote dentro de uma importação, por
+exemplo) somam na de fora, que dá a origem e o usuário. Ao terminar, a
+execução alimenta as métricas de recálculo (produtos.metricas), com a origem
+como cascata.
+
+Dentro de uma transação que acaba desfeita, a linha da execução some junto:
+quem quer o registro das falhas abre a execução fora da transação (ver
+produtos.tarefas).
+"""
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.db import connection, connections
+from django.utils import timezone
+
+from app.middleware import Medicao
+
+from . import metricas
+
+
+_atual = threading.local()
+
+CAMPOS_FINAIS = [
+    'precos_lidos', 'precos_alterados', 'precos_inalterados', 'consultas', 'duracao', 'erro', 'concluida_em',
+]
+
+
+def execucao_atual():
+    """Execução em andamento nesta thread (ou None)."""
+    return getattr(_atual, 'execucao', None)
+
+
+def contar_preco(alterado):
+    """Um preço recalculado na execução atual (sem execução, não faz nada)."""
+    execucao = execucao_atual()
+    if execucao is None:
+        return
+    execucao.precos_lidos += 1
+    if alterado:
+        execucao.precos_alterados += 1
+    else:
+        execucao.precos_inalterados += 1
+
+
+@contextmanager
+def registrar_execucao(origem, motivo='', usuario=None):
+    """Abre uma ExecucaoRecalculo (ou reaproveita a que já está em andamento na thread)."""
+    externa = execucao_atual()
+    if externa is not None:
+        yield externa
+        return
+
+    from .models import ExecucaoRecalculo
+
+    execucao = ExecucaoRecalculo.objects.create(origem=origem, motivo=motivo, usuario=usuario)
+    medicao = Medicao()
+    comeco = time.perf_counter()
+    _atual.execucao = execucao
+    try:
+        with ExitStack() as pilha:
+            for conexao in connections.all():
+                pilha.enter_context(conexao.execute_wrapper(medicao))
+            yield execucao
+    except Exception as e:
+        execucao.erro = f'{type(e).__name__}: {e}'
+        raise
+    finally:
+        _atual.execucao = None
+        execucao.duracao = time.perf_counter() - comeco
+        execucao.consultas = medicao.total
+        execucao.concluida_em = timezone.now()
+        # Numa transação quebrada não dá para gravar; ela vai ser desfeita, com a execução
+        if not (connection.in_atomic_block and connection.needs_rollback):
+            if execucao.precos_lidos or execucao.erro:
+                execucao.save(update_fields=CAMPOS_FINAIS)
+            else:
+                execucao.delete()
+        metricas.registrar_recalculo(origem, execucao.precos_lidos, comeco)
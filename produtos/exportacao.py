@@ -0,0 +1,168 @@
+"""
+Exportação do histórico de preços (CSV e XLSX) com memória constante.
+
+As linhas são lidas com cursor no servidor (`iterator(chunk_size=...)`) e
+escritas uma a uma: no CSV direto na resposta HTTP (StreamingHttpResponse),
+no XLSX pelo modo write-only do openpyxl, que descarrega cada linha em um
+arquivo temporário em disco.
+"""
+import csv
+import datetime
+import tempfile
+
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+import openpyxl
+
+from .models import HistoricoPreco
+
+
+TAMANHO_LOTE = 2000
+
+# (campo no banco, cabeçalho do arquivo)
+COLUNAS_HISTORICO = [
+    ('data_registro', 'Data/Hora'),
+    ('produto__sku', 'SKU'),
+    ('produto__titulo', 'Produto'),
+    ('canal__nome', 'Canal'),
+    ('grupo_nome', 'Grupo'),
+    ('usuario__username', 'Usuário'),
+    ('motivo', 'Motivo'),
+    ('custo', 'Custo'),
+    ('peso_produto', 'Peso (kg)'),
+    ('frete_aplicado', 'Frete'),
+    ('taxa_extra', 'Taxa Extra'),
+    ('preco_venda', 'Preço Venda'),
+    ('preco_promocao', 'Preço Promoção'),
+    ('preco_minimo', 'Preço Mínimo'),
+    ('imposto', 'Imposto (%)'),
+    ('operacao', 'Operação (%)'),
+    ('lucro', 'Lucro (%)'),
+    ('promocao', 'Promoção (%)'),
+    ('minimo', 'Mínimo (%)'),
+    ('ads', 'Ads (%)'),
+    ('comissao', 'Comissão (%)'),
+    ('markup_frete', 'Markup Frete'),
+    ('markup_venda', 'Markup Venda'),
+    ('markup_promocao', 'Markup Promoção'),
+    ('markup_minimo', 'Markup Mínimo'),
+]
+
+CONTENT_TYPE_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def _inicio_do_dia(valor, dias=0):
+    """Início do dia (no fuso atual) de uma data ou 'AAAA-MM-DD'; None se inválida."""
+    if isinstance(valor, str):
+        try:
+            valor = parse_date(valor.strip())
+        except ValueError:
+            valor = None
+    if not isinstance(valor, datetime.date):
+        return None
+    return timezone.make_aware(datetime.datetime.combine(valor + datetime.timedelta(days=dias), datetime.time.min))
+
+
+def filtrar_historicos(queryset, filtros):
+    """
+    Aplica os filtros da tela de histórico (produto, canal, data_inicio, data_fim
+    e execucao, o id da execução de recálculo).
+    `filtros` pode ser o request.GET ou um dict simples.
+    """
+    produto = filtros.get('produto')
+    canal = filtros.get('canal')
+    data_inicio = filtros.get('data_inicio')
+    data_fim = filtros.get('data_fim')
+    execucao = filtros.get('execucao')
+
+    if produto:
+        queryset = queryset.filter(produto__sku__icontains=produto)
+    if canal:
+        queryset = queryset.filter(canal__nome__icontains=canal)
+    if execucao and str(execucao).isdigit():
+        queryset = queryset.filter(execucao_id=execucao)
+    # Intervalo na própria coluna (não em data_registro__date) para usar o índice historico_data_idx
+    inicio = _inicio_do_dia(data_inicio)
+    if inicio:
+        queryset = queryset.filter(data_registro__gte=inicio)
+    fim = _inicio_do_dia(data_fim, dias=1)
+    if fim:
+        queryset = queryset.filter(data_registro__lt=fim)
+
+    return queryset
+
+
+def iterar_linhas(filtros, tamanho_lote=TAMANHO_LOTE):
+    """Gera tuplas com os valores das colunas, sem instanciar modelos."""
+    queryset = filtrar_historicos(HistoricoPreco.objects.all(), filtros)
+    campos = [campo for campo, _ in COLUNAS_HISTORICO]
+    linhas = queryset.order_by('-data_registro', '-pk').values_list(*campos)
+
+    for linha in linhas.iterator(chunk_size=tamanho_lote):
+        data = timezone.localtime(linha[0]).replace(tzinfo=None) if linha[0] else None
+        yield (data,) + linha[1:]
+
+
+def _formatar_csv(valor):
+    """Formata valores no padrão do Excel pt-BR (decimal com vírgula)."""
+    if valor is None:
+        return ''
+    if hasattr(valor, 'strftime'):
+        return valor.strftime('%d/%m/%Y %H:%M:%S')
+    if hasattr(valor, 'quantize'):
+        return str(valor).replace('.', ',')
+    return valor
+
+
+class _Eco:
+    """Pseudo-buffer: devolve o que o csv.writer escreve, sem acumular."""
+
+    def write(self, valor):
+        return valor
+
+
+def gerar_csv(filtros, tamanho_lote=TAMANHO_LOTE):
+    """Gera o CSV linha a linha (strings prontas para a resposta ou arquivo)."""
+    writer = csv.writer(_Eco(), delimiter=';')
+    # BOM para o Excel reconhecer UTF-8
+    yield '\ufeff' + writer.writerow([titulo for _, titulo in COLUNAS_HISTORICO])
+    for linha in iterar_linhas(filtros, tamanho_lote):
+        yield writer.writerow([_formatar_csv(v) for v in linha])
+
+
+def escrever_xlsx(filtros, destino, tamanho_lote=TAMANHO_LOTE):
+    """Escreve o XLSX em `destino` (caminho ou arquivo) no modo write-only."""
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet('Histórico')
+    ws.append([titulo for _, titulo in COLUNAS_HISTORICO])
+    total = 0
+    for linha in iterar_linhas(filtros, tamanho_lote):
+        ws.append(list(linha))
+        total += 1
+    wb.save(destino)
+    return total
+
+
+def _nome_arquivo(extensao):
+    return f"historico_precos_{timezone.localtime():%Y%m%d_%H%M%S}.{extensao}"
+
+
+def resposta_csv(filtros):
+    response = StreamingHttpResponse(gerar_csv(filtros), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename={_nome_arquivo("csv")}'
+    return response
+
+
+def resposta_xlsx(filtros):
+    # O arquivo temporário é apagado quando a resposta fecha o arquivo
+    arquivo = tempfile.TemporaryFile(suffix='.xlsx')
+    escrever_xlsx(filtros, arquivo)
+    arquivo.seek(0)
+    return FileResponse(
+        arquivo,
+        as_attachment=True,
+        filename=_nome_arquivo('xlsx'),
+        content_type=CONTENT_TYPE_XLSX,
+    )
@@ -0,0 +1,204 @@
+"""
+Feeds de preços por canal (CSV e XLSX) pré-gerados em disco.
+
+Cada canal tem `feeds/canal_<id>.csv` e `.xlsx` em MEDIA_ROOT, com SKU, título
+(principal e cada variação) e preços, lidos do read-model LinhaTabelaPreco.
+Ao lado de cada arquivo fica um `.sha256` (formato do sha256sum).
+
+Os signals só marcam o feed do canal como pendente; o comando gerar_feeds
+regera os pendentes depois de um intervalo sem novas alterações (debounce),
+então um recálculo de milhares de preços resulta em uma única geração.
+Os arquivos são escritos em temporário e trocados com os.replace, de modo que
+quem baixa nunca vê um arquivo pela metade. O download é estático: nenhum acesso ao banco.
+"""
+import csv
+import hashlib
+import os
+import re
+import tempfile
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+import openpyxl
+
+from canais_vendas.models import CanalVenda
+
+from .exportacao import _Eco, _formatar_csv
+from .matriz import CENTAVOS, preco_efetivo
+from .models import FeedCanal, LinhaTabelaPreco, PrecoProdutoCanal
+from .pendencias import PendenciasDoCommit
+
+
+SUBDIRETORIO = 'feeds'
+
+# Espera sem alterações antes de regerar e espera máxima sob alterações contínuas
+DEBOUNCE = timedelta(seconds=60)
+ESPERA_MAXIMA = timedelta(minutes=15)
+
+COLUNAS_FEED = ['SKU', 'Título', 'Tipo', 'Preço Venda', 'Preço Promoção', 'Preço Mínimo', 'Frete']
+
+# Caracteres que o Excel (e o openpyxl) não aceitam no nome da aba
+_RE_ABA_INVALIDA = re.compile(r'[\\/*?:\[\]]')
+
+
+def titulo_aba(canal):
+    """Nome do canal como título de aba: sem []:*?/\\ e com até 31 caracteres."""
+    titulo = _RE_ABA_INVALIDA.sub('-', canal.nome)[:31].strip()
+    return titulo or f'Canal {canal.pk}'
+
+
+def diretorio_feeds():
+    return Path(settings.MEDIA_ROOT) / SUBDIRETORIO
+
+
+def nome_arquivo(canal_id, extensao):
+    return f'canal_{canal_id}.{extensao}'
+
+
+def url_feed(canal_id, extensao):
+    return f'{settings.MEDIA_URL}{SUBDIRETORIO}/{nome_arquivo(canal_id, extensao)}'
+
+
+# ------------------------------------------------------------
+# Marcação (signals)
+# ------------------------------------------------------------
+
+def _gravar_canais(canais):
+    agora = timezone.now()
+    FeedCanal.objects.filter(canal_id__in=canais).update(alterado_em=agora, pendente=True)
+    FeedCanal.objects.filter(canal_id__in=canais, pendente_desde__isnull=True).update(pendente_desde=agora)
+
+
+_pendentes = PendenciasDoCommit(_gravar_canais)
+
+
+def marcar_feeds(*canal_ids):
+    """Marca os feeds dos canais como pendentes no commit da transação (agrupado)."""
+    _pendentes.marcar(canal_ids)
+
+
+def marcar_feeds_produto(produto_id):
+    """Produto/título alterado: marca os canais em que o produto tem preço."""
+    marcar_feeds(*PrecoProdutoCanal.objects.filter(produto_id=produto_id).values_list('canal_id', flat=True))
+
+
+# ------------------------------------------------------------
+# Geração
+# ------------------------------------------------------------
+
+def iterar_linhas_feed(canal_id):
+    linhas = LinhaTabelaPreco.objects.filter(canal_id=canal_id, preco__ativo=True).annotate(
+        venda=preco_efetivo('venda', 'preco__'),
+        promocao=preco_efetivo('promocao', 'preco__'),
+        minimo=preco_efetivo('minimo', 'preco__'),
+        frete=Coalesce(F('preco__frete_especifico'), F('preco__frete_calculado')),
+    ).order_by(*LinhaTabelaPreco.ORDENACAO).values_list(
+        'sku', 'titulo', 'principal', 'venda', 'promocao', 'minimo', 'frete'
+    )
+    for sku, titulo, principal, *valores in linhas.iterator(chunk_size=2000):
+        yield [sku, titulo, 'Principal' if principal else 'Variação'] + [
+            None if v is None else v.quantize(CENTAVOS) for v in valores
+        ]
+
+
+def _sha256(caminho):
+    h = hashlib.sha256()
+    with open(caminho, 'rb') as arquivo:
+        for bloco in iter(lambda: arquivo.read(1024 * 1024), b''):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+def _substituir(destino, escrever):
+    """Escreve via `escrever(caminho_temporario)` e troca atomicamente pelo destino."""
+    fd, temporario = tempfile.mkstemp(dir=destino.parent, prefix=f'.{destino.name}.', suffix='.tmp')
+    os.close(fd)
+    try:
+        escrever(temporario)
+        with open(temporario, 'rb') as arquivo:
+            os.fsync(arquivo.fileno())
+        os.chmod(temporario, 0o644)
+        os.replace(temporario, destino)
+    except BaseException:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        raise
+
+
+def _publicar(destino, escrever):
+    """Publica o arquivo e o .sha256 ao lado. Retorna o hash."""
+    _substituir(destino, escrever)
+    digest = _sha256(destino)
+
+    def escrever_hash(caminho):
+        with open(caminho, 'w', encoding='ascii') as arquivo:
+            arquivo.write(f'{digest}  {destino.name}\n')
+
+    _substituir(destino.with_name(destino.name + '.sha256'), escrever_hash)
+    return digest
+
+
+def gerar_feed(canal):
+    """Gera CSV e XLSX de um canal e atualiza o FeedCanal. Retorna o FeedCanal."""
+    diretorio = diretorio_feeds()
+    diretorio.mkdir(parents=True, exist_ok=True)
+    inicio = timezone.now()
+    total = 0
+
+    def escrever_csv(caminho):
+        nonlocal total
+        writer = csv.writer(_Eco(), delimiter=';')
+        with open(caminho, 'w', encoding='utf-8', newline='') as arquivo:
+            # BOM para o Excel reconhecer UTF-8
+            arquivo.write('\ufeff' + writer.writerow(COLUNAS_FEED))
+            for linha in iterar_linhas_feed(canal.pk):
+                arquivo.write(writer.writerow([_formatar_csv(v) for v in linha]))
+                total += 1
+
+    def escrever_xlsx(caminho):
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet(titulo_aba(canal))
+        ws.append(COLUNAS_FEED)
+        for linha in iterar_linhas_feed(canal.pk):
+            ws.append(linha)
+        wb.save(caminho)
+
+    sha_csv = _publicar(diretorio / nome_arquivo(canal.pk, 'csv'), escrever_csv)
+    sha_xlsx = _publicar(diretorio / nome_arquivo(canal.pk, 'xlsx'), escrever_xlsx)
+
+    feed, _ = FeedCanal.objects.get_or_create(canal=canal)
+    FeedCanal.objects.filter(pk=feed.pk).update(
+        gerado_em=timezone.now(), linhas=total, sha256_csv=sha_csv, sha256_xlsx=sha_xlsx,
+    )
+    # Só limpa a pendência se nada mudou durante a geração
+    FeedCanal.objects.filter(pk=feed.pk).exclude(alterado_em__gt=inicio).update(
+        pendente=False, pendente_desde=None,
+    )
+    feed.refresh_from_db()
+    return feed
+
+
+def feeds_a_gerar(agora=None, todos=False):
+    """Canais cujo feed precisa ser gerado (cria o FeedCanal dos canais novos)."""
+    agora = agora or timezone.now()
+    canais = CanalVenda.objects.filter(ativo=True)
+
+    existentes = set(FeedCanal.objects.values_list('canal_id', flat=True))
+    FeedCanal.objects.bulk_create([
+        FeedCanal(canal_id=pk, pendente=True, pendente_desde=agora, alterado_em=agora)
+        for pk in canais.values_list('pk', flat=True) if pk not in existentes
+    ])
+
+    if todos:
+        return list(canais)
+    return list(canais.filter(feed__pendente=True).filter(
+        Q(feed__gerado_em__isnull=True)
+        | Q(feed__alterado_em__isnull=True)
+        | Q(feed__alterado_em__lte=agora - DEBOUNCE)
+        | Q(feed__pendente_desde__lte=agora - ESPERA_MAXIMA)
+    ))
@@ -0,0 +1,469 @@
+"""
+Importação do catálogo (produtos, ficha técnica e títulos) por planilha.
+
+Formatos:
+- XLSX com as abas "Produtos", "Ficha Técnica" e "Títulos" (qualquer uma
+  pode faltar), processadas nessa ordem;
+- CSV de uma das três entidades (escolhida no formulário).
+
+As colunas são identificadas pelo cabeçalho (sem diferenciar acentos ou
+maiúsculas). Tudo é casado pelo SKU:
+
+- Produtos: upsert por SKU. Em produto existente, células vazias mantêm o valor atual.
+- Ficha Técnica: a planilha substitui a ficha inteira de cada SKU que aparece nela.
+- Títulos: upsert por (SKU, título); títulos que não estão na planilha ficam como estão.
+
+As linhas são lidas em streaming e gravadas em lotes com bulk_create/bulk_update
+(itens de ficha com produtos.escrita.inserir_em_massa, COPY no PostgreSQL),
+com os signals por linha desligados (`recalculo_suspenso()`). No final, custo da
+ficha, índices derivados e preços dos produtos afetados são atualizados uma vez,
+em lote (produtos.recalculo).
+
+Com `validar=True` nada é gravado: as linhas só passam pela conversão e
+`progresso` é chamado a cada lote (primeira etapa das importações em segundo
+plano, ver produtos.tarefas). Erros que dependem do banco, como SKU não
+cadastrado, só aparecem na gravação.
+"""
+import csv
+import io
+from decimal import Decimal
+from itertools import islice
+
+from django.db import transaction
+from django.utils import timezone
+
+import openpyxl
+
+from tabela_frete.importacao import ErroLinha, ler_booleano, ler_decimal
+
+from .busca import normalizar
+from .escrita import inserir_em_massa
+from .models import ItemFichaTecnica, PrecoProdutoCanal, Produto, TituloProduto
+from .recalculo import atualizar_custos_ficha, atualizar_derivados_produtos, recalcular_em_lote
+from .signals import recalculo_suspenso
+
+
+TAMANHO_LOTE = 1000
+
+MAX_ERROS_RELATORIO = 200
+
+PRODUTOS = 'produtos'
+FICHA = 'ficha'
+TITULOS = 'titulos'
+
+ENTIDADES = [
+    (PRODUTOS, 'Produtos'),
+    (FICHA, 'Ficha Técnica'),
+    (TITULOS, 'Títulos'),
+]
+
+# Nome normalizado da aba -> entidade
+ABAS = {
+    'produtos': PRODUTOS,
+    'ficha tecnica': FICHA,
+    'ficha': FICHA,
+    'titulos': TITULOS,
+}
+
+COLUNAS = {
+    PRODUTOS: ['sku', 'titulo', 'ean', 'largura', 'altura', 'profundidade', 'peso_fisico', 'ativo'],
+    FICHA: ['sku', 'tipo', 'codigo', 'descricao', 'unidade', 'quantidade', 'custo_unitario', 'multiplicador'],
+    TITULOS: ['sku', 'titulo', 'ativo'],
+}
+
+OBRIGATORIOS_PRODUTO = ['titulo', 'largura', 'altura', 'profundidade', 'peso_fisico']
+
+# (casas decimais, dígitos, mínimo) dos campos numéricos
+DECIMAIS_PRODUTO = {
+    'largura': (2, 10, Decimal('0.01')),
+    'altura': (2, 10, Decimal('0.01')),
+    'profundidade': (2, 10, Decimal('0.01')),
+    'peso_fisico': (3, 10, Decimal('0.001')),
+}
+
+TIPOS_ITEM = dict(ItemFichaTecnica.TIPO_CHOICES)
+UNIDADES_ITEM = dict(ItemFichaTecnica.UNIDADE_CHOICES)
+
+
+class RelatorioCatalogo:
+    """Contagens por entidade e erros por linha (aba, linha, mensagem)."""
+
+    def __init__(self):
+        self.linhas = 0
+        self.validas = 0
+        self.produtos_criados = 0
+        self.produtos_atualizados = 0
+        self.itens_ficha = 0
+        self.titulos_criados = 0
+        self.titulos_atualizados = 0
+        self.precos_recalculados = 0
+        self.total_erros = 0
+        self.erros = []
+
+    def adicionar_erro(self, origem, numero, mensagem):
+        self.total_erros += 1
+        if len(self.erros) < MAX_ERROS_RELATORIO:
+            self.erros.append((origem, numero, mensagem))
+
+    def rejeitar(self, origem, numero, mensagem):
+        """Linha que passou na conversão mas não pôde ser gravada."""
+        self.validas -= 1
+        self.adicionar_erro(origem, numero, mensagem)
+
+    @property
+    def erros_omitidos(self):
+        return self.total_erros - len(self.erros)
+
+    @property
+    def gravadas(self):
+        return (
+            self.produtos_criados + self.produtos_atualizados + self.itens_ficha
+            + self.titulos_criados + self.titulos_atualizados
+        )
+
+
+# ------------------------------------------------------------
+# Leitura
+# ------------------------------------------------------------
+
+def _nome_coluna(valor):
+    return '_'.join(normalizar(valor).split())
+
+
+def _mapear_colunas(cabecalho, entidade):
+    nomes = [_nome_coluna(c) if c is not None else '' for c in cabecalho]
+    colunas = {nome: i for i, nome in enumerate(nomes) if nome in COLUNAS[entidade]}
+    if 'sku' not in colunas:
+        raise ErroLinha('coluna "sku" não encontrada no cabeçalho')
+    return colunas
+
+
+def _linhas_com_dados(linhas):
+    for numero, valores in linhas:
+        if any(v is not None and str(v).strip() != '' for v in valores):
+            yield numero, valores
+
+
+def _abas_xlsx(arquivo):
+    """[(entidade, nome da aba, cabeçalho, linhas)] na ordem produtos, ficha, títulos."""
+    wb = openpyxl.load_workbook(arquivo, read_only=True, data_only=True)
+    abas = {}
+    ignoradas = []
+    for ws in wb.worksheets:
+        entidade = ABAS.get(normalizar(ws.title).strip())
+        if entidade is None or entidade in abas:
+            ignoradas.append(ws.title)
+            continue
+        linhas = ws.iter_rows(values_only=True)
+        cabecalho = next(linhas, None) or ()
+        abas[entidade] = (ws.title, cabecalho, _linhas_com_dados(enumerate(linhas, start=2)))
+    return wb, [(e, *abas[e]) for e, _ in ENTIDADES if e in abas], ignoradas
+
+
+def _linhas_csv(arquivo):
+    # UploadedFile do Django: o TextIOWrapper precisa do arquivo binário subjacente
+    texto = io.TextIOWrapper(getattr(arquivo, 'file', arquivo), encoding='utf-8-sig', newline='')
+    primeira = texto.readline()
+    delimitador = ';' if primeira.count(';') >= primeira.count(',') else ','
+    cabecalho = next(csv.reader([primeira], delimiter=delimitador), [])
+    linhas = csv.reader(texto, delimiter=delimitador)
+    return cabecalho, _linhas_com_dados(enumerate(linhas, start=2))
+
+
+def _lotes(iteravel, tamanho):
+    iteravel = iter(iteravel)
+    while True:
+        lote = list(islice(iteravel, tamanho))
+        if not lote:
+            return
+        yield lote
+
+
+def _valor(valores, colunas, campo):
+    indice = colunas.get(campo)
+    if indice is None or indice >= len(valores):
+        return None
+    valor = valores[indice]
+    if isinstance(valor, str):
+        valor = valor.strip()
+        if valor == '':
+            return None
+    return valor
+
+
+def _texto(valores, colunas, campo, tamanho):
+    valor = _valor(valores, colunas, campo)
+    if valor is None:
+        return None
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)
+    valor = str(valor)
+    if len(valor) > tamanho:
+        raise ErroLinha(f'{campo}: mais de {tamanho} caracteres')
+    return valor
+
+
+# ------------------------------------------------------------
+# Entidades
+# ------------------------------------------------------------
+
+class _Importacao:
+    def __init__(self, relatorio, tamanho_lote, gravar=True, progresso=None):
+        self.relatorio = relatorio
+        self.tamanho_lote = tamanho_lote
+        self.gravar = gravar
+        self.progresso = progresso
+        self.agora = timezone.now()
+        self.ids_por_sku = {}
+        self.novos = set()
+        # Produtos cujo preço muda (dimensões, peso ou ficha) e cujos índices mudam (SKU/títulos)
+        self.recalcular = set()
+        self.derivados = set()
+        self.fichas = set()
+
+    def _ids(self, skus):
+        faltando = [s for s in skus if s not in self.ids_por_sku]
+        if faltando:
+            self.ids_por_sku.update(Produto.objects.filter(sku__in=faltando).values_list('sku', 'pk'))
+        return self.ids_por_sku
+
+    def _lotes(self, origem, linhas, ler):
+        """{sku: [(numero, dados)]} de cada lote, só quando a importação grava."""
+        for lote in _lotes(linhas, self.tamanho_lote):
+            por_sku = self._ler_lote(origem, lote, ler)
+            if self.progresso:
+                self.progresso(self.relatorio)
+            if self.gravar:
+                yield por_sku
+
+    def _ler_lote(self, origem, lote, ler):
+        """{sku: [(numero, dados)]} das linhas válidas do lote."""
+        por_sku = {}
+        for numero, valores in lote:
+            self.relatorio.linhas += 1
+            try:
+                sku, dados = ler(valores)
+            except ErroLinha as e:
+                self.relatorio.adicionar_erro(origem, numero, str(e))
+                continue
+            self.relatorio.validas += 1
+            por_sku.setdefault(sku, []).append((numero, dados))
+        return por_sku
+
+    def _sku(self, valores, colunas):
+        sku = _texto(valores, colunas, 'sku', 50)
+        if not sku:
+            raise ErroLinha('SKU vazio')
+        return sku
+
+    # Produtos
+
+    def produtos(self, origem, cabecalho, linhas):
+        colunas = _mapear_colunas(cabecalho, PRODUTOS)
+
+        def ler(valores):
+            dados = {}
+            titulo = _texto(valores, colunas, 'titulo', 255)
+            if titulo is not None:
+                dados['titulo'] = titulo
+            ean = _texto(valores, colunas, 'ean', 20)
+            if ean is not None:
+                dados['ean'] = ean
+            for campo, (casas, digitos, minimo) in DECIMAIS_PRODUTO.items():
+                valor = ler_decimal(_valor(valores, colunas, campo), campo, casas, digitos)
+                if valor is not None:
+                    if valor < minimo:
+                        raise ErroLinha(f'{campo}: deve ser no mínimo {minimo}')
+                    dados[campo] = valor
+            ativo = _valor(valores, colunas, 'ativo')
+            if ativo is not None:
+                dados['ativo'] = ler_booleano(ativo)
+            return self._sku(valores, colunas), dados
+
+        for por_sku in self._lotes(origem, linhas, ler):
+            existentes = {p.sku: p for p in Produto.objects.filter(sku__in=list(por_sku))}
+            novos, alterados, campos = [], [], {'atualizado_em'}
+            for sku, ocorrencias in por_sku.items():
+                dados = {}
+                for _, d in ocorrencias:
+                    dados.update(d)
+                numero = ocorrencias[-1][0]
+                produto = existentes.get(sku)
+                if produto is None:
+                    faltando = [c for c in OBRIGATORIOS_PRODUTO if c not in dados]
+                    if faltando:
+                        self.relatorio.validas -= len(ocorrencias) - 1
+                        self.relatorio.rejeitar(origem, numero, f'produto novo sem {", ".join(faltando)}')
+                        continue
+                    novos.append(Produto(sku=sku, **dados))
+                else:
+                    for campo, valor in dados.items():
+                        setattr(produto, campo, valor)
+                    produto.atualizado_em = self.agora
+                    campos.update(dados)
+                    alterados.append(produto)
+                    if set(dados) & set(DECIMAIS_PRODUTO):
+                        self.recalcular.add(produto.pk)
+
+            Produto.objects.bulk_create(novos)
+            if alterados:
+                Produto.objects.bulk_update(alterados, sorted(campos))
+            self.relatorio.produtos_criados += len(novos)
+            self.relatorio.produtos_atualizados += len(alterados)
+
+            ids = self._ids([p.sku for p in novos])
+            self.novos.update(ids[p.sku] for p in novos)
+            self.derivados.update(ids[p.sku] for p in novos)
+            self.derivados.update(p.pk for p in alterados)
+
+    # Ficha técnica
+
+    def ficha(self, origem, cabecalho, linhas):
+        colunas = _mapear_colunas(cabecalho, FICHA)
+        substituidos = set()
+
+        def ler(valores):
+            tipo = (_texto(valores, colunas, 'tipo', 2) or 'MP').upper()
+            if tipo not in TIPOS_ITEM:
+                raise ErroLinha(f'tipo "{tipo}" inválido (use {", ".join(TIPOS_ITEM)})')
+            unidade = (_texto(valores, colunas, 'unidade', 5) or 'UN').upper()
+            if unidade not in UNIDADES_ITEM:
+                raise ErroLinha(f'unidade "{unidade}" inválida')
+            codigo = _texto(valores, colunas, 'codigo', 50)
+            if not codigo:
+                raise ErroLinha('código vazio')
+            quantidade = ler_decimal(_valor(valores, colunas, 'quantidade'), 'quantidade', 2)
+            custo_unitario = ler_decimal(_valor(valores, colunas, 'custo_unitario'), 'custo_unitario', 3)
+            if quantidade is None or custo_unitario is None:
+                raise ErroLinha('quantidade e custo_unitario são obrigatórios')
+            multiplicador = ler_decimal(_valor(valores, colunas, 'multiplicador'), 'multiplicador', 2, 5)
+            return self._sku(valores, colunas), {
+                'tipo': tipo,
+                'codigo': codigo,
+                'descricao': _texto(valores, colunas, 'descricao', 255) or codigo,
+                'unidade': unidade,
+                'quantidade': quantidade,
+                'custo_unitario': custo_unitario,
+                'multiplicador': Decimal('1.00') if multiplicador is None else multiplicador,
+            }
+
+        for por_sku in self._lotes(origem, linhas, ler):
+            ids = self._ids(list(por_sku))
+            itens = []
+            for sku, ocorrencias in por_sku.items():
+                produto_id = ids.get(sku)
+                if produto_id is None:
+                    for numero, _ in ocorrencias:
+                        self.relatorio.rejeitar(origem, numero, f'SKU "{sku}" não cadastrado')
+                    continue
+                itens.extend(ItemFichaTecnica(produto_id=produto_id, **dados) for _, dados in ocorrencias)
+
+            # A ficha de cada SKU é substituída na primeira vez que ele aparece
+            limpar = {i.produto_id for i in itens} - substituidos
+            if limpar:
+                ItemFichaTecnica.objects.filter(produto_id__in=limpar).delete()
+                substituidos |= limpar
+            inserir_em_massa(ItemFichaTecnica, itens)
+            self.relatorio.itens_ficha += len(itens)
+            self.fichas |= limpar
+            self.recalcular |= limpar
+
+    # Títulos
+
+    def titulos(self, origem, cabecalho, linhas):
+        colunas = _mapear_colunas(cabecalho, TITULOS)
+
+        def ler(valores):
+            titulo = _texto(valores, colunas, 'titulo', 255)
+            if not titulo:
+                raise ErroLinha('título vazio')
+            ativo = _valor(valores, colunas, 'ativo')
+            return self._sku(valores, colunas), (titulo, True if ativo is None else ler_booleano(ativo))
+
+        for por_sku in self._lotes(origem, linhas, ler):
+            ids = self._ids(list(por_sku))
+            desejados = {}
+            for sku, ocorrencias in por_sku.items():
+                produto_id = ids.get(sku)
+                if produto_id is None:
+                    for numero, _ in ocorrencias:
+                        self.relatorio.rejeitar(origem, numero, f'SKU "{sku}" não cadastrado')
+                    continue
+                for _, (titulo, ativo) in ocorrencias:
+                    desejados[(produto_id, titulo)] = ativo
+
+            existentes = {
+                (t.produto_id, t.titulo): t
+                for t in TituloProduto.objects.filter(
+                    produto_id__in={p for p, _ in desejados},
+                    titulo__in={t for _, t in desejados},
+                )
+            }
+            novos, alterados = [], []
+            for (produto_id, titulo), ativo in desejados.items():
+                existente = existentes.get((produto_id, titulo))
+                if existente is None:
+                    novos.append(TituloProduto(produto_id=produto_id, titulo=titulo, ativo=ativo))
+                elif existente.ativo != ativo:
+                    existente.ativo = ativo
+                    existente.atualizado_em = self.agora
+                    alterados.append(existente)
+
+            TituloProduto.objects.bulk_create(novos)
+            TituloProduto.objects.bulk_update(alterados, ['ativo', 'atualizado_em'])
+            self.relatorio.titulos_criados += len(novos)
+            self.relatorio.titulos_atualizados += len(alterados)
+            self.derivados.update(t.produto_id for t in novos + alterados)
+
+    # Final
+
+    def finalizar(self, motivo):
+        if self.fichas:
+            atualizar_custos_ficha(self.fichas)
+        atualizar_derivados_produtos(self.derivados | self.recalcular, novos=bool(self.novos))
+        if self.recalcular:
+            self.relatorio.precos_recalculados = recalcular_em_lote(
+                PrecoProdutoCanal.objects.filter(produto_id__in=self.recalcular, ativo=True),
+                motivo=motivo, cascata='importacao',
+            )
+
+
+def importar_catalogo(arquivo, entidade_csv=None, tamanho_lote=TAMANHO_LOTE, motivo='Importação de catálogo',
+                      validar=False, progresso=None):
+    """
+    Importa um XLSX (abas por entidade) ou um CSV de `entidade_csv`.
+    Retorna o RelatorioCatalogo. Erros de formato do arquivo sobem como exceção.
+    """
+    relatorio = RelatorioCatalogo()
+    importacao = _Importacao(relatorio, tamanho_lote, gravar=not validar, progresso=progresso)
+    metodos = {PRODUTOS: importacao.produtos, FICHA: importacao.ficha, TITULOS: importacao.titulos}
+
+    wb = None
+    if arquivo.name.lower().endswith('.csv'):
+        if entidade_csv not in metodos:
+            raise ValueError('Informe o conteúdo do CSV (produtos, ficha técnica ou títulos).')
+        cabecalho, linhas = _linhas_csv(arquivo)
+        abas = [(entidade_csv, 'CSV', cabecalho, linhas)]
+    else:
+        wb, abas, ignoradas = _abas_xlsx(arquivo)
+        for nome in ignoradas:
+            relatorio.adicionar_erro(nome, None, 'aba ignorada (use Produtos, Ficha Técnica ou Títulos)')
+
+    def processar():
+        for entidade, origem, cabecalho, linhas in abas:
+            try:
+                metodos[entidade](origem, cabecalho, linhas)
+            except ErroLinha as e:
+                relatorio.adicionar_erro(origem, 1, str(e))
+
+    try:
+        if validar:
+            processar()
+        else:
+            with transaction.atomic(), recalculo_suspenso():
+                processar()
+                importacao.finalizar(motivo)
+    finally:
+        if wb is not None:
+            wb.close()
+    return relatorio
@@ -0,0 +1,74 @@
+"""
+Comando para exportar o histórico de preços em CSV ou XLSX.
+
+A leitura usa cursor no servidor e a escrita é linha a linha, então a memória
+fica constante independente do volume exportado.
+
+Uso:
+    python manage.py exportar_historico --saida historico.csv
+    python manage.py exportar_historico --formato xlsx --saida historico.xlsx
+    python manage.py exportar_historico --saida ml.csv --canal "ML Full" --data-inicio 2026-01-01
+"""
+from django.core.management.base import BaseCommand
+
+from produtos.exportacao import gerar_csv, escrever_xlsx
+
+
+class Command(BaseCommand):
+    help = 'Exporta o histórico de preços (filtrado) para CSV ou XLSX'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--saida',
+            type=str,
+            required=True,
+            help='Caminho do arquivo de saída',
+        )
+        parser.add_argument(
+            '--formato',
+            choices=['csv', 'xlsx'],
+            default='csv',
+            help='Formato do arquivo (padrão: csv)',
+        )
+        parser.add_argument(
+            '--produto',
+            type=str,
+            help='Filtra por SKU (contém)',
+        )
+        parser.add_argument(
+            '--canal',
+            type=str,
+            help='Filtra por nome do canal (contém)',
+        )
+        parser.add_argument(
+            '--data-inicio',
+            type=str,
+            help='Data inicial (AAAA-MM-DD)',
+        )
+        parser.add_argument(
+            '--data-fim',
+            type=str,
+            help='Data final (AAAA-MM-DD)',
+        )
+
+    def handle(self, *args, **options):
+        saida = options['saida']
+        filtros = {
+            'produto': options.get('produto'),
+            'canal': options.get('canal'),
+            'data_inicio': options.get('data_inicio'),
+            'data_fim': options.get('data_fim'),
+        }
+
+        self.stdout.write(f'Exportando histórico para {saida}...')
+
+        if options['formato'] == 'xlsx':
+            total = escrever_xlsx(filtros, saida)
+        else:
+            total = -1  # cabeçalho
+            with open(saida, 'w', encoding='utf-8', newline='') as arquivo:
+                for linha in gerar_csv(filtros):
+                    arquivo.write(linha)
+                    total += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Exportação concluída: {total} registros'))
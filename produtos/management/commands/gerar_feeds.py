@@ -0,0 +1,63 @@
+"""
+Comando para gerar os feeds de preços por canal (CSV e XLSX em MEDIA_ROOT/feeds).
+
+Sem argumentos, gera apenas os feeds pendentes cujo canal está há pelo menos
+1 minuto sem alterações (ou pendente há mais de 15 minutos). Pensado para
+rodar no cron a cada minuto, mais uma execução diária com --todos.
+
+Uso:
+    python manage.py gerar_feeds                      # Pendentes (debounce)
+    python manage.py gerar_feeds --todos              # Todos os canais ativos
+    python manage.py gerar_feeds --canal "ML Full"    # Apenas um canal
+    python manage.py gerar_feeds --canal 12           # Pelo id (nome repetido em grupos diferentes)
+"""
+from django.core.management.base import BaseCommand
+
+from canais_vendas.models import CanalVenda
+from produtos.feeds import feeds_a_gerar, gerar_feed
+
+
+class Command(BaseCommand):
+    help = 'Gera os arquivos de feed de preços por canal'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--todos',
+            action='store_true',
+            help='Regera o feed de todos os canais ativos',
+        )
+        parser.add_argument(
+            '--canal',
+            type=str,
+            help='Nome ou id do canal específico',
+        )
+
+    def handle(self, *args, **options):
+        canal_nome = options.get('canal')
+
+        if canal_nome:
+            # O nome só é único dentro do grupo
+            canais = list(CanalVenda.objects.filter(nome=canal_nome).select_related('grupo').order_by('pk'))
+            if not canais and canal_nome.isdigit():
+                canais = list(CanalVenda.objects.filter(pk=int(canal_nome)))
+            if not canais:
+                self.stderr.write(self.style.ERROR(f'Canal "{canal_nome}" não encontrado'))
+                return
+            if len(canais) > 1:
+                opcoes = ', '.join(f'{canal.pk} ({canal.grupo.nome})' for canal in canais)
+                self.stderr.write(self.style.ERROR(
+                    f'Há {len(canais)} canais "{canal_nome}", em grupos diferentes; informe o id: {opcoes}'
+                ))
+                return
+        else:
+            canais = feeds_a_gerar(todos=options['todos'])
+
+        if not canais:
+            self.stdout.write('Nenhum feed pendente.')
+            return
+
+        for canal in canais:
+            feed = gerar_feed(canal)
+            self.stdout.write(f'  {canal.nome}: {feed.linhas} linhas')
+
+        self.stdout.write(self.style.SUCCESS(f'Feeds gerados: {len(canais)}'))
@@ -0,0 +1,63 @@
+"""
+Comando que processa as importações de planilha enfileiradas pelas telas de
+importação (catálogo e regras de frete).
+
+Sem argumentos, processa a fila atual e termina (para o cron a cada minuto).
+Com --continuo, fica rodando como worker e verifica a fila a cada intervalo.
+Antes de cada verificação, as tarefas validando ou gravando há mais de
+--tempo-limite minutos (worker que parou no meio) são marcadas como falhou.
+
+Uso:
+    python manage.py processar_importacoes                 # Fila atual
+    python manage.py processar_importacoes --continuo      # Worker
+    python manage.py processar_importacoes --continuo --intervalo 2
+    python manage.py processar_importacoes --tempo-limite 180
+"""
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from produtos.models import TarefaImportacao
+from produtos.tarefas import TEMPO_LIMITE, processar_pendentes
+
+
+class Command(BaseCommand):
+    help = 'Processa as importações de planilha pendentes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--continuo',
+            action='store_true',
+            help='Continua rodando e verificando a fila',
+        )
+        parser.add_argument(
+            '--intervalo',
+            type=float,
+            default=5,
+            help='Segundos entre verificações da fila no modo contínuo (padrão: 5)',
+        )
+        parser.add_argument(
+            '--tempo-limite',
+            type=int,
+            default=int(TEMPO_LIMITE.total_seconds() // 60),
+            help='Minutos até uma tarefa em andamento ser dada como interrompida (padrão: %(default)s)',
+        )
+
+    def handle(self, *args, **options):
+        tempo_limite = timedelta(minutes=options['tempo_limite'])
+        while True:
+            for tarefa in processar_pendentes(tempo_limite=tempo_limite):
+                self._relatar(tarefa)
+            if not options['continuo']:
+                break
+            time.sleep(options['intervalo'])
+
+    def _relatar(self, tarefa):
+        if tarefa.status == TarefaImportacao.FALHOU:
+            self.stderr.write(self.style.ERROR(f'  #{tarefa.pk} {tarefa}: {tarefa.mensagem}'))
+            return
+        self.stdout.write(
+            f'  #{tarefa.pk} {tarefa}: {tarefa.linhas_gravadas} gravadas, '
+            f'{tarefa.total_erros} erros, {tarefa.precos_recalculados} preços recalculados'
+        )
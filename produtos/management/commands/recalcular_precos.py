@@ -6,10 +6,16 @@ Uso:
     python manage.py recalcular_precos --produto SKU123   # Apenas um produto
     python manage.py recalcular_precos --canal "ML Full"  # Apenas um canal
     python manage.py recalcular_precos --sem-historico    # Sem salvar histórico
+    python manage.py recalcular_precos --pendentes        # Apenas cálculos pendentes (backfill)
+
+Cada execução fica registrada em ExecucaoRecalculo (tela /recalculos/), com os
+erros por preço.
 """
 from django.core.management.base import BaseCommand
 from django.db import transaction
+from django.db.models import Q
 
+from produtos.execucoes import registrar_execucao
 from produtos.models import Produto, PrecoProdutoCanal
 from canais_vendas.models import CanalVenda
 
@@ -33,6 +39,11 @@ class Command(BaseCommand):
             action='store_true',
             help='Não salvar histórico (útil para migração inicial)',
         )
+        parser.add_argument(
+            '--pendentes',
+            action='store_true',
+            help='Apenas preços com cálculo pendente (campos calculados vazios)',
+        )
         parser.add_argument(
             '--dry-run',
             action='store_true',
@@ -48,6 +59,10 @@ class Command(BaseCommand):
         # Filtra os preços
         precos = PrecoProdutoCanal.objects.filter(ativo=True)
 
+        if options.get('pendentes'):
+            precos = precos.filter(Q(calculado_em__isnull=True) | Q(preco_venda_calculado__isnull=True))
+            self.stdout.write('Filtrando preços com cálculo pendente')
+
         if sku:
             try:
                 produto = Produto.objects.get(sku=sku)
@@ -88,32 +103,31 @@ class Command(BaseCommand):
         self.stdout.write('Iniciando recálculo...')
 
         recalculados = 0
-        erros = 0
+        erros = []
 
-        for preco in precos.select_related('produto', 'canal'):
-            try:
-                with transaction.atomic():
-                    preco.recalcular_precos(
-                        salvar_historico=salvar_historico,
-                        motivo=motivo
-                    )
-                recalculados += 1
-
-                if recalculados % 100 == 0:
-                    self.stdout.write(f'  Processados: {recalculados}/{total}')
-
-            except Exception as e:
-                erros += 1
-                self.stderr.write(
-                    self.style.ERROR(
-                        f'Erro ao recalcular {preco.produto.sku}/{preco.canal.nome}: {e}'
-                    )
-                )
+        with registrar_execucao('comando', motivo) as execucao:
+            for preco in precos.select_related('produto', 'canal'):
+                try:
+                    with transaction.atomic():
+                        preco.recalcular_precos(
+                            salvar_historico=salvar_historico,
+                            motivo=motivo
+                        )
+                    recalculados += 1
+
+                    if recalculados % 100 == 0:
+                        self.stdout.write(f'  Processados: {recalculados}/{total}')
+
+                except Exception as e:
+                    erros.append(f'{preco.produto.sku}/{preco.canal.nome}: {e}')
+                    self.stderr.write(self.style.ERROR(f'Erro ao recalcular {erros[-1]}'))
+
+            execucao.erro = '\n'.join(erros)
 
         self.stdout.write('')
         self.stdout.write(self.style.SUCCESS(f'Recálculo concluído!'))
         self.stdout.write(f'  - Recalculados: {recalculados}')
         if erros:
-            self.stdout.write(self.style.ERROR(f'  - Erros: {erros}'))
+            self.stdout.write(self.style.ERROR(f'  - Erros: {len(erros)}'))
         if not salvar_historico:
             self.stdout.write(self.style.WARNING('  - Histórico NÃO foi salvo'))
@@ -0,0 +1,29 @@
+"""
+Comando para reconstruir os índices derivados do catálogo.
+
+Os índices são mantidos automaticamente pelos signals; use este comando após
+cargas feitas direto no banco ou se suspeitar de divergência.
+
+Uso:
+    python manage.py reconstruir_indices
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from produtos.busca import reconstruir_indice_busca
+from produtos.tabela_precos import reconstruir_linhas_tabela
+
+
+class Command(BaseCommand):
+    help = 'Reconstrói o índice de busca e a tabela de preços (read-model)'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Reconstruindo índice de busca...')
+        with transaction.atomic():
+            total = reconstruir_indice_busca()
+        self.stdout.write(self.style.SUCCESS(f'Índice de busca reconstruído: {total} produtos'))
+
+        self.stdout.write('Reconstruindo tabela de preços...')
+        with transaction.atomic():
+            total = reconstruir_linhas_tabela()
+        self.stdout.write(self.style.SUCCESS(f'Tabela de preços reconstruída: {total} linhas'))
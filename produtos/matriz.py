@@ -0,0 +1,124 @@
+"""
+Matriz de preços: produtos nas linhas, canais nas colunas.
+
+Cada página sai de uma única consulta em PrecoProdutoCanal (valores já
+resolvidos entre manual e calculado pelo banco), pivotada em uma passada.
+O resultado fica em cache com chave que inclui o último `calculado_em` e a
+quantidade de preços ativos: qualquer recálculo, ativação ou desativação gera
+uma chave nova e a matriz é remontada na próxima leitura.
+"""
+import hashlib
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db.models import Case, When, F, Q, Max, Count, DecimalField
+
+from canais_vendas.models import CanalVenda
+
+from .busca import filtrar_busca
+from .models import Produto, PrecoProdutoCanal
+
+
+# tipo -> (campo manual, campo calculado, rótulo)
+TIPOS_PRECO = {
+    'venda': ('preco_venda_manual', 'preco_venda_calculado', 'Preço Venda'),
+    'promocao': ('preco_promocao_manual', 'preco_promocao_calculado', 'Preço Promoção'),
+    'minimo': ('preco_minimo_manual', 'preco_minimo_calculado', 'Preço Mínimo'),
+}
+
+CENTAVOS = Decimal('0.01')
+PRODUTOS_POR_PAGINA = 100
+TEMPO_CACHE = 600
+
+
+def preco_efetivo(tipo, prefixo=''):
+    """
+    Expressão SQL equivalente às properties preco_venda/preco_promocao/preco_minimo:
+    manual quando o cálculo automático está desligado e há valor, senão o calculado.
+    `prefixo` permite usar a partir de outro modelo (ex.: 'preco__' em LinhaTabelaPreco).
+    """
+    manual, calculado, _ = TIPOS_PRECO[tipo]
+    manual, calculado = prefixo + manual, prefixo + calculado
+    return Case(
+        When(
+            Q(**{f'{prefixo}usar_calculo_automatico': False})
+            & Q(**{f'{manual}__isnull': False}) & ~Q(**{manual: 0}),
+            then=F(manual),
+        ),
+        default=F(calculado),
+        output_field=DecimalField(max_digits=10, decimal_places=2),
+    )
+
+
+def versao_precos():
+    """Identifica o estado atual dos preços (muda a cada recálculo ou (des)ativação)."""
+    dados = PrecoProdutoCanal.objects.aggregate(
+        ultimo=Max('calculado_em'),
+        ativos=Count('pk', filter=Q(ativo=True)),
+    )
+    ultimo = dados['ultimo'].isoformat() if dados['ultimo'] else '-'
+    return f"{ultimo}:{dados['ativos']}"
+
+
+def canais_matriz(grupo=None):
+    canais = CanalVenda.objects.filter(ativo=True).select_related('grupo')
+    if grupo:
+        canais = canais.filter(grupo_id=grupo)
+    return list(canais.order_by('grupo__nome', 'nome'))
+
+
+def montar_matriz(tipo='venda', grupo=None, search=None, pagina=1, por_pagina=PRODUTOS_POR_PAGINA):
+    """
+    Retorna um dict serializável:
+    {'tipo', 'canais': [{id, nome, grupo}], 'linhas': [{produto_id, sku, titulo, valores}],
+     'pagina', 'num_paginas', 'total_produtos'}
+    `valores` segue a ordem de `canais` (None onde o produto não tem preço no canal).
+    """
+    if tipo not in TIPOS_PRECO:
+        tipo = 'venda'
+
+    parametros = f"{tipo}|{grupo or ''}|{pagina}|{por_pagina}|{search or ''}"
+    chave = f"matriz:{versao_precos()}:{hashlib.md5(parametros.encode()).hexdigest()}"
+    resultado = cache.get(chave)
+    if resultado is not None:
+        return resultado
+
+    canais = canais_matriz(grupo)
+    ids_canais = [canal.pk for canal in canais]
+    coluna = {canal_id: i for i, canal_id in enumerate(ids_canais)}
+
+    produtos = Produto.objects.filter(ativo=True).filter(
+        pk__in=PrecoProdutoCanal.objects.filter(ativo=True, canal_id__in=ids_canais).values('produto_id')
+    )
+    if search:
+        produtos = filtrar_busca(produtos, search)
+    paginator = Paginator(produtos.order_by('sku').values_list('pk', 'sku', 'titulo'), por_pagina)
+    page = paginator.get_page(pagina)
+
+    linhas = []
+    posicao = {}
+    for produto_id, sku, titulo in page.object_list:
+        posicao[produto_id] = len(linhas)
+        linhas.append({'produto_id': produto_id, 'sku': sku, 'titulo': titulo, 'valores': [None] * len(canais)})
+
+    if linhas:
+        precos = PrecoProdutoCanal.objects.filter(
+            ativo=True, produto_id__in=list(posicao), canal_id__in=ids_canais
+        ).annotate(valor=preco_efetivo(tipo)).values_list('produto_id', 'canal_id', 'valor')
+        for produto_id, canal_id, valor in precos:
+            # SQLite não aplica a escala do output_field em expressões
+            if valor is not None:
+                valor = valor.quantize(CENTAVOS)
+            linhas[posicao[produto_id]]['valores'][coluna[canal_id]] = valor
+
+    resultado = {
+        'tipo': tipo,
+        'canais': [{'id': c.pk, 'nome': c.nome, 'grupo': c.grupo.nome} for c in canais],
+        'linhas': linhas,
+        'pagina': page.number,
+        'num_paginas': paginator.num_pages,
+        'total_produtos': paginator.count,
+    }
+    cache.set(chave, resultado, TEMPO_CACHE)
+    return resultado
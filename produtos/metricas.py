@@ -0,0 +1,229 @@
+"""
+Métricas do motor de preços no formato texto do Prometheus (GET /metrics).
+
+Registro em memória por processo, com contadores e histogramas rotulados:
+
+- solver de preço (Produto._calcular_preco_iterativo): chamadas, iterações
+  por chamada e chamadas que não convergiram no limite de iterações;
+- consultas de frete (TabelaFrete.calcular_frete), por tipo de tabela ou
+  regra especial;
+- preços recalculados e duração do recálculo, por cascata: a origem da
+  execução de recálculo (produtos.execucoes), como produto, canal, grupo,
+  tabela de frete/taxa, importação, componente, edição em massa ou comando;
+- linhas de histórico gravadas;
+- artefatos do cache versionado: servidos da memória, do cache ou montados.
+
+Com vários processos (workers do gunicorn), defina METRICAS_DIR (diretório
+compartilhado, limpo a cada deploy): cada processo grava o seu estado em
+`<pid>.json` no máximo a cada INTERVALO_GRAVACAO segundos (e ao sair), e o
+/metrics soma os arquivos de todos. Sem METRICAS_DIR, só o processo que
+atende a requisição é exposto.
+"""
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+
+INTERVALO_GRAVACAO = 5
+
+_lock = threading.Lock()
+_registro = []
+_gravacao = {'ultima': 0.0}
+
+
+class Metrica:
+    tipo = None
+
+    def __init__(self, nome, ajuda, rotulos=()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self.valores = {}
+        _registro.append(self)
+
+    def _chave(self, rotulos):
+        return tuple(str(rotulos[rotulo]) for rotulo in self.rotulos)
+
+    def _formatar_rotulos(self, chave, extra=()):
+        pares = [*zip(self.rotulos, chave), *extra]
+        if not pares:
+            return ''
+        return '{' + ','.join(f'{nome}="{_escapar(valor)}"' for nome, valor in pares) + '}'
+
+    def linhas(self, valores):
+        yield f'# HELP {self.nome} {self.ajuda}'
+        yield f'# TYPE {self.nome} {self.tipo}'
+        for chave in sorted(valores):
+            yield from self._amostras(chave, valores[chave])
+
+
+class Contador(Metrica):
+    tipo = 'counter'
+
+    def inc(self, valor=1, **rotulos):
+        chave = self._chave(rotulos)
+        with _lock:
+            self.valores[chave] = self.valores.get(chave, 0) + valor
+        _talvez_gravar()
+
+    @staticmethod
+    def somar(a, b):
+        return a + b
+
+    def _amostras(self, chave, valor):
+        yield f'{self.nome}{self._formatar_rotulos(chave)} {_numero(valor)}'
+
+
+class Histograma(Metrica):
+    """Estado por rótulo: [contagem de cada faixa (não acumulada)..., acima da última, soma, total]."""
+    tipo = 'histogram'
+
+    def __init__(self, nome, ajuda, limites, rotulos=()):
+        super().__init__(nome, ajuda, rotulos)
+        self.limites = tuple(limites)
+
+    def observe(self, valor, **rotulos):
+        chave = self._chave(rotulos)
+        with _lock:
+            estado = self.valores.get(chave)
+            if estado is None:
+                estado = self.valores[chave] = [0] * (len(self.limites) + 1) + [0.0, 0]
+            estado[bisect.bisect_left(self.limites, valor)] += 1
+            estado[-2] += valor
+            estado[-1] += 1
+        _talvez_gravar()
+
+    @staticmethod
+    def somar(a, b):
+        return [x + y for x, y in zip(a, b)]
+
+    def _amostras(self, chave, estado):
+        acumulado = 0
+        for limite, contagem in zip((*self.limites, '+Inf'), estado):
+            acumulado += contagem
+            rotulos = self._formatar_rotulos(chave, [('le', _numero(limite))])
+            yield f'{self.nome}_bucket{rotulos} {acumulado}'
+        yield f'{self.nome}_sum{self._formatar_rotulos(chave)} {_numero(estado[-2])}'
+        yield f'{self.nome}_count{self._formatar_rotulos(chave)} {estado[-1]}'
+
+
+def _escapar(valor):
+    return valor.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _numero(valor):
+    if isinstance(valor, str):
+        return valor
+    if isinstance(valor, float) and not valor.is_integer():
+        return repr(valor)
+    return str(int(valor))
+
+
+# ------------------------------------------------------------
+# Métricas
+# ------------------------------------------------------------
+
+SOLVER_CHAMADAS = Contador(
+    'precos_solver_chamadas_total', 'Chamadas do cálculo iterativo de preço.',
+)
+SOLVER_NAO_CONVERGIU = Contador(
+    'precos_solver_nao_convergiu_total', 'Chamadas que chegaram ao limite de iterações sem convergir.',
+)
+SOLVER_ITERACOES = Histograma(
+    'precos_solver_iteracoes', 'Iterações por chamada do cálculo de preço.', (1, 2, 3, 4, 5, 6, 8, 10),
+)
+FRETE_CONSULTAS = Contador(
+    'frete_consultas_total', 'Consultas de frete em tabelas (regra especial ou tipo da tabela).', ['regra'],
+)
+PRECOS_RECALCULADOS = Contador(
+    'precos_recalculados_total', 'Preços recalculados, por cascata.', ['cascata'],
+)
+RECALCULO_DURACAO = Histograma(
+    'precos_recalculo_duracao_segundos', 'Duração de cada recálculo, por cascata.',
+    (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300), ['cascata'],
+)
+HISTORICOS_GRAVADOS = Contador(
+    'precos_historicos_gravados_total', 'Linhas de histórico de preço gravadas.',
+)
+CACHE_ARTEFATOS = Contador(
+    'cache_artefatos_total', 'Artefatos do cache versionado: memoria, cache ou montado.', ['artefato', 'origem'],
+)
+
+
+def registrar_recalculo(cascata, precos, comeco):
+    """Preços recalculados e duração (comeco: time.perf_counter() do início da execução)."""
+    PRECOS_RECALCULADOS.inc(precos, cascata=cascata)
+    RECALCULO_DURACAO.observe(time.perf_counter() - comeco, cascata=cascata)
+
+
+# ------------------------------------------------------------
+# Vários processos
+# ------------------------------------------------------------
+
+def _diretorio():
+    diretorio = getattr(settings, 'METRICAS_DIR', None)
+    return Path(diretorio) if diretorio else None
+
+
+def _estado():
+    with _lock:
+        return {
+            metrica.nome: [[list(chave), valor] for chave, valor in metrica.valores.items()]
+            for metrica in _registro
+        }
+
+
+def gravar():
+    """Grava o estado deste processo em METRICAS_DIR/<pid>.json (troca atômica do arquivo)."""
+    _gravacao['ultima'] = time.monotonic()
+    diretorio = _diretorio()
+    if diretorio is None:
+        return
+    diretorio.mkdir(parents=True, exist_ok=True)
+    temporario = diretorio / f'.{os.getpid()}.{threading.get_ident()}.json.tmp'
+    temporario.write_text(json.dumps(_estado()), encoding='utf-8')
+    os.replace(temporario, diretorio / f'{os.getpid()}.json')
+
+
+def _talvez_gravar():
+    if time.monotonic() - _gravacao['ultima'] >= INTERVALO_GRAVACAO:
+        gravar()
+
+
+atexit.register(gravar)
+
+
+def _estados():
+    """Estados de todos os processos (ou só deste, sem METRICAS_DIR)."""
+    diretorio = _diretorio()
+    if diretorio is None:
+        return [_estado()]
+    gravar()
+    estados = []
+    for arquivo in sorted(diretorio.glob('*.json')):
+        try:
+            estados.append(json.loads(arquivo.read_text(encoding='utf-8')))
+        except (OSError, ValueError):
+            # Arquivo de um processo sendo trocado ou removido
+            continue
+    return estados
+
+
+def exportar():
+    """Texto no formato de exposição do Prometheus (versão 0.0.4)."""
+    estados = _estados()
+    linhas = []
+    for metrica in _registro:
+        valores = {}
+        for estado in estados:
+            for chave, valor in estado.get(metrica.nome, ()):
+                chave = tuple(chave)
+                valores[chave] = metrica.somar(valores[chave], valor) if chave in valores else valor
+        linhas.extend(metrica.linhas(valores))
+    return '\n'.join(linhas) + '\n'
@@ -0,0 +1,129 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:12
+
+import re
+import unicodedata
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Cópia de produtos.busca (normalizar, tokenizar, montar_documento) como era
+# nesta migração: o código do app pode mudar depois, a migração não.
+_RE_TOKEN = re.compile(r'[a-z0-9]+')
+
+
+def _tokenizar(texto):
+    if not texto:
+        return []
+    texto = unicodedata.normalize('NFKD', str(texto))
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return _RE_TOKEN.findall(texto.lower())
+
+
+def montar_documento(sku, titulo, titulos=()):
+    tokens = _tokenizar(sku)
+    compacto = ''.join(tokens)
+    if compacto and compacto not in tokens:
+        tokens.append(compacto)
+    tokens += _tokenizar(titulo)
+    for t in titulos:
+        tokens += _tokenizar(t)
+    return ' ' + ' '.join(tokens) + ' '
+
+
+SQLITE_FTS = [
+    """
+    CREATE VIRTUAL TABLE produtos_busca_fts USING fts5(
+        documento,
+        content='produtos_indicebuscaproduto',
+        content_rowid='produto_id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER produtos_busca_fts_ai AFTER INSERT ON produtos_indicebuscaproduto BEGIN
+        INSERT INTO produtos_busca_fts(rowid, documento) VALUES (new.produto_id, new.documento);
+    END
+    """,
+    """
+    CREATE TRIGGER produtos_busca_fts_ad AFTER DELETE ON produtos_indicebuscaproduto BEGIN
+        INSERT INTO produtos_busca_fts(produtos_busca_fts, rowid, documento) VALUES ('delete', old.produto_id, old.documento);
+    END
+    """,
+    """
+    CREATE TRIGGER produtos_busca_fts_au AFTER UPDATE ON produtos_indicebuscaproduto BEGIN
+        INSERT INTO produtos_busca_fts(produtos_busca_fts, rowid, documento) VALUES ('delete', old.produto_id, old.documento);
+        INSERT INTO produtos_busca_fts(rowid, documento) VALUES (new.produto_id, new.documento);
+    END
+    """,
+]
+
+POSTGRES_TRGM = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX produtos_busca_trgm ON produtos_indicebuscaproduto USING gin (documento gin_trgm_ops)",
+]
+
+
+def criar_indice_textual(apps, schema_editor):
+    """FTS5 no SQLite (se compilado com FTS5) e trigram no PostgreSQL."""
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+            if not cursor.fetchone()[0]:
+                return
+        comandos = SQLITE_FTS
+    elif vendor == 'postgresql':
+        comandos = POSTGRES_TRGM
+    else:
+        return
+    for sql in comandos:
+        schema_editor.execute(sql)
+
+
+def remover_indice_textual(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        for nome in ('produtos_busca_fts_ai', 'produtos_busca_fts_ad', 'produtos_busca_fts_au'):
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {nome}")
+        schema_editor.execute("DROP TABLE IF EXISTS produtos_busca_fts")
+    elif vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS produtos_busca_trgm")
+
+
+def popular_indice(apps, schema_editor):
+    Produto = apps.get_model('produtos', 'Produto')
+    TituloProduto = apps.get_model('produtos', 'TituloProduto')
+    IndiceBuscaProduto = apps.get_model('produtos', 'IndiceBuscaProduto')
+
+    titulos_por_produto = {}
+    for produto_id, titulo in TituloProduto.objects.filter(ativo=True).values_list('produto_id', 'titulo'):
+        titulos_por_produto.setdefault(produto_id, []).append(titulo)
+
+    IndiceBuscaProduto.objects.bulk_create([
+        IndiceBuscaProduto(produto_id=pk, documento=montar_documento(sku, titulo, titulos_por_produto.get(pk, ())))
+        for pk, sku, titulo in Produto.objects.values_list('pk', 'sku', 'titulo')
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('produtos', '0008_remove_tituloproduto_ean_remove_tituloproduto_sku'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndiceBuscaProduto',
+            fields=[
+                ('produto', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='indice_busca', serialize=False, to='produtos.produto')),
+                ('documento', models.TextField(blank=True)),
+            ],
+            options={
+                'verbose_name': 'Índice de Busca',
+                'verbose_name_plural': 'Índices de Busca',
+            },
+        ),
+        migrations.RunPython(criar_indice_textual, remover_indice_textual),
+        migrations.RunPython(popular_indice, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,105 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:13
+
+import re
+import unicodedata
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Cópia de produtos.busca.montar_documento e produtos.tabela_precos.dados_linhas
+# como eram nesta migração: o código do app pode mudar depois, a migração não.
+_RE_TOKEN = re.compile(r'[a-z0-9]+')
+
+
+def _tokenizar(texto):
+    if not texto:
+        return []
+    texto = unicodedata.normalize('NFKD', str(texto))
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return _RE_TOKEN.findall(texto.lower())
+
+
+def _montar_documento(sku, titulo):
+    tokens = _tokenizar(sku)
+    compacto = ''.join(tokens)
+    if compacto and compacto not in tokens:
+        tokens.append(compacto)
+    tokens += _tokenizar(titulo)
+    return ' ' + ' '.join(tokens) + ' '
+
+
+def dados_linhas(produto_id, sku, titulo, titulos, precos):
+    for preco_id, canal_id, canal_nome, grupo_id, grupo_nome in precos:
+        base = {
+            'preco_id': preco_id,
+            'produto_id': produto_id,
+            'canal_id': canal_id,
+            'grupo_id': grupo_id,
+            'sku': sku,
+            'canal_nome': canal_nome,
+            'grupo_nome': grupo_nome,
+        }
+        yield dict(base, titulo=titulo, principal=True, titulo_produto_id=None,
+                   busca=_montar_documento(sku, titulo))
+        for titulo_id, titulo_sec in titulos:
+            yield dict(base, titulo=titulo_sec, principal=False, titulo_produto_id=titulo_id,
+                       busca=_montar_documento(sku, titulo_sec))
+
+
+def popular_linhas(apps, schema_editor):
+    Produto = apps.get_model('produtos', 'Produto')
+    TituloProduto = apps.get_model('produtos', 'TituloProduto')
+    PrecoProdutoCanal = apps.get_model('produtos', 'PrecoProdutoCanal')
+    LinhaTabelaPreco = apps.get_model('produtos', 'LinhaTabelaPreco')
+
+    titulos_por_produto = {}
+    for produto_id, pk, titulo in TituloProduto.objects.filter(ativo=True).values_list('produto_id', 'pk', 'titulo'):
+        titulos_por_produto.setdefault(produto_id, []).append((pk, titulo))
+
+    produtos = {pk: (sku, titulo) for pk, sku, titulo in Produto.objects.values_list('pk', 'sku', 'titulo')}
+
+    linhas = []
+    precos = PrecoProdutoCanal.objects.values_list(
+        'produto_id', 'pk', 'canal_id', 'canal__nome', 'canal__grupo_id', 'canal__grupo__nome'
+    )
+    for produto_id, *preco in precos:
+        sku, titulo = produtos[produto_id]
+        for dados in dados_linhas(produto_id, sku, titulo, titulos_por_produto.get(produto_id, ()), [preco]):
+            linhas.append(LinhaTabelaPreco(**dados))
+    LinhaTabelaPreco.objects.bulk_create(linhas, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('canais_vendas', '0002_canalvenda_score'),
+        ('grupo_vendas', '0001_initial'),
+        ('produtos', '0009_indice_busca_produto'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LinhaTabelaPreco',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sku', models.CharField(max_length=50)),
+                ('grupo_nome', models.CharField(max_length=100)),
+                ('canal_nome', models.CharField(max_length=100)),
+                ('titulo', models.CharField(max_length=255)),
+                ('principal', models.BooleanField(default=True)),
+                ('busca', models.TextField(blank=True)),
+                ('canal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='linhas_tabela', to='canais_vendas.canalvenda')),
+                ('grupo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='linhas_tabela', to='grupo_vendas.grupocanais')),
+                ('preco', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='linhas_tabela', to='produtos.precoprodutocanal')),
+                ('produto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='linhas_tabela', to='produtos.produto')),
+                ('titulo_produto', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='linhas_tabela', to='produtos.tituloproduto')),
+            ],
+            options={
+                'verbose_name': 'Linha da Tabela de Preços',
+                'verbose_name_plural': 'Linhas da Tabela de Preços',
+                'indexes': [models.Index(fields=['sku', 'grupo_nome', 'canal_nome', '-principal', 'titulo', 'id'], name='linha_tabela_ordem_idx')],
+            },
+        ),
+        migrations.RunPython(popular_linhas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:17
+
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def popular_custo_ficha(apps, schema_editor):
+    Produto = apps.get_model('produtos', 'Produto')
+    ItemFichaTecnica = apps.get_model('produtos', 'ItemFichaTecnica')
+
+    custos = {}
+    for produto_id, quantidade, custo_unitario, multiplicador in ItemFichaTecnica.objects.values_list(
+        'produto_id', 'quantidade', 'custo_unitario', 'multiplicador'
+    ):
+        item = (quantidade * custo_unitario * multiplicador).quantize(Decimal('0.001'))
+        custos[produto_id] = custos.get(produto_id, Decimal('0.000')) + item
+
+    for produto_id, total in custos.items():
+        Produto.objects.filter(pk=produto_id).update(custo_ficha=total.quantize(Decimal('0.01')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('produtos', '0010_linha_tabela_preco'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='produto',
+            name='custo_ficha',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=10),
+        ),
+        migrations.RunPython(popular_custo_ficha, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('produtos', '0011_produto_custo_ficha'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContadorAlteracao',
+            fields=[
+                ('escopo', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('valor', models.PositiveBigIntegerField(default=0)),
+                ('atualizado_em', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Contador de Alteração',
+                'verbose_name_plural': 'Contadores de Alteração',
+            },
+        ),
+    ]
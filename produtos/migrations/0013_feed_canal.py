@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('canais_vendas', '0002_canalvenda_score'),
+        ('produtos', '0012_contador_alteracao'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedCanal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pendente', models.BooleanField(default=True)),
+                ('pendente_desde', models.DateTimeField(blank=True, null=True)),
+                ('alterado_em', models.DateTimeField(blank=True, null=True)),
+                ('gerado_em', models.DateTimeField(blank=True, null=True)),
+                ('linhas', models.PositiveIntegerField(default=0)),
+                ('sha256_csv', models.CharField(blank=True, max_length=64)),
+                ('sha256_xlsx', models.CharField(blank=True, max_length=64)),
+                ('canal', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='feed', to='canais_vendas.canalvenda')),
+            ],
+            options={
+                'verbose_name': 'Feed do Canal',
+                'verbose_name_plural': 'Feeds dos Canais',
+            },
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:39
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('produtos', '0013_feed_canal'),
+        ('tabela_frete', '0005_regrafreteespecial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TarefaImportacao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('catalogo', 'Catálogo (produtos, ficha e títulos)'), ('regras_matriz', 'Regras de frete (matriz)'), ('regras_simples', 'Regras de frete (simples)')], max_length=20)),
+                ('status', models.CharField(choices=[('pendente', 'Na fila'), ('validando', 'Validando linhas'), ('gravando', 'Gravando e recalculando preços'), ('concluida', 'Concluída'), ('falhou', 'Falhou')], default='pendente', max_length=20)),
+                ('arquivo', models.FileField(upload_to='importacoes/%Y/%m/')),
+                ('nome_arquivo', models.CharField(max_length=255)),
+                ('entidade', models.CharField(blank=True, help_text='Conteúdo do CSV do catálogo', max_length=20)),
+                ('substituir', models.BooleanField(default=False)),
+                ('linhas_lidas', models.PositiveIntegerField(default=0)),
+                ('linhas_validas', models.PositiveIntegerField(default=0)),
+                ('linhas_gravadas', models.PositiveIntegerField(default=0)),
+                ('precos_recalculados', models.PositiveIntegerField(default=0)),
+                ('total_erros', models.PositiveIntegerField(default=0)),
+                ('erros', models.JSONField(blank=True, default=list, help_text='[origem, linha, mensagem]')),
+                ('mensagem', models.TextField(blank=True, help_text='Motivo da falha')),
+                ('criada_em', models.DateTimeField(auto_now_add=True)),
+                ('iniciada_em', models.DateTimeField(blank=True, null=True)),
+                ('concluida_em', models.DateTimeField(blank=True, null=True)),
+                ('tabela_frete', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='importacoes', to='tabela_frete.tabelafrete')),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Tarefa de Importação',
+                'verbose_name_plural': 'Tarefas de Importação',
+                'ordering': ['-criada_em'],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def vincular_componentes(apps, schema_editor):
+    """Itens existentes vieram do autocomplete: a descrição é o nome do componente."""
+    Componente = apps.get_model('controle_producao', 'Componente')
+    ItemFichaTecnica = apps.get_model('produtos', 'ItemFichaTecnica')
+
+    for componente_id, nome in Componente.objects.values_list('pk', 'nome'):
+        ItemFichaTecnica.objects.filter(descricao=nome, componente__isnull=True).update(componente_id=componente_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('controle_producao', '0001_initial'),
+        ('produtos', '0014_tarefa_importacao'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='itemfichatecnica',
+            name='componente',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='itens_ficha', to='controle_producao.componente'),
+        ),
+        migrations.RunPython(vincular_componentes, migrations.RunPython.noop),
+    ]
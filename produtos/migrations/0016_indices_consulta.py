@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('produtos', '0015_itemfichatecnica_componente'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='historicopreco',
+            index=models.Index(fields=['-data_registro', '-id'], name='historico_data_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='precoprodutocanal',
+            index=models.Index(condition=models.Q(('ativo', True)), fields=['canal'], name='preco_canal_ativo_idx'),
+        ),
+    ]
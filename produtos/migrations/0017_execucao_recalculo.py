@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:03
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('produtos', '0016_indices_consulta'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExecucaoRecalculo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('origem', models.CharField(choices=[('produto', 'Produto / ficha técnica'), ('canal', 'Canal de venda'), ('grupo', 'Grupo de canais'), ('tabela_frete', 'Tabela de frete'), ('tabela_taxa', 'Tabela de taxa'), ('componente', 'Preço de componente'), ('importacao', 'Importação'), ('edicao_massa', 'Edição em massa de regras'), ('comando', 'Comando recalcular_precos'), ('manual', 'Edição manual de preço'), ('lote', 'Recálculo em lote')], max_length=20)),
+                ('motivo', models.TextField(blank=True)),
+                ('precos_lidos', models.PositiveIntegerField(default=0)),
+                ('precos_alterados', models.PositiveIntegerField(default=0)),
+                ('precos_inalterados', models.PositiveIntegerField(default=0)),
+                ('consultas', models.PositiveIntegerField(default=0)),
+                ('duracao', models.FloatField(blank=True, help_text='Segundos (vazio enquanto em andamento)', null=True)),
+                ('erro', models.TextField(blank=True)),
+                ('iniciada_em', models.DateTimeField(auto_now_add=True)),
+                ('concluida_em', models.DateTimeField(blank=True, null=True)),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Execução de Recálculo',
+                'verbose_name_plural': 'Execuções de Recálculo',
+                'ordering': ['-iniciada_em'],
+            },
+        ),
+        migrations.AddField(
+            model_name='historicopreco',
+            name='execucao',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='historicos', to='produtos.execucaorecalculo'),
+        ),
+        migrations.AddIndex(
+            model_name='execucaorecalculo',
+            index=models.Index(fields=['-duracao'], name='execucao_duracao_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='execucaorecalculo',
+            index=models.Index(fields=['-precos_lidos'], name='execucao_precos_idx'),
+        ),
+    ]
@@ -5,6 +5,9 @@ from django.db import transaction
 from decimal import Decimal
 
 from canais_vendas.models import CanalVenda
+from grupo_vendas.models import GrupoCanais
+
+from . import execucoes, metricas
 
 class Produto(models.Model):
     titulo = models.CharField(max_length=255, verbose_name='Título Principal')
@@ -16,6 +19,8 @@ class Produto(models.Model):
     peso_fisico = models.DecimalField(max_digits=10, decimal_places=3, validators=[MinValueValidator(Decimal('0.001'))])
     titulos_secundarios = models.JSONField(default=list, blank=True)
     ativo = models.BooleanField(default=True)
+    # Cópia de `custo` gravada no banco para listagens (atualizada pelos signals da ficha técnica)
+    custo_ficha = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'), editable=False)
     criado_em = models.DateTimeField(auto_now_add=True)
     atualizado_em = models.DateTimeField(auto_now=True)
 
@@ -37,6 +42,12 @@ class Produto(models.Model):
             total += item.custo_total
         return total.quantize(Decimal('0.01'))
 
+    def atualizar_custo_ficha(self):
+        """Regrava custo_ficha a partir da ficha técnica (sem disparar post_save)."""
+        self.custo_ficha = self.custo
+        Produto.objects.filter(pk=self.pk).update(custo_ficha=self.custo_ficha)
+        return self.custo_ficha
+
     def _calcular_preco_iterativo(self, canal, markup_target, frete_fixo=None, max_iteracoes=10):
         # Resolve: Preço = (Custo + Taxa(Preço)) * Markup + Frete(Peso, Preço) * Markup_Frete
         peso = self.peso_produto
@@ -51,7 +62,8 @@ class Produto(models.Model):
         )
         taxa = Decimal('0.00')
 
-        for _ in range(max_iteracoes):
+        iteracoes = 0
+        for iteracoes in range(1, max_iteracoes + 1):
             # 1. Calcula novo preço baseado nos componentes atuais
             # Nota: Taxa e Frete podem depender do preço
             novo_preco = ((custo + taxa) * markup_target) + (frete * canal.markup_frete)
@@ -73,7 +85,11 @@ class Produto(models.Model):
             preco_venda = novo_preco
             taxa = nova_taxa
             frete = novo_frete
+        else:
+            metricas.SOLVER_NAO_CONVERGIU.inc()
 
+        metricas.SOLVER_CHAMADAS.inc()
+        metricas.SOLVER_ITERACOES.observe(iteracoes)
         return preco_venda
 
     def calcular_preco_venda(self, canal, frete=None):
@@ -203,6 +219,11 @@ class ItemFichaTecnica(models.Model):
     ]
 
     produto = models.ForeignKey(Produto, related_name='itens_ficha', on_delete=models.CASCADE)
+    # Componente do PCP de onde veio o custo: mudanças de preço dele são propagadas (produtos.recalculo)
+    componente = models.ForeignKey(
+        'controle_producao.Componente', related_name='itens_ficha',
+        on_delete=models.SET_NULL, null=True, blank=True,
+    )
     tipo = models.CharField(max_length=2, choices=TIPO_CHOICES, default='MP')
     codigo = models.CharField(max_length=50)
     descricao = models.CharField(max_length=255)
@@ -241,88 +262,93 @@ class PrecoProdutoCanal(models.Model):
         unique_together = ['produto', 'canal']
         verbose_name = 'Preço Produto/Canal'
         verbose_name_plural = 'Preços Produto/Canal'
+        indexes = [
+            # Preços ativos de um canal (recálculo, feeds, matriz); os de um produto
+            # usam o índice do unique_together, que começa por produto
+            models.Index(fields=['canal'], condition=models.Q(ativo=True), name='preco_canal_ativo_idx'),
+        ]
 
     def __str__(self):
         return f"{self.produto.sku} - {self.canal.nome}"
 
+    # ========================================
+    # Valores exibidos
+    # Somente leitura do que está gravado: nenhum cálculo em tempo real.
+    # Enquanto o preço não foi calculado (calculo_pendente) retornam None;
+    # o comando `recalcular_precos --pendentes` preenche esses registros.
+    # ========================================
+
+    @property
+    def calculo_pendente(self):
+        """True enquanto os campos calculados ainda não foram preenchidos."""
+        return self.calculado_em is None or self.preco_venda_calculado is None
+
     @property
     def frete_aplicado(self):
         """Retorna o frete específico ou o calculado."""
         if self.frete_especifico is not None:
             return self.frete_especifico
-        if self.frete_calculado is not None:
-            return self.frete_calculado
-        # Fallback: calcula em tempo real
-        return self.canal.obter_frete(
-            peso_produto=self.produto.peso_produto, 
-            preco_venda=self.preco_venda,
-            largura=self.produto.largura,
-            altura=self.produto.altura,
-            profundidade=self.produto.profundidade
-        )
+        return self.frete_calculado
 
     @property
     def preco_venda(self):
         """Retorna o preço de venda (manual ou calculado)."""
         if not self.usar_calculo_automatico and self.preco_venda_manual:
             return self.preco_venda_manual
-        if self.preco_venda_calculado is not None:
-            return self.preco_venda_calculado
-        # Fallback: calcula em tempo real
-        return self.produto.calcular_preco_venda(self.canal, self.frete_especifico)
+        return self.preco_venda_calculado
 
     @property
     def preco_promocao(self):
         """Retorna o preço promocional (manual ou calculado)."""
         if not self.usar_calculo_automatico and self.preco_promocao_manual:
             return self.preco_promocao_manual
-        if self.preco_promocao_calculado is not None:
-            return self.preco_promocao_calculado
-        # Fallback: calcula em tempo real
-        return self.produto.calcular_preco_promocao(self.canal, self.frete_especifico)
+        return self.preco_promocao_calculado
 
     @property
     def preco_minimo(self):
         """Retorna o preço mínimo (manual ou calculado)."""
         if not self.usar_calculo_automatico and self.preco_minimo_manual:
             return self.preco_minimo_manual
-        if self.preco_minimo_calculado is not None:
-            return self.preco_minimo_calculado
-        # Fallback: calcula em tempo real
-        return self.produto.calcular_preco_minimo(self.canal, self.frete_especifico)
+        return self.preco_minimo_calculado
 
     @property
     def custo(self):
-        """Retorna o custo (calculado ou do produto)."""
-        if self.custo_calculado is not None:
-            return self.custo_calculado
-        return self.produto.custo
+        """Retorna o custo usado no último cálculo."""
+        return self.custo_calculado
 
     @property
     def taxa_extra(self):
         """Retorna a taxa extra calculada."""
-        if self.taxa_calculada is not None:
-            return self.taxa_calculada
-        return self.canal.obter_taxa_extra(self.preco_venda)
+        return self.taxa_calculada
 
     @property
     def desconto_maximo_percentual(self):
-        """Calcula o desconto máximo possível."""
+        """Calcula o desconto máximo possível (None se o cálculo está pendente)."""
+        if self.preco_venda is None or self.preco_minimo is None:
+            return None
         if self.preco_venda <= 0:
             return Decimal('0.00')
         return ((self.preco_venda - self.preco_minimo) / self.preco_venda * Decimal('100')).quantize(Decimal('0.01'))
 
     def salvar_historico(self, usuario=None, motivo=''):
         """Salva um snapshot imutável dos preços atuais com todos os parâmetros."""
+        historico = self.montar_historico(usuario=usuario, motivo=motivo)
+        historico.save()
+        metricas.HISTORICOS_GRAVADOS.inc()
+        return historico
+
+    def montar_historico(self, usuario=None, motivo=''):
+        """Snapshot dos preços atuais (não salvo), para gravação individual ou em lote."""
         canal = self.canal
 
-        HistoricoPreco.objects.create(
+        return HistoricoPreco(
             # Identificação
             produto=self.produto,
             canal=canal,
             grupo_nome=canal.grupo.nome if canal.grupo else '',
             usuario=usuario,
             motivo=motivo,
+            execucao=execucoes.execucao_atual(),
 
             # Valores do Produto
             custo=self.custo,
@@ -351,18 +377,17 @@ class PrecoProdutoCanal(models.Model):
             markup_minimo=canal.markup_minimo,
         )
 
-    def recalcular_precos(self, salvar_historico=True, usuario=None, motivo='Recálculo automático'):
-        """
-        Recalcula todos os preços e salva no banco.
-        Se salvar_historico=True, salva os preços antigos no histórico antes de atualizar.
-        """
-        from django.utils import timezone
+    CAMPOS_CALCULADOS = [
+        'custo_calculado', 'preco_venda_calculado', 'preco_promocao_calculado',
+        'preco_minimo_calculado', 'frete_calculado', 'taxa_calculada', 'calculado_em',
+    ]
+    # O que conta como preço alterado na execução de recálculo (calculado_em muda sempre)
+    CAMPOS_COMPARADOS = CAMPOS_CALCULADOS[:-1]
 
-        # Salva histórico com preços antigos (apenas se já tiver preços calculados)
-        if salvar_historico and self.preco_venda_calculado is not None:
-            self.salvar_historico(usuario=usuario, motivo=motivo)
+    def aplicar_calculo(self):
+        """Calcula custo, preços, frete e taxa e preenche os campos calculados (sem salvar)."""
+        from django.utils import timezone
 
-        # Recalcula todos os valores
         custo = self.produto.custo
         peso = self.produto.peso_produto
         frete_base = self.frete_especifico
@@ -385,7 +410,7 @@ class PrecoProdutoCanal(models.Model):
             )
         taxa = self.canal.obter_taxa_extra(preco_venda=preco_venda)
 
-        # Atualiza os campos calculados
+        anteriores = [getattr(self, campo) for campo in self.CAMPOS_COMPARADOS]
         self.custo_calculado = custo
         self.preco_venda_calculado = preco_venda
         self.preco_promocao_calculado = preco_promocao
@@ -393,6 +418,18 @@ class PrecoProdutoCanal(models.Model):
         self.frete_calculado = frete
         self.taxa_calculada = taxa
         self.calculado_em = timezone.now()
+        execucoes.contar_preco(anteriores != [getattr(self, campo) for campo in self.CAMPOS_COMPARADOS])
+
+    def recalcular_precos(self, salvar_historico=True, usuario=None, motivo='Recálculo automático'):
+        """
+        Recalcula todos os preços e salva no banco.
+        Se salvar_historico=True, salva os preços antigos no histórico antes de atualizar.
+        """
+        # Salva histórico com preços antigos (apenas se já tiver preços calculados)
+        if salvar_historico and self.preco_venda_calculado is not None:
+            self.salvar_historico(usuario=usuario, motivo=motivo)
+
+        self.aplicar_calculo()
 
         # Salva sem disparar o save() normal (evita loop)
         self.save(recalculando=True)
@@ -400,43 +437,16 @@ class PrecoProdutoCanal(models.Model):
         return self
 
     @transaction.atomic
-    def save(self, *args, recalculando=False, **kwargs):
+    def save(self, *args, recalculando=False, usuario=None, motivo='Alteração manual', **kwargs):
         # Se é um update normal (não recálculo), salva histórico
         if self.pk and not recalculando:
             # Verifica se já tem preços calculados para salvar no histórico
             if self.preco_venda_calculado is not None:
-                self.salvar_historico(motivo='Alteração manual')
+                self.salvar_historico(usuario=usuario, motivo=motivo)
 
         # Se é criação ou alteração manual, recalcula os preços
         if not recalculando:
-            from django.utils import timezone
-            custo = self.produto.custo
-            peso = self.produto.peso_produto
-            frete_base = self.frete_especifico
-
-            preco_venda = self.produto.calcular_preco_venda(self.canal, frete_base)
-            preco_promocao = self.produto.calcular_preco_promocao(self.canal, frete_base)
-            preco_minimo = self.produto.calcular_preco_minimo(self.canal, frete_base)
-
-            if frete_base is not None:
-                frete = frete_base
-            else:
-                frete = self.canal.obter_frete(
-                    peso_produto=peso, 
-                    preco_venda=preco_venda,
-                    largura=self.produto.largura,
-                    altura=self.produto.altura,
-                    profundidade=self.produto.profundidade
-                )
-            taxa = self.canal.obter_taxa_extra(preco_venda=preco_venda)
-
-            self.custo_calculado = custo
-            self.preco_venda_calculado = preco_venda
-            self.preco_promocao_calculado = preco_promocao
-            self.preco_minimo_calculado = preco_minimo
-            self.frete_calculado = frete
-            self.taxa_calculada = taxa
-            self.calculado_em = timezone.now()
+            self.aplicar_calculo()
 
         super().save(*args, **kwargs)
 
@@ -479,10 +489,243 @@ class HistoricoPreco(models.Model):
     markup_promocao = models.DecimalField(max_digits=10, decimal_places=4, null=True, blank=True)
     markup_minimo = models.DecimalField(max_digits=10, decimal_places=4, null=True, blank=True)
 
+    # Execução de recálculo que gravou o registro
+    execucao = models.ForeignKey(
+        'ExecucaoRecalculo', on_delete=models.SET_NULL, null=True, blank=True, related_name='historicos'
+    )
+
     class Meta:
         verbose_name = 'Histórico de Preço'
         verbose_name_plural = 'Históricos de Preços'
         ordering = ['-data_registro']
+        indexes = [
+            # Listagem, exportação e painel: mais recentes primeiro, com filtro por período
+            models.Index(fields=['-data_registro', '-id'], name='historico_data_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.produto} - {self.canal} - {self.data_registro:%d/%m/%Y %H:%M}"
+
+
+class IndiceBuscaProduto(models.Model):
+    """
+    Documento de busca normalizado de um produto (SKU + título + títulos alternativos).
+    Mantido pelos signals de Produto e TituloProduto. Ver produtos/busca.py.
+    """
+    produto = models.OneToOneField(Produto, primary_key=True, related_name='indice_busca', on_delete=models.CASCADE)
+    documento = models.TextField(blank=True)
+
+    class Meta:
+        verbose_name = 'Índice de Busca'
+        verbose_name_plural = 'Índices de Busca'
+
+    def __str__(self):
+        return f"{self.produto_id}: {self.documento.strip()}"
+
+
+class LinhaTabelaPreco(models.Model):
+    """
+    Read-model da Tabela de Preços: uma linha por (título, preço produto/canal).
+    Para cada PrecoProdutoCanal existe a linha do título principal e uma linha por
+    título alternativo ativo. SKU, canal e grupo ficam copiados aqui para ordenar e
+    paginar (keyset) direto no índice. Mantido pelos signals (ver produtos/tabela_precos.py).
+    """
+    preco = models.ForeignKey(PrecoProdutoCanal, related_name='linhas_tabela', on_delete=models.CASCADE)
+    produto = models.ForeignKey(Produto, related_name='linhas_tabela', on_delete=models.CASCADE)
+    canal = models.ForeignKey(CanalVenda, related_name='linhas_tabela', on_delete=models.CASCADE)
+    grupo = models.ForeignKey(GrupoCanais, related_name='linhas_tabela', on_delete=models.CASCADE)
+    titulo_produto = models.ForeignKey(
+        TituloProduto, related_name='linhas_tabela', on_delete=models.CASCADE, null=True, blank=True
+    )
+
+    sku = models.CharField(max_length=50)
+    grupo_nome = models.CharField(max_length=100)
+    canal_nome = models.CharField(max_length=100)
+    titulo = models.CharField(max_length=255)
+    principal = models.BooleanField(default=True)
+    busca = models.TextField(blank=True)
+
+    ORDENACAO = ['sku', 'grupo_nome', 'canal_nome', '-principal', 'titulo', 'id']
+
+    class Meta:
+        verbose_name = 'Linha da Tabela de Preços'
+        verbose_name_plural = 'Linhas da Tabela de Preços'
+        indexes = [
+            models.Index(
+                fields=['sku', 'grupo_nome', 'canal_nome', '-principal', 'titulo', 'id'],
+                name='linha_tabela_ordem_idx',
+            ),
+        ]
 
     def __str__(self):
-        return f"{self.produto} - {self.canal} - {self.data_registro:%d/%m/%Y %H:%M}"
\ No newline at end of file
+        return f"{self.sku} - {self.canal_nome} - {self.titulo}"
+
+
+class ContadorAlteracao(models.Model):
+    """
+    Contador de alterações por escopo ('catalogo', 'estrutura', 'canal:<id>',
+    'grupo:<id>', 'produto:<id>'). Incrementado pelos signals e usado como
+    validador barato (ETag/Last-Modified) das páginas de preços (ver produtos/condicional.py).
+    """
+    escopo = models.CharField(max_length=50, primary_key=True)
+    valor = models.PositiveBigIntegerField(default=0)
+    atualizado_em = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'Contador de Alteração'
+        verbose_name_plural = 'Contadores de Alteração'
+
+    def __str__(self):
+        return f"{self.escopo}: {self.valor}"
+
+
+class FeedCanal(models.Model):
+    """
+    Estado dos arquivos de feed (CSV/XLSX) de um canal em MEDIA_ROOT/feeds.
+    Os signals marcam o feed como pendente quando preços do canal mudam e o
+    comando gerar_feeds regera os pendentes depois de um intervalo sem alterações.
+    """
+    canal = models.OneToOneField(CanalVenda, related_name='feed', on_delete=models.CASCADE)
+    pendente = models.BooleanField(default=True)
+    pendente_desde = models.DateTimeField(null=True, blank=True)
+    alterado_em = models.DateTimeField(null=True, blank=True)
+    gerado_em = models.DateTimeField(null=True, blank=True)
+    linhas = models.PositiveIntegerField(default=0)
+    sha256_csv = models.CharField(max_length=64, blank=True)
+    sha256_xlsx = models.CharField(max_length=64, blank=True)
+
+    class Meta:
+        verbose_name = 'Feed do Canal'
+        verbose_name_plural = 'Feeds dos Canais'
+
+    def __str__(self):
+        return f"Feed {self.canal.nome}"
+
+
+class TarefaImportacao(models.Model):
+    """
+    Importação de planilha processada fora da requisição pelo comando
+    processar_importacoes. O upload fica em MEDIA_ROOT/importacoes e a tarefa
+    guarda o andamento (linhas lidas, válidas e gravadas) e os erros por linha.
+    """
+    TIPO_CATALOGO = 'catalogo'
+    TIPO_REGRAS_MATRIZ = 'regras_matriz'
+    TIPO_REGRAS_SIMPLES = 'regras_simples'
+
+    TIPO_CHOICES = [
+        (TIPO_CATALOGO, 'Catálogo (produtos, ficha e títulos)'),
+        (TIPO_REGRAS_MATRIZ, 'Regras de frete (matriz)'),
+        (TIPO_REGRAS_SIMPLES, 'Regras de frete (simples)'),
+    ]
+
+    PENDENTE = 'pendente'
+    VALIDANDO = 'validando'
+    GRAVANDO = 'gravando'
+    CONCLUIDA = 'concluida'
+    FALHOU = 'falhou'
+
+    STATUS_CHOICES = [
+        (PENDENTE, 'Na fila'),
+        (VALIDANDO, 'Validando linhas'),
+        (GRAVANDO, 'Gravando e recalculando preços'),
+        (CONCLUIDA, 'Concluída'),
+        (FALHOU, 'Falhou'),
+    ]
+
+    EM_ANDAMENTO = [PENDENTE, VALIDANDO, GRAVANDO]
+
+    tipo = models.CharField(max_length=20, choices=TIPO_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDENTE)
+    arquivo = models.FileField(upload_to='importacoes/%Y/%m/')
+    nome_arquivo = models.CharField(max_length=255)
+    entidade = models.CharField(max_length=20, blank=True, help_text='Conteúdo do CSV do catálogo')
+    tabela_frete = models.ForeignKey(
+        'tabela_frete.TabelaFrete', on_delete=models.CASCADE, null=True, blank=True, related_name='importacoes'
+    )
+    substituir = models.BooleanField(default=False)
+    usuario = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+
+    # Andamento
+    linhas_lidas = models.PositiveIntegerField(default=0)
+    linhas_validas = models.PositiveIntegerField(default=0)
+    linhas_gravadas = models.PositiveIntegerField(default=0)
+    precos_recalculados = models.PositiveIntegerField(default=0)
+    total_erros = models.PositiveIntegerField(default=0)
+    erros = models.JSONField(default=list, blank=True, help_text='[origem, linha, mensagem]')
+    mensagem = models.TextField(blank=True, help_text='Motivo da falha')
+
+    criada_em = models.DateTimeField(auto_now_add=True)
+    iniciada_em = models.DateTimeField(null=True, blank=True)
+    concluida_em = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Tarefa de Importação'
+        verbose_name_plural = 'Tarefas de Importação'
+        ordering = ['-criada_em']
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} - {self.nome_arquivo}"
+
+    @property
+    def em_andamento(self):
+        return self.status in self.EM_ANDAMENTO
+
+    @property
+    def erros_omitidos(self):
+        return self.total_erros - len(self.erros)
+
+
+class ExecucaoRecalculo(models.Model):
+    """
+    Uma execução de recálculo de preços: cascata de signal, comando, importação,
+    edição em massa ou edição manual (ver produtos.execucoes). Guarda o escopo
+    (preços lidos, alterados e inalterados), a duração, as consultas ao banco e
+    o erro; os históricos gravados na execução apontam para ela.
+    """
+    ORIGEM_CHOICES = [
+        ('produto', 'Produto / ficha técnica'),
+        ('canal', 'Canal de venda'),
+        ('grupo', 'Grupo de canais'),
+        ('tabela_frete', 'Tabela de frete'),
+        ('tabela_taxa', 'Tabela de taxa'),
+        ('componente', 'Preço de componente'),
+        ('importacao', 'Importação'),
+        ('edicao_massa', 'Edição em massa de regras'),
+        ('comando', 'Comando recalcular_precos'),
+        ('manual', 'Edição manual de preço'),
+        ('lote', 'Recálculo em lote'),
+    ]
+
+    origem = models.CharField(max_length=20, choices=ORIGEM_CHOICES)
+    motivo = models.TextField(blank=True)
+    usuario = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+
+    # Escopo
+    precos_lidos = models.PositiveIntegerField(default=0)
+    precos_alterados = models.PositiveIntegerField(default=0)
+    precos_inalterados = models.PositiveIntegerField(default=0)
+
+    # Custo
+    consultas = models.PositiveIntegerField(default=0)
+    duracao = models.FloatField(null=True, blank=True, help_text='Segundos (vazio enquanto em andamento)')
+    erro = models.TextField(blank=True)
+
+    iniciada_em = models.DateTimeField(auto_now_add=True)
+    concluida_em = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Execução de Recálculo'
+        verbose_name_plural = 'Execuções de Recálculo'
+        ordering = ['-iniciada_em']
+        indexes = [
+            # Tela de execuções: mais lentas e maiores primeiro
+            models.Index(fields=['-duracao'], name='execucao_duracao_idx'),
+            models.Index(fields=['-precos_lidos'], name='execucao_precos_idx'),
+        ]
+
+    def __str__(self):
+        return f"#{self.pk} {self.get_origem_display()} - {self.iniciada_em:%d/%m/%Y %H:%M}"
+
+    @property
+    def em_andamento(self):
+        return self.concluida_em is None
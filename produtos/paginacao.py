@@ -0,0 +1,102 @@
+"""
+Paginação por cursor (keyset).
+
+Em vez de OFFSET, cada página começa logo depois (ou antes) da última linha vista,
+comparando as colunas da ordenação. O custo de qualquer página é o mesmo e
+nenhuma linha se repete ou some quando os dados mudam entre uma página e outra.
+"""
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+def codificar_cursor(valores):
+    dados = json.dumps(valores, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(dados).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor):
+    """Retorna a lista de valores do cursor ou None se inválido."""
+    if not cursor:
+        return None
+    try:
+        dados = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        valores = json.loads(dados)
+    except (ValueError, TypeError):
+        return None
+    return valores if isinstance(valores, list) else None
+
+
+def _ler_cursor(queryset, ordenacao, cursor):
+    """
+    Valores do cursor convertidos pelos campos da ordenação, ou None se o
+    cursor não serve (aí a paginação volta para a primeira página).
+    """
+    valores = decodificar_cursor(cursor)
+    if valores is None or len(valores) != len(ordenacao):
+        return None
+    convertidos = []
+    for campo, valor in zip(ordenacao, valores):
+        if valor is None:
+            return None
+        try:
+            convertidos.append(queryset.model._meta.get_field(campo.lstrip('-')).to_python(valor))
+        except (TypeError, ValueError, ValidationError):
+            return None
+    return convertidos
+
+
+def _filtro_apos(ordenacao, valores, para_tras=False):
+    """
+    Monta (a > x) OR (a = x AND b > y) OR ... respeitando campos decrescentes ('-campo').
+    Com para_tras=True monta a comparação inversa (linhas antes do cursor).
+    """
+    filtro = Q()
+    iguais = {}
+    for campo, valor in zip(ordenacao, valores):
+        decrescente = campo.startswith('-')
+        nome = campo.lstrip('-')
+        operador = 'lt' if decrescente != para_tras else 'gt'
+        filtro |= Q(**iguais, **{f'{nome}__{operador}': valor})
+        iguais[nome] = valor
+    return filtro
+
+
+def _inverter(ordenacao):
+    return [campo[1:] if campo.startswith('-') else f'-{campo}' for campo in ordenacao]
+
+
+def paginar_keyset(queryset, ordenacao, tamanho, depois=None, antes=None):
+    """
+    Retorna (itens, cursor_anterior, cursor_proximo).
+    `ordenacao` deve terminar em um campo único (ex.: 'id') para o cursor ser exato.
+    """
+    nomes = [campo.lstrip('-') for campo in ordenacao]
+    valores_antes = _ler_cursor(queryset, ordenacao, antes)
+    valores_depois = _ler_cursor(queryset, ordenacao, depois)
+
+    if valores_antes is not None:
+        pagina = queryset.filter(_filtro_apos(ordenacao, valores_antes, para_tras=True))
+        itens = list(pagina.order_by(*_inverter(ordenacao))[:tamanho + 1])
+        tem_mais = len(itens) > tamanho
+        itens = itens[:tamanho][::-1]
+        tem_anterior, tem_proximo = tem_mais, True
+    else:
+        if valores_depois is not None:
+            pagina = queryset.filter(_filtro_apos(ordenacao, valores_depois))
+            tem_anterior = True
+        else:
+            pagina = queryset
+            tem_anterior = False
+        itens = list(pagina.order_by(*ordenacao)[:tamanho + 1])
+        tem_proximo = len(itens) > tamanho
+        itens = itens[:tamanho]
+
+    def cursor_de(item):
+        return codificar_cursor([getattr(item, nome) for nome in nomes])
+
+    cursor_anterior = cursor_de(itens[0]) if itens and tem_anterior else None
+    cursor_proximo = cursor_de(itens[-1]) if itens and tem_proximo else None
+    return itens, cursor_anterior, cursor_proximo
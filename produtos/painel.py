@@ -0,0 +1,70 @@
+"""
+Dados do dashboard servidos do cache.
+
+Os contadores e as listas de "últimos" ficam no cache do Django e são
+invalidados pelos signals (produtos/signals.py) quando produtos, canais,
+grupos ou preços são criados, ativados, desativados ou excluídos. Assim a
+home faz no máximo uma leitura de cache por bloco, independente do tamanho do catálogo.
+"""
+from django.core.cache import cache
+
+from canais_vendas.models import CanalVenda
+from grupo_vendas.models import GrupoCanais
+
+from .models import Produto, PrecoProdutoCanal, HistoricoPreco
+
+
+CHAVE_CONTADORES = 'painel:contadores'
+CHAVE_PRODUTOS = 'painel:ultimos_produtos'
+CHAVE_HISTORICOS = 'painel:ultimos_historicos'
+
+# Rede de segurança para caches por processo (LocMemCache): nenhum dado fica
+# velho por mais que isso, mesmo se a invalidação ocorreu em outro processo.
+TEMPO_CACHE = 300
+
+
+def _contar():
+    return {
+        'total_produtos': Produto.objects.filter(ativo=True).count(),
+        'total_grupos': GrupoCanais.objects.count(),
+        'total_canais': CanalVenda.objects.filter(ativo=True).count(),
+        'total_precos': PrecoProdutoCanal.objects.filter(ativo=True).count(),
+    }
+
+
+def _ultimos_produtos():
+    return list(
+        Produto.objects.filter(ativo=True)
+        .order_by('-criado_em')
+        .values('pk', 'sku', 'titulo', 'custo_ficha')[:5]
+    )
+
+
+def _ultimos_historicos():
+    return [
+        {'data_registro': data, 'sku': sku, 'canal': canal, 'preco_venda': preco}
+        for data, sku, canal, preco in HistoricoPreco.objects.order_by('-data_registro')
+        .values_list('data_registro', 'produto__sku', 'canal__nome', 'preco_venda')[:10]
+    ]
+
+
+def dados_painel():
+    """Contexto completo do dashboard."""
+    contexto = cache.get_or_set(CHAVE_CONTADORES, _contar, TEMPO_CACHE)
+    return dict(
+        contexto,
+        ultimos_produtos=cache.get_or_set(CHAVE_PRODUTOS, _ultimos_produtos, TEMPO_CACHE),
+        ultimos_historicos=cache.get_or_set(CHAVE_HISTORICOS, _ultimos_historicos, TEMPO_CACHE),
+    )
+
+
+def invalidar_contadores():
+    cache.delete(CHAVE_CONTADORES)
+
+
+def invalidar_produtos():
+    cache.delete(CHAVE_PRODUTOS)
+
+
+def invalidar_historicos():
+    cache.delete(CHAVE_HISTORICOS)
@@ -0,0 +1,80 @@
+"""
+Marcações agrupadas por transação e gravadas uma vez no commit.
+
+Usado pelos contadores do GET condicional (produtos.condicional), pelos
+feeds por canal (produtos.feeds) e pela propagação do preço dos componentes
+(produtos.recalculo.marcar_componentes): um recálculo de milhares de preços marca os
+mesmos escopos milhares de vezes, mas tudo é gravado uma vez por transação.
+
+As marcações vão para um lote por savepoint (cada save() de preço abre o
+seu), que é o callback registrado com transaction.on_commit. A thread guarda
+só uma referência fraca a cada lote; a única referência forte é a da fila do
+on_commit. Se a transação ou o savepoint é desfeito, o Django descarta o
+callback e o lote deixa de existir, com as suas chaves. No commit, o primeiro
+lote a rodar grava a união de todos os lotes ainda vivos e os marca como
+gravados; os demais callbacks não fazem nada. Fora de transação, grava na hora.
+"""
+import threading
+import weakref
+
+from django.db import transaction
+
+
+class _Lote:
+    """Chaves de um savepoint (ou da transação); é o próprio callback registrado no on_commit."""
+
+    def __init__(self, pendencias):
+        self.pendencias = pendencias
+        self.chaves = set()
+        self.gravado = False
+
+    def __call__(self):
+        if not self.gravado:
+            self.pendencias._gravar_pendentes(self)
+
+
+class PendenciasDoCommit:
+    """`gravar(chaves)` roda uma vez por transação, no commit, com tudo o que foi marcado nela."""
+
+    def __init__(self, gravar):
+        self.gravar = gravar
+        self._local = threading.local()
+
+    def _lotes(self):
+        lotes = getattr(self._local, 'lotes', None)
+        if lotes is None:
+            lotes = self._local.lotes = {}
+        return lotes
+
+    def _gravar_pendentes(self, lote):
+        vivos = [lote] + [referencia() for referencia in self._lotes().values()]
+        self._local.lotes = {}
+        chaves = set()
+        for vivo in vivos:
+            if vivo is not None and not vivo.gravado:
+                vivo.gravado = True
+                chaves.update(vivo.chaves)
+        self.gravar(chaves)
+
+    def marcar(self, chaves):
+        chaves = set(chaves)
+        if not chaves:
+            return
+        conexao = transaction.get_connection()
+        if not conexao.in_atomic_block:
+            self.gravar(chaves)
+            return
+
+        lotes = self._lotes()
+        savepoints = tuple(conexao.savepoint_ids)
+        referencia = lotes.get(savepoints)
+        lote = referencia() if referencia is not None else None
+        if lote is None or lote.gravado:
+            # Lotes de transações e savepoints desfeitos já foram coletados
+            for chave, antiga in list(lotes.items()):
+                if antiga() is None:
+                    del lotes[chave]
+            lote = _Lote(self)
+            lotes[savepoints] = weakref.ref(lote)
+            transaction.on_commit(lote)
+        lote.chaves.update(chaves)
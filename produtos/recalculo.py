@@ -0,0 +1,172 @@
+"""
+Recálculo de preços e atualização de derivados em lote.
+
+Usado por importações e outras alterações em massa, que rodam com os signals
+por linha desligados (`recalculo_suspenso()`):
+
+- recalcular_em_lote: carrega os preços em lotes com produto, ficha técnica e
+  canal (grupo, tabelas de frete e taxa) já resolvidos, calcula em memória e
+  grava com upsert dos campos calculados e inserção em massa do histórico
+  (produtos.escrita: ON CONFLICT e COPY no PostgreSQL). As tabelas de frete e
+  taxa compiladas vêm do cache versionado, com a versão lida uma vez por lote;
+- atualizar_custos_ficha / atualizar_derivados_produtos: custo gravado, índice
+  de busca e linhas da tabela de preços por conjunto de produtos;
+- propagar_precos_componentes: novo preço de componentes do PCP em todos os
+  itens de ficha vinculados (um UPDATE), custo dos produtos e recálculo em lote.
+  marcar_componentes agrupa as mudanças da transação e propaga uma vez no commit.
+
+Cada recalcular_em_lote é uma execução registrada (produtos.execucoes), ou
+soma na execução em andamento (importação, edição em massa).
+
+Como bulk_* não dispara signals, estas funções marcam elas mesmas os
+contadores do GET condicional, os feeds por canal e o cache do dashboard.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Round
+
+from controle_producao.models import Componente
+
+from . import metricas
+from .busca import atualizar_indices_busca
+from .cache_versionado import versoes_fixas
+from .condicional import escopos_dos_produtos, marcar_alteracao
+from .escrita import gravar_ou_atualizar, inserir_em_massa
+from .execucoes import registrar_execucao
+from .feeds import marcar_feeds
+from .models import HistoricoPreco, ItemFichaTecnica, PrecoProdutoCanal, Produto
+from .painel import invalidar_contadores, invalidar_historicos, invalidar_produtos
+from .pendencias import PendenciasDoCommit
+from .tabela_precos import sincronizar_linhas_produtos
+
+
+TAMANHO_LOTE = 500
+
+
+def notificar_produtos_alterados(produto_ids):
+    """Contadores do GET condicional e feeds dos canais onde os produtos têm preço."""
+    produto_ids = list(produto_ids)
+    if not produto_ids:
+        return
+    marcar_alteracao(*escopos_dos_produtos(produto_ids))
+    marcar_feeds(*PrecoProdutoCanal.objects.filter(produto_id__in=produto_ids).values_list(
+        'canal_id', flat=True
+    ).distinct())
+
+
+def recalcular_em_lote(precos, motivo, salvar_historico=True, usuario=None, tamanho_lote=TAMANHO_LOTE,
+                       cascata='lote'):
+    """
+    Recalcula os preços do queryset `precos`. Mesmo resultado de chamar
+    recalcular_precos() em cada um, com poucas consultas por lote. Retorna o total.
+    `cascata` é a origem da execução registrada (e das métricas).
+    """
+    with registrar_execucao(cascata, motivo, usuario=usuario):
+        pks = list(precos.order_by('pk').values_list('pk', flat=True))
+        produto_ids = set()
+        historicos = 0
+
+        for inicio in range(0, len(pks), tamanho_lote):
+            lote = list(
+                PrecoProdutoCanal.objects.filter(pk__in=pks[inicio:inicio + tamanho_lote])
+                .select_related('produto', 'canal__grupo', 'canal__tabela_frete', 'canal__tabela_taxa')
+                .prefetch_related('produto__itens_ficha')
+            )
+            registros = []
+            with versoes_fixas():
+                for preco in lote:
+                    if salvar_historico and preco.preco_venda_calculado is not None:
+                        registros.append(preco.montar_historico(usuario=usuario, motivo=motivo))
+                    preco.aplicar_calculo()
+                    produto_ids.add(preco.produto_id)
+
+            with transaction.atomic():
+                inserir_em_massa(HistoricoPreco, registros)
+                gravar_ou_atualizar(
+                    PrecoProdutoCanal, lote, ['produto', 'canal'], PrecoProdutoCanal.CAMPOS_CALCULADOS
+                )
+            historicos += len(registros)
+
+        notificar_produtos_alterados(produto_ids)
+        if historicos:
+            invalidar_historicos()
+        metricas.HISTORICOS_GRAVADOS.inc(historicos)
+    return len(pks)
+
+
+def atualizar_custos_ficha(produto_ids):
+    """Regrava custo_ficha de vários produtos (mesmo arredondamento de Produto.custo)."""
+    custos = {pk: Decimal('0.000') for pk in produto_ids}
+    for produto_id, quantidade, custo_unitario, multiplicador in ItemFichaTecnica.objects.filter(
+        produto_id__in=list(custos)
+    ).values_list('produto_id', 'quantidade', 'custo_unitario', 'multiplicador'):
+        custos[produto_id] += (quantidade * custo_unitario * multiplicador).quantize(Decimal('0.001'))
+
+    Produto.objects.bulk_update(
+        [Produto(pk=pk, custo_ficha=total.quantize(Decimal('0.01'))) for pk, total in custos.items()],
+        ['custo_ficha'],
+        batch_size=TAMANHO_LOTE,
+    )
+
+
+def atualizar_derivados_produtos(produto_ids, novos=False):
+    """
+    Índice de busca, linhas da tabela de preços, contadores e dashboard dos
+    produtos alterados em massa (o que os signals de Produto/TituloProduto fariam).
+    """
+    produto_ids = list(produto_ids)
+    if not produto_ids:
+        return
+    atualizar_indices_busca(produto_ids)
+    sincronizar_linhas_produtos(produto_ids)
+    notificar_produtos_alterados(produto_ids)
+    invalidar_produtos()
+    if novos:
+        invalidar_contadores()
+
+
+def propagar_precos_componentes(componente_ids, motivo='Preço de componente atualizado'):
+    """
+    Copia o preço atual dos componentes para os itens de ficha vinculados,
+    regrava o custo dos produtos afetados e recalcula seus preços. Retorna os preços recalculados.
+    """
+    from .painel import invalidar_produtos
+
+    itens = ItemFichaTecnica.objects.filter(componente_id__in=list(componente_ids))
+    produto_ids = set(itens.values_list('produto_id', flat=True).distinct())
+    if not produto_ids:
+        return 0
+
+    # custo_unitario tem 3 casas e o preço do componente 4 (mesmo arredondamento da tela da ficha)
+    itens.update(custo_unitario=Round(
+        Subquery(Componente.objects.filter(pk=OuterRef('componente_id')).values('preco')[:1]), 3
+    ))
+    atualizar_custos_ficha(produto_ids)
+    invalidar_produtos()
+    precos = PrecoProdutoCanal.objects.filter(produto_id__in=produto_ids, ativo=True)
+    # recalcular_em_lote notifica os produtos recalculados; os sem preço ativo também mudaram de custo
+    notificar_produtos_alterados(produto_ids - set(precos.values_list('produto_id', flat=True)))
+    return recalcular_em_lote(precos, motivo=motivo, cascata='componente')
+
+
+def _propagar_pendentes(componentes):
+    pendentes = dict(componentes)
+    if len(pendentes) == 1:
+        motivo = f'Preço do componente "{next(iter(pendentes.values()))}" atualizado'
+    else:
+        motivo = f'Preço de {len(pendentes)} componentes atualizado'
+    with transaction.atomic():
+        propagar_precos_componentes(pendentes, motivo=motivo)
+
+
+_componentes_pendentes = PendenciasDoCommit(_propagar_pendentes)
+
+
+def marcar_componentes(componentes):
+    """
+    Agenda a propagação do preço dos componentes para o commit da transação
+    (várias alterações, como no changelist do admin, viram um único recálculo).
+    """
+    _componentes_pendentes.marcar((c.pk, c.nome) for c in componentes)
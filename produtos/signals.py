@@ -8,84 +8,113 @@ Dispara recálculo quando:
 - GrupoCanais é alterado (afeta canais que herdam)
 - Produto tem dimensões/peso alterados
 - ItemFichaTecnica é alterado (afeta custo)
+- Componente do PCP muda de preço (propagado às fichas vinculadas)
+
+Cada recálculo em cascata roda numa única transação (as marcações de cada preço
+são gravadas uma vez no commit) e fica registrado numa ExecucaoRecalculo (produtos.execucoes).
+
+Também mantém os índices derivados do catálogo: busca de produtos e
+read-model da tabela de preços (LinhaTabelaPreco), o custo gravado do produto
+(custo_ficha), o cache do dashboard e os contadores de alteração usados no
+GET condicional (ETag/Last-Modified), além de marcar os feeds por canal para regeração.
+
+Importações em lote desligam os signals por linha de Produto, ficha técnica e
+títulos com `recalculo_suspenso()` e fazem o mesmo trabalho uma vez no final
+(ver produtos.recalculo).
 """
-from django.db.models.signals import post_save, post_delete
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+from django.db.models.signals import post_init, post_save, post_delete
 from django.dispatch import receiver
 from django.db import transaction
 
+from .execucoes import registrar_execucao
+
+
+_suspensao = threading.local()
+
+
+@contextmanager
+def recalculo_suspenso():
+    """Desliga, nesta thread, os signals por linha de Produto, ItemFichaTecnica e TituloProduto."""
+    anterior = getattr(_suspensao, 'ativa', False)
+    _suspensao.ativa = True
+    try:
+        yield
+    finally:
+        _suspensao.ativa = anterior
+
+
+def recalculo_esta_suspenso():
+    return getattr(_suspensao, 'ativa', False)
+
+
+def suspendivel(handler):
+    """Receiver ignorado dentro de `recalculo_suspenso()`."""
+    @wraps(handler)
+    def wrapper(*args, **kwargs):
+        if recalculo_esta_suspenso():
+            return None
+        return handler(*args, **kwargs)
+    return wrapper
+
+
+def _recalcular(origem, motivo, precos):
+    """
+    Recalcula os preços numa única transação: as marcações dos signals de cada
+    preço (contadores do GET condicional, feeds) são agrupadas e gravadas uma
+    vez no commit, em vez de uma vez por preço.
+    """
+    total = 0
+    with registrar_execucao(origem, motivo), transaction.atomic():
+        for preco in precos.select_related('produto', 'canal'):
+            preco.recalcular_precos(salvar_historico=True, motivo=motivo)
+            total += 1
+    return total
+
 
 def recalcular_precos_canal(canal, motivo):
     """Recalcula todos os preços de um canal específico."""
     from .models import PrecoProdutoCanal
 
-    precos = PrecoProdutoCanal.objects.filter(canal=canal, ativo=True)
-    for preco in precos:
-        preco.recalcular_precos(salvar_historico=True, motivo=motivo)
-
-    return precos.count()
+    return _recalcular('canal', motivo, PrecoProdutoCanal.objects.filter(canal=canal, ativo=True))
 
 
 def recalcular_precos_produto(produto, motivo):
     """Recalcula todos os preços de um produto específico."""
     from .models import PrecoProdutoCanal
 
-    precos = PrecoProdutoCanal.objects.filter(produto=produto, ativo=True)
-    for preco in precos:
-        preco.recalcular_precos(salvar_historico=True, motivo=motivo)
-
-    return precos.count()
+    return _recalcular('produto', motivo, PrecoProdutoCanal.objects.filter(produto=produto, ativo=True))
 
 
 def recalcular_precos_tabela_frete(tabela_frete, motivo):
     """Recalcula todos os preços de canais que usam uma tabela de frete."""
-    from canais_vendas.models import CanalVenda
     from .models import PrecoProdutoCanal
 
-    canais = CanalVenda.objects.filter(tabela_frete=tabela_frete)
-    total = 0
-
-    for canal in canais:
-        precos = PrecoProdutoCanal.objects.filter(canal=canal, ativo=True)
-        for preco in precos:
-            preco.recalcular_precos(salvar_historico=True, motivo=motivo)
-        total += precos.count()
-
-    return total
+    return _recalcular('tabela_frete', motivo, PrecoProdutoCanal.objects.filter(
+        canal__tabela_frete=tabela_frete, ativo=True
+    ).order_by('canal_id', 'pk'))
 
 
 def recalcular_precos_tabela_taxa(tabela_taxa, motivo):
     """Recalcula todos os preços de canais que usam uma tabela de taxa."""
-    from canais_vendas.models import CanalVenda
     from .models import PrecoProdutoCanal
 
-    canais = CanalVenda.objects.filter(tabela_taxa=tabela_taxa)
-    total = 0
-
-    for canal in canais:
-        precos = PrecoProdutoCanal.objects.filter(canal=canal, ativo=True)
-        for preco in precos:
-            preco.recalcular_precos(salvar_historico=True, motivo=motivo)
-        total += precos.count()
-
-    return total
+    return _recalcular('tabela_taxa', motivo, PrecoProdutoCanal.objects.filter(
+        canal__tabela_taxa=tabela_taxa, ativo=True
+    ).order_by('canal_id', 'pk'))
 
 
 def recalcular_precos_grupo(grupo, motivo):
     """Recalcula todos os preços de canais de um grupo (que herdam do grupo)."""
-    from canais_vendas.models import CanalVenda
     from .models import PrecoProdutoCanal
 
     # Apenas canais que herdam do grupo
-    canais = CanalVenda.objects.filter(grupo=grupo, herdar_grupo=True)
-    total = 0
-
-    for canal in canais:
-        precos = PrecoProdutoCanal.objects.filter(canal=canal, ativo=True)
-        for preco in precos:
-            preco.recalcular_precos(salvar_historico=True, motivo=motivo)
-        total += precos.count()
-
-    return total
+    return _recalcular('grupo', motivo, PrecoProdutoCanal.objects.filter(
+        canal__grupo=grupo, canal__herdar_grupo=True, ativo=True
+    ).order_by('canal_id', 'pk'))
 
 
 # ============================================================
@@ -241,6 +270,7 @@ def on_grupo_canais_save(sender, instance, **kwargs):
 # ============================================================
 
 @receiver(post_save, sender='produtos.Produto')
+@suspendivel
 def on_produto_save(sender, instance, **kwargs):
     """Quando um produto é alterado (peso, dimensões), recalcula seus preços."""
     transaction.on_commit(
@@ -256,8 +286,12 @@ def on_produto_save(sender, instance, **kwargs):
 # ============================================================
 
 @receiver(post_save, sender='produtos.ItemFichaTecnica')
+@suspendivel
 def on_item_ficha_save(sender, instance, **kwargs):
     """Quando um item da ficha técnica é alterado, recalcula preços do produto."""
+    from .painel import invalidar_produtos
+    instance.produto.atualizar_custo_ficha()
+    invalidar_produtos()
     transaction.on_commit(
         lambda: recalcular_precos_produto(
             instance.produto,
@@ -267,11 +301,230 @@ def on_item_ficha_save(sender, instance, **kwargs):
 
 
 @receiver(post_delete, sender='produtos.ItemFichaTecnica')
+@suspendivel
 def on_item_ficha_delete(sender, instance, **kwargs):
     """Quando um item da ficha técnica é excluído."""
+    from .painel import invalidar_produtos
+    instance.produto.atualizar_custo_ficha()
+    invalidar_produtos()
     transaction.on_commit(
         lambda: recalcular_precos_produto(
             instance.produto,
             f'Item excluído da ficha técnica do produto "{instance.produto.sku}"'
         )
     )
+
+
+# ============================================================
+# SIGNALS PARA COMPONENTES DO PCP (CUSTO DA FICHA)
+# ============================================================
+
+@receiver(post_init, sender='controle_producao.Componente')
+def guardar_preco_componente(sender, instance, **kwargs):
+    instance._preco_inicial = instance.__dict__.get('preco')
+
+
+@receiver(post_save, sender='controle_producao.Componente')
+def on_componente_preco(sender, instance, created, **kwargs):
+    """Preço do componente mudou: propaga para as fichas vinculadas no commit (em lote)."""
+    from .recalculo import marcar_componentes
+    if not created and instance.preco != instance._preco_inicial:
+        marcar_componentes([instance])
+    instance._preco_inicial = instance.preco
+
+
+# ============================================================
+# SIGNALS PARA ÍNDICES DERIVADOS (BUSCA E TABELA DE PREÇOS)
+# ============================================================
+
+@receiver(post_save, sender='produtos.Produto')
+@suspendivel
+def on_produto_save_indices(sender, instance, **kwargs):
+    """Atualiza o documento de busca e as linhas da tabela de preços (SKU e título principal)."""
+    from .busca import atualizar_indice_busca
+    from .tabela_precos import sincronizar_linhas_produto
+    atualizar_indice_busca(instance)
+    sincronizar_linhas_produto(instance.pk)
+
+
+@receiver(post_save, sender='produtos.TituloProduto')
+@suspendivel
+def on_titulo_save_indices(sender, instance, **kwargs):
+    """Atualiza busca e tabela de preços quando um título alternativo muda."""
+    from .busca import atualizar_indice_busca
+    from .tabela_precos import sincronizar_linhas_produto
+    atualizar_indice_busca(instance.produto)
+    sincronizar_linhas_produto(instance.produto_id)
+
+
+@receiver(post_delete, sender='produtos.TituloProduto')
+@suspendivel
+def on_titulo_delete_indices(sender, instance, **kwargs):
+    """Remove o título excluído do documento de busca (as linhas da tabela caem em cascata)."""
+    from .busca import atualizar_indice_busca
+    from .models import Produto
+
+    def atualizar():
+        # O produto pode ter sido excluído junto (cascade)
+        produto = Produto.objects.filter(pk=instance.produto_id).first()
+        if produto:
+            atualizar_indice_busca(produto)
+
+    transaction.on_commit(atualizar)
+
+
+@receiver(post_save, sender='produtos.PrecoProdutoCanal')
+def on_preco_criado_indices(sender, instance, created, **kwargs):
+    """Um novo preço produto/canal ganha suas linhas na tabela de preços."""
+    if created:
+        from .tabela_precos import sincronizar_linhas_produto
+        sincronizar_linhas_produto(instance.produto_id)
+
+
+@receiver(post_save, sender='canais_vendas.CanalVenda')
+def on_canal_venda_save_indices(sender, instance, **kwargs):
+    """Propaga nome e grupo do canal para a tabela de preços."""
+    from .tabela_precos import atualizar_nomes_canal
+    atualizar_nomes_canal(instance)
+
+
+@receiver(post_save, sender='grupo_vendas.GrupoCanais')
+def on_grupo_canais_save_indices(sender, instance, **kwargs):
+    """Propaga o nome do grupo para a tabela de preços."""
+    from .tabela_precos import atualizar_nomes_grupo
+    atualizar_nomes_grupo(instance)
+
+
+# ============================================================
+# SIGNALS PARA O DASHBOARD (CACHE DE CONTADORES)
+# ============================================================
+
+@receiver(post_init, sender='produtos.Produto')
+@receiver(post_init, sender='produtos.PrecoProdutoCanal')
+@receiver(post_init, sender='canais_vendas.CanalVenda')
+def guardar_ativo_inicial(sender, instance, **kwargs):
+    """Guarda o `ativo` carregado para saber, no post_save, se houve (des)ativação."""
+    instance._ativo_inicial = instance.__dict__.get('ativo')
+
+
+def _mudou_contagem(instance, created):
+    return created or instance.ativo != getattr(instance, '_ativo_inicial', instance.ativo)
+
+
+@receiver(post_save, sender='produtos.Produto')
+@suspendivel
+def on_produto_save_painel(sender, instance, created, **kwargs):
+    from .painel import invalidar_contadores, invalidar_produtos
+    if _mudou_contagem(instance, created):
+        invalidar_contadores()
+    # SKU/título podem ter mudado: a lista de últimos produtos é sempre refeita
+    invalidar_produtos()
+    instance._ativo_inicial = instance.ativo
+
+
+@receiver(post_save, sender='produtos.PrecoProdutoCanal')
+@receiver(post_save, sender='canais_vendas.CanalVenda')
+def on_ativo_save_painel(sender, instance, created, **kwargs):
+    if _mudou_contagem(instance, created):
+        from .painel import invalidar_contadores
+        invalidar_contadores()
+    instance._ativo_inicial = instance.ativo
+
+
+@receiver(post_save, sender='grupo_vendas.GrupoCanais')
+def on_grupo_save_painel(sender, instance, created, **kwargs):
+    if created:
+        from .painel import invalidar_contadores
+        invalidar_contadores()
+
+
+@receiver(post_delete, sender='produtos.Produto')
+@receiver(post_delete, sender='produtos.PrecoProdutoCanal')
+@receiver(post_delete, sender='canais_vendas.CanalVenda')
+@receiver(post_delete, sender='grupo_vendas.GrupoCanais')
+def on_delete_painel(sender, instance, **kwargs):
+    from .painel import invalidar_contadores, invalidar_produtos
+    invalidar_contadores()
+    if sender._meta.label == 'produtos.Produto':
+        invalidar_produtos()
+
+
+@receiver(post_save, sender='produtos.HistoricoPreco')
+def on_historico_save_painel(sender, instance, created, **kwargs):
+    if created:
+        from .painel import invalidar_historicos
+        invalidar_historicos()
+
+
+# ============================================================
+# SIGNALS PARA GET CONDICIONAL (CONTADORES DE ALTERAÇÃO)
+# ============================================================
+
+@receiver(post_save, sender='produtos.PrecoProdutoCanal')
+@receiver(post_delete, sender='produtos.PrecoProdutoCanal')
+def on_preco_alteracao(sender, instance, **kwargs):
+    from .condicional import marcar_alteracao, CATALOGO, escopo_canal, escopo_grupo, escopo_produto
+    marcar_alteracao(
+        CATALOGO,
+        escopo_canal(instance.canal_id),
+        escopo_grupo(instance.canal.grupo_id),
+        escopo_produto(instance.produto_id),
+    )
+
+
+@receiver(post_save, sender='produtos.Produto')
+@receiver(post_delete, sender='produtos.Produto')
+@suspendivel
+def on_produto_alteracao(sender, instance, **kwargs):
+    from .condicional import marcar_alteracao, escopos_do_produto
+    marcar_alteracao(*escopos_do_produto(instance.pk))
+
+
+@receiver(post_save, sender='produtos.TituloProduto')
+@receiver(post_delete, sender='produtos.TituloProduto')
+@receiver(post_save, sender='produtos.ItemFichaTecnica')
+@receiver(post_delete, sender='produtos.ItemFichaTecnica')
+@suspendivel
+def on_item_produto_alteracao(sender, instance, **kwargs):
+    from .condicional import marcar_alteracao, escopos_do_produto
+    marcar_alteracao(*escopos_do_produto(instance.produto_id))
+
+
+@receiver(post_save, sender='canais_vendas.CanalVenda')
+@receiver(post_delete, sender='canais_vendas.CanalVenda')
+def on_canal_alteracao(sender, instance, **kwargs):
+    from .condicional import marcar_alteracao, ESTRUTURA, escopo_canal
+    marcar_alteracao(ESTRUTURA, escopo_canal(instance.pk))
+
+
+@receiver(post_save, sender='grupo_vendas.GrupoCanais')
+@receiver(post_delete, sender='grupo_vendas.GrupoCanais')
+def on_grupo_alteracao(sender, instance, **kwargs):
+    from .condicional import marcar_alteracao, ESTRUTURA, escopo_grupo
+    marcar_alteracao(ESTRUTURA, escopo_grupo(instance.pk))
+
+
+# ============================================================
+# SIGNALS PARA FEEDS POR CANAL
+# ============================================================
+
+@receiver(post_save, sender='produtos.PrecoProdutoCanal')
+@receiver(post_delete, sender='produtos.PrecoProdutoCanal')
+def on_preco_feed(sender, instance, **kwargs):
+    from .feeds import marcar_feeds
+    marcar_feeds(instance.canal_id)
+
+
+@receiver(post_save, sender='produtos.Produto')
+@suspendivel
+def on_produto_feed(sender, instance, **kwargs):
+    from .feeds import marcar_feeds_produto
+    marcar_feeds_produto(instance.pk)
+
+
+@receiver(post_save, sender='produtos.TituloProduto')
+@receiver(post_delete, sender='produtos.TituloProduto')
+@suspendivel
+def on_titulo_feed(sender, instance, **kwargs):
+    from .feeds import marcar_feeds_produto
+    marcar_feeds_produto(instance.produto_id)
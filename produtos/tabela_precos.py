@@ -0,0 +1,110 @@
+"""
+Manutenção do read-model da Tabela de Preços (LinhaTabelaPreco).
+
+Cada PrecoProdutoCanal vira uma linha para o título principal e uma linha para
+cada título alternativo ativo. As linhas são refeitas por produto (são poucas:
+canais × títulos) e os nomes de canal/grupo são atualizados em massa quando
+mudam. A listagem então pagina direto sobre linhas reais, sem expandir nada em Python.
+"""
+from .busca import montar_documento
+from .models import Produto, TituloProduto, PrecoProdutoCanal, LinhaTabelaPreco
+
+
+def dados_linhas(produto_id, sku, titulo, titulos, precos):
+    """
+    Gera os campos de cada linha do produto.
+    titulos: [(titulo_produto_id, titulo)]  - apenas ativos
+    precos:  [(preco_id, canal_id, canal_nome, grupo_id, grupo_nome)]
+    """
+    for preco_id, canal_id, canal_nome, grupo_id, grupo_nome in precos:
+        base = {
+            'preco_id': preco_id,
+            'produto_id': produto_id,
+            'canal_id': canal_id,
+            'grupo_id': grupo_id,
+            'sku': sku,
+            'canal_nome': canal_nome,
+            'grupo_nome': grupo_nome,
+        }
+        yield dict(base, titulo=titulo, principal=True, titulo_produto_id=None,
+                   busca=montar_documento(sku, titulo))
+        for titulo_id, titulo_sec in titulos:
+            yield dict(base, titulo=titulo_sec, principal=False, titulo_produto_id=titulo_id,
+                       busca=montar_documento(sku, titulo_sec))
+
+
+def sincronizar_linhas_produto(produto_id):
+    """Refaz todas as linhas da tabela de um produto."""
+    return sincronizar_linhas_produtos([produto_id])
+
+
+def sincronizar_linhas_produtos(produto_ids):
+    """Refaz as linhas da tabela de vários produtos (consultas por conjunto, não por produto)."""
+    produto_ids = list(produto_ids)
+    LinhaTabelaPreco.objects.filter(produto_id__in=produto_ids).delete()
+
+    titulos_por_produto = {}
+    for produto_id, pk, titulo in TituloProduto.objects.filter(
+        produto_id__in=produto_ids, ativo=True
+    ).values_list('produto_id', 'pk', 'titulo'):
+        titulos_por_produto.setdefault(produto_id, []).append((pk, titulo))
+
+    precos_por_produto = {}
+    for produto_id, *preco in PrecoProdutoCanal.objects.filter(produto_id__in=produto_ids).values_list(
+        'produto_id', 'pk', 'canal_id', 'canal__nome', 'canal__grupo_id', 'canal__grupo__nome'
+    ):
+        precos_por_produto.setdefault(produto_id, []).append(preco)
+
+    linhas = [
+        LinhaTabelaPreco(**dados)
+        for produto_id, sku, titulo in Produto.objects.filter(pk__in=produto_ids).values_list('pk', 'sku', 'titulo')
+        for dados in dados_linhas(
+            produto_id, sku, titulo,
+            titulos_por_produto.get(produto_id, []), precos_por_produto.get(produto_id, []),
+        )
+    ]
+    LinhaTabelaPreco.objects.bulk_create(linhas, batch_size=2000)
+    return len(linhas)
+
+
+def atualizar_nomes_canal(canal):
+    """Propaga nome/grupo do canal para as linhas (um UPDATE)."""
+    return LinhaTabelaPreco.objects.filter(canal=canal).update(
+        canal_nome=canal.nome,
+        grupo_id=canal.grupo_id,
+        grupo_nome=canal.grupo.nome,
+    )
+
+
+def atualizar_nomes_grupo(grupo):
+    """Propaga o nome do grupo para as linhas (um UPDATE)."""
+    return LinhaTabelaPreco.objects.filter(grupo=grupo).update(grupo_nome=grupo.nome)
+
+
+def reconstruir_linhas_tabela(tamanho_lote=2000):
+    """Reconstrói o read-model inteiro (usado pelo comando reconstruir_indices)."""
+    LinhaTabelaPreco.objects.all().delete()
+
+    titulos_por_produto = {}
+    for produto_id, pk, titulo in TituloProduto.objects.filter(ativo=True).values_list('produto_id', 'pk', 'titulo').iterator():
+        titulos_por_produto.setdefault(produto_id, []).append((pk, titulo))
+
+    produtos = dict((pk, (sku, titulo)) for pk, sku, titulo in Produto.objects.values_list('pk', 'sku', 'titulo').iterator())
+
+    lote = []
+    total = 0
+    precos = PrecoProdutoCanal.objects.order_by('produto_id').values_list(
+        'produto_id', 'pk', 'canal_id', 'canal__nome', 'canal__grupo_id', 'canal__grupo__nome'
+    )
+    for produto_id, *preco in precos.iterator():
+        sku, titulo = produtos[produto_id]
+        for dados in dados_linhas(produto_id, sku, titulo, titulos_por_produto.get(produto_id, ()), [preco]):
+            lote.append(LinhaTabelaPreco(**dados))
+        if len(lote) >= tamanho_lote:
+            LinhaTabelaPreco.objects.bulk_create(lote)
+            total += len(lote)
+            lote = []
+    if lote:
+        LinhaTabelaPreco.objects.bulk_create(lote)
+        total += len(lote)
+    return total
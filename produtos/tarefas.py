@@ -0,0 +1,222 @@
+"""
+Importações em segundo plano.
+
+As views só guardam o upload numa TarefaImportacao (status "pendente"); o
+comando processar_importacoes executa as tarefas da fila, em duas etapas:
+
+1. validação: a planilha é lida sem gravar nada e o andamento (linhas lidas,
+   válidas e erros) é salvo na tarefa a cada lote, fora de transação, então a
+   página de status acompanha o progresso;
+2. gravação: a importação roda numa única transação, junto com o recálculo
+   dos preços afetados (produtos do catálogo, ou os produtos cujo frete mudou
+   com as regras novas). Se algo falhar, nada é gravado e a tarefa fica como
+   "falhou". A gravação é uma execução de recálculo (produtos.execucoes),
+   aberta fora da transação para que a falha fique registrada.
+
+A tarefa é reservada com um UPDATE condicional no status, então vários
+workers podem rodar ao mesmo tempo sem processar a mesma importação. Toda
+mudança de status de uma tarefa em andamento também é condicional.
+
+Uma tarefa validando ou gravando há mais de TEMPO_LIMITE (contado de
+iniciada_em) é de um worker que parou no meio: processar_pendentes a marca
+como "falhou" antes de pegar a fila. Ela não volta para a fila porque o
+worker pode estar só lento, e a importação rodaria duas vezes; a gravação é
+uma transação, então uma tarefa interrompida não deixou nada pela metade.
+
+O upload só serve para a execução: quando a tarefa termina (concluída,
+falhou ou expirou), o arquivo é apagado e fica só o nome_arquivo.
+"""
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from tabela_frete.importacao import (
+    importar_regras_matriz, importar_regras_simples, validar_regras_matriz, validar_regras_simples,
+)
+
+from .execucoes import registrar_execucao
+from .importacao import importar_catalogo
+from .models import TarefaImportacao
+
+
+logger = logging.getLogger(__name__)
+
+TEMPO_LIMITE = timedelta(hours=1)
+
+
+def criar_tarefa(tipo, arquivo, usuario=None, **campos):
+    """Guarda o upload e coloca a importação na fila."""
+    return TarefaImportacao.objects.create(
+        tipo=tipo,
+        arquivo=arquivo,
+        nome_arquivo=arquivo.name[:255],
+        usuario=usuario if usuario is not None and usuario.is_authenticated else None,
+        **campos,
+    )
+
+
+def _erros(relatorio):
+    """Erros do relatório no formato da tarefa: [origem, linha, mensagem]."""
+    return [list(erro) if len(erro) == 3 else ['Planilha', *erro] for erro in relatorio.erros]
+
+
+def _atualizar(tarefa, **campos):
+    for campo, valor in campos.items():
+        setattr(tarefa, campo, valor)
+    TarefaImportacao.objects.filter(pk=tarefa.pk).update(**campos)
+
+
+def _mudar_status(tarefa, de, para, **campos):
+    """UPDATE condicional: muda o status só se ele ainda é `de` (um dos status). False se não era mais."""
+    de = [de] if isinstance(de, str) else de
+    campos['status'] = para
+    if not TarefaImportacao.objects.filter(pk=tarefa.pk, status__in=de).update(**campos):
+        return False
+    for campo, valor in campos.items():
+        setattr(tarefa, campo, valor)
+    return True
+
+
+def _remover_arquivo(tarefa):
+    """Apaga o upload da tarefa terminada (o nome_arquivo continua na tarefa)."""
+    if not tarefa.arquivo:
+        return
+    try:
+        tarefa.arquivo.delete(save=False)
+    except OSError:
+        logger.warning('Não foi possível apagar o arquivo da importação %s', tarefa.pk, exc_info=True)
+        return
+    _atualizar(tarefa, arquivo='')
+
+
+def _progresso(tarefa):
+    def salvar(relatorio):
+        _atualizar(
+            tarefa,
+            linhas_lidas=relatorio.linhas,
+            linhas_validas=relatorio.validas,
+            total_erros=relatorio.total_erros,
+            erros=_erros(relatorio),
+        )
+    return salvar
+
+
+# ------------------------------------------------------------
+# Etapas por tipo
+# ------------------------------------------------------------
+
+def _validar_catalogo(tarefa, arquivo, progresso):
+    return importar_catalogo(arquivo, entidade_csv=tarefa.entidade, validar=True, progresso=progresso)
+
+
+def _gravar_catalogo(tarefa, arquivo):
+    relatorio = importar_catalogo(
+        arquivo, entidade_csv=tarefa.entidade, motivo=f'Importação de catálogo ({tarefa.nome_arquivo})'
+    )
+    return relatorio, relatorio.gravadas, relatorio.precos_recalculados
+
+
+def _regras(validar, importar):
+    def validar_regras(tarefa, arquivo, progresso):
+        return validar(tarefa.tabela_frete, arquivo, progresso=progresso)
+
+    def gravar_regras(tarefa, arquivo):
+        # A importação já recalcula os preços afetados pelas regras novas (tabela_frete.substituicao)
+        relatorio = importar(tarefa.tabela_frete, arquivo, substituir=tarefa.substituir)
+        return relatorio, relatorio.importadas, relatorio.precos_recalculados
+
+    return validar_regras, gravar_regras
+
+
+ETAPAS = {
+    TarefaImportacao.TIPO_CATALOGO: (_validar_catalogo, _gravar_catalogo),
+    TarefaImportacao.TIPO_REGRAS_MATRIZ: _regras(validar_regras_matriz, importar_regras_matriz),
+    TarefaImportacao.TIPO_REGRAS_SIMPLES: _regras(validar_regras_simples, importar_regras_simples),
+}
+
+
+# ------------------------------------------------------------
+# Execução
+# ------------------------------------------------------------
+
+def reservar(tarefa):
+    """Passa a tarefa de pendente para validando; False se outro worker já pegou."""
+    return _mudar_status(
+        tarefa, TarefaImportacao.PENDENTE, TarefaImportacao.VALIDANDO, iniciada_em=timezone.now()
+    )
+
+
+def executar(tarefa):
+    """Valida e grava uma tarefa já reservada. Retorna a tarefa atualizada."""
+    validar, gravar = ETAPAS[tarefa.tipo]
+    try:
+        with tarefa.arquivo.open('rb') as arquivo:
+            relatorio = validar(tarefa, arquivo, _progresso(tarefa))
+        _progresso(tarefa)(relatorio)
+
+        if not _mudar_status(tarefa, TarefaImportacao.VALIDANDO, TarefaImportacao.GRAVANDO):
+            # Expirou durante a validação (expirar_travadas): não grava mais
+            tarefa.refresh_from_db()
+            return tarefa
+        motivo = f'{tarefa.get_tipo_display()}: importação #{tarefa.pk} ({tarefa.nome_arquivo})'
+        with registrar_execucao('importacao', motivo, usuario=tarefa.usuario), \
+                tarefa.arquivo.open('rb') as arquivo, transaction.atomic():
+            relatorio, gravadas, recalculados = gravar(tarefa, arquivo)
+    except Exception as e:
+        logger.exception('Falha na importação %s', tarefa.pk)
+        _atualizar(tarefa, status=TarefaImportacao.FALHOU, mensagem=str(e), concluida_em=timezone.now())
+        _remover_arquivo(tarefa)
+        return tarefa
+
+    # Sem condição: mesmo que tenha expirado enquanto gravava, a gravação foi confirmada
+    _atualizar(
+        tarefa,
+        status=TarefaImportacao.CONCLUIDA,
+        linhas_lidas=relatorio.linhas,
+        linhas_validas=relatorio.validas,
+        linhas_gravadas=gravadas,
+        precos_recalculados=recalculados,
+        total_erros=relatorio.total_erros,
+        erros=_erros(relatorio),
+        concluida_em=timezone.now(),
+    )
+    _remover_arquivo(tarefa)
+    return tarefa
+
+
+def expirar_travadas(tempo_limite=TEMPO_LIMITE):
+    """Marca como falhou as tarefas validando/gravando iniciadas há mais de `tempo_limite`. Retorna as expiradas."""
+    agora = timezone.now()
+    minutos = int(tempo_limite.total_seconds() // 60)
+    expiradas = []
+    for tarefa in TarefaImportacao.objects.filter(
+        status__in=[TarefaImportacao.VALIDANDO, TarefaImportacao.GRAVANDO], iniciada_em__lt=agora - tempo_limite,
+    ):
+        mensagem = (
+            f'Sem conclusão {minutos} min depois de iniciada ({tarefa.get_status_display().lower()}): '
+            f'o processamento parou. Envie a planilha de novo.'
+        )
+        if _mudar_status(tarefa, tarefa.status, TarefaImportacao.FALHOU, mensagem=mensagem, concluida_em=agora):
+            logger.warning('Importação %s expirou', tarefa.pk)
+            _remover_arquivo(tarefa)
+            expiradas.append(tarefa)
+    return expiradas
+
+
+def processar_pendentes(limite=None, tempo_limite=TEMPO_LIMITE):
+    """
+    Expira as tarefas travadas e executa as da fila, das mais antigas para as
+    mais novas. Retorna as executadas.
+    """
+    expirar_travadas(tempo_limite)
+    pendentes = TarefaImportacao.objects.filter(status=TarefaImportacao.PENDENTE).order_by('criada_em', 'pk')
+    if limite:
+        pendentes = pendentes[:limite]
+
+    executadas = []
+    for tarefa in pendentes:
+        if reservar(tarefa):
+            executadas.append(executar(tarefa))
+    return executadas
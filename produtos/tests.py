@@ -1,3 +1,1167 @@
-from django.test import TestCase
+import csv
+import datetime
+import hashlib
+import io
+import json
+import os
+import tempfile
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+import openpyxl
+
+from app.testes import TestCase
+from canais_vendas.models import CanalVenda
+from controle_producao.models import Componente
+from grupo_vendas.models import GrupoCanais
+from tabela_frete.models import RegraFreteEspecial, RegraFreteMatriz, RegraFreteSimples, RegraTaxa
+
+from . import busca, cache_versionado, feeds, metricas, painel
+from .busca import filtrar_busca
+from .condicional import CATALOGO, escopo_canal, marcar_alteracao
+from .escrita import gravar_ou_atualizar, inserir_em_massa
+from .execucoes import registrar_execucao
+from .exportacao import COLUNAS_HISTORICO, CONTENT_TYPE_XLSX, filtrar_historicos
+from .feeds import gerar_feed
+from .matriz import montar_matriz
+from .models import (
+    ContadorAlteracao, ExecucaoRecalculo, FeedCanal, HistoricoPreco, ItemFichaTecnica, LinhaTabelaPreco,
+    PrecoProdutoCanal, Produto, TituloProduto,
+)
+from .paginacao import codificar_cursor, paginar_keyset
+from .recalculo import recalcular_em_lote
+from .signals import recalcular_precos_canal
+from .views import TabelaPrecosView
+
+
+class IndicesConsultaTest(TestCase):
+    """
+    As consultas mais frequentes (recálculo, compilação das tabelas, signals e
+    histórico) devem ser resolvidas por índice, não por varredura da tabela.
+    """
+
+    def _plano(self, queryset):
+        if connection.vendor == 'postgresql':
+            # Com tabelas vazias o planejador prefere Seq Scan; desliga para ver se há índice utilizável
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        return queryset.explain()
+
+    def assertUsaIndice(self, queryset):
+        plano = self._plano(queryset)
+        tabela = queryset.model._meta.db_table
+        if connection.vendor == 'postgresql':
+            self.assertNotIn(f'Seq Scan on {tabela}', plano)
+            return
+        linhas = [linha for linha in plano.splitlines() if f' {tabela} ' in f'{linha} ']
+        self.assertTrue(linhas, plano)
+        for linha in linhas:
+            self.assertRegex(linha, r'USING (COVERING )?INDEX|USING INTEGER PRIMARY KEY', plano)
+
+    def test_precos_ativos_por_canal_e_produto(self):
+        self.assertUsaIndice(PrecoProdutoCanal.objects.filter(canal_id=1, ativo=True))
+        self.assertUsaIndice(PrecoProdutoCanal.objects.filter(produto_id=1, ativo=True))
+
+    def test_regras_das_tabelas_compiladas(self):
+        # Mesmas consultas de tabela_frete.compilador
+        self.assertUsaIndice(
+            RegraFreteMatriz.objects.filter(tabela_id=1, ativo=True, excedente=False).values_list('pk', 'ordem')
+        )
+        self.assertUsaIndice(
+            RegraFreteSimples.objects.filter(tabela_id=1, ativo=True, excedente=False).values_list('pk', 'inicio')
+        )
+        self.assertUsaIndice(RegraFreteEspecial.objects.filter(tabela_id=1, ativo=True).order_by('ordem', 'pk'))
+        self.assertUsaIndice(RegraTaxa.objects.filter(tabela_id=1, ativo=True).values_list('pk', 'preco_inicio'))
+
+    def test_canais_por_tabela_e_grupo(self):
+        # Mesmas consultas de produtos.signals
+        self.assertUsaIndice(CanalVenda.objects.filter(tabela_frete_id=1))
+        self.assertUsaIndice(CanalVenda.objects.filter(tabela_taxa_id=1))
+        self.assertUsaIndice(CanalVenda.objects.filter(grupo_id=1, herdar_grupo=True))
+
+    def test_historico_mais_recente_primeiro(self):
+        self.assertUsaIndice(HistoricoPreco.objects.order_by('-data_registro', '-pk')[:50])
+        periodo = {'data_inicio': '2026-01-01', 'data_fim': '2026-01-31'}
+        self.assertUsaIndice(filtrar_historicos(HistoricoPreco.objects.all(), periodo).order_by('-data_registro'))
+
+
+class EscritaEmMassaTest(TestCase):
+    """Caminho sem COPY (SQLite): o mesmo código do PostgreSQL, com executemany."""
+
+    def setUp(self):
+        super().setUp()
+        grupo = GrupoCanais.objects.create(nome='Grupo Teste')
+        self.canal = CanalVenda.objects.create(nome='Canal Teste', grupo=grupo)
+        self.produto = Produto.objects.create(
+            titulo='Produto Teste', sku='TESTE-1', largura=10, altura=10, profundidade=10, peso_fisico=1,
+        )
+
+    def test_inserir_em_massa_preenche_auto_now_add_e_nulos(self):
+        registros = (
+            HistoricoPreco(
+                produto=self.produto, canal=self.canal, motivo=f'Linha {i}\tcom tab', custo=Decimal('1.50'),
+                preco_venda=Decimal('10.00'), frete_aplicado=Decimal('0.00'),
+            )
+            for i in range(5)
+        )
+        self.assertEqual(inserir_em_massa(HistoricoPreco, registros, tamanho_lote=2), 5)
+
+        historicos = HistoricoPreco.objects.filter(produto=self.produto)
+        self.assertEqual(historicos.count(), 5)
+        historico = historicos.get(motivo='Linha 3\tcom tab')
+        self.assertIsNotNone(historico.data_registro)
+        self.assertIsNone(historico.preco_promocao)
+        self.assertEqual(historico.custo, Decimal('1.50'))
+
+    def test_gravar_ou_atualizar_regrava_so_os_campos_indicados(self):
+        preco = PrecoProdutoCanal.objects.get_or_create(produto=self.produto, canal=self.canal)[0]
+        preco.preco_venda_calculado = Decimal('99.90')
+        preco.preco_venda_manual = Decimal('1.00')
+        gravar_ou_atualizar(PrecoProdutoCanal, [preco], ['produto', 'canal'], ['preco_venda_calculado'])
+
+        preco.refresh_from_db()
+        self.assertEqual(preco.preco_venda_calculado, Decimal('99.90'))
+        self.assertIsNone(preco.preco_venda_manual)
+        self.assertEqual(PrecoProdutoCanal.objects.filter(produto=self.produto).count(), 1)
+
+
+class CacheVersionadoTest(TestCase):
+    """Artefatos montados uma vez por versão e nunca servidos depois de invalidados."""
+
+    def setUp(self):
+        super().setUp()
+        self.nome = f'teste:{self.id()}'
+        self.montagens = 0
+
+    def _montar(self):
+        self.montagens += 1
+        return {'montagem': self.montagens}
+
+    def _novo_processo(self):
+        # Outro worker: mesmo cache compartilhado, sem nada em memória
+        cache_versionado._locais.pop(self.nome, None)
+
+    def test_outro_processo_aproveita_artefato_da_mesma_versao(self):
+        self.assertEqual(cache_versionado.obter(self.nome, self._montar), {'montagem': 1})
+        self._novo_processo()
+        self.assertEqual(cache_versionado.obter(self.nome, self._montar), {'montagem': 1})
+        self.assertEqual(self.montagens, 1)
+
+    def test_invalidar_remonta_em_todos_os_processos(self):
+        cache_versionado.obter(self.nome, self._montar)
+        cache_versionado.invalidar(self.nome)
+        self.assertEqual(cache_versionado.obter(self.nome, self._montar), {'montagem': 2})
+        self._novo_processo()
+        self.assertEqual(cache_versionado.obter(self.nome, self._montar), {'montagem': 2})
+
+    def test_versoes_fixas_veem_trocas_do_proprio_bloco(self):
+        with cache_versionado.versoes_fixas():
+            versao = cache_versionado.versao_atual(self.nome)
+            self.assertEqual(cache_versionado.versao_atual(self.nome), versao)
+            cache_versionado.trocar_versao(self.nome)
+            self.assertNotEqual(cache_versionado.versao_atual(self.nome), versao)
+
+
+class MetricasTest(TestCase):
+    """Registro de métricas e exposição no formato do Prometheus."""
+
+    def test_exportar_soma_o_estado_de_todos_os_processos(self):
+        with tempfile.TemporaryDirectory() as diretorio, override_settings(METRICAS_DIR=diretorio):
+            duracao = [0] * (len(metricas.RECALCULO_DURACAO.limites) + 1) + [0.5, 1]
+            duracao[metricas.RECALCULO_DURACAO.limites.index(0.5)] = 1
+            with open(os.path.join(diretorio, '999999.json'), 'w', encoding='utf-8') as arquivo:
+                json.dump({
+                    'precos_recalculados_total': [[['teste'], 5]],
+                    'precos_recalculo_duracao_segundos': [[['teste'], duracao]],
+                }, arquivo)
+
+            metricas.PRECOS_RECALCULADOS.inc(2, cascata='teste')
+            metricas.RECALCULO_DURACAO.observe(0.02, cascata='teste')
+            linhas = metricas.exportar().splitlines()
+
+        self.assertIn('# TYPE precos_recalculados_total counter', linhas)
+        self.assertIn('precos_recalculados_total{cascata="teste"} 7', linhas)
+        self.assertIn('precos_recalculo_duracao_segundos_bucket{cascata="teste",le="0.01"} 0', linhas)
+        self.assertIn('precos_recalculo_duracao_segundos_bucket{cascata="teste",le="0.05"} 1', linhas)
+        self.assertIn('precos_recalculo_duracao_segundos_bucket{cascata="teste",le="0.5"} 2', linhas)
+        self.assertIn('precos_recalculo_duracao_segundos_bucket{cascata="teste",le="+Inf"} 2', linhas)
+        self.assertIn('precos_recalculo_duracao_segundos_count{cascata="teste"} 2', linhas)
+
+    def test_endpoint_com_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+        with override_settings(METRICAS_TOKEN='segredo'):
+            self.assertEqual(self.client.get('/metrics').status_code, 401)
+            resposta = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer segredo')
+        self.assertEqual(resposta.status_code, 200)
+        self.assertIn(b'# TYPE precos_solver_iteracoes histogram', resposta.content)
+
+
+class ExecucaoRecalculoTest(TestCase):
+    """Cada recálculo fica registrado, com escopo, custo e os históricos que gravou."""
+
+    def setUp(self):
+        super().setUp()
+        self.usuario = User.objects.create_user('execucao', password='x')
+        grupo = GrupoCanais.objects.create(nome='Grupo Teste')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.canal = CanalVenda.objects.create(nome='Canal Teste', grupo=grupo)
+            self.produto = Produto.objects.create(
+                titulo='Produto Teste', sku='TESTE-1', largura=10, altura=10, profundidade=10, peso_fisico=1,
+            )
+            self.preco = PrecoProdutoCanal.objects.create(produto=self.produto, canal=self.canal)
+
+    def test_cascata_do_signal_registra_escopo_e_marca_os_historicos(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.produto.save()
+
+        execucao = ExecucaoRecalculo.objects.filter(origem='produto').latest('pk')
+        self.assertEqual(execucao.motivo, 'Produto "TESTE-1" atualizado')
+        self.assertEqual((execucao.precos_lidos, execucao.precos_alterados, execucao.precos_inalterados), (1, 0, 1))
+        self.assertGreater(execucao.consultas, 0)
+        self.assertIsNotNone(execucao.duracao)
+        self.assertIsNotNone(execucao.concluida_em)
+        self.assertEqual(list(execucao.historicos.values_list('produto_id', flat=True)), [self.produto.pk])
+
+    def test_execucoes_aninhadas_somam_na_de_fora(self):
+        with registrar_execucao('comando', 'Externa', usuario=self.usuario) as externa:
+            recalcular_em_lote(PrecoProdutoCanal.objects.all(), 'Interna')
+            recalcular_em_lote(PrecoProdutoCanal.objects.all(), 'Interna')
+
+        externa.refresh_from_db()
+        self.assertEqual(externa.precos_lidos, 2)
+        self.assertEqual(externa.usuario, self.usuario)
+        self.assertEqual(ExecucaoRecalculo.objects.filter(motivo='Interna').count(), 0)
+        self.assertEqual(HistoricoPreco.objects.filter(motivo='Interna', execucao=externa).count(), 2)
+
+    def test_erro_fica_registrado(self):
+        with self.assertRaises(ValueError):
+            with registrar_execucao('lote', 'Falha'):
+                raise ValueError('tabela inválida')
+
+        execucao = ExecucaoRecalculo.objects.get(motivo='Falha')
+        self.assertEqual(execucao.erro, 'ValueError: tabela inválida')
+        self.assertIsNotNone(execucao.concluida_em)
+
+    def test_sem_precos_nem_erro_nao_fica_registrada(self):
+        outro = CanalVenda.objects.create(nome='Canal Vazio', grupo=self.canal.grupo)
+        antes = ExecucaoRecalculo.objects.count()
+        with self.captureOnCommitCallbacks(execute=True):
+            outro.save()
+        with registrar_execucao('comando', 'Nada a recalcular'):
+            recalcular_em_lote(PrecoProdutoCanal.objects.none(), 'Nada a recalcular')
+
+        self.assertEqual(ExecucaoRecalculo.objects.count(), antes)
+
+    def test_edicao_manual_com_usuario_e_motivo(self):
+        self.client.force_login(self.usuario)
+        resposta = self.client.post(f'/precos/{self.preco.pk}/editar/', {
+            'preco_venda_manual': '99.90', 'motivo': 'Ajuste de concorrência',
+        })
+        self.assertEqual(resposta.status_code, 302)
+
+        execucao = ExecucaoRecalculo.objects.get(origem='manual')
+        self.assertEqual(execucao.usuario, self.usuario)
+        historico = execucao.historicos.get()
+        self.assertEqual((historico.usuario, historico.motivo), (self.usuario, 'Ajuste de concorrência'))
+        self.assertEqual(list(filtrar_historicos(HistoricoPreco.objects.all(), {'execucao': str(execucao.pk)})),
+                         [historico])
+
+
+class CondicionalTest(TestCase):
+    """ETag/Last-Modified das páginas de preço e contadores de alteração por escopo."""
+
+    def setUp(self):
+        super().setUp()
+        self.usuario = User.objects.create_user('condicional', password='x')
+        self.client.force_login(self.usuario)
+        with self.captureOnCommitCallbacks(execute=True):
+            grupo = GrupoCanais.objects.create(nome='Grupo Teste')
+            self.canal = CanalVenda.objects.create(nome='Canal Teste', grupo=grupo)
+            self.produto = Produto.objects.create(
+                titulo='Produto Teste', sku='TESTE-1', largura=10, altura=10, profundidade=10, peso_fisico=1,
+            )
+            self.preco = PrecoProdutoCanal.objects.create(produto=self.produto, canal=self.canal)
+
+    def test_304_com_etag_ou_last_modified_da_versao_atual(self):
+        resposta = self.client.get('/precos/')
+        self.assertEqual(resposta.status_code, 200)
+        etag, modificado = resposta['ETag'], resposta['Last-Modified']
+
+        self.assertEqual(self.client.get('/precos/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get('/precos/', HTTP_IF_MODIFIED_SINCE=modificado).status_code, 304)
+        # Outra URL (filtros) é outra representação
+        self.assertEqual(self.client.get('/precos/?search=x', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_alteracao_no_escopo_invalida_a_etag(self):
+        etag = self.client.get('/precos/').headers['ETag']
+        etag_canal = self.client.get(f'/precos/?canal={self.canal.pk}').headers['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.preco.frete_especifico = Decimal('9.90')
+            self.preco.save()
+
+        self.assertEqual(self.client.get('/precos/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        resposta = self.client.get(f'/precos/?canal={self.canal.pk}', HTTP_IF_NONE_MATCH=etag_canal)
+        self.assertEqual(resposta.status_code, 200)
+        self.assertNotEqual(resposta['ETag'], etag_canal)
+
+    def test_um_callback_por_transacao_e_nada_gravado_do_que_foi_desfeito(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            for _ in range(50):
+                marcar_alteracao('teste:a')
+            try:
+                with transaction.atomic():
+                    marcar_alteracao('teste:desfeito')
+                    raise ValueError
+            except ValueError:
+                pass
+        # O do savepoint desfeito é descartado pelo Django
+        self.assertEqual(len(callbacks), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    marcar_alteracao('teste:desfeito')
+                    raise ValueError
+            except ValueError:
+                pass
+        with self.captureOnCommitCallbacks(execute=True):
+            marcar_alteracao('teste:b')
+
+        contadores = dict(ContadorAlteracao.objects.filter(escopo__startswith='teste:').values_list('escopo', 'valor'))
+        self.assertEqual(contadores, {'teste:a': 1, 'teste:b': 1})
+
+    def test_cascata_grava_cada_escopo_uma_vez(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for numero in range(2, 6):
+                produto = Produto.objects.create(
+                    titulo=f'Produto {numero}', sku=f'TESTE-{numero}',
+                    largura=10, altura=10, profundidade=10, peso_fisico=1,
+                )
+                PrecoProdutoCanal.objects.create(produto=produto, canal=self.canal)
+        antes = dict(ContadorAlteracao.objects.values_list('escopo', 'valor'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(recalcular_precos_canal(self.canal, 'Teste'), 5)
+
+        # Cinco preços recalculados, um incremento por escopo
+        depois = dict(ContadorAlteracao.objects.values_list('escopo', 'valor'))
+        alterados = {escopo: valor - antes.get(escopo, 0) for escopo, valor in depois.items() if valor != antes.get(escopo)}
+        self.assertEqual(alterados[CATALOGO], 1)
+        self.assertEqual(alterados[escopo_canal(self.canal.pk)], 1)
+        self.assertEqual(set(alterados.values()), {1})
+
+
+class FeedsTest(TestCase):
+    """Feeds por canal: marcação de pendência pelas alterações e geração dos arquivos."""
+
+    def setUp(self):
+        super().setUp()
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=self.media.name))
+        self.usuario = User.objects.create_user('feeds', password='x')
+        with self.captureOnCommitCallbacks(execute=True):
+            grupo = GrupoCanais.objects.create(nome='Grupo Teste')
+            self.canal = CanalVenda.objects.create(nome='Canal Teste', grupo=grupo)
+            self.produto = Produto.objects.create(
+                titulo='Produto Teste', sku='TESTE-1', largura=10, altura=10, profundidade=10, peso_fisico=1,
+            )
+            self.titulo = TituloProduto.objects.create(produto=self.produto, titulo='Variação Teste')
+            self.preco = PrecoProdutoCanal.objects.create(produto=self.produto, canal=self.canal)
+        self.feed = gerar_feed(self.canal)
+
+    def assertPendente(self, pendente=True):
+        self.assertEqual(FeedCanal.objects.get(canal=self.canal).pendente, pendente)
+
+    def test_gerar_feed_escreve_csv_xlsx_e_sha256(self):
+        self.assertPendente(False)
+        self.assertEqual(self.feed.linhas, 2)
+        diretorio = feeds.diretorio_feeds()
+
+        csv_texto = (diretorio / f'canal_{self.canal.pk}.csv').read_text(encoding='utf-8-sig')
+        linhas = csv_texto.splitlines()
+        self.assertEqual(linhas[0], ';'.join(feeds.COLUNAS_FEED))
+        self.assertEqual([linha.split(';')[:3] for linha in linhas[1:]], [
+            ['TESTE-1', 'Produto Teste', 'Principal'], ['TESTE-1', 'Variação Teste', 'Variação'],
+        ])
+
+        planilha = openpyxl.load_workbook(diretorio / f'canal_{self.canal.pk}.xlsx', read_only=True)
+        valores = list(planilha.active.values)
+        self.assertEqual(list(valores[0]), feeds.COLUNAS_FEED)
+        self.assertEqual(len(valores), 3)
+
+        for extensao, sha in (('csv', self.feed.sha256_csv), ('xlsx', self.feed.sha256_xlsx)):
+            arquivo = diretorio / f'canal_{self.canal.pk}.{extensao}'
+            digest = hashlib.sha256(arquivo.read_bytes()).hexdigest()
+            self.assertEqual(sha, digest)
+            self.assertEqual(
+                (diretorio / f'{arquivo.name}.sha256').read_text(encoding='ascii'), f'{digest}  {arquivo.name}\n',
+            )
+
+    def test_aba_sem_caracteres_invalidos(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.canal.nome = 'ML [Full]: SP/RJ *promo?* \\ ' + 'x' * 40
+            self.canal.save()
+        gerar_feed(self.canal)
+
+        planilha = openpyxl.load_workbook(feeds.diretorio_feeds() / f'canal_{self.canal.pk}.xlsx', read_only=True)
+        self.assertEqual(planilha.sheetnames, ['ML -Full-- SP-RJ -promo-- - xxx'])
+
+    def test_comando_canal_por_nome_ou_id(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            grupo = GrupoCanais.objects.create(nome='Outro Grupo')
+            outro = CanalVenda.objects.create(nome='Canal Teste', grupo=grupo)
+
+        saida, erros = io.StringIO(), io.StringIO()
+        call_command('gerar_feeds', canal='Canal Teste', stdout=saida, stderr=erros)
+        self.assertIn(f'informe o id: {self.canal.pk} (Grupo Teste), {outro.pk} (Outro Grupo)', erros.getvalue())
+        self.assertEqual(saida.getvalue(), '')
+
+        saida = io.StringIO()
+        call_command('gerar_feeds', canal=str(outro.pk), stdout=saida)
+        self.assertIn('Canal Teste: 0 linhas', saida.getvalue())
+        self.assertTrue((feeds.diretorio_feeds() / f'canal_{outro.pk}.csv').exists())
+
+    def test_editar_preco_marca_o_feed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.preco.frete_especifico = Decimal('9.90')
+            self.preco.save()
+        self.assertPendente()
+
+    def test_editar_produto_marca_o_feed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.produto.titulo = 'Produto Renomeado'
+            self.produto.save()
+        self.assertPendente()
+
+    def test_editar_titulo_marca_o_feed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.titulo.titulo = 'Outra Variação'
+            self.titulo.save()
+        self.assertPendente()
+
+    def test_desmarcar_canal_do_produto_marca_o_feed(self):
+        self.client.force_login(self.usuario)
+        with self.captureOnCommitCallbacks(execute=True):
+            resposta = self.client.post(f'/produtos/{self.produto.pk}/precos/', {'canais': []})
+        self.assertEqual(resposta.status_code, 302)
+        self.assertFalse(PrecoProdutoCanal.objects.get(pk=self.preco.pk).ativo)
+        self.assertPendente()
+
+
+class PropagacaoComponentesTest(TestCase):
+    """Novo preço de um componente do PCP chega aos itens de ficha, ao custo e aos preços."""
+
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            grupo = GrupoCanais.objects.create(nome='Grupo Teste')
+            self.canal = CanalVenda.objects.create(nome='Canal Teste', grupo=grupo)
+            self.componente = Componente.objects.create(nome='Chapa', preco=Decimal('2.5000'))
+            self.produto = Produto.objects.create(
+                titulo='Produto Teste', sku='TESTE-1', largura=10, altura=10, profundidade=10, peso_fisico=1,
+            )
+            self.sem_preco = Produto.objects.create(
+                titulo='Sem Preço', sku='TESTE-2', largura=10, altura=10, profundidade=10, peso_fisico=1,
+            )
+            for produto in (self.produto, self.sem_preco):
+                ItemFichaTecnica.objects.create(
+                    produto=produto, componente=self.componente, codigo='CH', descricao='Chapa',
+                    quantidade=Decimal('2'), custo_unitario=Decimal('2.500'),
+                )
+            self.preco = PrecoProdutoCanal.objects.create(produto=self.produto, canal=self.canal)
+
+    def test_preco_do_componente_propaga_para_ficha_custo_e_preco(self):
+        self.assertEqual(self.preco.custo_calculado, Decimal('5.00'))
+        venda_antes = self.preco.preco_venda_calculado
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.componente.preco = Decimal('4.1234')
+            self.componente.save()
+
+        self.assertEqual(
+            set(ItemFichaTecnica.objects.values_list('custo_unitario', flat=True)), {Decimal('4.123')}
+        )
+        self.assertEqual(Produto.objects.get(pk=self.produto.pk).custo_ficha, Decimal('8.25'))
+        self.assertEqual(Produto.objects.get(pk=self.sem_preco.pk).custo_ficha, Decimal('8.25'))
+
+        preco = PrecoProdutoCanal.objects.get(pk=self.preco.pk)
+        self.assertEqual(preco.custo_calculado, Decimal('8.25'))
+        self.assertGreater(preco.preco_venda_calculado, venda_antes)
+        self.assertEqual(
+            preco.preco_venda_calculado, Produto.objects.get(pk=self.produto.pk).calcular_preco_venda(self.canal)
+        )
+        execucao = ExecucaoRecalculo.objects.latest('pk')
+        self.assertEqual((execucao.origem, execucao.precos_lidos), ('componente', 1))
+        self.assertEqual(execucao.motivo, 'Preço do componente "Chapa" atualizado')
+
+    def test_alteracao_desfeita_nao_propaga(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            outro = Componente.objects.create(nome='Cola', preco=Decimal('1.0000'))
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                with self.assertRaises(RuntimeError), transaction.atomic():
+                    self.componente.preco = Decimal('9.0000')
+                    self.componente.save()
+                    raise RuntimeError('desfaz o savepoint')
+                # Outra alteração na mesma transação não leva junto a que foi desfeita
+                outro.preco = Decimal('2.0000')
+                outro.save()
+        self.assertFalse(ExecucaoRecalculo.objects.filter(origem='componente').exists())
+        self.assertEqual(Produto.objects.get(pk=self.produto.pk).custo_ficha, Decimal('5.00'))
+
+
+class BuscaTest(TestCase):
+    """Busca por prefixo em SKU e títulos (FTS5 no SQLite) e sincronização do índice pelos triggers."""
+
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.prateleira = Produto.objects.create(
+                titulo='Prateleira de Aço', sku='PRT-100', largura=10, altura=10, profundidade=10, peso_fisico=1,
+            )
+            self.gaveteiro = Produto.objects.create(
+                titulo='Gaveteiro de Madeira', sku='GAV-200', largura=10, altura=10, profundidade=10, peso_fisico=1,
+            )
+            self.titulo = TituloProduto.objects.create(produto=self.gaveteiro, titulo='Organizador Ação')
+
+    def _encontrados(self, termo):
+        return set(filtrar_busca(Produto.objects.all(), termo).values_list('sku', flat=True))
+
+    def _fts(self, termo):
+        """Produtos que o índice FTS5 encontra (direto na tabela virtual)."""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {busca.TABELA_FTS} WHERE {busca.TABELA_FTS} MATCH %s', [f'"{termo}"*']
+            )
+            return {pk for pk, in cursor.fetchall()}
+
+    def test_prefixo_todas_as_palavras_e_acentos(self):
+        self.assertEqual(self._encontrados('prat aco'), {'PRT-100'})
+        self.assertEqual(self._encontrados('PRATELEIRA AÇO'), {'PRT-100'})
+        self.assertEqual(self._encontrados('de'), {'PRT-100', 'GAV-200'})
+        self.assertEqual(self._encontrados('prat madeira'), set())
+        self.assertEqual(self._encontrados('teleira'), set())
+
+    def test_sku_quebrado_ou_compacto_e_titulos_alternativos(self):
+        self.assertEqual(self._encontrados('prt 100'), {'PRT-100'})
+        self.assertEqual(self._encontrados('prt100'), {'PRT-100'})
+        self.assertEqual(self._encontrados('organiz acao'), {'GAV-200'})
+
+    def test_termo_sem_palavras_nao_filtra(self):
+        self.assertIsNone(busca.produtos_encontrados(' -- '))
+        self.assertEqual(self._encontrados(''), {'PRT-100', 'GAV-200'})
+
+    @skipUnless(connection.vendor == 'sqlite', 'FTS5 é só do SQLite')
+    def test_triggers_mantem_o_fts_sincronizado(self):
+        if not busca._usa_fts(connection.alias):
+            self.skipTest('SQLite sem FTS5')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.prateleira.titulo = 'Estante de Ferro'
+            self.prateleira.save()
+        self.assertEqual(self._fts('prateleira'), set())
+        self.assertEqual(self._fts('estante'), {self.prateleira.pk})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.titulo.delete()
+        self.assertEqual(self._fts('organizador'), set())
+
+        gaveteiro = self.gaveteiro.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            self.gaveteiro.delete()
+        self.assertEqual(self._fts('gaveteiro'), set())
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT count(*) FROM {busca.TABELA_FTS} WHERE rowid = %s', [gaveteiro])
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+
+class TabelaPrecosTest(TestCase):
+    """Read-model LinhaTabelaPreco e paginação por cursor da Tabela de Preços."""
+
+    def setUp(self):
+        super().setUp()
+        self.usuario = User.objects.create_user('tabela', password='x')
+        with self.captureOnCommitCallbacks(execute=True):
+            grupo = GrupoCanais.objects.create(nome='Grupo Teste')
+            self.canais = [CanalVenda.objects.create(nome=nome, grupo=grupo) for nome in ('Canal A', 'Canal B')]
+            for numero in range(4):
+                produto = Produto.objects.create(
+                    titulo=f'Produto {numero}', sku=f'SKU-{numero}',
+                    largura=10, altura=10, profundidade=10, peso_fisico=1,
+                )
+                if numero % 2:
+                    TituloProduto.objects.create(produto=produto, titulo=f'Variação {numero}')
+                for canal in self.canais:
+                    PrecoProdutoCanal.objects.create(produto=produto, canal=canal)
+        # 4 produtos x 2 canais, mais 2 variações x 2 canais
+        self.ordem = list(LinhaTabelaPreco.objects.order_by(*LinhaTabelaPreco.ORDENACAO))
+        self.assertEqual(len(self.ordem), 12)
+
+    def _paginas(self, tamanho, **cursor):
+        return paginar_keyset(LinhaTabelaPreco.objects.all(), LinhaTabelaPreco.ORDENACAO, tamanho, **cursor)
+
+    def test_read_model_tem_uma_linha_por_preco_e_titulo(self):
+        primeiras = [(l.sku, l.canal_nome, l.principal, l.titulo) for l in self.ordem[:4]]
+        self.assertEqual(primeiras, [
+            ('SKU-0', 'Canal A', True, 'Produto 0'),
+            ('SKU-0', 'Canal B', True, 'Produto 0'),
+            ('SKU-1', 'Canal A', True, 'Produto 1'),
+            ('SKU-1', 'Canal A', False, 'Variação 1'),
+        ])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.canais[0].nome = 'Canal Z'
+            self.canais[0].save()
+        self.assertEqual(LinhaTabelaPreco.objects.filter(canal_nome='Canal Z').count(), 6)
+
+    def test_avanca_e_volta_sem_repetir_nem_pular_linhas(self):
+        vistas, cursores, depois = [], [], None
+        while True:
+            linhas, anterior, proximo = self._paginas(5, depois=depois)
+            vistas += linhas
+            cursores.append(anterior)
+            if proximo is None:
+                break
+            depois = proximo
+        self.assertEqual([l.pk for l in vistas], [l.pk for l in self.ordem])
+        self.assertEqual(len(cursores), 3)
+        self.assertIsNone(cursores[0])
+
+        # Voltando a partir da última página: as mesmas linhas da segunda página
+        linhas, anterior, proximo = self._paginas(5, antes=cursores[-1])
+        self.assertEqual([l.pk for l in linhas], [l.pk for l in self.ordem[5:10]])
+        self.assertIsNotNone(anterior)
+        self.assertIsNotNone(proximo)
+        linhas, anterior, _ = self._paginas(5, antes=anterior)
+        self.assertEqual([l.pk for l in linhas], [l.pk for l in self.ordem[:5]])
+        self.assertIsNone(anterior)
+
+    def test_linha_nova_antes_do_cursor_nao_desloca_a_pagina_seguinte(self):
+        _, _, proximo = self._paginas(5)
+        with self.captureOnCommitCallbacks(execute=True):
+            TituloProduto.objects.create(produto=Produto.objects.get(sku='SKU-0'), titulo='AAA Nova')
+        linhas, _, _ = self._paginas(5, depois=proximo)
+        self.assertEqual([l.pk for l in linhas], [l.pk for l in self.ordem[5:10]])
+
+    def test_cursor_invalido_volta_para_a_primeira_pagina(self):
+        primeira = self.ordem[0]
+        valores = ['SKU-0', 'Grupo Teste', 'Canal A', True, 'Produto 0']
+        for cursor in (
+            '@@@', codificar_cursor({'a': 1}), codificar_cursor([1, 2]),
+            # Tamanho certo, valores que não servem para os campos da ordenação
+            codificar_cursor(valores + ['a']), codificar_cursor(valores[:3] + ['talvez', 'Produto 0', primeira.pk]),
+            codificar_cursor(valores + [None]), codificar_cursor(valores + [[primeira.pk]]),
+        ):
+            for direcao in ('depois', 'antes'):
+                with self.subTest(cursor=cursor, direcao=direcao):
+                    linhas, anterior, _ = self._paginas(5, **{direcao: cursor})
+                    self.assertEqual([l.pk for l in linhas], [l.pk for l in self.ordem[:5]])
+                    self.assertIsNone(anterior)
+
+        self.client.force_login(self.usuario)
+        resposta = self.client.get('/precos/tabela/', {'depois': codificar_cursor(valores + ['a'])})
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.context['linhas'][0].pk, primeira.pk)
+
+    def test_tela_pagina_pelo_cursor_com_os_filtros(self):
+        self.client.force_login(self.usuario)
+        with mock.patch.object(TabelaPrecosView, 'tamanho_pagina', 2):
+            resposta = self.client.get('/precos/tabela/', {'canal': self.canais[1].pk})
+            proximo = resposta.context['cursor_proximo']
+            seguinte = self.client.get('/precos/tabela/', {'canal': self.canais[1].pk, 'depois': proximo})
+
+        do_canal = [l.pk for l in self.ordem if l.canal_id == self.canais[1].pk]
+        self.assertEqual([l.pk for l in resposta.context['linhas']], do_canal[:2])
+        self.assertEqual([l.pk for l in seguinte.context['linhas']], do_canal[2:4])
+        self.assertEqual(seguinte.context['filtros'], f'canal={self.canais[1].pk}')
+
+
+class ExportacaoHistoricoTest(TestCase):
+    """Exportação do histórico em CSV (streaming), XLSX e pelo comando, com os filtros da tela."""
+
+    def setUp(self):
+        super().setUp()
+        self.usuario = User.objects.create_user('historico', password='x')
+        grupo = GrupoCanais.objects.create(nome='Grupo Teste')
+        mercado = CanalVenda.objects.create(nome='Mercado Livre', grupo=grupo)
+        shopee = CanalVenda.objects.create(nome='Shopee', grupo=grupo)
+        produto = Produto.objects.create(
+            titulo='Prateleira', sku='PRT-1', largura=10, altura=10, profundidade=10, peso_fisico=1,
+        )
+        for canal, data, venda in [
+            (mercado, datetime.datetime(2026, 1, 10, 15, 30), '100.50'),
+            (mercado, datetime.datetime(2026, 1, 31, 23, 59), '110.00'),
+            (shopee, datetime.datetime(2026, 1, 20, 8, 0), '99.90'),
+            (mercado, datetime.datetime(2026, 2, 1, 0, 0), '120.00'),
+        ]:
+            historico = HistoricoPreco.objects.create(
+                produto=produto, canal=canal, grupo_nome=grupo.nome, usuario=self.usuario, motivo='Teste',
+                custo=Decimal('50.00'), frete_aplicado=Decimal('12.34'), preco_venda=Decimal(venda),
+            )
+            HistoricoPreco.objects.filter(pk=historico.pk).update(data_registro=timezone.make_aware(data))
+
+    def _csv(self, resposta):
+        texto = b''.join(resposta.streaming_content).decode('utf-8')
+        self.assertTrue(texto.startswith('\ufeff'))
+        return list(csv.reader(io.StringIO(texto[1:]), delimiter=';'))
+
+    def test_csv_em_streaming_com_filtros_e_formato_pt_br(self):
+        self.client.force_login(self.usuario)
+        resposta = self.client.get('/historico/exportar/', {
+            'canal': 'mercado', 'data_inicio': '2026-01-01', 'data_fim': '2026-01-31',
+        })
+
+        self.assertTrue(resposta.streaming)
+        self.assertIn('attachment; filename=historico_precos_', resposta['Content-Disposition'])
+        cabecalho, *linhas = self._csv(resposta)
+        self.assertEqual(cabecalho, [titulo for _, titulo in COLUNAS_HISTORICO])
+        coluna = {titulo: i for i, titulo in enumerate(cabecalho)}
+        # Mais recente primeiro; o dia final entra inteiro
+        self.assertEqual([l[coluna['Data/Hora']] for l in linhas], ['31/01/2026 23:59:00', '10/01/2026 15:30:00'])
+        self.assertEqual([l[coluna['Preço Venda']] for l in linhas], ['110,00', '100,50'])
+        primeira = linhas[0]
+        self.assertEqual(
+            (primeira[coluna['SKU']], primeira[coluna['Canal']], primeira[coluna['Usuário']]),
+            ('PRT-1', 'Mercado Livre', 'historico'),
+        )
+        self.assertEqual((primeira[coluna['Frete']], primeira[coluna['Peso (kg)']]), ('12,34', ''))
+
+    def test_data_invalida_e_ignorada(self):
+        self.client.force_login(self.usuario)
+        resposta = self.client.get('/historico/exportar/', {'data_inicio': '2026-13-45', 'produto': 'prt'})
+        self.assertEqual(len(self._csv(resposta)), 5)
+
+    def test_xlsx_com_datas_e_numeros(self):
+        self.client.force_login(self.usuario)
+        resposta = self.client.get('/historico/exportar/', {'formato': 'xlsx', 'canal': 'shopee'})
+
+        self.assertEqual(resposta['Content-Type'], CONTENT_TYPE_XLSX)
+        livro = openpyxl.load_workbook(io.BytesIO(b''.join(resposta.streaming_content)))
+        cabecalho, linha = livro['Histórico'].iter_rows(values_only=True)
+        self.assertEqual(list(cabecalho), [titulo for _, titulo in COLUNAS_HISTORICO])
+        valores = dict(zip(cabecalho, linha))
+        self.assertEqual(valores['Data/Hora'], datetime.datetime(2026, 1, 20, 8, 0))
+        self.assertEqual(valores['Preço Venda'], 99.9)
+        self.assertEqual(valores['Canal'], 'Shopee')
+
+    def test_comando_grava_o_mesmo_csv(self):
+        with tempfile.TemporaryDirectory() as diretorio:
+            saida = os.path.join(diretorio, 'historico.csv')
+            mensagens = io.StringIO()
+            call_command('exportar_historico', saida=saida, canal='mercado', stdout=mensagens)
+            with open(saida, encoding='utf-8-sig', newline='') as arquivo:
+                linhas = list(csv.reader(arquivo, delimiter=';'))
+
+        self.assertIn('Exportação concluída: 3 registros', mensagens.getvalue())
+        self.assertEqual(len(linhas), 4)
+        self.assertEqual(linhas[1][0], '01/02/2026 00:00:00')
+
+
+class PainelTest(TestCase):
+    """Dashboard servido do cache e invalidado só pelo que muda cada bloco."""
+
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.grupo = GrupoCanais.objects.create(nome='Grupo Teste')
+            self.canal = CanalVenda.objects.create(nome='Canal Teste', grupo=self.grupo)
+            self.produto = Produto.objects.create(
+                titulo='Produto Teste', sku='TESTE-1', largura=10, altura=10, profundidade=10, peso_fisico=1,
+            )
+            self.preco = PrecoProdutoCanal.objects.create(produto=self.produto, canal=self.canal)
+
+    def _contadores(self):
+        dados = painel.dados_painel()
+        return {chave: dados[chave] for chave in ('total_produtos', 'total_grupos', 'total_canais', 'total_precos')}
+
+    def assertEmCache(self, *chaves):
+        for chave in (painel.CHAVE_CONTADORES, painel.CHAVE_PRODUTOS, painel.CHAVE_HISTORICOS):
+            self.assertEqual(cache.get(chave) is not None, chave in chaves, chave)
+
+    def test_segunda_leitura_nao_consulta_o_banco(self):
+        self.assertEqual(
+            self._contadores(), {'total_produtos': 1, 'total_grupos': 1, 'total_canais': 1, 'total_precos': 1}
+        )
+        with self.assertNumQueries(0):
+            dados = painel.dados_painel()
+        self.assertEqual([p['sku'] for p in dados['ultimos_produtos']], ['TESTE-1'])
+        self.assertEqual(len(dados['ultimos_historicos']), HistoricoPreco.objects.count())
+
+    def test_editar_produto_refaz_so_a_lista_de_produtos(self):
+        painel.dados_painel()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.produto.titulo = 'Renomeado'
+            self.produto.save()
+        self.assertEmCache(painel.CHAVE_CONTADORES)
+        self.assertEqual(painel.dados_painel()['ultimos_produtos'][0]['titulo'], 'Renomeado')
+
+    def test_ativar_desativar_e_criar_refazem_os_contadores(self):
+        painel.dados_painel()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.preco.frete_especifico = Decimal('5.00')
+            self.preco.save()
+        # O recálculo grava um histórico; o preço continua ativo
+        self.assertEmCache(painel.CHAVE_CONTADORES, painel.CHAVE_PRODUTOS)
+
+        self.preco.ativo = False
+        self.preco.save()
+        self.assertEqual(self._contadores()['total_precos'], 0)
+
+        self.canal.ativo = False
+        self.canal.save()
+        self.assertEqual(self._contadores()['total_canais'], 0)
+
+        GrupoCanais.objects.create(nome='Outro Grupo')
+        self.assertEqual(self._contadores()['total_grupos'], 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.produto.delete()
+        dados = painel.dados_painel()
+        self.assertEqual((dados['total_produtos'], dados['ultimos_produtos']), (0, []))
+
+    def test_recalculo_em_lote_refaz_os_ultimos_historicos(self):
+        antes = len(painel.dados_painel()['ultimos_historicos'])
+        recalcular_em_lote(PrecoProdutoCanal.objects.all(), motivo='Teste')
+        self.assertEmCache(painel.CHAVE_CONTADORES, painel.CHAVE_PRODUTOS)
+        ultimos = painel.dados_painel()['ultimos_historicos']
+        self.assertEqual(len(ultimos), antes + 1)
+        ultimo = HistoricoPreco.objects.latest('pk')
+        self.assertEqual((ultimos[0]['data_registro'], ultimos[0]['sku']), (ultimo.data_registro, 'TESTE-1'))
+
+
+class MatrizPrecosTest(TestCase):
+    """Pivot produtos x canais da matriz de preços, filtros, paginação e cache por versão dos preços."""
+
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alfa = alfa = GrupoCanais.objects.create(nome='Alfa')
+            beta = GrupoCanais.objects.create(nome='Beta')
+            self.a2 = CanalVenda.objects.create(nome='A2', grupo=alfa)
+            self.a1 = CanalVenda.objects.create(nome='A1', grupo=alfa)
+            self.b1 = CanalVenda.objects.create(nome='B1', grupo=beta)
+            inativo = CanalVenda.objects.create(nome='A0', grupo=alfa, ativo=False)
+
+            def produto(sku, titulo, ativo=True):
+                return Produto.objects.create(
+                    titulo=titulo, sku=sku, largura=10, altura=10, profundidade=10, peso_fisico=1, ativo=ativo,
+                )
+
+            self.p1 = produto('P1', 'Prateleira')
+            self.p2 = produto('P2', 'Gaveteiro')
+            p3 = produto('P3', 'Inativo', ativo=False)
+            p4 = produto('P4', 'Preço inativo')
+            self.p1_a1 = PrecoProdutoCanal.objects.create(produto=self.p1, canal=self.a1)
+            PrecoProdutoCanal.objects.create(
+                produto=self.p1, canal=self.a2, usar_calculo_automatico=False,
+                preco_venda_manual=Decimal('123.45'), preco_promocao_manual=Decimal('110.00'),
+            )
+            PrecoProdutoCanal.objects.create(produto=self.p2, canal=self.b1)
+            PrecoProdutoCanal.objects.create(produto=self.p2, canal=inativo)
+            PrecoProdutoCanal.objects.create(produto=p3, canal=self.a1)
+            PrecoProdutoCanal.objects.create(produto=p4, canal=self.a1, ativo=False)
+
+    def _calculado(self, produto, canal, campo='preco_venda_calculado'):
+        return getattr(PrecoProdutoCanal.objects.get(produto=produto, canal=canal), campo)
+
+    def test_pivot_de_produtos_ativos_por_canal_ativo(self):
+        matriz = montar_matriz()
+
+        self.assertEqual(
+            [(c['grupo'], c['nome']) for c in matriz['canais']], [('Alfa', 'A1'), ('Alfa', 'A2'), ('Beta', 'B1')]
+        )
+        self.assertEqual(matriz['total_produtos'], 2)
+        p1, p2 = matriz['linhas']
+        self.assertEqual((p1['sku'], p1['titulo']), ('P1', 'Prateleira'))
+        self.assertEqual(p1['valores'], [self._calculado(self.p1, self.a1), Decimal('123.45'), None])
+        self.assertEqual(p2['valores'], [None, None, self._calculado(self.p2, self.b1)])
+
+        promocao = montar_matriz(tipo='promocao')
+        self.assertEqual(promocao['linhas'][0]['valores'][:2], [
+            self._calculado(self.p1, self.a1, 'preco_promocao_calculado'), Decimal('110.00'),
+        ])
+        # Manual sem valor para o mínimo: vale o calculado
+        self.assertEqual(
+            montar_matriz(tipo='minimo')['linhas'][0]['valores'][1],
+            self._calculado(self.p1, self.a2, 'preco_minimo_calculado'),
+        )
+        self.assertEqual(montar_matriz(tipo='outro')['tipo'], 'venda')
+
+    def test_filtro_por_grupo_busca_e_paginacao(self):
+        matriz = montar_matriz(grupo=self.alfa.pk)
+        self.assertEqual([c['nome'] for c in matriz['canais']], ['A1', 'A2'])
+        self.assertEqual([l['sku'] for l in matriz['linhas']], ['P1'])
+
+        self.assertEqual([l['sku'] for l in montar_matriz(search='gavet')['linhas']], ['P2'])
+
+        segunda = montar_matriz(pagina=2, por_pagina=1)
+        self.assertEqual((segunda['pagina'], segunda['num_paginas']), (2, 2))
+        self.assertEqual([l['sku'] for l in segunda['linhas']], ['P2'])
+
+    def test_cache_muda_com_a_versao_dos_precos(self):
+        montar_matriz()
+        with self.assertNumQueries(1):
+            montar_matriz()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.p1_a1.ativo = False
+            self.p1_a1.save()
+        self.assertEqual(montar_matriz()['linhas'][0]['valores'][0], None)
+
+
+class ApiPrecosTest(TestCase):
+    """API de preços em lote: erros de parâmetro (400), filtros e paginação por cursor."""
+
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            alfa = GrupoCanais.objects.create(nome='Alfa')
+            self.beta = GrupoCanais.objects.create(nome='Beta')
+            self.a1 = CanalVenda.objects.create(nome='A1', grupo=alfa)
+            self.b1 = CanalVenda.objects.create(nome='B1', grupo=self.beta)
+            for numero in range(3):
+                produto = Produto.objects.create(
+                    titulo=f'Produto {numero}', sku=f'SKU-{numero}',
+                    largura=10, altura=10, profundidade=10, peso_fisico=1,
+                )
+                for canal in (self.a1, self.b1):
+                    PrecoProdutoCanal.objects.create(
+                        produto=produto, canal=canal, usar_calculo_automatico=False,
+                        preco_venda_manual=Decimal('10.5'), frete_especifico=Decimal('7'),
+                    )
+            PrecoProdutoCanal.objects.filter(produto__sku='SKU-2', canal=self.b1).update(ativo=False)
+
+    def _post(self, dados):
+        return self.client.post('/api/precos/', json.dumps(dados), content_type='application/json')
+
+    def test_parametros_invalidos_dao_400(self):
+        for resposta, erro in [
+            (self.client.post('/api/precos/', '{skus', content_type='application/json'),
+             'Corpo da requisição não é um JSON válido'),
+            (self._post(['SKU-0']), 'O corpo deve ser um objeto JSON'),
+            (self._post({'skus': 'SKU-0'}), '"skus" deve ser uma lista de strings'),
+            (self._post({'skus': ['SKU-0', 1]}), '"skus" deve ser uma lista de strings'),
+            (self._post({'skus': [' ', '']}), 'Informe ao menos um SKU em "skus"'),
+            (self._post({'skus': ['SKU-0'], 'canal': 'x'}), '"canal" deve ser um número inteiro'),
+            (self.client.get('/api/precos/', {'skus': 'SKU-0', 'limite': '1.5'}),
+             '"limite" deve ser um número inteiro'),
+            (self.client.get('/api/precos/'), 'Informe ao menos um SKU em "skus"'),
+            (self._post({'skus': ['SKU-0'], 'cursor': codificar_cursor(['a'])}), '"cursor" inválido'),
+            (self._post({'skus': ['SKU-0'], 'cursor': codificar_cursor([1, 2])}), '"cursor" inválido'),
+            (self._post({'skus': ['SKU-0'], 'cursor': 7}), '"cursor" inválido'),
+            (self.client.get('/api/precos/', {'skus': 'SKU-0', 'cursor': '%%%'}), '"cursor" inválido'),
+        ]:
+            with self.subTest(erro=erro):
+                self.assertEqual(resposta.status_code, 400)
+                self.assertEqual(resposta.json(), {'erro': erro})
+
+        with mock.patch('produtos.api.MAX_SKUS', 2):
+            resposta = self._post({'skus': ['A', 'B', 'C']})
+        self.assertEqual(resposta.json(), {'erro': 'Máximo de 2 SKUs por requisição'})
+        self.assertEqual(self.client.put('/api/precos/').status_code, 405)
+
+    def test_itens_com_precos_efetivos_em_string(self):
+        resposta = self.client.get('/api/precos/', {'skus': 'SKU-0,SKU-0,NAO-EXISTE', 'canal': self.a1.pk})
+
+        self.assertEqual(resposta.status_code, 200)
+        dados = resposta.json()
+        self.assertIsNone(dados['proximo'])
+        item, = dados['itens']
+        self.assertEqual(
+            {campo: item[campo] for campo in ('sku', 'canal_id', 'canal', 'grupo', 'venda', 'frete')},
+            {
+                'sku': 'SKU-0', 'canal_id': self.a1.pk, 'canal': 'A1', 'grupo': 'Alfa',
+                'venda': '10.50', 'frete': '7.00',
+            },
+        )
+        self.assertIsNotNone(item['calculado_em'])
+
+    def test_cursor_percorre_tudo_sem_repetir(self):
+        skus = ['SKU-0', 'SKU-1', 'SKU-2']
+        vistos, cursor, paginas = [], None, 0
+        while True:
+            dados = self._post({'skus': skus, 'limite': 2, 'cursor': cursor}).json()
+            paginas += 1
+            vistos += [(item['sku'], item['canal']) for item in dados['itens']]
+            cursor = dados['proximo']
+            if cursor is None:
+                break
+
+        self.assertEqual(paginas, 3)
+        # Preço inativo fica de fora
+        self.assertEqual(sorted(vistos), [
+            ('SKU-0', 'A1'), ('SKU-0', 'B1'), ('SKU-1', 'A1'), ('SKU-1', 'B1'), ('SKU-2', 'A1'),
+        ])
+
+        dados = self._post({'skus': skus, 'grupo': self.beta.pk}).json()
+        self.assertEqual([item['sku'] for item in dados['itens']], ['SKU-0', 'SKU-1'])
+
+
+class CalculoPendenteTest(TestCase):
+    """Preços ainda não calculados: nada é resolvido na leitura e --pendentes preenche só eles."""
+
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            grupo = GrupoCanais.objects.create(nome='Grupo Pendente')
+            self.canal = CanalVenda.objects.create(nome='Canal Pendente', grupo=grupo)
+            self.precos = []
+            for numero in range(2):
+                produto = Produto.objects.create(
+                    titulo=f'Produto {numero}', sku=f'PEND-{numero}',
+                    largura=10, altura=10, profundidade=10, peso_fisico=1,
+                )
+                self.precos.append(PrecoProdutoCanal.objects.create(produto=produto, canal=self.canal))
+        self.pendente, self.calculado = self.precos
+        # Como um preço inserido em massa ou criado antes dos campos calculados existirem
+        PrecoProdutoCanal.objects.filter(pk=self.pendente.pk).update(
+            **{campo: None for campo in PrecoProdutoCanal.CAMPOS_CALCULADOS}
+        )
+        self.pendente.refresh_from_db()
+        self.calculado.refresh_from_db()
+
+    def test_valores_exibidos_sao_none_sem_calcular(self):
+        self.assertTrue(self.pendente.calculo_pendente)
+        self.assertFalse(self.calculado.calculo_pendente)
+
+        with mock.patch.object(Produto, '_calcular_preco_iterativo') as iterativo, self.assertNumQueries(0):
+            valores = [
+                self.pendente.preco_venda, self.pendente.preco_promocao, self.pendente.preco_minimo,
+                self.pendente.frete_aplicado, self.pendente.custo, self.pendente.taxa_extra,
+                self.pendente.desconto_maximo_percentual,
+            ]
+        self.assertEqual(valores, [None] * 7)
+        iterativo.assert_not_called()
+
+        # Preço manual e frete específico continuam valendo enquanto o cálculo está pendente
+        self.pendente.usar_calculo_automatico = False
+        self.pendente.preco_venda_manual = Decimal('50.00')
+        self.pendente.frete_especifico = Decimal('8.00')
+        self.assertEqual(self.pendente.preco_venda, Decimal('50.00'))
+        self.assertEqual(self.pendente.frete_aplicado, Decimal('8.00'))
+        self.assertIsNone(self.pendente.desconto_maximo_percentual)
+
+    def test_paginas_mostram_calculo_pendente(self):
+        for url in ('/precos/', f'/produtos/{self.pendente.produto_id}/'):
+            with self.subTest(url=url):
+                self.assertContains(self.client.get(url), 'Cálculo pendente')
+        self.assertNotContains(self.client.get(f'/produtos/{self.calculado.produto_id}/'), 'Cálculo pendente')
+
+    def test_comando_pendentes_preenche_so_os_pendentes(self):
+        calculado_em = self.calculado.calculado_em
+        saida = io.StringIO()
+
+        call_command('recalcular_precos', pendentes=True, stdout=saida)
+
+        self.assertIn('Total de preços a recalcular: 1', saida.getvalue())
+        self.pendente.refresh_from_db()
+        self.calculado.refresh_from_db()
+        self.assertFalse(self.pendente.calculo_pendente)
+        self.assertEqual(self.pendente.preco_venda, self.calculado.preco_venda)
+        self.assertEqual(self.calculado.calculado_em, calculado_em)
+        # Sem valores anteriores não há o que guardar no histórico
+        self.assertFalse(HistoricoPreco.objects.filter(produto=self.pendente.produto, motivo__contains='lote').exists())
+
+        saida = io.StringIO()
+        call_command('recalcular_precos', pendentes=True, stdout=saida)
+        self.assertIn('Nenhum preço encontrado para recalcular', saida.getvalue())
+
+
+class AdminListagensTest(TestCase):
+    """Listagens do admin: colunas a partir de anotações e campos gravados, consultas fixas."""
+
+    URLS = {
+        'produto': '/admin/produtos/produto/',
+        'titulo': '/admin/produtos/tituloproduto/',
+        'preco': '/admin/produtos/precoprodutocanal/',
+        'historico': '/admin/produtos/historicopreco/',
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(User.objects.create_superuser('admin', password='x'))
+        self.componente = Componente.objects.create(nome='MDF', preco=Decimal('10.0000'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.grupo = GrupoCanais.objects.create(nome='Grupo Admin')
+            self.canal = CanalVenda.objects.create(nome='Canal Admin', grupo=self.grupo)
+        self.produtos = self._semear(2)
+
+    def _semear(self, quantidade):
+        produtos = []
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(quantidade):
+                n = Produto.objects.count() + 1
+                produto = Produto.objects.create(
+                    titulo=f'Produto {n}', sku=f'ADM-{n}', largura=10, altura=10, profundidade=10, peso_fisico=1,
+                )
+                TituloProduto.objects.create(produto=produto, titulo=f'Anúncio {n} azul')
+                TituloProduto.objects.create(produto=produto, titulo=f'Anúncio {n} verde')
+                TituloProduto.objects.create(produto=produto, titulo=f'Anúncio {n} antigo', ativo=False)
+                ItemFichaTecnica.objects.create(
+                    produto=produto, componente=self.componente, codigo=f'C{n}', descricao='MDF',
+                    quantidade=Decimal(n), custo_unitario=Decimal('10.000'),
+                )
+                preco = PrecoProdutoCanal.objects.create(produto=produto, canal=self.canal)
+                preco.save(motivo='Histórico')
+                produtos.append(produto)
+        return produtos
+
+    def _linhas(self, url, **params):
+        resposta = self.client.get(url, params)
+        self.assertEqual(resposta.status_code, 200)
+        return resposta, list(resposta.context['cl'].result_list)
+
+    def test_titulos_ativos_sem_duplicar_na_busca(self):
+        _, linhas = self._linhas(self.URLS['produto'])
+        self.assertEqual({p.sku: p.qtd_titulos_ativos for p in linhas}, {'ADM-1': 2, 'ADM-2': 2})
+
+        # A busca casa os dois títulos de ADM-1: continua uma linha, com a mesma contagem
+        _, linhas = self._linhas(self.URLS['produto'], q='Anúncio 1')
+        self.assertEqual([(p.sku, p.qtd_titulos_ativos) for p in linhas], [('ADM-1', 2)])
+
+    def test_custo_gravado_e_colunas_ordenaveis(self):
+        resposta, linhas = self._linhas(self.URLS['produto'], o='-3')
+        self.assertEqual([p.sku for p in linhas], ['ADM-2', 'ADM-1'])
+        self.assertContains(resposta, 'R$ 20.00')
+        self.assertEqual(Produto.objects.get(sku='ADM-2').custo_ficha, Decimal('20.00'))
+
+        _, linhas = self._linhas(self.URLS['produto'], o='4.1')
+        self.assertEqual([p.sku for p in linhas], ['ADM-1', 'ADM-2'])
+
+    def test_preco_pendente_e_filtro_por_canal(self):
+        PrecoProdutoCanal.objects.filter(produto=self.produtos[0]).update(calculado_em=None, preco_venda_calculado=None)
+        outro = CanalVenda.objects.create(nome='Outro Canal', grupo=self.grupo)
+
+        resposta, linhas = self._linhas(self.URLS['preco'])
+        self.assertEqual(len(linhas), 2)
+        self.assertContains(resposta, 'Cálculo pendente', count=1)
+        # O filtro lista os canais com o grupo, carregado junto
+        self.assertContains(resposta, str(outro))
+
+        _, linhas = self._linhas(self.URLS['preco'], canal__id__exact=outro.pk)
+        self.assertEqual(linhas, [])
+
+    def test_consultas_nao_crescem_com_as_linhas(self):
+        def medir():
+            consultas = {}
+            for nome, url in self.URLS.items():
+                with CaptureQueriesContext(connection) as capturadas:
+                    self.assertEqual(self.client.get(url).status_code, 200)
+                consultas[nome] = len(capturadas)
+            return consultas
+
+        antes = medir()
+        self._semear(5)
+        with self.captureOnCommitCallbacks(execute=True):
+            CanalVenda.objects.create(nome='Canal Extra', grupo=GrupoCanais.objects.create(nome='Grupo Extra'))
+        self.assertEqual(medir(), antes)
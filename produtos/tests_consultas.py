@@ -0,0 +1,196 @@
+"""
+Orçamento de consultas por tela.
+
+Cada tela é medida num catálogo semeado e de novo depois de o catálogo
+crescer (mais produtos, títulos, itens de ficha, canais e histórico): o
+número de consultas tem que ser o mesmo nas duas medições, ou seja, nada de
+uma consulta por linha, e caber no orçamento. Uma consulta nova numa tela só
+entra no orçamento se for fixa. Em desenvolvimento o número aparece no
+cabeçalho X-Consultas (app/middleware.py).
+"""
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+
+from app.testes import TestCase
+from canais_vendas.models import CanalVenda
+from controle_producao.models import Componente
+from grupo_vendas.models import GrupoCanais
+from tabela_frete.models import RegraFreteMatriz, RegraTaxa, TabelaFrete, TabelaTaxa
+
+from .models import HistoricoPreco, ItemFichaTecnica, PrecoProdutoCanal, Produto, TituloProduto
+from .recalculo import recalcular_em_lote
+
+
+# Consultas por tela, incluindo sessão e usuário logado nas telas que os usam
+ORCAMENTOS = {
+    'home': 8,
+    'produto_list': 4,
+    'produto_detail': 7,
+    'produto_update': 3,
+    'ficha_tecnica_edit': 9,
+    'titulos_edit': 5,
+    'preco_list': 7,
+    'tabela_precos': 6,
+    'preco_matriz': 9,
+    'preco_matriz_json': 8,
+    'feed_list': 3,
+    'preco_edit': 6,
+    'produto_precos': 5,
+    'api_precos': 1,
+    'historico_list': 4,
+    'historico_detail': 5,
+    'tarefa_importacao_list': 3,
+    'execucao_recalculo_list': 4,
+    'grupo_list': 4,
+    'grupo_detail': 4,
+    'canal_list': 4,
+    'canal_detail': 6,
+    'tabela_frete_list': 5,
+    'tabela_frete_detail': 9,
+    'regras_matriz_bulk_edit': 5,
+    'componente_list': 4,
+    'admin_produto': 5,
+    'admin_preco': 6,
+    'admin_historico': 5,
+    'admin_canal': 6,
+    'admin_grupo': 5,
+    'admin_tabela_frete': 5,
+}
+
+
+class OrcamentoConsultasTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_superuser('orcamento', password='x')
+        cls.grupo = GrupoCanais.objects.create(nome='Marketplaces')
+        cls.tabela = TabelaFrete.objects.create(nome='Tabela Teste', tipo='matriz')
+        RegraFreteMatriz.objects.create(tabela=cls.tabela, peso_fim=Decimal('5'), valor_frete=Decimal('15.00'))
+        RegraFreteMatriz.objects.create(tabela=cls.tabela, peso_inicio=Decimal('5'), valor_frete=Decimal('30.00'))
+        cls.tabela_taxa = TabelaTaxa.objects.create(nome='Taxa Teste')
+        RegraTaxa.objects.create(tabela=cls.tabela_taxa, preco_fim=Decimal('79'), valor_taxa=Decimal('6.00'))
+        cls.componente = Componente.objects.create(nome='MDF 15mm', preco=Decimal('12.5000'))
+        cls.sequencia = 0
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.usuario)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.canais = [self._canal()]
+            self.produtos = self._semear(3)
+
+    def _canal(self):
+        n = CanalVenda.objects.count() + 1
+        return CanalVenda.objects.create(
+            nome=f'Canal {n}', grupo=self.grupo, tipo_frete='tabela',
+            tabela_frete=self.tabela, tabela_taxa=self.tabela_taxa,
+        )
+
+    def _semear(self, quantidade):
+        """Produtos com títulos, ficha e preço calculado (com histórico) em todos os canais."""
+        produtos = []
+        for _ in range(quantidade):
+            type(self).sequencia += 1
+            n = self.sequencia
+            produto = Produto.objects.create(
+                titulo=f'Produto {n}', sku=f'SKU-{n:03d}', largura=20, altura=10, profundidade=30,
+                peso_fisico=Decimal('1.5') * n,
+            )
+            for i in range(2):
+                TituloProduto.objects.create(produto=produto, titulo=f'Anúncio {n}.{i}')
+                ItemFichaTecnica.objects.create(
+                    produto=produto, componente=self.componente, codigo=f'C{n}.{i}', descricao='MDF',
+                    quantidade=Decimal('2'), custo_unitario=Decimal('12.500'),
+                )
+            produtos.append(produto)
+
+        for produto in Produto.objects.all():
+            for canal in self.canais:
+                PrecoProdutoCanal.objects.get_or_create(produto=produto, canal=canal)
+        precos = PrecoProdutoCanal.objects.all()
+        recalcular_em_lote(precos, 'Semeadura')
+        recalcular_em_lote(precos, 'Semeadura (histórico)')
+        return produtos
+
+    def _crescer(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.canais.append(self._canal())
+            self._semear(6)
+
+    def _telas(self):
+        produto = self.produtos[0]
+        preco = PrecoProdutoCanal.objects.filter(produto=produto).first()
+        historico = HistoricoPreco.objects.filter(produto=produto).first()
+        skus = ','.join(Produto.objects.values_list('sku', flat=True))
+        return {
+            'home': '/',
+            'produto_list': '/produtos/',
+            'produto_detail': f'/produtos/{produto.pk}/',
+            'produto_update': f'/produtos/{produto.pk}/editar/',
+            'ficha_tecnica_edit': f'/produtos/{produto.pk}/ficha/',
+            'titulos_edit': f'/produtos/{produto.pk}/titulos/',
+            'preco_list': '/precos/',
+            'tabela_precos': '/precos/tabela/',
+            'preco_matriz': '/precos/matriz/',
+            'preco_matriz_json': '/precos/matriz.json',
+            'feed_list': '/precos/feeds/',
+            'preco_edit': f'/precos/{preco.pk}/editar/',
+            'produto_precos': f'/produtos/{produto.pk}/precos/',
+            'api_precos': f'/api/precos/?skus={skus}',
+            'historico_list': '/historico/',
+            'historico_detail': f'/historico/{historico.pk}/',
+            'tarefa_importacao_list': '/importacoes/',
+            'execucao_recalculo_list': '/recalculos/?ordem=lentas',
+            'grupo_list': '/grupos/',
+            'grupo_detail': f'/grupos/{self.grupo.pk}/',
+            'canal_list': '/canais/',
+            'canal_detail': f'/canais/{self.canais[0].pk}/',
+            'tabela_frete_list': '/tabelas-frete/',
+            'tabela_frete_detail': f'/tabelas-frete/{self.tabela.pk}/',
+            'regras_matriz_bulk_edit': f'/tabelas-frete/{self.tabela.pk}/regras-matriz/bulk/',
+            'componente_list': '/pcp/',
+            'admin_produto': '/admin/produtos/produto/',
+            'admin_preco': '/admin/produtos/precoprodutocanal/',
+            'admin_historico': '/admin/produtos/historicopreco/',
+            'admin_canal': '/admin/canais_vendas/canalvenda/',
+            'admin_grupo': '/admin/grupo_vendas/grupocanais/',
+            'admin_tabela_frete': '/admin/tabela_frete/tabelafrete/',
+        }
+
+    def _medir(self):
+        consultas = {}
+        for nome, url in self._telas().items():
+            # Sem cache: mede o caminho completo da tela
+            cache.clear()
+            with CaptureQueriesContext(connection) as capturadas:
+                resposta = self.client.get(url)
+            self.assertEqual(resposta.status_code, 200, f'{nome}: {url}')
+            consultas[nome] = capturadas
+        return consultas
+
+    @override_settings(MEDIR_CONSULTAS=True)
+    def test_cabecalho_com_as_consultas_da_requisicao(self):
+        self.client = self.client_class()
+        self.client.force_login(self.usuario)
+        with CaptureQueriesContext(connection) as capturadas:
+            resposta = self.client.get('/produtos/')
+        self.assertTrue(resposta['X-Consultas'].startswith(f'{len(capturadas)} consultas; 0 repetidas;'))
+
+    def test_todas_as_telas_tem_orcamento(self):
+        self.assertEqual(set(self._telas()), set(ORCAMENTOS))
+
+    def test_consultas_por_tela_no_orcamento_e_sem_crescer_com_o_catalogo(self):
+        antes = self._medir()
+        self._crescer()
+        depois = self._medir()
+
+        for nome, orcamento in ORCAMENTOS.items():
+            with self.subTest(tela=nome):
+                sqls = '\n'.join(c['sql'] for c in depois[nome].captured_queries)
+                self.assertEqual(len(depois[nome]), len(antes[nome]), f'cresce com o catálogo:\n{sqls}')
+                self.assertLessEqual(len(depois[nome]), orcamento, sqls)
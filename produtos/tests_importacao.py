@@ -0,0 +1,303 @@
+"""
+Importação do catálogo por planilha (produtos.importacao) e fila de
+importações em segundo plano (produtos.tarefas).
+"""
+import os
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from django.utils import timezone
+
+import openpyxl
+
+from app.testes import TestCase
+from canais_vendas.models import CanalVenda
+from grupo_vendas.models import GrupoCanais
+
+from . import tarefas
+from .importacao import importar_catalogo
+from .models import ExecucaoRecalculo, ItemFichaTecnica, PrecoProdutoCanal, Produto, TarefaImportacao, TituloProduto
+
+
+def _csv(*linhas):
+    return SimpleUploadedFile('produtos.csv', '\n'.join(linhas).encode('utf-8'))
+
+
+CSV_PRODUTOS = (
+    'sku;titulo;largura;altura;profundidade;peso_fisico',
+    'A-1;Produto A;10;10;10;1',
+    'B-1;Produto B;20;20;20;2',
+    'C-1;Produto C;abc;10;10;1',
+)
+
+
+class TarefasImportacaoTest(TestCase):
+    """Fila de importações: estados, reserva por um worker só, andamento, expiração e limpeza do upload."""
+
+    def setUp(self):
+        super().setUp()
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=self.media.name))
+
+    def _tarefa(self, arquivo=None):
+        return tarefas.criar_tarefa(
+            TarefaImportacao.TIPO_CATALOGO, arquivo or _csv(*CSV_PRODUTOS), entidade='produtos'
+        )
+
+    def assertArquivoRemovido(self, tarefa, caminho):
+        self.assertEqual(TarefaImportacao.objects.get(pk=tarefa.pk).arquivo.name, '')
+        self.assertFalse(os.path.exists(caminho))
+
+    def test_pendente_ate_concluida(self):
+        tarefa = self._tarefa()
+        caminho = tarefa.arquivo.path
+        self.assertEqual(tarefa.status, TarefaImportacao.PENDENTE)
+        self.assertTrue(os.path.exists(caminho))
+
+        executadas = tarefas.processar_pendentes()
+
+        self.assertEqual([t.pk for t in executadas], [tarefa.pk])
+        tarefa.refresh_from_db()
+        self.assertEqual(tarefa.status, TarefaImportacao.CONCLUIDA)
+        self.assertEqual((tarefa.linhas_lidas, tarefa.linhas_validas, tarefa.linhas_gravadas), (3, 2, 2))
+        self.assertEqual(tarefa.total_erros, 1)
+        self.assertEqual(tarefa.erros[0][:2], ['CSV', 4])
+        self.assertIsNotNone(tarefa.iniciada_em)
+        self.assertIsNotNone(tarefa.concluida_em)
+        self.assertEqual(set(Produto.objects.values_list('sku', flat=True)), {'A-1', 'B-1'})
+        self.assertEqual(tarefa.nome_arquivo, 'produtos.csv')
+        self.assertArquivoRemovido(tarefa, caminho)
+        self.assertEqual(tarefas.processar_pendentes(), [])
+
+    def test_falha_na_gravacao_marca_falhou_sem_gravar(self):
+        tarefa = self._tarefa()
+        caminho = tarefa.arquivo.path
+        validar, _ = tarefas.ETAPAS[TarefaImportacao.TIPO_CATALOGO]
+
+        def gravar(tarefa, arquivo):
+            importar_catalogo(arquivo, entidade_csv='produtos')
+            raise RuntimeError('erro depois de gravar')
+
+        with mock.patch.dict(tarefas.ETAPAS, {TarefaImportacao.TIPO_CATALOGO: (validar, gravar)}), \
+                self.assertLogs('produtos.tarefas', 'ERROR'):
+            tarefas.processar_pendentes()
+
+        tarefa.refresh_from_db()
+        self.assertEqual(tarefa.status, TarefaImportacao.FALHOU)
+        self.assertEqual(tarefa.mensagem, 'erro depois de gravar')
+        self.assertFalse(Produto.objects.exists())
+        self.assertEqual(
+            ExecucaoRecalculo.objects.get(origem='importacao').erro, 'RuntimeError: erro depois de gravar'
+        )
+        self.assertArquivoRemovido(tarefa, caminho)
+
+    def test_dois_workers_nao_reservam_a_mesma_tarefa(self):
+        tarefa = self._tarefa()
+        worker_1 = TarefaImportacao.objects.get(pk=tarefa.pk)
+        worker_2 = TarefaImportacao.objects.get(pk=tarefa.pk)
+
+        self.assertTrue(tarefas.reservar(worker_1))
+        self.assertFalse(tarefas.reservar(worker_2))
+        self.assertEqual(worker_1.status, TarefaImportacao.VALIDANDO)
+        self.assertEqual(worker_2.status, TarefaImportacao.PENDENTE)
+        # A fila não oferece mais a tarefa reservada
+        self.assertEqual(tarefas.processar_pendentes(), [])
+
+    def test_andamento_da_validacao_e_salvo_a_cada_lote(self):
+        tarefa = self._tarefa()
+        salvos = []
+        _, gravar = tarefas.ETAPAS[TarefaImportacao.TIPO_CATALOGO]
+
+        def validar(tarefa, arquivo, progresso):
+            def registrar(relatorio):
+                progresso(relatorio)
+                salvos.append(TarefaImportacao.objects.values_list(
+                    'status', 'linhas_lidas', 'linhas_validas', 'total_erros'
+                ).get(pk=tarefa.pk))
+            return importar_catalogo(arquivo, entidade_csv='produtos', tamanho_lote=1, validar=True,
+                                     progresso=registrar)
+
+        with mock.patch.dict(tarefas.ETAPAS, {TarefaImportacao.TIPO_CATALOGO: (validar, gravar)}):
+            tarefas.processar_pendentes()
+
+        self.assertEqual(salvos, [
+            (TarefaImportacao.VALIDANDO, 1, 1, 0),
+            (TarefaImportacao.VALIDANDO, 2, 2, 0),
+            (TarefaImportacao.VALIDANDO, 3, 2, 1),
+        ])
+        self.assertEqual(TarefaImportacao.objects.get(pk=tarefa.pk).status, TarefaImportacao.CONCLUIDA)
+
+    def test_tarefas_travadas_expiram_antes_da_fila(self):
+        travada = self._tarefa()
+        recente = self._tarefa()
+        caminho = travada.arquivo.path
+        for tarefa in (travada, recente):
+            tarefas.reservar(tarefa)
+        TarefaImportacao.objects.filter(pk=travada.pk).update(
+            status=TarefaImportacao.GRAVANDO, iniciada_em=timezone.now() - timedelta(hours=2),
+        )
+        pendente = self._tarefa()
+
+        with self.assertLogs('produtos.tarefas', 'WARNING') as logs:
+            executadas = tarefas.processar_pendentes()
+
+        self.assertEqual(logs.output, [f'WARNING:produtos.tarefas:Importação {travada.pk} expirou'])
+        self.assertEqual([t.pk for t in executadas], [pendente.pk])
+        travada.refresh_from_db()
+        self.assertEqual(travada.status, TarefaImportacao.FALHOU)
+        self.assertIn('60 min', travada.mensagem)
+        self.assertIsNotNone(travada.concluida_em)
+        self.assertArquivoRemovido(travada, caminho)
+        self.assertEqual(TarefaImportacao.objects.get(pk=recente.pk).status, TarefaImportacao.VALIDANDO)
+
+    def test_tarefa_expirada_durante_a_validacao_nao_grava(self):
+        tarefa = self._tarefa()
+        validar, gravar = tarefas.ETAPAS[TarefaImportacao.TIPO_CATALOGO]
+
+        def validar_devagar(tarefa, arquivo, progresso):
+            relatorio = validar(tarefa, arquivo, progresso)
+            # Outro worker dá a tarefa como interrompida enquanto esta ainda valida
+            tarefas.expirar_travadas(timedelta(0))
+            return relatorio
+
+        with mock.patch.dict(tarefas.ETAPAS, {TarefaImportacao.TIPO_CATALOGO: (validar_devagar, gravar)}), \
+                self.assertLogs('produtos.tarefas', 'WARNING'):
+            executada, = tarefas.processar_pendentes()
+
+        self.assertEqual(executada.status, TarefaImportacao.FALHOU)
+        self.assertEqual(TarefaImportacao.objects.get(pk=tarefa.pk).status, TarefaImportacao.FALHOU)
+        self.assertFalse(Produto.objects.exists())
+
+
+def _xlsx(**abas):
+    """XLSX com uma aba por argumento (nome da aba com _ no lugar de espaço): [cabeçalho, linhas...]."""
+    livro = openpyxl.Workbook()
+    livro.remove(livro.active)
+    for nome, linhas in abas.items():
+        aba = livro.create_sheet(nome.replace('_', ' '))
+        for linha in linhas:
+            aba.append(linha)
+    conteudo = BytesIO()
+    livro.save(conteudo)
+    return SimpleUploadedFile('catalogo.xlsx', conteudo.getvalue())
+
+
+CABECALHO_FICHA = ['SKU', 'Tipo', 'Código', 'Descrição', 'Unidade', 'Quantidade', 'Custo Unitário']
+
+
+class ImportacaoCatalogoTest(TestCase):
+    """Upsert de produtos, substituição da ficha, upsert de títulos e erros por linha."""
+
+    def setUp(self):
+        super().setUp()
+
+    def _existente(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            grupo = GrupoCanais.objects.create(nome='Grupo Teste')
+            canal = CanalVenda.objects.create(nome='Canal Teste', grupo=grupo)
+            produto = Produto.objects.create(
+                titulo='Produto A', sku='A-1', ean='789', largura=10, altura=10, profundidade=10, peso_fisico=1,
+            )
+            ItemFichaTecnica.objects.create(
+                produto=produto, codigo='VELHO', descricao='Item velho', quantidade=1, custo_unitario=Decimal('50'),
+            )
+            PrecoProdutoCanal.objects.create(produto=produto, canal=canal)
+        return produto
+
+    def test_cria_produtos_por_csv(self):
+        relatorio = importar_catalogo(_csv(*CSV_PRODUTOS), entidade_csv='produtos')
+
+        self.assertEqual((relatorio.linhas, relatorio.validas, relatorio.produtos_criados), (3, 2, 2))
+        self.assertEqual(relatorio.erros, [('CSV', 4, 'largura: "abc" não é um número')])
+        produto = Produto.objects.get(sku='B-1')
+        self.assertEqual((produto.titulo, produto.peso_fisico), ('Produto B', Decimal('2.000')))
+        self.assertEqual(produto.indice_busca.documento, ' b 1 b1 produto b ')
+
+    def test_cria_produtos_ficha_e_titulos_por_xlsx(self):
+        relatorio = importar_catalogo(_xlsx(
+            Produtos=[
+                ['SKU', 'Título', 'Largura', 'Altura', 'Profundidade', 'Peso Físico'],
+                ['A-1', 'Produto A', 10, 10, 10, 1],
+            ],
+            Ficha_Técnica=[CABECALHO_FICHA, ['A-1', 'MP', 'CH', 'Chapa', 'UN', 2, 3.5]],
+            Títulos=[['SKU', 'Título'], ['A-1', 'Variação A']],
+        ))
+
+        self.assertEqual(relatorio.total_erros, 0)
+        self.assertEqual(relatorio.gravadas, 3)
+        produto = Produto.objects.get(sku='A-1')
+        self.assertEqual(produto.custo_ficha, Decimal('7.00'))
+        self.assertEqual(list(produto.titulos.values_list('titulo', flat=True)), ['Variação A'])
+
+    def test_celulas_vazias_mantem_os_valores_e_dimensoes_recalculam_precos(self):
+        produto = self._existente()
+        relatorio = importar_catalogo(_csv(
+            'sku;titulo;ean;largura;altura;profundidade;peso_fisico',
+            'A-1;;;;;;3',
+        ), entidade_csv='produtos')
+
+        self.assertEqual(relatorio.produtos_atualizados, 1)
+        self.assertEqual(relatorio.precos_recalculados, 1)
+        produto.refresh_from_db()
+        self.assertEqual((produto.titulo, produto.ean, produto.largura), ('Produto A', '789', Decimal('10.00')))
+        self.assertEqual(produto.peso_fisico, Decimal('3.000'))
+
+    def test_ficha_de_um_sku_em_varios_lotes_e_substituida_uma_vez(self):
+        produto = self._existente()
+        relatorio = importar_catalogo(_xlsx(Ficha=[
+            CABECALHO_FICHA,
+            ['A-1', 'MP', 'I1', 'Item 1', 'UN', 1, 1],
+            ['A-1', 'MP', 'I2', 'Item 2', 'UN', 1, 2],
+            ['A-1', 'EM', 'I3', 'Item 3', 'UN', 1, 3],
+        ]), tamanho_lote=2)
+
+        self.assertEqual(relatorio.itens_ficha, 3)
+        self.assertEqual(
+            list(produto.itens_ficha.order_by('codigo').values_list('codigo', flat=True)), ['I1', 'I2', 'I3']
+        )
+        self.assertEqual(Produto.objects.get(pk=produto.pk).custo_ficha, Decimal('6.00'))
+        self.assertEqual(PrecoProdutoCanal.objects.get(produto=produto).custo_calculado, Decimal('6.00'))
+
+    def test_titulos_sao_atualizados_ou_criados_e_os_demais_ficam(self):
+        produto = self._existente()
+        TituloProduto.objects.create(produto=produto, titulo='Mantido')
+        TituloProduto.objects.create(produto=produto, titulo='Desativar')
+
+        relatorio = importar_catalogo(_csv(
+            'sku;titulo;ativo', 'A-1;Desativar;0', 'A-1;Novo;', 'A-1;Mantido;1',
+        ), entidade_csv='titulos')
+
+        self.assertEqual((relatorio.titulos_criados, relatorio.titulos_atualizados), (1, 1))
+        self.assertEqual(
+            dict(produto.titulos.values_list('titulo', 'ativo')), {'Mantido': True, 'Desativar': False, 'Novo': True}
+        )
+
+    def test_sku_nao_cadastrado_e_erro_da_linha(self):
+        self._existente()
+        relatorio = importar_catalogo(_xlsx(Títulos=[
+            ['SKU', 'Título'], ['A-1', 'Variação A'], ['X-9', 'Sem produto'],
+        ]))
+
+        self.assertEqual((relatorio.linhas, relatorio.validas, relatorio.titulos_criados), (2, 1, 1))
+        self.assertEqual(relatorio.erros, [('Títulos', 3, 'SKU "X-9" não cadastrado')])
+
+    def test_validar_nao_grava_nada(self):
+        produto = self._existente()
+        progresso = []
+        relatorio = importar_catalogo(_xlsx(
+            Produtos=[['SKU', 'Título'], ['A-1', 'Renomeado'], ['N-1', 'Novo']],
+            Ficha=[CABECALHO_FICHA, ['A-1', 'MP', 'I1', 'Item 1', 'UN', 1, 1]],
+            Títulos=[['SKU', 'Título'], ['A-1', 'Variação']],
+        ), validar=True, progresso=lambda r: progresso.append(r.linhas))
+
+        self.assertEqual((relatorio.linhas, relatorio.validas, relatorio.gravadas), (4, 4, 0))
+        self.assertEqual(progresso, [2, 3, 4])
+        self.assertEqual(list(Produto.objects.values_list('sku', 'titulo')), [('A-1', 'Produto A')])
+        self.assertEqual(list(produto.itens_ficha.values_list('codigo', flat=True)), ['VELHO'])
+        self.assertFalse(produto.titulos.exists())
@@ -8,6 +8,10 @@ urlpatterns = [
     # Produtos
     path('produtos/', views.ProdutoListView.as_view(), name='produto_list'),
     path('produtos/novo/', views.ProdutoCreateView.as_view(), name='produto_create'),
+    path('produtos/importar/', views.catalogo_import, name='catalogo_import'),
+    path('produtos/importar/modelo/', views.catalogo_modelo, name='catalogo_modelo'),
+    path('importacoes/', views.TarefaImportacaoListView.as_view(), name='tarefa_importacao_list'),
+    path('importacoes/<int:pk>/', views.TarefaImportacaoDetailView.as_view(), name='tarefa_importacao_detail'),
     path('produtos/<int:pk>/', views.ProdutoDetailView.as_view(), name='produto_detail'),
     path('produtos/<int:pk>/editar/', views.ProdutoUpdateView.as_view(), name='produto_update'),
     path('produtos/<int:pk>/excluir/', views.ProdutoDeleteView.as_view(), name='produto_delete'),
@@ -21,10 +25,19 @@ urlpatterns = [
     # Preços por Canal
     path('precos/', views.PrecoListView.as_view(), name='preco_list'),
     path('precos/tabela/', views.TabelaPrecosView.as_view(), name='tabela_precos'),
+    path('precos/matriz/', views.preco_matriz, name='preco_matriz'),
+    path('precos/matriz.json', views.preco_matriz_json, name='preco_matriz_json'),
+    path('precos/feeds/', views.feed_list, name='feed_list'),
     path('precos/<int:pk>/editar/', views.preco_edit, name='preco_edit'),
     path('produtos/<int:produto_pk>/precos/', views.produto_precos, name='produto_precos'),
 
+    # API
+    path('api/precos/', views.api_precos, name='api_precos'),
+    path('metrics', views.metricas_prometheus, name='metricas'),
+
     # Histórico
+    path('recalculos/', views.ExecucaoRecalculoListView.as_view(), name='execucao_recalculo_list'),
     path('historico/', views.HistoricoListView.as_view(), name='historico_list'),
+    path('historico/exportar/', views.historico_export, name='historico_export'),
     path('historico/<int:pk>/', views.HistoricoDetailView.as_view(), name='historico_detail'),
 ]
@@ -1,31 +1,43 @@
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
+from django.http import HttpResponse, JsonResponse
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib import messages
 from django.urls import reverse_lazy, reverse
-from django.db.models import Count
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+from django.db.models import Count, F
 from django.forms import modelformset_factory
 from django.db import transaction
 
-from django.db.models import Q
-
-from .models import Produto, TituloProduto, ItemFichaTecnica, PrecoProdutoCanal, HistoricoPreco
+import openpyxl
+
+from .models import Produto, TituloProduto, ItemFichaTecnica, PrecoProdutoCanal, HistoricoPreco, LinhaTabelaPreco, FeedCanal, TarefaImportacao, ExecucaoRecalculo
+from .exportacao import filtrar_historicos, resposta_csv, resposta_xlsx
+from .execucoes import registrar_execucao
+from .busca import filtrar_busca, tokenizar
+from .paginacao import paginar_keyset
+from .painel import dados_painel, invalidar_contadores
+from . import metricas
+from .matriz import montar_matriz, TIPOS_PRECO
+from .feeds import marcar_feeds, url_feed
+from .api import ErroConsulta, ler_parametros, consultar_precos, resposta_json
+from .importacao import ENTIDADES, COLUNAS
+from .tarefas import criar_tarefa
+from .condicional import (
+    CATALOGO, condicional_por_escopo, escopo_listagem, escopo_produto_detalhe,
+    escopos_do_produto, marcar_alteracao,
+)
 from canais_vendas.models import CanalVenda
 from grupo_vendas.models import GrupoCanais
 
 
 def home(request):
-    """Dashboard principal"""
-    context = {
-        'total_produtos': Produto.objects.filter(ativo=True).count(),
-        'total_grupos': GrupoCanais.objects.count(),
-        'total_canais': CanalVenda.objects.filter(ativo=True).count(),
-        'total_precos': PrecoProdutoCanal.objects.filter(ativo=True).count(),
-        'ultimos_produtos': Produto.objects.filter(ativo=True).order_by('-criado_em')[:5],
-        'ultimos_historicos': HistoricoPreco.objects.order_by('-data_registro')[:10],
-    }
-    return render(request, 'produtos/home.html', context)
+    """Dashboard principal (contadores e listas vêm do cache, ver produtos/painel.py)"""
+    return render(request, 'produtos/home.html', dados_painel())
 
 
 class ProdutoListView(ListView):
@@ -38,15 +50,12 @@ class ProdutoListView(ListView):
         queryset = Produto.objects.all()
         search = self.request.GET.get('search')
         if search:
-            # Pesquisa no produto principal e nos títulos alternativos
-            queryset = queryset.filter(
-                Q(sku__icontains=search) |
-                Q(titulo__icontains=search) |
-                Q(titulos__titulo__icontains=search)
-            ).distinct()
+            # Pesquisa no produto principal e nos títulos alternativos (índice de busca)
+            queryset = filtrar_busca(queryset, search)
         return queryset.order_by('-criado_em')
 
 
+@method_decorator(condicional_por_escopo(escopo_produto_detalhe), name='dispatch')
 class ProdutoDetailView(DetailView):
     model = Produto
     template_name = 'produtos/produto_detail.html'
@@ -144,7 +153,7 @@ def ficha_tecnica_edit(request, produto_pk):
 
     FormSetBase = modelformset_factory(
         ItemFichaTecnica,
-        fields=['codigo', 'descricao', 'unidade', 'quantidade', 'custo_unitario', 'multiplicador'],
+        fields=['componente', 'codigo', 'descricao', 'unidade', 'quantidade', 'custo_unitario', 'multiplicador'],
         extra=0,
         can_delete=True
     )
@@ -200,6 +209,50 @@ def ficha_tecnica_edit(request, produto_pk):
     })
 
 
+def catalogo_import(request):
+    """Importação do catálogo (produtos, ficha técnica e títulos) por XLSX ou CSV, em segundo plano."""
+    if request.method == 'POST':
+        arquivo = request.FILES.get('arquivo')
+        if not arquivo:
+            messages.error(request, 'Nenhum arquivo enviado.')
+            return redirect('catalogo_import')
+        if not arquivo.name.lower().endswith(('.xlsx', '.csv')):
+            messages.error(request, 'O arquivo deve ser um Excel (.xlsx) ou CSV.')
+            return redirect('catalogo_import')
+
+        entidade = request.POST.get('entidade', '')
+        if arquivo.name.lower().endswith('.csv') and entidade not in dict(ENTIDADES):
+            messages.error(request, 'Informe o conteúdo do CSV.')
+            return redirect('catalogo_import')
+
+        tarefa = criar_tarefa(TarefaImportacao.TIPO_CATALOGO, arquivo, usuario=request.user, entidade=entidade)
+        messages.info(request, 'Importação enviada para processamento.')
+        return redirect('tarefa_importacao_detail', pk=tarefa.pk)
+
+    return render(request, 'produtos/catalogo_import.html', {'entidades': ENTIDADES})
+
+
+def catalogo_modelo(request):
+    """Modelo XLSX da importação de catálogo (uma aba por entidade)."""
+    wb = openpyxl.Workbook()
+    wb.remove(wb.active)
+    exemplos = {
+        'produtos': ['SKU-001', 'Prateleira de Aço 5 Bandejas', '7890000000001', 40, 180, 30, 12.5, 1],
+        'ficha': ['SKU-001', 'MP', 'ACO-01', 'Chapa de aço', 'KG', 10, 8.5, 1],
+        'titulos': ['SKU-001', 'Estante de Aço 5 Prateleiras', 1],
+    }
+    for entidade, nome in ENTIDADES:
+        ws = wb.create_sheet(nome)
+        ws.append(COLUNAS[entidade])
+        ws.append(exemplos[entidade])
+
+    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    response['Content-Disposition'] = 'attachment; filename=modelo_importacao_catalogo.xlsx'
+    wb.save(response)
+    return response
+
+
+@method_decorator(condicional_por_escopo(escopo_listagem), name='dispatch')
 class PrecoListView(ListView):
     model = PrecoProdutoCanal
     template_name = 'produtos/preco_list.html'
@@ -217,12 +270,8 @@ class PrecoListView(ListView):
         canal = self.request.GET.get('canal')
 
         if produto:
-            # Pesquisa no produto principal e nos títulos alternativos
-            queryset = queryset.filter(
-                Q(produto__sku__icontains=produto) |
-                Q(produto__titulo__icontains=produto) |
-                Q(produto__titulos__titulo__icontains=produto)
-            ).distinct()
+            # Pesquisa no produto principal e nos títulos alternativos (índice de busca)
+            queryset = filtrar_busca(queryset, produto, campo_produto='produto_id')
         if grupo:
             queryset = queryset.filter(canal__grupo_id=grupo)
         if canal:
@@ -253,10 +302,12 @@ def preco_edit(request, pk):
         frete_especifico = request.POST.get('frete_especifico')
         preco.frete_especifico = frete_especifico if frete_especifico else None
 
-        motivo = request.POST.get('motivo', '')
+        motivo = request.POST.get('motivo') or 'Alteração manual'
+        usuario = request.user if request.user.is_authenticated else None
 
         try:
-            preco.save(usuario=request.user if request.user.is_authenticated else None, motivo=motivo)
+            with registrar_execucao('manual', motivo, usuario=usuario):
+                preco.save(usuario=usuario, motivo=motivo)
             messages.success(request, 'Preço atualizado com sucesso!')
             return redirect('preco_list')
         except Exception as e:
@@ -285,10 +336,13 @@ def produto_precos(request, produto_pk):
                     preco.ativo = True
                     preco.save()
             else:
-                # Desativar preço se existir
-                PrecoProdutoCanal.objects.filter(
-                    produto=produto, canal=canal
-                ).update(ativo=False)
+                # Desativar preço se existir (update direto não dispara signals)
+                if PrecoProdutoCanal.objects.filter(
+                    produto=produto, canal=canal, ativo=True
+                ).update(ativo=False):
+                    invalidar_contadores()
+                    marcar_alteracao(*escopos_do_produto(produto.pk))
+                    marcar_feeds(canal.pk)
 
         messages.success(request, 'Preços atualizados com sucesso!')
         return redirect('produto_detail', pk=produto.pk)
@@ -307,6 +361,121 @@ def produto_precos(request, produto_pk):
     })
 
 
+@condicional_por_escopo(escopo_listagem)
+def preco_matriz(request):
+    """Matriz produtos × canais (venda, promoção ou mínimo)."""
+    matriz = montar_matriz(
+        tipo=request.GET.get('tipo', 'venda'),
+        grupo=request.GET.get('grupo') or None,
+        search=request.GET.get('search') or None,
+        pagina=request.GET.get('page', 1),
+    )
+    filtros = request.GET.copy()
+    filtros.pop('page', None)
+
+    return render(request, 'produtos/preco_matriz.html', {
+        'matriz': matriz,
+        'tipos': [(chave, rotulo) for chave, (_, _, rotulo) in TIPOS_PRECO.items()],
+        'grupos': GrupoCanais.objects.all(),
+        'filtros': filtros.urlencode(),
+    })
+
+
+@condicional_por_escopo(escopo_listagem)
+def preco_matriz_json(request):
+    """Mesma matriz em JSON (valores como string decimal, null onde não há preço)."""
+    matriz = montar_matriz(
+        tipo=request.GET.get('tipo', 'venda'),
+        grupo=request.GET.get('grupo') or None,
+        search=request.GET.get('search') or None,
+        pagina=request.GET.get('page', 1),
+    )
+    return JsonResponse(matriz)
+
+
+@csrf_exempt
+@require_http_methods(['GET', 'POST'])
+def api_precos(request):
+    """
+    Preços em lote por SKU (somente leitura).
+    POST {"skus": [...], "canal": id, "grupo": id, "cursor": "...", "limite": 1000}
+    ou GET ?skus=A,B,C&canal=id
+    """
+    try:
+        parametros = ler_parametros(request)
+    except ErroConsulta as e:
+        return resposta_json({'erro': str(e)}, status=400)
+    return resposta_json(consultar_precos(**parametros))
+
+
+def metricas_prometheus(request):
+    """Métricas do motor de preços para o Prometheus (ver produtos/metricas.py)."""
+    token = settings.METRICAS_TOKEN
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponse(status=401)
+    return HttpResponse(metricas.exportar(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def feed_list(request):
+    """Feeds de preços por canal (os arquivos são servidos direto de MEDIA_URL)."""
+    feeds = FeedCanal.objects.filter(canal__ativo=True).select_related('canal', 'canal__grupo').order_by(
+        'canal__grupo__nome', 'canal__nome'
+    )
+    for feed in feeds:
+        feed.url_csv = url_feed(feed.canal_id, 'csv')
+        feed.url_xlsx = url_feed(feed.canal_id, 'xlsx')
+    return render(request, 'produtos/feed_list.html', {'feeds': feeds})
+
+
+class TarefaImportacaoListView(ListView):
+    model = TarefaImportacao
+    template_name = 'produtos/tarefa_importacao_list.html'
+    context_object_name = 'tarefas'
+    paginate_by = 50
+
+    def get_queryset(self):
+        return TarefaImportacao.objects.select_related('tabela_frete', 'usuario').defer('erros')
+
+
+class TarefaImportacaoDetailView(DetailView):
+    """Andamento da importação; a página se recarrega enquanto a tarefa não termina."""
+    model = TarefaImportacao
+    template_name = 'produtos/tarefa_importacao_detail.html'
+    context_object_name = 'tarefa'
+
+
+class ExecucaoRecalculoListView(ListView):
+    """Execuções de recálculo: recentes, mais lentas ou maiores (preços lidos), por origem."""
+    model = ExecucaoRecalculo
+    template_name = 'produtos/execucao_recalculo_list.html'
+    context_object_name = 'execucoes'
+    paginate_by = 50
+
+    ORDENS = {
+        'recentes': ['-iniciada_em', '-pk'],
+        'lentas': [F('duracao').desc(nulls_last=True), '-pk'],
+        'maiores': ['-precos_lidos', '-pk'],
+    }
+
+    def get_queryset(self):
+        queryset = ExecucaoRecalculo.objects.select_related('usuario')
+        origem = self.request.GET.get('origem')
+        if origem:
+            queryset = queryset.filter(origem=origem)
+        if self.request.GET.get('com_erro'):
+            queryset = queryset.exclude(erro='')
+        return queryset.order_by(*self.ORDENS.get(self.request.GET.get('ordem'), self.ORDENS['recentes']))
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['origens'] = ExecucaoRecalculo.ORIGEM_CHOICES
+        # Filtros atuais sem a página, para os links de paginação
+        filtros = self.request.GET.copy()
+        filtros.pop('page', None)
+        context['filtros'] = filtros.urlencode()
+        return context
+
+
 class HistoricoListView(ListView):
     model = HistoricoPreco
     template_name = 'produtos/historico_list.html'
@@ -314,24 +483,17 @@ class HistoricoListView(ListView):
     paginate_by = 50
 
     def get_queryset(self):
-        queryset = HistoricoPreco.objects.all()
-
-        # Filtros
-        produto = self.request.GET.get('produto')
-        canal = self.request.GET.get('canal')
-        data_inicio = self.request.GET.get('data_inicio')
-        data_fim = self.request.GET.get('data_fim')
+        queryset = HistoricoPreco.objects.select_related('produto', 'canal', 'usuario')
+        queryset = filtrar_historicos(queryset, self.request.GET)
+        return queryset.order_by('-data_registro')
 
-        if produto:
-            queryset = queryset.filter(sku_produto__icontains=produto)
-        if canal:
-            queryset = queryset.filter(nome_canal__icontains=canal)
-        if data_inicio:
-            queryset = queryset.filter(data_registro__date__gte=data_inicio)
-        if data_fim:
-            queryset = queryset.filter(data_registro__date__lte=data_fim)
 
-        return queryset.order_by('-data_registro')
+@condicional_por_escopo(lambda request: CATALOGO)
+def historico_export(request):
+    """Exporta o histórico filtrado em CSV (streaming) ou XLSX (write-only)"""
+    if request.GET.get('formato') == 'xlsx':
+        return resposta_xlsx(request.GET)
+    return resposta_csv(request.GET)
 
 
 class HistoricoDetailView(DetailView):
@@ -340,16 +502,20 @@ class HistoricoDetailView(DetailView):
     context_object_name = 'historico'
 
 
+@method_decorator(condicional_por_escopo(escopo_listagem), name='dispatch')
 class TabelaPrecosView(ListView):
-    model = PrecoProdutoCanal
+    """
+    Tabela completa (título principal e variações) lida do read-model
+    LinhaTabelaPreco, com paginação por cursor: cada linha do banco é uma linha
+    da tela, então a página tem sempre o mesmo tamanho e custo.
+    """
+    model = LinhaTabelaPreco
     template_name = 'produtos/tabela_precos.html'
-    context_object_name = 'precos'
-    paginate_by = 50
+    context_object_name = 'linhas'
+    tamanho_pagina = 50
 
     def get_queryset(self):
-        queryset = PrecoProdutoCanal.objects.filter(ativo=True).select_related(
-            'produto', 'canal', 'canal__grupo'
-        ).prefetch_related('produto__titulos')
+        queryset = LinhaTabelaPreco.objects.filter(preco__ativo=True).select_related('preco')
 
         # Filtros
         search = self.request.GET.get('search')
@@ -357,61 +523,38 @@ class TabelaPrecosView(ListView):
         canal = self.request.GET.get('canal')
 
         if grupo:
-            queryset = queryset.filter(canal__grupo_id=grupo)
+            queryset = queryset.filter(grupo_id=grupo)
         if canal:
             queryset = queryset.filter(canal_id=canal)
-        
+
         if search:
-            # Filtra se houver match em qualquer título (Pai ou Filho) ou SKU
-            queryset = queryset.filter(
-                Q(produto__sku__icontains=search) |
-                Q(produto__titulo__icontains=search) |
-                Q(produto__titulos__titulo__icontains=search)
-            ).distinct()
+            # Pré-filtra pelo índice de busca do produto e depois exige que
+            # cada palavra case com o SKU ou com o título da própria linha
+            queryset = filtrar_busca(queryset, search, campo_produto='produto_id')
+            for token in tokenizar(search):
+                queryset = queryset.filter(busca__contains=' ' + token)
 
-        return queryset.order_by('produto__sku', 'canal__grupo__nome', 'canal__nome')
+        return queryset
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        
-        # Expandir os resultados da página atual
-        page_precos = context['object_list']
-        search = self.request.GET.get('search', '').lower()
-        rows = []
-
-        for preco in page_precos:
-            # 1. Título Principal
-            # Se não tem busca, OU se tem busca e bate com SKU ou Título Principal
-            show_main = True
-            if search:
-                if not (search in preco.produto.sku.lower() or search in preco.produto.titulo.lower()):
-                    show_main = False
-            
-            if show_main:
-                rows.append({
-                    'titulo': preco.produto.titulo,
-                    'obj': preco,
-                    'is_main': True
-                })
-
-            # 2. Títulos Secundários
-            for titulo_sec in preco.produto.titulos.all():
-                if not titulo_sec.ativo:
-                    continue
-                
-                show_sec = True
-                if search:
-                    if search not in titulo_sec.titulo.lower():
-                        show_sec = False
-                
-                if show_sec:
-                    rows.append({
-                        'titulo': titulo_sec.titulo,
-                        'obj': preco,
-                        'is_main': False
-                    })
-        
-        context['rows'] = rows
+
+        linhas, anterior, proximo = paginar_keyset(
+            self.object_list,
+            LinhaTabelaPreco.ORDENACAO,
+            self.tamanho_pagina,
+            depois=self.request.GET.get('depois'),
+            antes=self.request.GET.get('antes'),
+        )
+
+        filtros = self.request.GET.copy()
+        filtros.pop('depois', None)
+        filtros.pop('antes', None)
+
+        context['linhas'] = linhas
+        context['cursor_anterior'] = anterior
+        context['cursor_proximo'] = proximo
+        context['filtros'] = filtros.urlencode()
         context['grupos'] = GrupoCanais.objects.all()
         context['canais'] = CanalVenda.objects.filter(ativo=True)
         return context
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class TabelaFreteConfig(AppConfig):
     name = 'tabela_frete'
+
+    def ready(self):
+        # Importa signals para registrá-los
+        import tabela_frete.signals  # noqa: F401
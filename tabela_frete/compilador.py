@@ -0,0 +1,457 @@
+"""
+Compilação das regras de frete e de taxa em faixas sem sobreposição.
+
+As tabelas são avaliadas por "primeira regra que casa" (na ordem de
+prioridade de cada tipo). O compilador reproduz essa semântica com uma
+varredura ordenada dos intervalos (O(n log n) por eixo, com um heap das
+regras ativas): cada trecho do eixo fica com a regra que venceria a busca
+linear. O resultado serve de diagnóstico e de estrutura de consulta:
+
+- lacunas: trechos sem regra (o frete cai para R$ 0,00);
+- sobreposições: trechos cobertos por mais de uma regra (só a primeira vale);
+- regras sem efeito: totalmente encobertas por regras de prioridade maior,
+  ou com início >= fim;
+- faixas: layout normalizado [início, fim) -> valor, consultado com bisect.
+
+Matriz (peso × preço ou peso × score) é compilada por fatias de peso: cada
+fatia tem o conjunto de regras ativas naquele peso e uma varredura no segundo
+eixo. Fatias consecutivas com o mesmo layout são unidas.
+
+As tabelas compiladas ficam no cache versionado (produtos.cache_versionado),
+uma versão por tabela, trocada pelos signals (e pelas alterações em lote) a
+cada alteração das regras: os workers carregam a compilação pronta em vez de
+consultar as regras, e a alteração de uma tabela não descarta as outras.
+"""
+import bisect
+import heapq
+from decimal import Decimal
+
+from produtos import cache_versionado
+
+
+INFINITO = Decimal('Infinity')
+ZERO = Decimal('0')
+
+# Itens de cada tipo guardados no relatório (os demais só entram na contagem)
+MAX_ITENS_RELATORIO = 50
+
+
+# ------------------------------------------------------------
+# Varredura
+# ------------------------------------------------------------
+
+class Varredura:
+    """Resultado da varredura de um eixo."""
+
+    def __init__(self):
+        self.faixas = []          # (inicio, fim, chave vencedora)
+        self.lacunas = []         # (inicio, fim)
+        self.sobreposicoes = []   # (inicio, fim, vencedora, [encobertas])
+        self.vencedoras = set()
+        self.vazias = []          # chaves com inicio >= fim
+
+
+def _acrescentar(lista, inicio, fim, *dados):
+    """Une ao último trecho se for contíguo e com os mesmos dados."""
+    if lista and lista[-1][1] == inicio and tuple(lista[-1][2:]) == dados:
+        lista[-1] = (lista[-1][0], fim, *dados)
+    else:
+        lista.append((inicio, fim, *dados))
+
+
+def varrer(intervalos, dominio_inicio=ZERO):
+    """
+    intervalos: [(inicio, fim, prioridade, chave)], fim=INFINITO quando aberto.
+    Menor prioridade vence (mesma ordem da busca linear). Prioridades são únicas.
+    """
+    resultado = Varredura()
+    validos = []
+    for intervalo in intervalos:
+        if intervalo[0] < intervalo[1]:
+            validos.append(intervalo)
+        else:
+            resultado.vazias.append(intervalo[3])
+
+    pontos = sorted({dominio_inicio, *(i[0] for i in validos), *(i[1] for i in validos)} - {INFINITO})
+    pontos.append(INFINITO)
+    por_inicio = sorted(validos, key=lambda i: i[0])
+    por_fim = sorted(validos, key=lambda i: i[1])
+
+    ativos = {}
+    heap = []
+    p_inicio = p_fim = 0
+    for a, b in zip(pontos, pontos[1:]):
+        while p_inicio < len(por_inicio) and por_inicio[p_inicio][0] <= a:
+            inicio, fim, prioridade, chave = por_inicio[p_inicio]
+            ativos[chave] = prioridade
+            heapq.heappush(heap, (prioridade, chave))
+            p_inicio += 1
+        while p_fim < len(por_fim) and por_fim[p_fim][1] <= a:
+            ativos.pop(por_fim[p_fim][3], None)
+            p_fim += 1
+        while heap and heap[0][1] not in ativos:
+            heapq.heappop(heap)
+
+        if not heap:
+            if a >= dominio_inicio:
+                _acrescentar(resultado.lacunas, a, b)
+            continue
+
+        vencedora = heap[0][1]
+        resultado.vencedoras.add(vencedora)
+        _acrescentar(resultado.faixas, a, b, vencedora)
+        if len(ativos) > 1:
+            encobertas = tuple(sorted(c for c in ativos if c != vencedora))
+            _acrescentar(resultado.sobreposicoes, a, b, vencedora, encobertas)
+
+    return resultado
+
+
+# ------------------------------------------------------------
+# Layouts de consulta
+# ------------------------------------------------------------
+
+class Faixas:
+    """Faixas [inicio, fim) ordenadas e sem sobreposição, consultadas com bisect."""
+
+    def __init__(self, faixas, valor_de):
+        self.inicios = [f[0] for f in faixas]
+        self.fins = [f[1] for f in faixas]
+        self.chaves = [f[2] for f in faixas]
+        self.valores = [valor_de(f[2]) for f in faixas]
+
+    def buscar(self, x):
+        i = bisect.bisect_right(self.inicios, x) - 1
+        if i >= 0 and x < self.fins[i]:
+            return self.valores[i]
+        return None
+
+    def __eq__(self, outro):
+        return isinstance(outro, Faixas) and (self.inicios, self.fins, self.chaves) == (
+            outro.inicios, outro.fins, outro.chaves
+        )
+
+    def segmentos(self):
+        """(inicio, fim, valor) unindo trechos vizinhos de mesmo valor: compara layouts por valor, não por regra."""
+        segmentos = []
+        for inicio, fim, valor in zip(self.inicios, self.fins, self.valores):
+            _acrescentar(segmentos, inicio, fim, valor)
+        return tuple(segmentos)
+
+
+class Fatias:
+    """Layout 2D: fatias de peso, cada uma com as faixas do segundo eixo."""
+
+    def __init__(self, fatias):
+        self.inicios = [f[0] for f in fatias]
+        self.fins = [f[1] for f in fatias]
+        self.faixas = [f[2] for f in fatias]
+
+    def fatia(self, peso):
+        """Faixas do segundo eixo para o peso (None fora das fatias)."""
+        i = bisect.bisect_right(self.inicios, peso) - 1
+        if i >= 0 and peso < self.fins[i]:
+            return self.faixas[i]
+        return None
+
+    def buscar(self, peso, segundo):
+        faixas = self.fatia(peso)
+        return None if faixas is None else faixas.buscar(segundo)
+
+
+# ------------------------------------------------------------
+# Relatório
+# ------------------------------------------------------------
+
+def _formatar_valor(valor, unidade):
+    if unidade == 'R$':
+        return f'R$ {valor}'
+    return f'{valor} {unidade}'.strip()
+
+
+def _formatar_faixa(inicio, fim, unidade, inteiro=False):
+    if fim == INFINITO:
+        return f'{_formatar_valor(inicio, unidade)} em diante'
+    if inteiro:
+        return f'{_formatar_valor(inicio, unidade)} a {_formatar_valor(fim - 1, unidade)}'
+    return f'{_formatar_valor(inicio, unidade)} até {_formatar_valor(fim, unidade)}'
+
+
+class RelatorioCompilacao:
+    """Problemas encontrados na compilação de um conjunto de regras."""
+
+    def __init__(self, titulo, total_regras):
+        self.titulo = titulo
+        self.total_regras = total_regras
+        self.total_faixas = 0
+        self.contagens = {'lacunas': 0, 'sobreposicoes': 0, 'sem_efeito': 0}
+        self.lacunas = []
+        self.sobreposicoes = []
+        self.sem_efeito = []
+
+    def _adicionar(self, tipo, mensagem):
+        self.contagens[tipo] += 1
+        lista = getattr(self, tipo)
+        if len(lista) < MAX_ITENS_RELATORIO:
+            lista.append(mensagem)
+
+    @property
+    def total_problemas(self):
+        return sum(self.contagens.values())
+
+    @property
+    def ok(self):
+        return self.total_regras > 0 and not self.total_problemas
+
+    def resumo(self):
+        if not self.total_regras:
+            return f'{self.titulo}: nenhuma regra ativa.'
+        partes = []
+        if self.contagens['lacunas']:
+            partes.append(f'{self.contagens["lacunas"]} lacuna(s)')
+        if self.contagens['sobreposicoes']:
+            partes.append(f'{self.contagens["sobreposicoes"]} sobreposição(ões)')
+        if self.contagens['sem_efeito']:
+            partes.append(f'{self.contagens["sem_efeito"]} regra(s) sem efeito')
+        if not partes:
+            return f'{self.titulo}: {self.total_regras} regras, sem lacunas ou sobreposições.'
+        return f'{self.titulo}: ' + ', '.join(partes) + '.'
+
+
+def _rotulo(chave):
+    return f'regra #{chave}'
+
+
+def _relatar_sem_efeito(relatorio, chaves, vencedoras, vazias):
+    for chave in sorted(vazias):
+        relatorio._adicionar('sem_efeito', f'{_rotulo(chave)}: início maior ou igual ao fim')
+    for chave in sorted(set(chaves) - vencedoras - set(vazias)):
+        relatorio._adicionar('sem_efeito', f'{_rotulo(chave)}: totalmente encoberta por regras de prioridade maior')
+
+
+def compilar_simples(regras, titulo, unidade='', valor_de=None):
+    """
+    regras: [(inicio, fim, prioridade, chave, valor)] com None para fim aberto.
+    Retorna (Faixas, RelatorioCompilacao).
+    """
+    valores = {r[3]: r[4] for r in regras}
+    varredura = varrer([
+        (r[0] or ZERO, INFINITO if r[1] is None else r[1], r[2], r[3]) for r in regras
+    ])
+
+    relatorio = RelatorioCompilacao(titulo, len(regras))
+    relatorio.total_faixas = len(varredura.faixas)
+    if regras:
+        for inicio, fim in varredura.lacunas:
+            relatorio._adicionar('lacunas', f'Sem regra de {_formatar_faixa(inicio, fim, unidade)}')
+        for inicio, fim, vencedora, encobertas in varredura.sobreposicoes:
+            relatorio._adicionar('sobreposicoes', (
+                f'{_formatar_faixa(inicio, fim, unidade)}: vale a {_rotulo(vencedora)}, '
+                f'encobre {", ".join(_rotulo(c) for c in encobertas)}'
+            ))
+        _relatar_sem_efeito(relatorio, valores, varredura.vencedoras, varredura.vazias)
+
+    return Faixas(varredura.faixas, valores.get), relatorio
+
+
+def compilar_matriz(regras, titulo, unidade_segundo='', segundo_inteiro=False):
+    """
+    regras: [(peso_ini, peso_fim, seg_ini, seg_fim, prioridade, chave, valor)] com seg_fim
+    já exclusivo (score inclusivo entra como fim + 1) e None para fins abertos.
+    Retorna (Fatias, RelatorioCompilacao).
+    """
+    valores = {r[5]: r[6] for r in regras}
+    pesos = [(r[0] or ZERO, INFINITO if r[1] is None else r[1], r[5]) for r in regras]
+    segundos = {
+        r[5]: (r[2] or ZERO, INFINITO if r[3] is None else r[3], r[4], r[5]) for r in regras
+    }
+    vazias = {c for ini, fim, c in pesos if ini >= fim} | {c for c, s in segundos.items() if s[0] >= s[1]}
+
+    intervalos = sorted(i for i in pesos if i[0] < i[1])
+    por_fim = sorted(intervalos, key=lambda i: i[1])
+    pontos = sorted({ZERO, *(i[0] for i in intervalos), *(i[1] for i in intervalos)} - {INFINITO})
+    pontos.append(INFINITO)
+
+    ativos = set()
+    p_inicio = p_fim = 0
+    memo = {}
+    fatias = []
+    lacunas_peso = []
+    vencedoras = set()
+    for a, b in zip(pontos, pontos[1:]):
+        while p_inicio < len(intervalos) and intervalos[p_inicio][0] <= a:
+            ativos.add(intervalos[p_inicio][2])
+            p_inicio += 1
+        while p_fim < len(por_fim) and por_fim[p_fim][1] <= a:
+            ativos.discard(por_fim[p_fim][2])
+            p_fim += 1
+        if not ativos:
+            if a >= ZERO:
+                _acrescentar(lacunas_peso, a, b)
+            continue
+
+        # Fatias com o mesmo conjunto de regras ativas têm a mesma varredura
+        conjunto = frozenset(ativos)
+        if conjunto not in memo:
+            memo[conjunto] = varrer([segundos[c] for c in conjunto])
+        varredura = memo[conjunto]
+        vencedoras |= varredura.vencedoras
+        faixas = Faixas(varredura.faixas, valores.get)
+        if fatias and fatias[-1][1] == a and fatias[-1][2] == faixas:
+            fatias[-1] = (fatias[-1][0], b, faixas, fatias[-1][3])
+        else:
+            fatias.append((a, b, faixas, varredura))
+
+    relatorio = RelatorioCompilacao(titulo, len(regras))
+    relatorio.total_faixas = sum(len(f[2].inicios) for f in fatias)
+    if regras:
+        for inicio, fim in lacunas_peso:
+            relatorio._adicionar('lacunas', f'Sem regra para peso de {_formatar_faixa(inicio, fim, "kg")}')
+        for inicio_peso, fim_peso, _, varredura in fatias:
+            peso = _formatar_faixa(inicio_peso, fim_peso, 'kg')
+            for inicio, fim in varredura.lacunas:
+                relatorio._adicionar('lacunas', (
+                    f'Peso {peso}: sem regra de '
+                    f'{_formatar_faixa(inicio, fim, unidade_segundo, segundo_inteiro)}'
+                ))
+            for inicio, fim, vencedora, encobertas in varredura.sobreposicoes:
+                relatorio._adicionar('sobreposicoes', (
+                    f'Peso {peso}, {_formatar_faixa(inicio, fim, unidade_segundo, segundo_inteiro)}: '
+                    f'vale a {_rotulo(vencedora)}, encobre {", ".join(_rotulo(c) for c in encobertas)}'
+                ))
+        _relatar_sem_efeito(relatorio, valores, vencedoras, vazias)
+
+    return Fatias([(a, b, faixas) for a, b, faixas, _ in fatias]), relatorio
+
+
+# ------------------------------------------------------------
+# Tabelas compiladas
+# ------------------------------------------------------------
+
+class TabelaFreteCompilada:
+    """Regras ativas de uma TabelaFrete, compiladas sob demanda por (tipo, excedente)."""
+
+    def __init__(self, tabela_id):
+        from .models import DescontoNotaVendedor, RegraFreteEspecial
+
+        self.tabela_id = tabela_id
+        self.especiais = list(
+            RegraFreteEspecial.objects.filter(tabela_id=tabela_id, ativo=True).order_by('ordem', 'pk')
+        )
+        self.descontos = dict(
+            DescontoNotaVendedor.objects.filter(tabela_id=tabela_id).values_list('nota', 'percentual_desconto')
+        )
+        self._layouts = {}
+
+    def _compilar(self, tipo, excedente):
+        from .models import RegraFreteMatriz, RegraFreteSimples
+
+        titulo = 'Regras excedentes (>1m)' if excedente else 'Regras normais'
+        if tipo in ('matriz', 'matriz_score'):
+            regras = RegraFreteMatriz.objects.filter(tabela_id=self.tabela_id, ativo=True, excedente=excedente)
+            if tipo == 'matriz':
+                linhas = regras.values_list(
+                    'pk', 'ordem', 'peso_inicio', 'peso_fim', 'preco_inicio', 'preco_fim', 'valor_frete'
+                )
+                return compilar_matriz([
+                    (p_ini, p_fim, s_ini, s_fim, (ordem, p_ini or ZERO, s_ini or ZERO, pk), pk, valor)
+                    for pk, ordem, p_ini, p_fim, s_ini, s_fim, valor in linhas
+                ], titulo, 'R$')
+            linhas = regras.values_list(
+                'pk', 'ordem', 'peso_inicio', 'peso_fim', 'score_inicio', 'score_fim', 'valor_frete'
+            )
+            # Score é inteiro e inclusivo no fim: [inicio, fim + 1)
+            return compilar_matriz([
+                (p_ini, p_fim, s_ini, None if s_fim is None else s_fim + 1,
+                 (ordem, p_ini or ZERO, s_ini or 0, pk), pk, valor)
+                for pk, ordem, p_ini, p_fim, s_ini, s_fim, valor in linhas
+            ], titulo, '', segundo_inteiro=True)
+
+        unidade = 'kg' if tipo == 'peso' else 'R$'
+        linhas = RegraFreteSimples.objects.filter(
+            tabela_id=self.tabela_id, ativo=True, excedente=excedente
+        ).values_list('pk', 'inicio', 'fim', 'valor_frete')
+        return compilar_simples([
+            (inicio, fim, (inicio or ZERO, pk), pk, valor) for pk, inicio, fim, valor in linhas
+        ], titulo, unidade)
+
+    def layout(self, tipo, excedente):
+        """(layout, relatório) do tipo de tabela e da flag de excedente."""
+        chave = (tipo, excedente)
+        if chave not in self._layouts:
+            self._layouts[chave] = self._compilar(tipo, excedente)
+        return self._layouts[chave]
+
+    def frete(self, tipo, excedente, peso, preco, score):
+        """Valor da regra vencedora ou None (nenhuma regra casa)."""
+        layout, _ = self.layout(tipo, excedente)
+        if tipo == 'matriz':
+            return layout.buscar(peso, preco)
+        if tipo == 'matriz_score':
+            return layout.buscar(peso, score)
+        if tipo == 'peso':
+            return layout.buscar(peso)
+        return layout.buscar(preco)
+
+
+class TabelaTaxaCompilada:
+    """Regras ativas de uma TabelaTaxa (faixas de preço)."""
+
+    def __init__(self, tabela_id):
+        from .models import RegraTaxa
+
+        linhas = RegraTaxa.objects.filter(tabela_id=tabela_id, ativo=True).values_list(
+            'pk', 'preco_inicio', 'preco_fim', 'valor_taxa'
+        )
+        self.faixas, self.relatorio = compilar_simples([
+            (inicio, fim, (inicio or ZERO, pk), pk, valor) for pk, inicio, fim, valor in linhas
+        ], 'Regras de taxa', 'R$')
+
+    def taxa(self, preco):
+        return self.faixas.buscar(preco)
+
+
+# ------------------------------------------------------------
+# Cache versionado
+# ------------------------------------------------------------
+
+def _nome_frete(tabela_id):
+    return f'tabela_frete:compilada:{tabela_id}'
+
+
+def _nome_taxa(tabela_id):
+    return f'tabela_taxa:compilada:{tabela_id}'
+
+
+def compilar_tabela_frete(tabela):
+    """Compilação nova (fora do cache) com os layouts que a tabela usa já montados."""
+    compilada = TabelaFreteCompilada(tabela.pk)
+    compilada.layout(tabela.tipo, False)
+    if tabela.usa_tabela_excedente:
+        compilada.layout(tabela.tipo, True)
+    return compilada
+
+
+def obter_tabela_frete(tabela):
+    return cache_versionado.obter(_nome_frete(tabela.pk), lambda: compilar_tabela_frete(tabela))
+
+
+def obter_tabela_taxa(tabela_id):
+    return cache_versionado.obter(_nome_taxa(tabela_id), lambda: TabelaTaxaCompilada(tabela_id))
+
+
+def invalidar_tabela_frete(tabela_id):
+    cache_versionado.invalidar(_nome_frete(tabela_id))
+
+
+def invalidar_tabela_taxa(tabela_id):
+    cache_versionado.invalidar(_nome_taxa(tabela_id))
+
+
+def diagnosticar(tabela):
+    """Relatórios de compilação da tabela (normal e, se usada, excedente)."""
+    compilada = obter_tabela_frete(tabela)
+    relatorios = [compilada.layout(tabela.tipo, False)[1]]
+    if tabela.usa_tabela_excedente:
+        relatorios.append(compilada.layout(tabela.tipo, True)[1])
+    return relatorios
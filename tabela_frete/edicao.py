@@ -0,0 +1,167 @@
+"""
+Edição em massa das regras matriz (tela estilo planilha).
+
+A tela mostra as regras paginadas e envia só as células alteradas, num JSON:
+
+    {
+        "alterar": {"<pk>": {"campo": "valor", ...}, ...},
+        "excluir": [<pk>, ...],
+        "incluir": [{"campo": "valor", ...}, ...]
+    }
+
+Todas as células são validadas antes de gravar (com as validações dos campos
+do modelo); havendo erro, nada é gravado. A gravação roda dentro de
+substituicao.alteracao_regras_frete: um bulk_update só com as colunas
+alteradas, inserção em massa das linhas novas e um DELETE, sem signals por
+regra, e um único recálculo dos preços afetados no final, registrado como
+uma execução de recálculo com o usuário que editou (produtos.execucoes).
+"""
+import json
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+
+from .models import RegraFreteMatriz
+from .substituicao import TAMANHO_LOTE, ResultadoAlteracao, alteracao_regras_frete, apagar_regras, inserir_regras
+
+
+CAMPOS_MATRIZ = (
+    'ordem', 'peso_inicio', 'peso_fim', 'preco_inicio', 'preco_fim',
+    'score_inicio', 'score_fim', 'valor_frete', 'excedente', 'ativo',
+)
+
+BOOLEANOS = {'excedente', 'ativo'}
+
+# Padrões de RegraFreteMatriz.save (a gravação em lote não chama save)
+PADROES = {
+    'ordem': 0,
+    'peso_inicio': Decimal('0.000'),
+    'preco_inicio': Decimal('0.00'),
+    'score_inicio': 0,
+}
+
+# Erros guardados para exibição (os demais só entram na contagem)
+MAX_ERROS = 50
+
+
+class EdicaoInvalida(ValueError):
+    """JSON da edição fora do formato esperado."""
+
+
+class ResultadoEdicao(ResultadoAlteracao):
+    """Contagens da edição e erros de validação por célula."""
+
+    def __init__(self):
+        super().__init__()
+        self.alteradas = 0
+        self.total_erros = 0
+        self.erros = []   # (linha, mensagem)
+
+    def adicionar_erro(self, linha, mensagem):
+        self.total_erros += 1
+        if len(self.erros) < MAX_ERROS:
+            self.erros.append((linha, mensagem))
+
+    @property
+    def erros_omitidos(self):
+        return self.total_erros - len(self.erros)
+
+
+def ler_edicao(texto):
+    """Converte o JSON enviado pela tela em (alterar {pk: campos}, excluir {pk}, incluir [campos])."""
+    try:
+        dados = json.loads(texto or '{}')
+    except ValueError:
+        raise EdicaoInvalida('Alterações em formato inválido.')
+    if not isinstance(dados, dict):
+        raise EdicaoInvalida('Alterações em formato inválido.')
+
+    alterar = dados.get('alterar') or {}
+    excluir = dados.get('excluir') or []
+    incluir = dados.get('incluir') or []
+    if not (isinstance(alterar, dict) and isinstance(excluir, list) and isinstance(incluir, list)):
+        raise EdicaoInvalida('Alterações em formato inválido.')
+    try:
+        alterar = {int(pk): campos for pk, campos in alterar.items()}
+        excluir = {int(pk) for pk in excluir}
+    except (TypeError, ValueError):
+        raise EdicaoInvalida('Identificador de regra inválido.')
+
+    for campos in [*alterar.values(), *incluir]:
+        if not isinstance(campos, dict):
+            raise EdicaoInvalida('Alterações em formato inválido.')
+        desconhecidos = set(campos) - set(CAMPOS_MATRIZ)
+        if desconhecidos:
+            raise EdicaoInvalida(f'Campo não editável: {", ".join(sorted(desconhecidos))}.')
+    return alterar, excluir, incluir
+
+
+def _limpar(campo, valor):
+    """Valor da célula convertido e validado pelo campo do modelo."""
+    if campo in BOOLEANOS:
+        return valor is True or str(valor).strip().lower() in ('true', '1', 'on')
+    if isinstance(valor, str):
+        valor = valor.strip().replace(',', '.')
+    if valor in (None, ''):
+        if campo in PADROES:
+            return PADROES[campo]
+        valor = None
+    return RegraFreteMatriz._meta.get_field(campo).clean(valor, None)
+
+
+def _aplicar(regra, campos, linha, resultado):
+    for campo, valor in campos.items():
+        try:
+            setattr(regra, campo, _limpar(campo, valor))
+        except ValidationError as e:
+            nome = RegraFreteMatriz._meta.get_field(campo).verbose_name
+            resultado.adicionar_erro(linha, f'{nome}: {" ".join(e.messages)}')
+
+
+def editar_regras_matriz(tabela, alterar, excluir, incluir, motivo=None, usuario=None):
+    """
+    Aplica a edição (ver ler_edicao) numa transação, com um único recálculo.
+    Se alguma célula for inválida ou alguma regra não existir mais, nada é
+    gravado e os erros ficam no resultado.
+    """
+    resultado = ResultadoEdicao()
+    alterar = {pk: campos for pk, campos in alterar.items() if pk not in excluir and campos}
+    regras = RegraFreteMatriz.objects.filter(tabela=tabela).in_bulk([*alterar, *excluir])
+    for pk in sorted({*alterar, *excluir} - set(regras)):
+        resultado.adicionar_erro(f'Regra #{pk}', 'não existe mais nesta tabela (recarregue a página)')
+
+    colunas = set()
+    alteradas = []
+    for pk, campos in alterar.items():
+        if pk in regras:
+            _aplicar(regras[pk], campos, f'Regra #{pk}', resultado)
+            alteradas.append(regras[pk])
+            colunas.update(campos)
+
+    novas = []
+    for numero, campos in enumerate(incluir, start=1):
+        regra = RegraFreteMatriz(tabela=tabela, **PADROES)
+        _aplicar(regra, campos, f'Nova linha {numero}', resultado)
+        if 'valor_frete' not in campos:
+            resultado.adicionar_erro(f'Nova linha {numero}', 'Valor Frete: este campo é obrigatório.')
+        novas.append(regra)
+
+    if resultado.total_erros:
+        return resultado
+
+    from produtos.execucoes import registrar_execucao
+
+    motivo = motivo or f'Edição em massa das regras da tabela de frete "{tabela.nome}"'
+    with registrar_execucao('edicao_massa', motivo, usuario=usuario), \
+            alteracao_regras_frete(tabela, motivo) as alteracao:
+        if excluir:
+            alteracao.removidas = apagar_regras(RegraFreteMatriz.objects.filter(tabela=tabela, pk__in=excluir))
+        if alteradas:
+            RegraFreteMatriz.objects.bulk_update(alteradas, sorted(colunas), batch_size=TAMANHO_LOTE)
+        alteracao.inseridas = inserir_regras(RegraFreteMatriz, novas)
+
+    resultado.alteradas = len(alteradas)
+    resultado.removidas = alteracao.removidas
+    resultado.inseridas = alteracao.inseridas
+    resultado.precos_recalculados = alteracao.precos_recalculados
+    return resultado
@@ -0,0 +1,239 @@
+"""
+Importação de regras de frete a partir de planilhas XLSX.
+
+A planilha é lida em modo read_only (`iter_rows(values_only=True)`), que
+entrega uma tupla de valores por linha sem carregar as células da aba em
+memória. As linhas passam por um pipeline de geradores (leitura -> validação
+-> objetos) e são inseridas em lotes de tamanho fixo (COPY no PostgreSQL), então a
+memória fica constante mesmo com centenas de milhares de linhas. A gravação
+(inclusive o "substituir") não dispara signals por regra: roda dentro de
+substituicao.alteracao_regras_frete, que recalcula uma vez só os preços afetados.
+
+Linhas inválidas não interrompem a importação: entram no RelatorioImportacao
+com o número da linha na planilha e o motivo.
+
+validar_regras_* percorre a planilha sem gravar nada, chamando `progresso`
+a cada lote; é a primeira etapa das importações em segundo plano
+(produtos.tarefas), que só mostram andamento do que já foi confirmado no banco.
+"""
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from itertools import islice
+
+import openpyxl
+
+from .models import RegraFreteMatriz, RegraFreteSimples
+from .substituicao import alteracao_regras_frete, apagar_regras, inserir_regras
+
+
+TAMANHO_LOTE = 2000
+
+# Erros guardados para exibição (os demais só entram na contagem)
+MAX_ERROS_RELATORIO = 200
+
+VALORES_VERDADEIROS = {'1', 'true', 'sim', 's', 'x'}
+
+# max_digits dos campos decimais das regras
+DIGITOS = 10
+
+
+class ErroLinha(ValueError):
+    """Valor inválido em uma linha da planilha."""
+
+
+class _PlanilhaSemRegras(Exception):
+    """Substituição com nenhuma regra válida: desfaz a transação."""
+
+
+class RelatorioImportacao:
+    """Resultado da importação: contagens e erros por linha."""
+
+    def __init__(self):
+        self.linhas = 0
+        self.validas = 0
+        self.importadas = 0
+        self.precos_recalculados = 0
+        self.total_erros = 0
+        self.erros = []
+
+    def adicionar_erro(self, numero, mensagem):
+        self.total_erros += 1
+        if len(self.erros) < MAX_ERROS_RELATORIO:
+            self.erros.append((numero, mensagem))
+
+    @property
+    def erros_omitidos(self):
+        return self.total_erros - len(self.erros)
+
+
+# ------------------------------------------------------------
+# Conversão de células
+# ------------------------------------------------------------
+
+def ler_decimal(valor, coluna, casas, digitos=DIGITOS):
+    if valor is None:
+        return None
+    if isinstance(valor, bool):
+        raise ErroLinha(f'{coluna}: valor inválido "{valor}"')
+    if isinstance(valor, str):
+        valor = valor.strip().replace(',', '.')
+        if valor == '':
+            return None
+    try:
+        numero = Decimal(str(valor))
+    except InvalidOperation:
+        raise ErroLinha(f'{coluna}: "{valor}" não é um número')
+    if not numero.is_finite():
+        raise ErroLinha(f'{coluna}: "{valor}" não é um número')
+    numero = numero.quantize(Decimal(1).scaleb(-casas), rounding=ROUND_HALF_UP)
+    if abs(numero) >= Decimal(10) ** (digitos - casas):
+        raise ErroLinha(f'{coluna}: valor {numero} fora do limite')
+    return numero
+
+
+def ler_inteiro(valor, coluna):
+    if valor is None or (isinstance(valor, str) and valor.strip() == ''):
+        return None
+    numero = ler_decimal(valor, coluna, 3)
+    if numero != numero.to_integral_value():
+        raise ErroLinha(f'{coluna}: "{valor}" não é um número inteiro')
+    return int(numero)
+
+
+def ler_booleano(valor):
+    if valor is None:
+        return False
+    if isinstance(valor, bool):
+        return valor
+    if isinstance(valor, (int, float)):
+        return valor == 1
+    return str(valor).strip().lower() in VALORES_VERDADEIROS
+
+
+def _coluna(valores, indice):
+    return valores[indice] if indice < len(valores) else None
+
+
+# ------------------------------------------------------------
+# Linhas -> objetos
+# ------------------------------------------------------------
+
+def construir_regra_matriz(tabela, valores):
+    """Colunas: peso_ini, peso_fim, preco_ini, preco_fim, score_ini, score_fim, valor, ordem, excedente."""
+    valor_frete = ler_decimal(_coluna(valores, 6), 'valor_frete', 2)
+    if valor_frete is None:
+        raise ErroLinha('valor_frete vazio')
+    ordem = ler_inteiro(_coluna(valores, 7), 'ordem') or 0
+    if ordem < 0:
+        raise ErroLinha('ordem não pode ser negativa')
+
+    # Mesmos padrões de RegraFreteMatriz.save (a inserção em massa não chama save)
+    peso_inicio = ler_decimal(_coluna(valores, 0), 'peso_inicio', 3)
+    preco_inicio = ler_decimal(_coluna(valores, 2), 'preco_inicio', 2)
+    score_inicio = ler_inteiro(_coluna(valores, 4), 'score_inicio')
+    return RegraFreteMatriz(
+        tabela=tabela,
+        peso_inicio=Decimal('0.000') if peso_inicio is None else peso_inicio,
+        peso_fim=ler_decimal(_coluna(valores, 1), 'peso_fim', 3),
+        preco_inicio=Decimal('0.00') if preco_inicio is None else preco_inicio,
+        preco_fim=ler_decimal(_coluna(valores, 3), 'preco_fim', 2),
+        score_inicio=0 if score_inicio is None else score_inicio,
+        score_fim=ler_inteiro(_coluna(valores, 5), 'score_fim'),
+        valor_frete=valor_frete,
+        ordem=ordem,
+        excedente=ler_booleano(_coluna(valores, 8)),
+    )
+
+
+def construir_regra_simples(tabela, valores):
+    """Colunas: inicio, fim, valor_frete, excedente."""
+    valor_frete = ler_decimal(_coluna(valores, 2), 'valor_frete', 2)
+    if valor_frete is None:
+        raise ErroLinha('valor_frete vazio')
+
+    inicio = ler_decimal(_coluna(valores, 0), 'inicio', 3)
+    return RegraFreteSimples(
+        tabela=tabela,
+        inicio=Decimal('0.000') if inicio is None else inicio,
+        fim=ler_decimal(_coluna(valores, 1), 'fim', 3),
+        valor_frete=valor_frete,
+        excedente=ler_booleano(_coluna(valores, 3)),
+    )
+
+
+# ------------------------------------------------------------
+# Pipeline
+# ------------------------------------------------------------
+
+def iterar_linhas(arquivo):
+    """(número da linha na planilha, tupla de valores) das linhas não vazias, sem o cabeçalho."""
+    wb = openpyxl.load_workbook(arquivo, read_only=True, data_only=True)
+    try:
+        ws = wb.active
+        for numero, valores in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2):
+            if any(v is not None and v != '' for v in valores):
+                yield numero, valores
+    finally:
+        wb.close()
+
+
+def iterar_regras(linhas, construir, relatorio):
+    for numero, valores in linhas:
+        relatorio.linhas += 1
+        try:
+            regra = construir(valores)
+        except ErroLinha as e:
+            relatorio.adicionar_erro(numero, str(e))
+            continue
+        relatorio.validas += 1
+        yield regra
+
+
+def _importar(tabela, modelo, construir, arquivo, substituir, tamanho_lote):
+    relatorio = RelatorioImportacao()
+    motivo = f'Importação de regras da tabela de frete "{tabela.nome}"'
+    try:
+        with alteracao_regras_frete(tabela, motivo) as resultado:
+            if substituir:
+                apagar_regras(modelo.objects.filter(tabela=tabela))
+            regras = iterar_regras(iterar_linhas(arquivo), construir, relatorio)
+            relatorio.importadas = inserir_regras(modelo, regras, tamanho_lote)
+            if substituir and not relatorio.importadas:
+                raise _PlanilhaSemRegras
+    except _PlanilhaSemRegras:
+        # Planilha sem regras válidas não apaga as regras atuais
+        return relatorio
+    relatorio.precos_recalculados = resultado.precos_recalculados
+    return relatorio
+
+
+def _validar(construir, arquivo, progresso, tamanho_lote):
+    relatorio = RelatorioImportacao()
+    regras = iterar_regras(iterar_linhas(arquivo), construir, relatorio)
+    while list(islice(regras, tamanho_lote)):
+        if progresso:
+            progresso(relatorio)
+    return relatorio
+
+
+def importar_regras_matriz(tabela, arquivo, substituir=False, tamanho_lote=TAMANHO_LOTE):
+    return _importar(
+        tabela, RegraFreteMatriz,
+        lambda valores: construir_regra_matriz(tabela, valores),
+        arquivo, substituir, tamanho_lote,
+    )
+
+
+def importar_regras_simples(tabela, arquivo, substituir=False, tamanho_lote=TAMANHO_LOTE):
+    return _importar(
+        tabela, RegraFreteSimples,
+        lambda valores: construir_regra_simples(tabela, valores),
+        arquivo, substituir, tamanho_lote,
+    )
+
+
+def validar_regras_matriz(tabela, arquivo, progresso=None, tamanho_lote=TAMANHO_LOTE):
+    return _validar(lambda valores: construir_regra_matriz(tabela, valores), arquivo, progresso, tamanho_lote)
+
+
+def validar_regras_simples(tabela, arquivo, progresso=None, tamanho_lote=TAMANHO_LOTE):
+    return _validar(lambda valores: construir_regra_simples(tabela, valores), arquivo, progresso, tamanho_lote)
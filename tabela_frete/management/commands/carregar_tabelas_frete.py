@@ -0,0 +1,142 @@
+"""
+Comando que carrega as planilhas de frete dos marketplaces (pasta
+"Tabela Frete") nas tabelas de frete de mesmo nome.
+
+Cada planilha é lida no formato do marketplace (tabela_frete.marketplaces) e
+as regras da tabela são substituídas em lote, numa transação por tabela, com
+um único recálculo dos preços afetados. A tabela é criada se não existir.
+
+Uso:
+    python manage.py carregar_tabelas_frete                      # Todas
+    python manage.py carregar_tabelas_frete magalu shein         # Apenas algumas
+    python manage.py carregar_tabelas_frete --verificar          # Confere a tabela compilada
+    python manage.py carregar_tabelas_frete --dry-run --verificar
+    python manage.py carregar_tabelas_frete --diretorio /caminho/planilhas
+"""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from tabela_frete.compilador import diagnosticar
+from tabela_frete.marketplaces import MARKETPLACES, verificar
+from tabela_frete.models import TabelaFrete
+from tabela_frete.substituicao import substituir_regras_frete
+
+
+# Divergências listadas por tabela (as demais só entram na contagem)
+MAX_DIVERGENCIAS = 20
+
+
+class _Desfazer(Exception):
+    """--dry-run: desfaz a transação da tabela depois da verificação."""
+
+
+class Command(BaseCommand):
+    help = 'Carrega as planilhas de frete dos marketplaces nas tabelas de frete'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'marketplaces',
+            nargs='*',
+            help=f'Marketplaces a carregar: {", ".join(sorted(MARKETPLACES))} (padrão: todos)',
+        )
+        parser.add_argument(
+            '--diretorio',
+            default=str(settings.BASE_DIR / 'Tabela Frete'),
+            help='Pasta com as planilhas (padrão: "Tabela Frete" do projeto)',
+        )
+        parser.add_argument(
+            '--verificar',
+            action='store_true',
+            help='Confere se a tabela compilada devolve o valor de cada célula da planilha',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Carrega e verifica dentro de uma transação desfeita no final',
+        )
+
+    def handle(self, *args, **options):
+        chaves = options['marketplaces'] or list(MARKETPLACES)
+        desconhecidos = sorted(set(chaves) - set(MARKETPLACES))
+        if desconhecidos:
+            raise CommandError(
+                f'Marketplace desconhecido: {", ".join(desconhecidos)} '
+                f'(disponíveis: {", ".join(sorted(MARKETPLACES))})'
+            )
+        falhas = 0
+        for chave in chaves:
+            marketplace = MARKETPLACES[chave]
+            caminho = marketplace.caminho(options['diretorio'])
+            if not caminho.exists():
+                raise CommandError(f'Planilha não encontrada: {caminho}')
+
+            inicio = time.monotonic()
+            leitura = marketplace.ler(caminho)
+            self.stdout.write(
+                f'{marketplace.nome}: {leitura.linhas} linhas, {len(leitura.regras)} regras'
+            )
+            for numero, motivo in leitura.ignoradas:
+                self.stdout.write(self.style.WARNING(f'  Linha {numero} ignorada: {motivo}'))
+            for numero, mensagem in leitura.erros:
+                self.stderr.write(self.style.ERROR(f'  Linha {numero}: {mensagem}'))
+            if not leitura.regras:
+                self.stderr.write(self.style.ERROR('  Nenhuma regra válida; tabela mantida.'))
+                falhas += 1
+                continue
+
+            try:
+                with transaction.atomic():
+                    falhas += self._carregar(marketplace, leitura, options['verificar'])
+                    if options['dry_run']:
+                        raise _Desfazer
+            except _Desfazer:
+                self.stdout.write('  --dry-run: nada foi gravado.')
+            self.stdout.write(f'  Concluído em {time.monotonic() - inicio:.2f}s')
+
+        if falhas:
+            raise CommandError(f'{falhas} tabela(s) com problemas')
+
+    def _carregar(self, marketplace, leitura, verificar_celulas):
+        """Grava as regras da planilha; 1 se a verificação encontrou divergências."""
+        tabela, criada = TabelaFrete.objects.get_or_create(
+            nome=marketplace.nome,
+            defaults={'tipo': marketplace.tipo, 'usa_tabela_excedente': marketplace.usa_tabela_excedente},
+        )
+        if not criada and (tabela.tipo, tabela.usa_tabela_excedente) != (
+            marketplace.tipo, marketplace.usa_tabela_excedente
+        ):
+            # Mudança de tipo recalcula os canais da tabela pelos signals
+            tabela.tipo = marketplace.tipo
+            tabela.usa_tabela_excedente = marketplace.usa_tabela_excedente
+            tabela.save()
+
+        regras = [regra for _, regra in leitura.regras]
+        for regra in regras:
+            regra.tabela = tabela
+        resultado = substituir_regras_frete(
+            tabela, leitura.modelo, regras,
+            motivo=f'Carga da planilha {marketplace.arquivo} na tabela de frete "{tabela.nome}"',
+        )
+        self.stdout.write(
+            f'  Tabela "{tabela.nome}" ({"criada" if criada else "atualizada"}): '
+            f'{resultado.removidas} regras removidas, {resultado.inseridas} inseridas, '
+            f'{resultado.precos_recalculados} preços recalculados'
+        )
+        for relatorio in diagnosticar(tabela):
+            self.stdout.write(f'  {relatorio.resumo()}')
+
+        if not verificar_celulas:
+            return 0
+        pontos, divergencias = verificar(tabela, leitura)
+        if not divergencias:
+            self.stdout.write(self.style.SUCCESS(f'  Verificação: {pontos} pontos conferem com a planilha'))
+            return 0
+        self.stderr.write(self.style.ERROR(
+            f'  Verificação: {len(divergencias)} de {pontos} pontos divergem da planilha'
+        ))
+        for divergencia in divergencias[:MAX_DIVERGENCIAS]:
+            self.stderr.write(f'    {divergencia}')
+        return 1
@@ -0,0 +1,308 @@
+"""
+Leitura das planilhas de frete dos marketplaces (pasta "Tabela Frete").
+
+Cada marketplace publica a tabela no seu próprio formato, com convenções que
+não são as das regras do sistema ([início, fim) e prioridade por ordem):
+
+- peso 0 a 0 significa "qualquer peso";
+- início igual ao fim significa "acima de": a regra começa onde terminam as
+  faixas fechadas do mesmo grupo (Magalu escreve 200,01 a 200,01 depois da
+  faixa 190 a 200) e não tem fim;
+- faixas com fim inclusivo (29 / 29,01, 0,5 / 0,501) viram [início, fim +
+  1 centavo ou 1 grama);
+- no Magalu o score aparece como início = fim (92, 97, 100, 101): cada valor é
+  o limite superior de uma faixa de reputação, então as faixas ficam 0 a 92,
+  93 a 97, 98 a 100 e 101 em diante.
+
+Os leitores devolvem as regras prontas para a inserção em massa (com os
+padrões do save() dos modelos), as linhas que não têm como ser representadas
+e os erros por linha. `verificar` confere, na tabela compilada, o valor de cada célula
+da planilha nos cantos da faixa de cada regra.
+"""
+from decimal import Decimal
+from pathlib import Path
+
+import openpyxl
+
+from .compilador import TabelaFreteCompilada
+from .importacao import ErroLinha, ler_booleano, ler_decimal, ler_inteiro
+from .models import RegraFreteMatriz, RegraFreteSimples
+
+
+UM_GRAMA = Decimal('0.001')
+UM_CENTAVO = Decimal('0.01')
+
+
+class LeituraPlanilha:
+    """Regras lidas de uma planilha de marketplace."""
+
+    def __init__(self, modelo):
+        self.modelo = modelo
+        self.linhas = 0
+        self.regras = []      # (número da linha, regra sem tabela)
+        self.ignoradas = []   # (número da linha, motivo)
+        self.erros = []       # (número da linha, mensagem)
+
+
+class Divergencia:
+    """Ponto em que a tabela compilada não devolve o valor da planilha."""
+
+    def __init__(self, numero, excedente, peso, segundo, esperado, obtido):
+        self.numero = numero
+        self.excedente = excedente
+        self.peso = peso
+        self.segundo = segundo
+        self.esperado = esperado
+        self.obtido = obtido
+
+    def __str__(self):
+        ponto = f'peso {self.peso}' if self.segundo is None else f'peso {self.peso}, {self.segundo}'
+        if self.excedente:
+            ponto += ' (excedente)'
+        return f'linha {self.numero}, {ponto}: esperado {self.esperado}, compilado {self.obtido}'
+
+
+# ------------------------------------------------------------
+# Leitura das linhas
+# ------------------------------------------------------------
+
+def _nome_coluna(valor):
+    # "excedente (0 ou 1)" -> "excedente"
+    return str(valor).strip().lower().split(' ')[0] if valor is not None else ''
+
+
+def _linhas(arquivo):
+    """(número da linha, {coluna: valor}) das linhas com dados da primeira aba."""
+    wb = openpyxl.load_workbook(arquivo, read_only=True, data_only=True)
+    try:
+        linhas = wb.active.iter_rows(values_only=True)
+        colunas = [_nome_coluna(c) for c in next(linhas, None) or ()]
+        for numero, valores in enumerate(linhas, start=2):
+            if any(v is not None and v != '' for v in valores):
+                yield numero, dict(zip(colunas, valores))
+    finally:
+        wb.close()
+
+
+def _ler(leitura, arquivo, ler_linha):
+    for numero, celulas in _linhas(arquivo):
+        leitura.linhas += 1
+        try:
+            ler_linha(numero, celulas)
+        except ErroLinha as e:
+            leitura.erros.append((numero, str(e)))
+    return leitura
+
+
+def _valor_frete(celulas):
+    valor = ler_decimal(celulas.get('valor_frete'), 'valor_frete', 2)
+    if valor is None:
+        raise ErroLinha('valor_frete vazio')
+    return valor
+
+
+def _faixa_peso(celulas, fim_inclusivo=False):
+    """(início, fim, acima_de) do peso: 0 a 0 é qualquer peso; início = fim é "acima de"."""
+    inicio = ler_decimal(celulas.get('peso_inicio'), 'peso_inicio', 3) or Decimal('0.000')
+    fim = ler_decimal(celulas.get('peso_fim'), 'peso_fim', 3)
+    if fim is None or fim == inicio == 0:
+        return inicio, None, False
+    if fim == inicio:
+        return inicio, None, True
+    return inicio, fim + UM_GRAMA if fim_inclusivo else fim, False
+
+
+def _abrir_acima(acima, fins_por_grupo):
+    """Regras "acima de X" começam no maior fim fechado do grupo que não passa de X."""
+    for grupo, regra in acima:
+        limites = [fim for fim in fins_por_grupo.get(grupo, ()) if fim <= regra.peso_inicio]
+        if limites:
+            regra.peso_inicio = max(limites)
+
+
+# ------------------------------------------------------------
+# Marketplaces
+# ------------------------------------------------------------
+
+def ler_mercado_livre(arquivo):
+    """
+    Matriz peso × preço. Linhas de peso 0 a 0 (produtos abaixo de R$ 79) valem
+    para qualquer peso; o preço tem fim inclusivo (78,99 / 79).
+    """
+    leitura = LeituraPlanilha(RegraFreteMatriz)
+    fins_por_grupo = {}
+    acima = []
+
+    def ler_linha(numero, celulas):
+        peso_inicio, peso_fim, acima_de = _faixa_peso(celulas)
+        preco_inicio = ler_decimal(celulas.get('preco_inicio'), 'preco_inicio', 2) or Decimal('0.00')
+        preco_fim = ler_decimal(celulas.get('preco_fim'), 'preco_fim', 2)
+        regra = RegraFreteMatriz(
+            peso_inicio=peso_inicio,
+            peso_fim=peso_fim,
+            preco_inicio=preco_inicio,
+            preco_fim=None if preco_fim is None else preco_fim + UM_CENTAVO,
+            score_inicio=0,
+            valor_frete=_valor_frete(celulas),
+            ordem=ler_inteiro(celulas.get('ordem'), 'ordem') or 0,
+        )
+        grupo = (regra.preco_inicio, regra.preco_fim)
+        if acima_de:
+            acima.append((grupo, regra))
+        elif peso_fim is not None:
+            fins_por_grupo.setdefault(grupo, []).append(peso_fim)
+        leitura.regras.append((numero, regra))
+
+    _ler(leitura, arquivo, ler_linha)
+    _abrir_acima(acima, fins_por_grupo)
+    return leitura
+
+
+def ler_magalu(arquivo):
+    """
+    Matriz peso × score, com a tabela excedente (>1m) por peso com fim
+    inclusivo. As linhas só de preço (peso 0 a 0, abaixo de R$ 79) não têm
+    como entrar numa tabela por score e ficam de fora.
+    """
+    leitura = LeituraPlanilha(RegraFreteMatriz)
+    fins_por_grupo = {}
+    acima = []
+    por_score = []
+
+    def ler_linha(numero, celulas):
+        valor_frete = _valor_frete(celulas)
+        excedente = ler_booleano(celulas.get('excedente'))
+        score = ler_inteiro(celulas.get('score_fim'), 'score_fim')
+        if score is None:
+            score = ler_inteiro(celulas.get('score_inicio'), 'score_inicio')
+
+        if score is None and not excedente:
+            preco_inicio = ler_decimal(celulas.get('preco_inicio'), 'preco_inicio', 2)
+            preco_fim = ler_decimal(celulas.get('preco_fim'), 'preco_fim', 2)
+            if preco_inicio is None and preco_fim is None:
+                raise ErroLinha('linha sem score, preço ou excedente')
+            leitura.ignoradas.append((numero, (
+                f'frete de R$ {valor_frete} por preço (R$ {preco_inicio or 0} a R$ {preco_fim or "-"}): '
+                'a tabela é por score'
+            )))
+            return
+
+        peso_inicio, peso_fim, acima_de = _faixa_peso(celulas, fim_inclusivo=excedente)
+        regra = RegraFreteMatriz(
+            peso_inicio=peso_inicio,
+            peso_fim=peso_fim,
+            preco_inicio=Decimal('0.00'),
+            score_inicio=0,
+            valor_frete=valor_frete,
+            ordem=ler_inteiro(celulas.get('ordem'), 'ordem') or 0,
+            excedente=excedente,
+        )
+        grupo = (excedente, score)
+        if acima_de:
+            acima.append((grupo, regra))
+        elif peso_fim is not None:
+            fins_por_grupo.setdefault(grupo, []).append(peso_fim)
+        if score is not None:
+            por_score.append((score, regra))
+        leitura.regras.append((numero, regra))
+
+    _ler(leitura, arquivo, ler_linha)
+    _abrir_acima(acima, fins_por_grupo)
+
+    # Cada score é o limite superior da sua faixa; o maior fica sem fim
+    limites = sorted({score for score, _ in por_score})
+    faixas = {
+        score: (0 if i == 0 else limites[i - 1] + 1, None if i == len(limites) - 1 else score)
+        for i, score in enumerate(limites)
+    }
+    for score, regra in por_score:
+        regra.score_inicio, regra.score_fim = faixas[score]
+    return leitura
+
+
+def ler_shein(arquivo):
+    """Tabela simples por peso, [início, fim)."""
+    leitura = LeituraPlanilha(RegraFreteSimples)
+
+    def ler_linha(numero, celulas):
+        inicio = ler_decimal(celulas.get('peso_inicio'), 'peso_inicio', 3)
+        leitura.regras.append((numero, RegraFreteSimples(
+            inicio=Decimal('0.000') if inicio is None else inicio,
+            fim=ler_decimal(celulas.get('peso_fim'), 'peso_fim', 3),
+            valor_frete=_valor_frete(celulas),
+            excedente=ler_booleano(celulas.get('excedente')),
+        )))
+
+    return _ler(leitura, arquivo, ler_linha)
+
+
+class Marketplace:
+    """Planilha de um marketplace e a TabelaFrete que ela alimenta."""
+
+    def __init__(self, nome, arquivo, tipo, usa_tabela_excedente, ler):
+        self.nome = nome
+        self.arquivo = arquivo
+        self.tipo = tipo
+        self.usa_tabela_excedente = usa_tabela_excedente
+        self.ler = ler
+
+    def caminho(self, diretorio):
+        return Path(diretorio) / self.arquivo
+
+
+MARKETPLACES = {
+    'magalu': Marketplace('Magalu', 'Magalu.xlsx', 'matriz_score', True, ler_magalu),
+    'mercado_livre': Marketplace('Mercado Livre', 'Mercado Livre.xlsx', 'matriz', False, ler_mercado_livre),
+    'shein': Marketplace('Shein', 'Shein.xlsx', 'peso', False, ler_shein),
+}
+
+
+# ------------------------------------------------------------
+# Verificação
+# ------------------------------------------------------------
+
+def _pontos(inicio, fim, passo):
+    """Primeiro e último ponto da faixa [inicio, fim)."""
+    inicio = inicio or 0
+    if fim is None or fim - passo <= inicio:
+        return [inicio]
+    return [inicio, fim - passo]
+
+
+def verificar(tabela, leitura):
+    """
+    Consulta a tabela compilada (sem cache) nos cantos da faixa de cada regra
+    lida e devolve (pontos verificados, [Divergencia]).
+    """
+    compilada = TabelaFreteCompilada(tabela.pk)
+    pontos = 0
+    divergencias = []
+    for numero, regra in leitura.regras:
+        if tabela.tipo == 'peso':
+            consultas = [(peso, None, None, peso) for peso in _pontos(regra.inicio, regra.fim, UM_GRAMA)]
+        elif tabela.tipo == 'preco':
+            consultas = [(preco, preco, None, preco) for preco in _pontos(regra.inicio, regra.fim, UM_CENTAVO)]
+        elif tabela.tipo == 'matriz':
+            consultas = [
+                (peso, preco, None, f'R$ {preco}')
+                for peso in _pontos(regra.peso_inicio, regra.peso_fim, UM_GRAMA)
+                for preco in _pontos(regra.preco_inicio, regra.preco_fim, UM_CENTAVO)
+            ]
+        else:
+            # Score inclusivo no fim: o último ponto é o próprio score_fim
+            fim_score = None if regra.score_fim is None else regra.score_fim + 1
+            consultas = [
+                (peso, None, score, f'score {score}')
+                for peso in _pontos(regra.peso_inicio, regra.peso_fim, UM_GRAMA)
+                for score in _pontos(regra.score_inicio, fim_score, 1)
+            ]
+
+        for peso, preco, score, segundo in consultas:
+            pontos += 1
+            obtido = compilada.frete(tabela.tipo, regra.excedente, peso, preco, score)
+            if obtido != regra.valor_frete:
+                divergencias.append(Divergencia(
+                    numero, regra.excedente, peso, None if tabela.tipo in ('peso', 'preco') else segundo,
+                    regra.valor_frete, obtido,
+                ))
+    return pontos, divergencias
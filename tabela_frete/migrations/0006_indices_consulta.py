@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tabela_frete', '0005_regrafreteespecial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='regrafreteespecial',
+            index=models.Index(condition=models.Q(('ativo', True)), fields=['tabela', 'ordem'], name='regra_especial_busca_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='regrafretematriz',
+            index=models.Index(condition=models.Q(('ativo', True)), fields=['tabela', 'excedente', 'ordem'], name='regra_matriz_busca_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='regrafretesimples',
+            index=models.Index(condition=models.Q(('ativo', True)), fields=['tabela', 'excedente', 'inicio'], name='regra_simples_busca_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='regrataxa',
+            index=models.Index(condition=models.Q(('ativo', True)), fields=['tabela', 'preco_inicio'], name='regra_taxa_busca_idx'),
+        ),
+    ]
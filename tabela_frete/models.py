@@ -2,6 +2,8 @@ from django.db import models
 from django.core.validators import MinValueValidator, MaxValueValidator
 from decimal import Decimal
 
+from produtos import metricas
+
 class TabelaFrete(models.Model):
     TIPO_CHOICES = [
         ('peso', 'Por Peso (kg)'),
@@ -42,10 +44,12 @@ class TabelaFrete(models.Model):
         
         # 0. Verifica Regras Especiais (Prioridade Máxima)
         # Ex: Se peso > 30kg ou dimensões > X, usa valor fixo especial
-        regras_especiais = self.regras_especiais.filter(ativo=True).order_by('ordem')
-        for regra in regras_especiais:
+        compilada = self.compilada()
+        for regra in compilada.especiais:
             if regra.avaliar_condicao(largura, altura, profundidade, peso):
+                metricas.FRETE_CONSULTAS.inc(regra='especial')
                 return regra.valor_frete
+        metricas.FRETE_CONSULTAS.inc(regra=self.tipo)
 
         # 1. Verifica se é excedente (> 100cm em qualquer dimensão)
         # Só ativa a flag se a tabela estiver configurada para usar tabela excedente
@@ -68,9 +72,9 @@ class TabelaFrete(models.Model):
         # Aplica desconto por nota se existir e se o canal tiver nota
         if self.suporta_nota_vendedor and nota_vendedor:
             try:
-                desc = self.descontos_nota.filter(nota=nota_vendedor).first()
-                if desc:
-                    fator = (Decimal('100') - desc.percentual_desconto) / Decimal('100')
+                percentual = compilada.descontos.get(nota_vendedor)
+                if percentual is not None:
+                    fator = (Decimal('100') - percentual) / Decimal('100')
                     valor_frete = (valor_frete * fator).quantize(Decimal('0.01'))
             except Exception:
                 pass
@@ -81,28 +85,24 @@ class TabelaFrete(models.Model):
 
         return valor_frete
 
+    def compilada(self):
+        """Regras compiladas em faixas (cache versionado, invalidado pelos signals)."""
+        from .compilador import obter_tabela_frete
+        return obter_tabela_frete(self)
+
     def _calcular_matriz(self, peso, preco, excedente):
-        regras = self.regras_matriz.filter(ativo=True, excedente=excedente).order_by('ordem', 'peso_inicio', 'preco_inicio')
-        for regra in regras:
-            if regra.avaliar_condicao(peso, preco=preco):
-                return regra.valor_frete
-        return Decimal('0.00')
+        valor = self.compilada().frete('matriz', excedente, peso, preco, None)
+        return Decimal('0.00') if valor is None else valor
 
     def _calcular_matriz_score(self, peso, score, excedente):
         if score is None: score = 0
-        regras = self.regras_matriz.filter(ativo=True, excedente=excedente).order_by('ordem', 'peso_inicio', 'score_inicio')
-        for regra in regras:
-            if regra.avaliar_condicao(peso, score=score):
-                return regra.valor_frete
-        return Decimal('0.00')
+        valor = self.compilada().frete('matriz_score', excedente, peso, None, score)
+        return Decimal('0.00') if valor is None else valor
 
     def _calcular_simples(self, valor_teste, excedente):
         """Busca regra para tabelas de Peso ou Preço (1 dimensão)"""
-        regras = self.regras_simples.filter(ativo=True, excedente=excedente).order_by('inicio')
-        for regra in regras:
-            if regra.avaliar_condicao(valor_teste):
-                return regra.valor_frete
-        return Decimal('0.00')
+        valor = self.compilada().frete(self.tipo, excedente, valor_teste, valor_teste, None)
+        return Decimal('0.00') if valor is None else valor
 
 
 class RegraFreteEspecial(models.Model):
@@ -126,6 +126,9 @@ class RegraFreteEspecial(models.Model):
         verbose_name = 'Regra Especial'
         verbose_name_plural = 'Regras Especiais'
         ordering = ['tabela', 'ordem']
+        indexes = [
+            models.Index(fields=['tabela', 'ordem'], condition=models.Q(ativo=True), name='regra_especial_busca_idx'),
+        ]
 
     def avaliar_condicao(self, largura, altura, profundidade, peso):
         # Se o campo estiver preenchido, a condição deve ser atendida
@@ -169,6 +172,12 @@ class RegraFreteMatriz(models.Model):
         verbose_name = 'Regra Matriz'
         verbose_name_plural = 'Regras Matriz'
         ordering = ['tabela', 'excedente', 'ordem']
+        indexes = [
+            # Regras ativas compiladas por (tabela, excedente), ver compilador
+            models.Index(
+                fields=['tabela', 'excedente', 'ordem'], condition=models.Q(ativo=True), name='regra_matriz_busca_idx'
+            ),
+        ]
 
     def save(self, *args, **kwargs):
         if self.peso_inicio is None: self.peso_inicio = Decimal('0.000')
@@ -228,6 +237,11 @@ class RegraFreteSimples(models.Model):
         verbose_name = 'Regra Simples (Peso ou Preço)'
         verbose_name_plural = 'Regras Simples'
         ordering = ['tabela', 'excedente', 'inicio']
+        indexes = [
+            models.Index(
+                fields=['tabela', 'excedente', 'inicio'], condition=models.Q(ativo=True), name='regra_simples_busca_idx'
+            ),
+        ]
 
     def save(self, *args, **kwargs):
         if self.inicio is None: self.inicio = Decimal('0.000')
@@ -256,12 +270,10 @@ class TabelaTaxa(models.Model):
         return self.nome
 
     def calcular_taxa(self, preco):
+        from .compilador import obter_tabela_taxa
         if preco is None: preco = Decimal('0.00')
-        regras = self.regras.filter(ativo=True).order_by('preco_inicio')
-        for regra in regras:
-            if regra.avaliar(preco):
-                return regra.valor_taxa
-        return Decimal('0.00')
+        valor = obter_tabela_taxa(self.pk).taxa(preco)
+        return Decimal('0.00') if valor is None else valor
 
 class RegraTaxa(models.Model):
     tabela = models.ForeignKey(TabelaTaxa, related_name='regras', on_delete=models.CASCADE)
@@ -270,6 +282,11 @@ class RegraTaxa(models.Model):
     valor_taxa = models.DecimalField(max_digits=10, decimal_places=2)
     ativo = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['tabela', 'preco_inicio'], condition=models.Q(ativo=True), name='regra_taxa_busca_idx'),
+        ]
+
     def save(self, *args, **kwargs):
         if self.preco_inicio is None: self.preco_inicio = Decimal('0.00')
         super().save(*args, **kwargs)
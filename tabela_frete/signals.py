@@ -0,0 +1,48 @@
+"""
+Signals das tabelas de frete e taxa: invalidam as tabelas compiladas.
+"""
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+
+
+MODELOS_FRETE = [
+    'tabela_frete.TabelaFrete',
+    'tabela_frete.RegraFreteMatriz',
+    'tabela_frete.RegraFreteSimples',
+    'tabela_frete.RegraFreteEspecial',
+    'tabela_frete.DescontoNotaVendedor',
+]
+
+MODELOS_TAXA = [
+    'tabela_frete.TabelaTaxa',
+    'tabela_frete.RegraTaxa',
+]
+
+
+def _tabela_id(instance):
+    # A própria tabela ou a tabela da regra; None numa tabela ainda não salva
+    return getattr(instance, 'tabela_id', instance.pk)
+
+
+def on_regras_frete_alteradas(sender, instance, **kwargs):
+    """
+    Regras mudaram: a tabela compilada é refeita na próxima consulta.
+    Também no pre_*: em autocommit o recálculo de preços (produtos.signals)
+    roda dentro do post_save, antes deste receiver.
+    """
+    from .compilador import invalidar_tabela_frete
+    if _tabela_id(instance) is not None:
+        invalidar_tabela_frete(_tabela_id(instance))
+
+
+def on_regras_taxa_alteradas(sender, instance, **kwargs):
+    """Mesmo que on_regras_frete_alteradas, para as tabelas de taxa."""
+    from .compilador import invalidar_tabela_taxa
+    if _tabela_id(instance) is not None:
+        invalidar_tabela_taxa(_tabela_id(instance))
+
+
+for _sinal in (pre_save, post_save, pre_delete, post_delete):
+    for _modelo in MODELOS_FRETE:
+        _sinal.connect(on_regras_frete_alteradas, sender=_modelo)
+    for _modelo in MODELOS_TAXA:
+        _sinal.connect(on_regras_taxa_alteradas, sender=_modelo)
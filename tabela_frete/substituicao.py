@@ -0,0 +1,186 @@
+"""
+Alterações em lote das regras de frete e de taxa, sem signals por regra.
+
+`.delete()` de um queryset de regras apaga linha a linha para enviar
+post_delete, e cada signal agenda um recálculo completo dos canais da tabela.
+Aqui as regras são trocadas com um DELETE e uma inserção em massa
+(produtos.escrita: COPY no PostgreSQL; nenhum signal) e o
+recálculo é feito uma vez, no final, só para os preços que podem ter mudado:
+
+- antes da troca a tabela é compilada (compilador) e, depois dela, de novo;
+- cada produto dos canais que usam a tabela tem uma "assinatura" de frete em
+  cada versão: a regra especial que o atende ou, senão, os valores da faixa
+  de peso em que ele cai (para matriz, a fatia inteira do segundo eixo, já que
+  o preço de venda depende do frete);
+- só os preços de produtos cuja assinatura mudou são recalculados, em lote.
+
+Tabelas por preço e tabelas de taxa dependem do próprio preço de venda: se
+o layout mudou, todos os preços que usam a tabela são recalculados.
+
+A inserção não chama save(): os objetos já devem vir com os padrões que o
+save() dos modelos aplicaria (ver importacao.construir_regra_*).
+"""
+from contextlib import contextmanager
+from decimal import Decimal
+from django.db import transaction
+
+from produtos.escrita import inserir_em_massa
+
+from .compilador import TabelaTaxaCompilada, compilar_tabela_frete, invalidar_tabela_frete, invalidar_tabela_taxa
+from .models import RegraFreteEspecial, RegraFreteMatriz, RegraFreteSimples, RegraTaxa
+
+
+TAMANHO_LOTE = 2000
+
+MODELOS_FRETE = (RegraFreteMatriz, RegraFreteSimples, RegraFreteEspecial)
+
+
+class ResultadoAlteracao:
+    """Contagens da alteração em lote."""
+
+    def __init__(self):
+        self.removidas = 0
+        self.inseridas = 0
+        self.precos_recalculados = 0
+
+
+# ------------------------------------------------------------
+# Assinaturas de frete por produto
+# ------------------------------------------------------------
+
+class _Assinaturas:
+    """O que decide o frete de um produto numa versão compilada da tabela."""
+
+    def __init__(self, tabela, compilada):
+        self.tabela = tabela
+        self.compilada = compilada
+        self._segmentos = {}
+
+    def _faixas(self, faixas):
+        if faixas is None:
+            return ()
+        chave = id(faixas)
+        if chave not in self._segmentos:
+            self._segmentos[chave] = faixas.segmentos()
+        return self._segmentos[chave]
+
+    def __call__(self, peso, largura, altura, profundidade):
+        for regra in self.compilada.especiais:
+            if regra.avaliar_condicao(largura, altura, profundidade, peso):
+                return ('especial', regra.valor_frete)
+
+        excedente = self.tabela.usa_tabela_excedente and (largura > 100 or altura > 100 or profundidade > 100)
+        layout, _ = self.compilada.layout(self.tabela.tipo, excedente)
+        if self.tabela.tipo in ('matriz', 'matriz_score'):
+            return ('faixas', excedente, self._faixas(layout.fatia(peso)))
+        if self.tabela.tipo == 'peso':
+            return ('valor', excedente, layout.buscar(peso))
+        return ('faixas', excedente, self._faixas(layout))
+
+
+def _recalcular_frete(tabela, antes, depois, motivo):
+    from produtos.models import PrecoProdutoCanal, Produto
+    from produtos.recalculo import recalcular_em_lote
+
+    # Canais com frete fixo e preços com frete específico não usam a tabela
+    precos = PrecoProdutoCanal.objects.filter(
+        canal__tabela_frete=tabela, canal__tipo_frete='tabela', ativo=True, frete_especifico__isnull=True,
+    )
+    assinatura_antes = _Assinaturas(tabela, antes)
+    assinatura_depois = _Assinaturas(tabela, depois)
+
+    afetados = []
+    for pk, peso_fisico, largura, altura, profundidade in Produto.objects.filter(
+        pk__in=precos.values('produto_id')
+    ).values_list('pk', 'peso_fisico', 'largura', 'altura', 'profundidade'):
+        # Mesmo peso de Produto.peso_produto
+        peso = max(peso_fisico, (largura * altura * profundidade) / Decimal('6000'))
+        if assinatura_antes(peso, largura, altura, profundidade) != assinatura_depois(peso, largura, altura, profundidade):
+            afetados.append(pk)
+
+    if not afetados:
+        return 0
+    return recalcular_em_lote(precos.filter(produto_id__in=afetados), motivo=motivo, cascata='tabela_frete')
+
+
+def _recalcular_taxa(tabela_taxa, antes, depois, motivo):
+    from produtos.models import PrecoProdutoCanal
+    from produtos.recalculo import recalcular_em_lote
+
+    if antes.faixas.segmentos() == depois.faixas.segmentos():
+        return 0
+    return recalcular_em_lote(
+        PrecoProdutoCanal.objects.filter(canal__tabela_taxa=tabela_taxa, ativo=True), motivo=motivo,
+        cascata='tabela_taxa',
+    )
+
+
+# ------------------------------------------------------------
+# Alterações
+# ------------------------------------------------------------
+
+@contextmanager
+def alteracao_regras_frete(tabela, motivo):
+    """
+    Bloco atômico para alterar regras da tabela sem signals (inserção em
+    massa, update, DELETE direto); no fim, um único recálculo dos preços afetados.
+    """
+    resultado = ResultadoAlteracao()
+    with transaction.atomic():
+        antes = compilar_tabela_frete(tabela)
+        yield resultado
+        invalidar_tabela_frete(tabela.pk)
+        resultado.precos_recalculados = _recalcular_frete(tabela, antes, compilar_tabela_frete(tabela), motivo)
+
+
+@contextmanager
+def alteracao_regras_taxa(tabela_taxa, motivo):
+    """Mesmo que alteracao_regras_frete, para uma tabela de taxa."""
+    resultado = ResultadoAlteracao()
+    with transaction.atomic():
+        antes = TabelaTaxaCompilada(tabela_taxa.pk)
+        yield resultado
+        invalidar_tabela_taxa(tabela_taxa.pk)
+        resultado.precos_recalculados = _recalcular_taxa(
+            tabela_taxa, antes, TabelaTaxaCompilada(tabela_taxa.pk), motivo
+        )
+
+
+def apagar_regras(queryset):
+    """DELETE direto, sem carregar as regras nem enviar post_delete (nada referencia as regras)."""
+    # _raw_delete é privado, mas é o DELETE que o próprio Collector usa quando
+    # não há cascatas nem signals. queryset.delete() carregaria todas as regras
+    # (centenas de milhares numa substituição) só para enviar post_delete, e os
+    # receivers de tabela_frete.signals apenas agendariam o recálculo completo
+    # da tabela e a invalidação da compilação, que alteracao_regras_* já faz
+    # uma vez no final. Nenhum modelo tem FK para as regras: não há o que cascatear.
+    # recalculo_suspenso() não cobre esses signals, então não é uma alternativa.
+    return queryset._raw_delete(queryset.db)
+
+
+def inserir_regras(modelo, regras, tamanho_lote=TAMANHO_LOTE):
+    """Inserção em massa, em lotes, de um iterável (pode ser um gerador). Retorna o total inserido."""
+    return inserir_em_massa(modelo, regras, tamanho_lote)
+
+
+def substituir_regras_frete(tabela, modelo, regras, motivo=None, tamanho_lote=TAMANHO_LOTE):
+    """
+    Troca todas as regras de `modelo` (matriz, simples ou especial) da tabela
+    pelas de `regras`, numa transação, com um único recálculo no final.
+    """
+    if modelo not in MODELOS_FRETE:
+        raise ValueError(f'{modelo.__name__} não é um modelo de regras de frete')
+    motivo = motivo or f'Regras da tabela de frete "{tabela.nome}" substituídas'
+    with alteracao_regras_frete(tabela, motivo) as resultado:
+        resultado.removidas = apagar_regras(modelo.objects.filter(tabela=tabela))
+        resultado.inseridas = inserir_regras(modelo, regras, tamanho_lote)
+    return resultado
+
+
+def substituir_regras_taxa(tabela_taxa, regras, motivo=None, tamanho_lote=TAMANHO_LOTE):
+    """Troca todas as regras da tabela de taxa, com um único recálculo no final."""
+    motivo = motivo or f'Regras da tabela de taxa "{tabela_taxa.nome}" substituídas'
+    with alteracao_regras_taxa(tabela_taxa, motivo) as resultado:
+        resultado.removidas = apagar_regras(RegraTaxa.objects.filter(tabela=tabela_taxa))
+        resultado.inseridas = inserir_regras(RegraTaxa, regras, tamanho_lote)
+    return resultado
@@ -1,3 +1,699 @@
-from django.test import TestCase
+import random
+from decimal import Decimal
+from io import BytesIO, StringIO
 
-# Create your tests here.
+import openpyxl
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+
+from app.testes import TestCase
+from canais_vendas.models import CanalVenda
+from grupo_vendas.models import GrupoCanais
+from produtos.models import ExecucaoRecalculo, HistoricoPreco, PrecoProdutoCanal, Produto
+
+from .compilador import compilar_simples, diagnosticar
+from .edicao import EdicaoInvalida, editar_regras_matriz, ler_edicao
+from .importacao import (
+    MAX_ERROS_RELATORIO, importar_regras_matriz, importar_regras_simples, validar_regras_simples,
+)
+from .marketplaces import MARKETPLACES, ler_magalu, ler_mercado_livre, ler_shein, verificar
+from .models import RegraFreteEspecial, RegraFreteMatriz, RegraFreteSimples, RegraTaxa, TabelaFrete, TabelaTaxa
+from .substituicao import alteracao_regras_frete, apagar_regras, substituir_regras_frete, substituir_regras_taxa
+
+
+ZERO = Decimal('0.00')
+
+
+def _decimal(aleatorio, maximo, casas=1):
+    return Decimal(aleatorio.randint(0, maximo * 10 ** casas)) / 10 ** casas
+
+
+def _fim(aleatorio, inicio, maximo):
+    """Fim aberto, vazio (fim <= início) ou depois do início."""
+    sorteio = aleatorio.random()
+    if sorteio < 0.2:
+        return None
+    if sorteio < 0.25:
+        return inicio
+    return inicio + _decimal(aleatorio, maximo) + Decimal('0.1')
+
+
+def _pontos(limites, aleatorio, quantidade=40):
+    """Limites das regras, vizinhos dos limites e pontos sorteados."""
+    pontos = {ZERO}
+    for limite in limites:
+        if limite is not None:
+            pontos.update({limite, limite - Decimal('0.01'), limite + Decimal('0.01')})
+    pontos.update(_decimal(aleatorio, 120, 2) for _ in range(quantidade))
+    return sorted(p for p in pontos if p >= 0)
+
+
+class CompiladorEquivalenciaTest(TestCase):
+    """
+    A consulta nas faixas compiladas dá a mesma regra que a busca linear
+    original (primeira regra que casa com avaliar_condicao, na ordem de cada tipo).
+    Empates de ordem são desfeitos pelo pk nas duas buscas.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.aleatorio = random.Random(20260101)
+
+    # Busca linear de referência (a implementação anterior à compilação), com as regras já carregadas
+
+    def _primeira(self, regras, condicao, valor):
+        for regra in regras:
+            if condicao(regra):
+                return getattr(regra, valor)
+        return ZERO
+
+    def _matriz(self, tabela, score=False, excedente=False):
+        segundo = 'score_inicio' if score else 'preco_inicio'
+        return list(tabela.regras_matriz.filter(ativo=True, excedente=excedente).order_by(
+            'ordem', 'peso_inicio', segundo, 'pk'
+        ))
+
+    # Regras sorteadas, com sobreposições, fins abertos, regras vazias e inativas
+
+    def _regras_matriz(self, tabela, quantidade=25, excedente=False, score=False):
+        for _ in range(quantidade):
+            peso_inicio = _decimal(self.aleatorio, 40)
+            campos = {
+                'tabela': tabela, 'ordem': self.aleatorio.randint(0, 3), 'excedente': excedente,
+                'ativo': self.aleatorio.random() > 0.1,
+                'peso_inicio': peso_inicio, 'peso_fim': _fim(self.aleatorio, peso_inicio, 40),
+                'valor_frete': _decimal(self.aleatorio, 90, 2),
+            }
+            if score:
+                score_inicio = self.aleatorio.randint(0, 80)
+                sorteio = self.aleatorio.random()
+                campos['score_inicio'] = score_inicio
+                campos['score_fim'] = None if sorteio < 0.2 else score_inicio + self.aleatorio.randint(-1, 40)
+            else:
+                preco_inicio = _decimal(self.aleatorio, 100)
+                campos['preco_inicio'] = preco_inicio
+                campos['preco_fim'] = _fim(self.aleatorio, preco_inicio, 100)
+            RegraFreteMatriz.objects.create(**campos)
+
+    def _regras_simples(self, tabela, quantidade=20, excedente=False):
+        for _ in range(quantidade):
+            inicio = _decimal(self.aleatorio, 100)
+            RegraFreteSimples.objects.create(
+                tabela=tabela, inicio=inicio, fim=_fim(self.aleatorio, inicio, 60), excedente=excedente,
+                valor_frete=_decimal(self.aleatorio, 90, 2), ativo=self.aleatorio.random() > 0.1,
+            )
+
+    def _limites(self, *campos, modelo=RegraFreteMatriz, **filtros):
+        limites = []
+        for valores in modelo.objects.filter(**filtros).values_list(*campos):
+            limites.extend(valores)
+        return limites
+
+    def test_matriz_peso_preco(self):
+        tabela = TabelaFrete.objects.create(nome='Matriz', tipo='matriz')
+        self._regras_matriz(tabela)
+        pesos = _pontos(self._limites('peso_inicio', 'peso_fim', tabela=tabela), self.aleatorio)
+        precos = _pontos(self._limites('preco_inicio', 'preco_fim', tabela=tabela), self.aleatorio)
+
+        regras = self._matriz(tabela)
+        for peso in pesos:
+            for preco in precos:
+                esperado = self._primeira(regras, lambda r: r.avaliar_condicao(peso, preco=preco), 'valor_frete')
+                self.assertEqual(tabela.calcular_frete(peso=peso, preco=preco), esperado, f'peso={peso} preco={preco}')
+
+    def test_matriz_peso_score(self):
+        tabela = TabelaFrete.objects.create(nome='Matriz Score', tipo='matriz_score')
+        self._regras_matriz(tabela, score=True)
+        pesos = _pontos(self._limites('peso_inicio', 'peso_fim', tabela=tabela), self.aleatorio)
+        scores = sorted({s + d for s in self._limites('score_inicio', 'score_fim', tabela=tabela) if s is not None
+                         for d in (-1, 0, 1)} | {0, 200})
+
+        regras = self._matriz(tabela, score=True)
+        for peso in pesos:
+            for score in scores:
+                esperado = self._primeira(regras, lambda r: r.avaliar_condicao(peso, score=score), 'valor_frete')
+                self.assertEqual(tabela.calcular_frete(peso=peso, score=score), esperado, f'peso={peso} score={score}')
+
+    def test_simples_por_peso_e_por_preco(self):
+        for tipo in ('peso', 'preco'):
+            tabela = TabelaFrete.objects.create(nome=f'Simples {tipo}', tipo=tipo)
+            self._regras_simples(tabela)
+            valores = _pontos(
+                self._limites('inicio', 'fim', modelo=RegraFreteSimples, tabela=tabela), self.aleatorio
+            )
+            regras = list(tabela.regras_simples.filter(ativo=True).order_by('inicio', 'pk'))
+            for valor in valores:
+                esperado = self._primeira(regras, lambda r: r.avaliar_condicao(valor), 'valor_frete')
+                self.assertEqual(tabela.calcular_frete(peso=valor, preco=valor), esperado, f'{tipo}={valor}')
+
+    def test_excedente_usa_as_regras_excedentes(self):
+        tabela = TabelaFrete.objects.create(nome='Excedente', tipo='matriz', usa_tabela_excedente=True)
+        self._regras_matriz(tabela, quantidade=10)
+        self._regras_matriz(tabela, quantidade=10, excedente=True)
+        pesos = _pontos(self._limites('peso_inicio', 'peso_fim', tabela=tabela), self.aleatorio, 10)
+        precos = _pontos(self._limites('preco_inicio', 'preco_fim', tabela=tabela), self.aleatorio, 10)
+
+        normais, excedentes = self._matriz(tabela), self._matriz(tabela, excedente=True)
+        for peso in pesos:
+            for preco in precos:
+                condicao = lambda r: r.avaliar_condicao(peso, preco=preco)
+                normal = tabela.calcular_frete(peso=peso, preco=preco, largura=100, altura=50, profundidade=50)
+                self.assertEqual(normal, self._primeira(normais, condicao, 'valor_frete'))
+                grande = tabela.calcular_frete(peso=peso, preco=preco, largura=101, altura=50, profundidade=50)
+                self.assertEqual(grande, self._primeira(excedentes, condicao, 'valor_frete'))
+
+    def test_regras_especiais_tem_prioridade_e_respeitam_a_ordem(self):
+        tabela = TabelaFrete.objects.create(nome='Especiais', tipo='peso')
+        RegraFreteSimples.objects.create(tabela=tabela, inicio=ZERO, valor_frete=Decimal('10.00'))
+        RegraFreteEspecial.objects.create(tabela=tabela, ordem=2, peso_min=Decimal('30'), valor_frete=Decimal('99.00'))
+        RegraFreteEspecial.objects.create(
+            tabela=tabela, ordem=1, peso_min=Decimal('30'), largura_min=Decimal('80'), valor_frete=Decimal('150.00'),
+        )
+        RegraFreteEspecial.objects.create(
+            tabela=tabela, ordem=0, altura_min=Decimal('200'), valor_frete=Decimal('300.00'), ativo=False,
+        )
+
+        self.assertEqual(tabela.calcular_frete(peso=Decimal('29.999'), altura=250), Decimal('10.00'))
+        self.assertEqual(tabela.calcular_frete(peso=Decimal('30'), largura=50), Decimal('99.00'))
+        self.assertEqual(tabela.calcular_frete(peso=Decimal('30'), largura=80), Decimal('150.00'))
+
+    def test_tabela_de_taxa(self):
+        tabela = TabelaTaxa.objects.create(nome='Taxa')
+        for _ in range(20):
+            inicio = _decimal(self.aleatorio, 100)
+            RegraTaxa.objects.create(
+                tabela=tabela, preco_inicio=inicio, preco_fim=_fim(self.aleatorio, inicio, 60),
+                valor_taxa=_decimal(self.aleatorio, 20, 2), ativo=self.aleatorio.random() > 0.1,
+            )
+        precos = _pontos(self._limites('preco_inicio', 'preco_fim', modelo=RegraTaxa, tabela=tabela), self.aleatorio)
+
+        regras = list(tabela.regras.filter(ativo=True).order_by('preco_inicio', 'pk'))
+        for preco in precos:
+            esperado = self._primeira(regras, lambda r: r.avaliar(preco), 'valor_taxa')
+            self.assertEqual(tabela.calcular_taxa(preco), esperado, f'preco={preco}')
+
+    def test_alteracao_de_regra_invalida_a_compilacao(self):
+        tabela = TabelaFrete.objects.create(nome='Invalidação', tipo='peso')
+        regra = RegraFreteSimples.objects.create(tabela=tabela, inicio=ZERO, valor_frete=Decimal('10.00'))
+        self.assertEqual(tabela.calcular_frete(peso=Decimal('1')), Decimal('10.00'))
+
+        regra.valor_frete = Decimal('12.00')
+        regra.save()
+        self.assertEqual(tabela.calcular_frete(peso=Decimal('1')), Decimal('12.00'))
+
+
+class DiagnosticoTest(TestCase):
+    """Lacunas, sobreposições e regras sem efeito no relatório da compilação."""
+
+    def setUp(self):
+        super().setUp()
+
+    def test_lacuna_sobreposicao_e_regras_sem_efeito(self):
+        d = Decimal
+        _, relatorio = compilar_simples([
+            (d('0'), d('10'), (d('0'), 1), 1, d('5.00')),
+            (d('5'), d('20'), (d('5'), 2), 2, d('7.00')),       # 5 a 10 encoberto pela 1
+            (d('2'), d('8'), (d('2'), 3), 3, d('9.00')),        # totalmente encoberta pela 1
+            (d('30'), None, (d('30'), 4), 4, d('11.00')),       # lacuna de 20 a 30
+            (d('40'), d('40'), (d('40'), 5), 5, d('13.00')),    # início = fim
+        ], 'Teste', 'kg')
+
+        self.assertEqual(relatorio.contagens, {'lacunas': 1, 'sobreposicoes': 3, 'sem_efeito': 2})
+        self.assertEqual(relatorio.lacunas, ['Sem regra de 20 kg até 30 kg'])
+        self.assertIn('5 kg até 8 kg: vale a regra #1, encobre regra #2, regra #3', relatorio.sobreposicoes)
+        self.assertEqual(relatorio.sem_efeito, [
+            'regra #5: início maior ou igual ao fim',
+            'regra #3: totalmente encoberta por regras de prioridade maior',
+        ])
+        self.assertFalse(relatorio.ok)
+
+    def test_tabela_sem_problemas(self):
+        tabela = TabelaFrete.objects.create(nome='Contínua', tipo='peso')
+        RegraFreteSimples.objects.create(tabela=tabela, inicio=ZERO, fim=Decimal('10'), valor_frete=Decimal('5.00'))
+        RegraFreteSimples.objects.create(tabela=tabela, inicio=Decimal('10'), valor_frete=Decimal('8.00'))
+
+        relatorio, = diagnosticar(tabela)
+        self.assertTrue(relatorio.ok)
+        self.assertEqual(relatorio.total_faixas, 2)
+
+    def test_matriz_relata_lacunas_por_fatia_de_peso_e_excedente(self):
+        tabela = TabelaFrete.objects.create(nome='Matriz', tipo='matriz', usa_tabela_excedente=True)
+        RegraFreteMatriz.objects.create(
+            tabela=tabela, peso_fim=Decimal('5'), preco_fim=Decimal('79'), valor_frete=Decimal('10.00'),
+        )
+        RegraFreteMatriz.objects.create(
+            tabela=tabela, peso_fim=Decimal('5'), preco_inicio=Decimal('100'), valor_frete=Decimal('0.00'),
+        )
+        RegraFreteMatriz.objects.create(tabela=tabela, peso_inicio=Decimal('5'), valor_frete=Decimal('20.00'))
+
+        normal, excedente = diagnosticar(tabela)
+        self.assertEqual(normal.contagens['lacunas'], 1)
+        self.assertIn('Peso 0 kg até 5.000 kg: sem regra de R$ 79.00 até R$ 100.00', normal.lacunas[0])
+        self.assertEqual(normal.contagens['sobreposicoes'], 0)
+        self.assertEqual(excedente.total_regras, 0)
+        self.assertEqual(excedente.resumo(), 'Regras excedentes (>1m): nenhuma regra ativa.')
+
+
+def _planilha(linhas, cabecalho=('cabecalho',)):
+    """XLSX em memória: cabeçalho e as linhas dadas."""
+    livro = openpyxl.Workbook()
+    aba = livro.active
+    aba.append(list(cabecalho))
+    for linha in linhas:
+        aba.append(linha)
+    arquivo = BytesIO()
+    livro.save(arquivo)
+    arquivo.seek(0)
+    return arquivo
+
+
+class SubstituicaoRegrasTest(TestCase):
+    """A troca de regras em lote recalcula só os preços cujo frete ou taxa pode ter mudado."""
+
+    def setUp(self):
+        super().setUp()
+        self.tabela = TabelaFrete.objects.create(nome='Matriz', tipo='matriz')
+        self.tabela_taxa = TabelaTaxa.objects.create(nome='Taxa')
+        with self.captureOnCommitCallbacks(execute=True):
+            RegraFreteMatriz.objects.create(tabela=self.tabela, peso_fim=Decimal('5'), valor_frete=Decimal('10.00'))
+            RegraFreteMatriz.objects.create(tabela=self.tabela, peso_inicio=Decimal('5'), valor_frete=Decimal('20.00'))
+            RegraTaxa.objects.create(tabela=self.tabela_taxa, valor_taxa=Decimal('3.00'))
+            grupo = GrupoCanais.objects.create(nome='Grupo Teste')
+            self.canal = CanalVenda.objects.create(
+                nome='Canal Teste', grupo=grupo, tipo_frete='tabela', tabela_frete=self.tabela,
+                tabela_taxa=self.tabela_taxa,
+            )
+            self.leve = Produto.objects.create(
+                titulo='Leve', sku='LEVE', largura=10, altura=10, profundidade=10, peso_fisico=1,
+            )
+            self.pesado = Produto.objects.create(
+                titulo='Pesado', sku='PESADO', largura=10, altura=10, profundidade=10, peso_fisico=10,
+            )
+            PrecoProdutoCanal.objects.create(produto=self.leve, canal=self.canal)
+            PrecoProdutoCanal.objects.create(produto=self.pesado, canal=self.canal)
+
+    def _preco(self, produto):
+        return PrecoProdutoCanal.objects.get(produto=produto, canal=self.canal)
+
+    def _regras(self, valor_pesado):
+        """Regras na forma da importação: com os padrões que o save() aplicaria."""
+        return [
+            RegraFreteMatriz(
+                tabela=self.tabela, peso_inicio=Decimal('0.000'), peso_fim=Decimal('5'),
+                preco_inicio=Decimal('0.00'), score_inicio=0, valor_frete=Decimal('10.00'),
+            ),
+            RegraFreteMatriz(
+                tabela=self.tabela, peso_inicio=Decimal('5'), preco_inicio=Decimal('0.00'), score_inicio=0,
+                valor_frete=valor_pesado,
+            ),
+        ]
+
+    def test_recalcula_so_os_produtos_com_frete_alterado(self):
+        leve = self._preco(self.leve)
+        self.assertEqual(leve.frete_calculado, Decimal('10.00'))
+        historicos = HistoricoPreco.objects.count()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            resultado = substituir_regras_frete(self.tabela, RegraFreteMatriz, self._regras(Decimal('25.00')))
+
+        self.assertEqual((resultado.removidas, resultado.inseridas, resultado.precos_recalculados), (2, 2, 1))
+        self.assertEqual(self._preco(self.pesado).frete_calculado, Decimal('25.00'))
+        self.assertEqual(self._preco(self.leve).calculado_em, leve.calculado_em)
+        self.assertEqual(HistoricoPreco.objects.count(), historicos + 1)
+        self.assertEqual(HistoricoPreco.objects.latest('pk').produto, self.pesado)
+
+    def test_regras_equivalentes_nao_recalculam_nada(self):
+        pesado = self._preco(self.pesado)
+        with self.captureOnCommitCallbacks(execute=True):
+            resultado = substituir_regras_frete(self.tabela, RegraFreteMatriz, self._regras(Decimal('20.00')))
+
+        self.assertEqual(resultado.inseridas, 2)
+        self.assertEqual(resultado.precos_recalculados, 0)
+        self.assertEqual(self._preco(self.pesado).calculado_em, pesado.calculado_em)
+
+    def test_taxa_recalcula_todos_os_precos_quando_o_layout_muda(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            igual = substituir_regras_taxa(
+                self.tabela_taxa, [RegraTaxa(tabela=self.tabela_taxa, valor_taxa=Decimal('3.00'))],
+            )
+        self.assertEqual(igual.precos_recalculados, 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            resultado = substituir_regras_taxa(
+                self.tabela_taxa, [RegraTaxa(tabela=self.tabela_taxa, valor_taxa=Decimal('4.00'))],
+            )
+        self.assertEqual(resultado.precos_recalculados, 2)
+        self.assertEqual(self._preco(self.leve).taxa_calculada, Decimal('4.00'))
+        self.assertEqual(self._preco(self.pesado).taxa_calculada, Decimal('4.00'))
+
+    def test_erro_no_bloco_desfaz_a_troca(self):
+        with self.assertRaises(RuntimeError):
+            with alteracao_regras_frete(self.tabela, 'Teste'):
+                apagar_regras(RegraFreteMatriz.objects.filter(tabela=self.tabela))
+                raise RuntimeError('falhou')
+        self.assertEqual(self.tabela.regras_matriz.count(), 2)
+
+    def test_importacao_sem_linhas_validas_desfaz_a_substituicao(self):
+        arquivo = _planilha([[0, 5, None, None, None, None, 'abc'], [5, None, None, None, None, None, None]])
+        with self.captureOnCommitCallbacks(execute=True):
+            relatorio = importar_regras_matriz(self.tabela, arquivo, substituir=True)
+
+        self.assertEqual((relatorio.linhas, relatorio.importadas, relatorio.total_erros), (2, 0, 2))
+        self.assertEqual(
+            sorted(self.tabela.regras_matriz.values_list('valor_frete', flat=True)),
+            [Decimal('10.00'), Decimal('20.00')],
+        )
+        self.assertEqual(self._preco(self.pesado).frete_calculado, Decimal('20.00'))
+
+
+class ImportacaoRegrasTest(TestCase):
+    """Importação de regras por planilha: relatório por linha, limite do relatório e substituição."""
+
+    def setUp(self):
+        super().setUp()
+        self.matriz = TabelaFrete.objects.create(nome='Matriz', tipo='matriz_score')
+        self.simples = TabelaFrete.objects.create(nome='Por peso', tipo='peso')
+        RegraFreteSimples.objects.create(tabela=self.simples, fim=Decimal('10'), valor_frete=Decimal('5.00'))
+
+    def test_relatorio_de_erros_por_linha(self):
+        relatorio = importar_regras_matriz(self.matriz, _planilha([
+            [None, '5,5', None, None, 0, 50, '12,34', None, 'sim'],
+            [],
+            ['x', 10, None, None, None, None, 9],
+            [0, 10, None, None, None, None, None],
+            [0, 10, None, None, None, None, 9, -1],
+            [0, 10, None, None, '1.5', None, 9],
+            [0, 10, None, None, None, None, 123456789],
+            [5.5, None, None, None, 51, None, 20, 2, 0],
+        ]))
+
+        self.assertEqual((relatorio.linhas, relatorio.validas, relatorio.importadas), (7, 2, 2))
+        self.assertEqual(relatorio.erros, [
+            (4, 'peso_inicio: "x" não é um número'),
+            (5, 'valor_frete vazio'),
+            (6, 'ordem não pode ser negativa'),
+            (7, 'score_inicio: "1.5" não é um número inteiro'),
+            (8, 'valor_frete: valor 123456789.00 fora do limite'),
+        ])
+        primeira, segunda = self.matriz.regras_matriz.order_by('ordem')
+        self.assertEqual(
+            (primeira.peso_inicio, primeira.peso_fim, primeira.valor_frete, primeira.excedente),
+            (Decimal('0.000'), Decimal('5.500'), Decimal('12.34'), True),
+        )
+        self.assertEqual((primeira.preco_inicio, primeira.score_fim), (Decimal('0.00'), 50))
+        self.assertEqual((segunda.score_inicio, segunda.ordem, segunda.excedente), (51, 2, False))
+
+    def test_relatorio_guarda_no_maximo_max_erros(self):
+        linhas = [[0, 10, None]] * (MAX_ERROS_RELATORIO + 5) + [[10, None, 8]]
+        relatorio = importar_regras_simples(self.simples, _planilha(linhas))
+
+        self.assertEqual(relatorio.total_erros, MAX_ERROS_RELATORIO + 5)
+        self.assertEqual(len(relatorio.erros), MAX_ERROS_RELATORIO)
+        self.assertEqual(relatorio.erros_omitidos, 5)
+        self.assertEqual(relatorio.erros[-1], (MAX_ERROS_RELATORIO + 1, 'valor_frete vazio'))
+        self.assertEqual(relatorio.importadas, 1)
+
+    def test_sem_substituir_acrescenta_as_regras(self):
+        relatorio = importar_regras_simples(self.simples, _planilha([[10, None, 8]]))
+
+        self.assertEqual(relatorio.importadas, 1)
+        self.assertEqual(self.simples.regras_simples.count(), 2)
+
+    def test_substituir_troca_as_regras(self):
+        relatorio = importar_regras_simples(
+            self.simples, _planilha([[0, 20, 7], [20, None, 9, 'x']]), substituir=True,
+        )
+
+        self.assertEqual(relatorio.importadas, 2)
+        self.assertEqual(
+            list(self.simples.regras_simples.order_by('inicio').values_list('valor_frete', 'excedente')),
+            [(Decimal('7.00'), False), (Decimal('9.00'), True)],
+        )
+
+    def test_substituir_sem_linhas_validas_mantem_as_regras(self):
+        relatorio = importar_regras_simples(self.simples, _planilha([[0, 20, 'abc'], [20]]), substituir=True)
+
+        self.assertEqual((relatorio.linhas, relatorio.importadas, relatorio.total_erros), (2, 0, 2))
+        self.assertEqual(
+            list(self.simples.regras_simples.values_list('valor_frete', flat=True)), [Decimal('5.00')]
+        )
+
+    def test_validar_nao_grava_e_informa_o_andamento(self):
+        andamento = []
+        relatorio = validar_regras_simples(
+            self.simples, _planilha([[0, 1, 2], [1, 2, 'x'], [2, 3, 4]]),
+            progresso=lambda r: andamento.append((r.linhas, r.total_erros)), tamanho_lote=1,
+        )
+
+        self.assertEqual((relatorio.linhas, relatorio.validas), (3, 2))
+        self.assertEqual(andamento, [(1, 0), (3, 1)])
+        self.assertEqual(self.simples.regras_simples.count(), 1)
+
+
+class EdicaoMatrizTest(TestCase):
+    """Edição em massa das regras matriz: formato do JSON, tudo ou nada e um único recálculo."""
+
+    def setUp(self):
+        super().setUp()
+        self.usuario = User.objects.create_user('edicao', password='x')
+        self.tabela = TabelaFrete.objects.create(nome='Matriz', tipo='matriz')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.leves = RegraFreteMatriz.objects.create(
+                tabela=self.tabela, peso_fim=Decimal('5'), valor_frete=Decimal('10.00'),
+            )
+            self.pesados = RegraFreteMatriz.objects.create(
+                tabela=self.tabela, peso_inicio=Decimal('5'), valor_frete=Decimal('20.00'),
+            )
+            grupo = GrupoCanais.objects.create(nome='Grupo Teste')
+            canal = CanalVenda.objects.create(
+                nome='Canal Teste', grupo=grupo, tipo_frete='tabela', tabela_frete=self.tabela,
+            )
+            for sku, peso in (('LEVE', 1), ('PESADO', 10)):
+                produto = Produto.objects.create(
+                    titulo=sku, sku=sku, largura=10, altura=10, profundidade=10, peso_fisico=peso,
+                )
+                PrecoProdutoCanal.objects.create(produto=produto, canal=canal)
+
+    def _fretes(self):
+        return dict(PrecoProdutoCanal.objects.values_list('produto__sku', 'frete_calculado'))
+
+    def test_ler_edicao_rejeita_formato_invalido(self):
+        for texto, mensagem in [
+            ('{alterar', 'Alterações em formato inválido.'),
+            ('[1, 2]', 'Alterações em formato inválido.'),
+            ('{"excluir": {"1": true}}', 'Alterações em formato inválido.'),
+            ('{"alterar": {"1": [1]}}', 'Alterações em formato inválido.'),
+            ('{"excluir": ["x"]}', 'Identificador de regra inválido.'),
+            ('{"alterar": {"1": {"tabela": 2}}}', 'Campo não editável: tabela.'),
+            ('{"incluir": [{"valor_frete": 1, "pk": 3, "id": 4}]}', 'Campo não editável: id, pk.'),
+        ]:
+            with self.subTest(texto=texto), self.assertRaisesMessage(EdicaoInvalida, mensagem):
+                ler_edicao(texto)
+
+    def test_ler_edicao(self):
+        self.assertEqual(ler_edicao(''), ({}, set(), []))
+        self.assertEqual(
+            ler_edicao(
+                '{"alterar": {"7": {"valor_frete": "1,50"}}, "excluir": [8, "9"], "incluir": [{"ordem": 1}]}'
+            ),
+            ({7: {'valor_frete': '1,50'}}, {8, 9}, [{'ordem': 1}]),
+        )
+
+    def test_uma_celula_invalida_nao_grava_nada(self):
+        resultado = editar_regras_matriz(
+            self.tabela,
+            alterar={self.leves.pk: {'valor_frete': '11'}, self.pesados.pk: {'peso_fim': 'abc'}},
+            excluir={999},
+            incluir=[{'valor_frete': '5'}, {'peso_inicio': '1'}],
+        )
+
+        self.assertEqual(resultado.total_erros, 3)
+        self.assertEqual(
+            [linha for linha, _ in resultado.erros], ['Regra #999', f'Regra #{self.pesados.pk}', 'Nova linha 2']
+        )
+        self.assertIn('Peso Fim', resultado.erros[1][1])
+        self.assertEqual(resultado.erros[2][1], 'Valor Frete: este campo é obrigatório.')
+        self.assertEqual(
+            list(self.tabela.regras_matriz.order_by('pk').values_list('valor_frete', flat=True)),
+            [Decimal('10.00'), Decimal('20.00')],
+        )
+        self.assertFalse(ExecucaoRecalculo.objects.filter(origem='edicao_massa').exists())
+
+    def test_alteracoes_inclusoes_e_exclusoes_gravam_juntas_com_um_recalculo(self):
+        self.assertEqual(self._fretes(), {'LEVE': Decimal('10.00'), 'PESADO': Decimal('20.00')})
+        execucoes = ExecucaoRecalculo.objects.count()
+        historicos = HistoricoPreco.objects.count()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            resultado = editar_regras_matriz(
+                self.tabela,
+                alterar={self.pesados.pk: {'valor_frete': '25,00', 'ordem': ''}},
+                excluir={self.leves.pk},
+                incluir=[{'peso_fim': '5', 'valor_frete': '12'}],
+                usuario=self.usuario,
+            )
+
+        self.assertEqual(resultado.total_erros, 0)
+        self.assertEqual(
+            (resultado.alteradas, resultado.removidas, resultado.inseridas, resultado.precos_recalculados),
+            (1, 1, 1, 2),
+        )
+        self.assertEqual(self._fretes(), {'LEVE': Decimal('12.00'), 'PESADO': Decimal('25.00')})
+        nova = self.tabela.regras_matriz.exclude(pk=self.pesados.pk).get()
+        self.assertEqual(
+            (nova.peso_inicio, nova.preco_inicio, nova.score_inicio), (Decimal('0.000'), Decimal('0.00'), 0)
+        )
+
+        # Uma execução só (nenhum signal por regra), com um histórico por preço
+        self.assertEqual(ExecucaoRecalculo.objects.count(), execucoes + 1)
+        execucao = ExecucaoRecalculo.objects.latest('pk')
+        self.assertEqual(
+            (execucao.origem, execucao.usuario, execucao.precos_lidos), ('edicao_massa', self.usuario, 2)
+        )
+        self.assertEqual(HistoricoPreco.objects.count(), historicos + 2)
+
+
+COLUNAS_MARKETPLACE = (
+    'peso_inicio', 'peso_fim', 'preco_inicio', 'preco_fim', 'score_inicio', 'score_fim', 'valor_frete', 'ordem',
+    'excedente (0 ou 1)',
+)
+
+
+class MarketplacesTest(TestCase):
+    """Leitura das planilhas da pasta "Tabela Frete" e conferência da tabela compilada."""
+
+    DIRETORIO = settings.BASE_DIR / 'Tabela Frete'
+
+    def setUp(self):
+        super().setUp()
+
+    def _ler(self, chave):
+        marketplace = MARKETPLACES[chave]
+        return marketplace.ler(marketplace.caminho(self.DIRETORIO))
+
+    def _carregar(self, chave, leitura):
+        marketplace = MARKETPLACES[chave]
+        tabela = TabelaFrete.objects.create(
+            nome=marketplace.nome, tipo=marketplace.tipo, usa_tabela_excedente=marketplace.usa_tabela_excedente,
+        )
+        regras = [regra for _, regra in leitura.regras]
+        for regra in regras:
+            regra.tabela = tabela
+        substituir_regras_frete(tabela, leitura.modelo, regras)
+        return tabela
+
+    @staticmethod
+    def _por_linha(leitura):
+        return dict(leitura.regras)
+
+    def test_mercado_livre(self):
+        leitura = self._ler('mercado_livre')
+
+        self.assertEqual((leitura.linhas, len(leitura.regras), leitura.ignoradas, leitura.erros), (113, 113, [], []))
+        regras = self._por_linha(leitura)
+        # Peso 0 a 0: qualquer peso; preço com fim inclusivo (29 -> 29,01)
+        abaixo = regras[2]
+        self.assertEqual(
+            (abaixo.peso_inicio, abaixo.peso_fim, abaixo.preco_inicio, abaixo.preco_fim, abaixo.valor_frete),
+            (Decimal('0.000'), None, Decimal('0.00'), Decimal('29.01'), Decimal('6.25')),
+        )
+        self.assertEqual((regras[4].preco_inicio, regras[4].preco_fim), (Decimal('50.01'), Decimal('79.00')))
+        self.assertEqual((regras[5].peso_inicio, regras[5].peso_fim), (Decimal('0.000'), Decimal('0.300')))
+        # 150 a 150: acima de 150 kg, a partir do fim da última faixa fechada do mesmo preço
+        acima = regras[26]
+        self.assertEqual(
+            (acima.peso_inicio, acima.peso_fim, acima.preco_inicio, acima.preco_fim, acima.valor_frete),
+            (Decimal('150.000'), None, Decimal('79.00'), Decimal('100.00'), Decimal('149.67')),
+        )
+        self.assertIsNone(regras[114].preco_fim)
+
+    def test_magalu(self):
+        leitura = self._ler('magalu')
+
+        self.assertEqual((leitura.linhas, len(leitura.regras), leitura.erros), (142, 139, []))
+        # As linhas só de preço não cabem numa tabela por score
+        self.assertEqual([numero for numero, _ in leitura.ignoradas], [33, 34, 35])
+        self.assertIn('a tabela é por score', leitura.ignoradas[0][1])
+
+        regras = self._por_linha(leitura)
+        # Excedente: peso com fim inclusivo (0,5 -> 0,501), sem score
+        excedente = regras[2]
+        self.assertEqual(
+            (excedente.excedente, excedente.peso_inicio, excedente.peso_fim, excedente.score_inicio,
+             excedente.score_fim),
+            (True, Decimal('0.000'), Decimal('0.501'), 0, None),
+        )
+        self.assertEqual(regras[3].peso_inicio, Decimal('0.501'))
+        # Cada score é o limite superior da sua faixa
+        faixas = {(r.score_inicio, r.score_fim) for r in regras.values() if not r.excedente}
+        self.assertEqual(faixas, {(0, 92), (93, 97), (98, 100), (101, None)})
+        # 200,01 a 200,01: acima de 200 kg
+        self.assertEqual((regras[143].peso_inicio, regras[143].peso_fim), (Decimal('200.000'), None))
+        self.assertEqual((regras[143].score_inicio, regras[143].valor_frete), (101, Decimal('93.98')))
+
+    def test_shein(self):
+        leitura = self._ler('shein')
+
+        # As linhas vazias no fim da aba não contam
+        self.assertEqual((leitura.linhas, len(leitura.regras), leitura.erros), (12, 12, []))
+        regras = self._por_linha(leitura)
+        self.assertEqual(
+            [(regras[n].inicio, regras[n].fim, regras[n].valor_frete) for n in (2, 3, 13)],
+            [
+                (Decimal('0.000'), Decimal('0.300'), Decimal('4.00')),
+                (Decimal('0.300'), Decimal('0.600'), Decimal('5.00')),
+                (Decimal('23.000'), Decimal('30.000'), Decimal('106.00')),
+            ],
+        )
+        self.assertFalse(any(r.excedente for r in regras.values()))
+
+    def test_erros_por_linha(self):
+        leitura = ler_shein(_planilha([
+            (0, 1, None, None, None, None, 5, None, 0),
+            (1, 2, None, None, None, None, None, None, 0),
+            ('x', 3, None, None, None, None, 7, None, 0),
+        ], COLUNAS_MARKETPLACE))
+        self.assertEqual(len(leitura.regras), 1)
+        self.assertEqual(leitura.erros, [(3, 'valor_frete vazio'), (4, 'peso_inicio: "x" não é um número')])
+
+        leitura = ler_magalu(_planilha([(0, 1, None, None, None, None, 5, None, None)], COLUNAS_MARKETPLACE))
+        self.assertEqual(leitura.erros, [(2, 'linha sem score, preço ou excedente')])
+
+        leitura = ler_mercado_livre(_planilha([(0, 1, 0, 'abc', None, None, 5, None, None)], COLUNAS_MARKETPLACE))
+        self.assertEqual(leitura.erros, [(2, 'preco_fim: "abc" não é um número')])
+
+    def test_verificar_confere_cada_celula(self):
+        for chave in MARKETPLACES:
+            with self.subTest(marketplace=chave):
+                leitura = self._ler(chave)
+                tabela = self._carregar(chave, leitura)
+
+                pontos, divergencias = verificar(tabela, leitura)
+                self.assertGreater(pontos, len(leitura.regras))
+                self.assertEqual([str(d) for d in divergencias], [])
+
+    def test_verificar_aponta_divergencia(self):
+        leitura = self._ler('shein')
+        tabela = self._carregar('shein', leitura)
+        RegraFreteSimples.objects.filter(tabela=tabela, inicio=Decimal('0.300')).update(valor_frete=Decimal('5.50'))
+
+        _, divergencias = verificar(tabela, leitura)
+        self.assertEqual([str(d) for d in divergencias], [
+            'linha 3, peso 0.300: esperado 5.00, compilado 5.50',
+            'linha 3, peso 0.599: esperado 5.00, compilado 5.50',
+        ])
+
+    def test_comando(self):
+        saida = StringIO()
+        call_command('carregar_tabelas_frete', 'shein', '--dry-run', '--verificar', stdout=saida)
+        self.assertIn('12 linhas, 12 regras', saida.getvalue())
+        self.assertIn('pontos conferem com a planilha', saida.getvalue())
+        self.assertFalse(TabelaFrete.objects.filter(nome='Shein').exists())
+
+        call_command('carregar_tabelas_frete', 'shein', 'mercado_livre', stdout=StringIO())
+        self.assertEqual(RegraFreteSimples.objects.filter(tabela__nome='Shein', tabela__tipo='peso').count(), 12)
+        self.assertEqual(RegraFreteMatriz.objects.filter(tabela__nome='Mercado Livre').count(), 113)
+
+        with self.assertRaisesMessage(CommandError, 'Marketplace desconhecido: amazon'):
+            call_command('carregar_tabelas_frete', 'amazon', stdout=StringIO())
@@ -2,13 +2,15 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView, View
 from django.contrib import messages
 from django.urls import reverse_lazy, reverse
-from django.forms import modelformset_factory
-from django.db import transaction
+from django.core.paginator import Paginator
 from django.http import HttpResponse
-from decimal import Decimal, InvalidOperation
 import openpyxl
 
 from .models import TabelaFrete, RegraFreteMatriz, RegraFreteSimples, DescontoNotaVendedor, RegraFreteEspecial
+from .compilador import diagnosticar
+from .edicao import EdicaoInvalida, editar_regras_matriz, ler_edicao
+from produtos.models import TarefaImportacao
+from produtos.tarefas import criar_tarefa
 
 # --- Tabela Frete ---
 
@@ -68,6 +70,41 @@ class RegrasSimplesTemplateView(View):
         wb.save(response)
         return response
 
+def _avisar_diagnostico(request, tabela):
+    """Aviso com o resumo das lacunas/sobreposições das regras da tabela (se houver)."""
+    for relatorio in diagnosticar(tabela):
+        if relatorio.total_problemas:
+            messages.warning(request, f'{relatorio.resumo()} Veja o diagnóstico na página da tabela.')
+
+
+class DiagnosticoRegrasMixin:
+    """Compila as regras da tabela depois de salvar e avisa sobre problemas."""
+
+    def form_valid(self, form):
+        response = super().form_valid(form)
+        _avisar_diagnostico(self.request, self.object.tabela)
+        return response
+
+
+def _importar_planilha(request, tabela, url_formulario, tipo):
+    """Valida o upload e coloca a importação na fila; o andamento fica na página da tarefa."""
+    arquivo = request.FILES.get('arquivo')
+
+    if not arquivo:
+        messages.error(request, 'Nenhum arquivo enviado.')
+        return redirect(url_formulario, tabela_pk=tabela.pk)
+
+    if not arquivo.name.endswith('.xlsx'):
+        messages.error(request, 'O arquivo deve ser um Excel (.xlsx).')
+        return redirect(url_formulario, tabela_pk=tabela.pk)
+
+    tarefa = criar_tarefa(
+        tipo, arquivo, usuario=request.user,
+        tabela_frete=tabela, substituir=request.POST.get('substituir') == 'on',
+    )
+    messages.info(request, 'Importação enviada para processamento.')
+    return redirect('tarefa_importacao_detail', pk=tarefa.pk)
+
 class RegrasMatrizImportView(View):
     template_name = 'tabela_frete/import_form.html'
 
@@ -77,105 +114,7 @@ class RegrasMatrizImportView(View):
 
     def post(self, request, tabela_pk):
         tabela = get_object_or_404(TabelaFrete, pk=tabela_pk)
-        arquivo = request.FILES.get('arquivo')
-        substituir = request.POST.get('substituir') == 'on'
-
-        if not arquivo:
-            messages.error(request, 'Nenhum arquivo enviado.')
-            return redirect('regras_matriz_import', tabela_pk=tabela.pk)
-
-        if not arquivo.name.endswith('.xlsx'):
-            messages.error(request, 'O arquivo deve ser um Excel (.xlsx).')
-            return redirect('regras_matriz_import', tabela_pk=tabela.pk)
-
-        try:
-            wb = openpyxl.load_workbook(arquivo, data_only=True)
-            ws = wb.active
-
-            regras_criadas = []
-            
-            with transaction.atomic():
-                if substituir:
-                    tabela.regras_matriz.all().delete()
-
-                rows = list(ws.rows)
-                if len(rows) > 0:
-                    data_rows = rows[1:] # Ignorar cabeçalho
-                else:
-                    data_rows = []
-
-                if not data_rows:
-                     messages.warning(request, 'Arquivo vazio ou sem dados.')
-                     return redirect('regras_matriz_import', tabela_pk=tabela.pk)
-
-                for i, row in enumerate(data_rows):
-                    # Formato esperado: peso_ini, peso_fim, preco_ini, preco_fim, score_ini, score_fim, valor, ordem, excedente
-                    values = [cell.value for cell in row]
-
-                    if not any(values): # Linha vazia
-                        continue
-
-                    def clean_decimal(val):
-                        if val is None: return None
-                        if isinstance(val, str):
-                            val = val.strip().replace(',', '.')
-                            if val == '': return None
-                        return Decimal(str(val))
-                    
-                    def clean_int(val):
-                        if val is None: return None
-                        try:
-                            return int(val)
-                        except:
-                            return None
-
-                    try:
-                        # Colunas: A=0, B=1, ...
-                        peso_ini = clean_decimal(values[0])
-                        peso_fim = clean_decimal(values[1])
-                        preco_ini = clean_decimal(values[2])
-                        preco_fim = clean_decimal(values[3])
-                        score_ini = clean_int(values[4])
-                        score_fim = clean_int(values[5])
-                        valor_frete = clean_decimal(values[6])
-                        ordem = clean_int(values[7]) or 0
-                        
-                        excedente = False
-                        if len(values) > 8:
-                            exc_val = values[8]
-                            if exc_val in [1, '1', True, 'True', 'sim', 'Sim']:
-                                excedente = True
-
-                        if valor_frete is None:
-                            continue 
-
-                        regras_criadas.append(RegraFreteMatriz(
-                            tabela=tabela,
-                            peso_inicio=peso_ini,
-                            peso_fim=peso_fim,
-                            preco_inicio=preco_ini,
-                            preco_fim=preco_fim,
-                            score_inicio=score_ini,
-                            score_fim=score_fim,
-                            valor_frete=valor_frete,
-                            ordem=ordem,
-                            excedente=excedente
-                        ))
-                    except (ValueError, InvalidOperation, IndexError) as e:
-                        print(f"Erro linha {i+2}: {e}")
-                        continue
-
-                if regras_criadas:
-                    RegraFreteMatriz.objects.bulk_create(regras_criadas)
-                    messages.success(request, f'{len(regras_criadas)} regras importadas com sucesso!')
-                else:
-                    messages.warning(request, 'Nenhuma regra válida encontrada no arquivo.')
-
-        except Exception as e:
-            messages.error(request, f'Erro ao processar arquivo: {str(e)}')
-            return redirect('regras_matriz_import', tabela_pk=tabela.pk)
-
-        return redirect('tabela_frete_detail', pk=tabela.pk)
+        return _importar_planilha(request, tabela, 'regras_matriz_import', TarefaImportacao.TIPO_REGRAS_MATRIZ)
 
 class RegrasSimplesImportView(View):
     template_name = 'tabela_frete/import_form.html'
@@ -186,132 +125,57 @@ class RegrasSimplesImportView(View):
 
     def post(self, request, tabela_pk):
         tabela = get_object_or_404(TabelaFrete, pk=tabela_pk)
-        arquivo = request.FILES.get('arquivo')
-        substituir = request.POST.get('substituir') == 'on'
-
-        if not arquivo:
-            messages.error(request, 'Nenhum arquivo enviado.')
-            return redirect('regras_simples_import', tabela_pk=tabela.pk)
-
-        if not arquivo.name.endswith('.xlsx'):
-            messages.error(request, 'O arquivo deve ser um Excel (.xlsx).')
-            return redirect('regras_simples_import', tabela_pk=tabela.pk)
-
-        try:
-            wb = openpyxl.load_workbook(arquivo, data_only=True)
-            ws = wb.active
-
-            regras_criadas = []
-            
-            with transaction.atomic():
-                if substituir:
-                    tabela.regras_simples.all().delete()
-
-                rows = list(ws.rows)
-                if len(rows) > 0:
-                    data_rows = rows[1:] # Ignorar cabeçalho
-                else:
-                    data_rows = []
-
-                if not data_rows:
-                     messages.warning(request, 'Arquivo vazio ou sem dados.')
-                     return redirect('regras_simples_import', tabela_pk=tabela.pk)
-
-                for i, row in enumerate(data_rows):
-                    # Formato esperado: inicio, fim, valor_frete, excedente
-                    values = [cell.value for cell in row]
-                    if not any(values): continue
-
-                    def clean_decimal(val):
-                        if val is None: return None
-                        if isinstance(val, str):
-                            val = val.strip().replace(',', '.')
-                            if val == '': return None
-                        return Decimal(str(val))
-
-                    try:
-                        inicio = clean_decimal(values[0])
-                        fim = clean_decimal(values[1])
-                        valor_frete = clean_decimal(values[2])
-                        
-                        excedente = False
-                        if len(values) > 3:
-                            exc_val = values[3]
-                            if exc_val in [1, '1', True, 'True', 'sim', 'Sim']:
-                                excedente = True
-                        
-                        if valor_frete is None: continue
-
-                        regras_criadas.append(RegraFreteSimples(
-                            tabela=tabela,
-                            inicio=inicio,
-                            fim=fim,
-                            valor_frete=valor_frete,
-                            excedente=excedente
-                        ))
-                    except (ValueError, InvalidOperation, IndexError) as e:
-                        print(f"Erro linha {i+2}: {e}")
-                        continue
-
-                if regras_criadas:
-                    RegraFreteSimples.objects.bulk_create(regras_criadas)
-                    messages.success(request, f'{len(regras_criadas)} regras importadas com sucesso!')
-                else:
-                    messages.warning(request, 'Nenhuma regra válida encontrada no arquivo.')
-
-        except Exception as e:
-            messages.error(request, f'Erro ao processar arquivo: {str(e)}')
-            return redirect('regras_simples_import', tabela_pk=tabela.pk)
-
-        return redirect('tabela_frete_detail', pk=tabela.pk)
+        return _importar_planilha(request, tabela, 'regras_simples_import', TarefaImportacao.TIPO_REGRAS_SIMPLES)
 
 class RegrasMatrizBulkEditView(View):
+    """
+    Edição em massa estilo planilha: regras paginadas, a tela envia só as
+    células alteradas e tudo é gravado em lote, com um único recálculo (edicao).
+    """
     template_name = 'tabela_frete/regras_bulk_edit.html'
+    regras_por_pagina = 100
+
+    def _render(self, request, tabela, numero_pagina, edicao_pendente='', resultado=None):
+        regras = RegraFreteMatriz.objects.filter(tabela=tabela).order_by('excedente', 'ordem', 'peso_inicio', 'pk')
+        pagina = Paginator(regras, self.regras_por_pagina).get_page(numero_pagina)
+        return render(request, self.template_name, {
+            'tabela': tabela,
+            'page_obj': pagina,
+            'regras': pagina.object_list,
+            'edicao_pendente': edicao_pendente,
+            'resultado': resultado,
+        })
 
     def get(self, request, tabela_pk):
         tabela = get_object_or_404(TabelaFrete, pk=tabela_pk)
-        
-        # Debug
-        regras_count = RegraFreteMatriz.objects.filter(tabela=tabela).count()
-        print(f"--- DEBUG: Tabela {tabela.nome} (ID {tabela.pk}) has {regras_count} matrix rules. ---")
-
-        RegraFormSet = modelformset_factory(
-            RegraFreteMatriz,
-            fields=['ordem', 'peso_inicio', 'peso_fim', 'preco_inicio', 'preco_fim', 'score_inicio', 'score_fim', 'valor_frete', 'ativo', 'excedente'],
-            extra=0,
-            can_delete=True
-        )
-        formset = RegraFormSet(queryset=RegraFreteMatriz.objects.filter(tabela=tabela).order_by('ordem', 'peso_inicio'))
-        print(f"--- DEBUG: Formset instantiated with {len(formset)} forms. ---")
-        return render(request, self.template_name, {'tabela': tabela, 'formset': formset})
+        return self._render(request, tabela, request.GET.get('page'))
 
     def post(self, request, tabela_pk):
         tabela = get_object_or_404(TabelaFrete, pk=tabela_pk)
-        RegraFormSet = modelformset_factory(
-            RegraFreteMatriz,
-            fields=['ordem', 'peso_inicio', 'peso_fim', 'preco_inicio', 'preco_fim', 'score_inicio', 'score_fim', 'valor_frete', 'ativo', 'excedente'],
-            extra=0,
-            can_delete=True
-        )
-        # É importante passar o queryset no POST também para garantir a integridade dos IDs
-        formset = RegraFormSet(request.POST, queryset=RegraFreteMatriz.objects.filter(tabela=tabela).order_by('ordem', 'peso_inicio'))
-        
-        if formset.is_valid():
-            instances = formset.save(commit=False)
-            for instance in instances:
-                instance.tabela = tabela
-                instance.save()
-            for obj in formset.deleted_objects:
-                obj.delete()
-            messages.success(request, 'Regras atualizadas com sucesso!')
-            return redirect('tabela_frete_detail', pk=tabela.pk)
-        else:
-            print("--- Formset Errors ---")
-            print(formset.errors)
-            print(formset.non_form_errors())
-            messages.error(request, 'Erro ao salvar. Verifique os campos.')
-        
-        return render(request, self.template_name, {'tabela': tabela, 'formset': formset})
+        pagina = request.POST.get('page')
+        texto = request.POST.get('edicao', '')
+        try:
+            alterar, excluir, incluir = ler_edicao(texto)
+        except EdicaoInvalida as e:
+            messages.error(request, str(e))
+            return self._render(request, tabela, pagina)
+
+        if not (alterar or excluir or incluir):
+            messages.info(request, 'Nenhuma alteração para salvar.')
+            return redirect(f"{reverse('regras_matriz_bulk_edit', args=[tabela.pk])}?page={pagina or 1}")
+
+        usuario = request.user if request.user.is_authenticated else None
+        resultado = editar_regras_matriz(tabela, alterar, excluir, incluir, usuario=usuario)
+        if resultado.total_erros:
+            messages.error(request, 'Nada foi salvo. Corrija as células com erro.')
+            return self._render(request, tabela, pagina, edicao_pendente=texto, resultado=resultado)
+
+        messages.success(request, (
+            f'Regras salvas: {resultado.alteradas} alteradas, {resultado.inseridas} incluídas, '
+            f'{resultado.removidas} excluídas. {resultado.precos_recalculados} preços recalculados.'
+        ))
+        _avisar_diagnostico(request, tabela)
+        return redirect(f"{reverse('regras_matriz_bulk_edit', args=[tabela.pk])}?page={pagina or 1}")
 
 class TabelaFreteListView(ListView):
     model = TabelaFrete
@@ -332,7 +196,8 @@ class TabelaFreteDetailView(DetailView):
         
         context['regras_especiais'] = self.object.regras_especiais.all().order_by('ordem')
         context['descontos'] = self.object.descontos_nota.all().order_by('nota')
-        context['canais'] = self.object.canais.all()
+        context['diagnostico'] = diagnosticar(self.object)
+        context['canais'] = self.object.canais.select_related('grupo')
         return context
 
 class TabelaFreteCreateView(CreateView):
@@ -356,7 +221,7 @@ class TabelaFreteDeleteView(DeleteView):
 
 # --- Regra Matriz ---
 
-class RegraMatrizCreateView(CreateView):
+class RegraMatrizCreateView(DiagnosticoRegrasMixin, CreateView):
     model = RegraFreteMatriz
     template_name = 'tabela_frete/regra_form.html'
     fields = ['ordem', 'peso_inicio', 'peso_fim', 'preco_inicio', 'preco_fim', 'score_inicio', 'score_fim', 'valor_frete', 'ativo', 'excedente']
@@ -378,7 +243,7 @@ class RegraMatrizCreateView(CreateView):
     def get_success_url(self):
         return reverse('tabela_frete_detail', kwargs={'pk': self.tabela.pk})
 
-class RegraMatrizUpdateView(UpdateView):
+class RegraMatrizUpdateView(DiagnosticoRegrasMixin, UpdateView):
     model = RegraFreteMatriz
     template_name = 'tabela_frete/regra_form.html'
     fields = ['ordem', 'peso_inicio', 'peso_fim', 'preco_inicio', 'preco_fim', 'score_inicio', 'score_fim', 'valor_frete', 'ativo', 'excedente']
@@ -402,7 +267,7 @@ class RegraMatrizDeleteView(DeleteView):
 
 # --- Regra Simples ---
 
-class RegraSimplesCreateView(CreateView):
+class RegraSimplesCreateView(DiagnosticoRegrasMixin, CreateView):
     model = RegraFreteSimples
     template_name = 'tabela_frete/regra_simples_form.html'
     fields = ['inicio', 'fim', 'valor_frete', 'ativo']
@@ -424,7 +289,7 @@ class RegraSimplesCreateView(CreateView):
     def get_success_url(self):
         return reverse('tabela_frete_detail', kwargs={'pk': self.tabela.pk})
 
-class RegraSimplesUpdateView(UpdateView):
+class RegraSimplesUpdateView(DiagnosticoRegrasMixin, UpdateView):
     model = RegraFreteSimples
     template_name = 'tabela_frete/regra_simples_form.html'
     fields = ['inicio', 'fim', 'valor_frete', 'ativo']